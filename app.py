@@ -1,15 +1,10 @@
 import hashlib
-import time
+import importlib
 import streamlit as st
 from streamlit_cookies_controller import CookieController
 import streamlit.components.v1 as components
-import pandas as pd
-import io
-import zipfile
 import os
 from datetime import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from models import (
     Product, ProductColor, InventoryLog,
     FinanceRecord, CostItem,
@@ -18,23 +13,47 @@ from models import (
     CompanyBalanceItem,
     SystemSetting, ProductPrice, ProductPart,
     SalesOrder, SalesOrderItem, OrderRefund,
-    Warehouse,OfflineTemplate, OfflineTemplateItem
+    Warehouse,OfflineTemplate, OfflineTemplateItem, OfflineTemplateSalesSummary,
+    SalesDailyFact, InventoryStockCheckpoint, InventoryLogArchive, ProductCostRollup, ProductCostSnapshot
 )
-from database import Base
-from views.product_view import show_product_page
-from views.cost_view import show_cost_page
-from views.inventory_view import show_inventory_page
-from views.finance_view import show_finance_page
-from views.balance_view import show_balance_page
-from views.asset_view import show_asset_page
-from views.consumable_view import show_other_asset_page
-from views.sales_view import show_sales_page
-from views.sales_order_view import show_sales_order_page
-from views.offline_sales_view import show_offline_sales_page
-from views.report_view import show_report_page
-from views.presale_order_view import show_presale_order_page
+from schema_manager import upgrade_schema
+from page_profiler import profile_page, render_profiling_panel
+from engine_factory import get_engine, register_read_replica
+from session_manager import session_manager
+from cache_manager import sync_all_caches
+from services.backup_service import backup_job, restore_job, sandbox_clone_job, rebuild_job
+from services.job_runner import job_runner
+from views.job_view import submit_job, tracked_job, show_job_progress, show_job_download, is_active, render_job_panel
+# 写路径的 ORM 钩子 (库存快照作废 / 成本汇总刷新) 必须在任何页面写库前注册，不能依赖按需加载的视图间接导入
+import services.inventory_service  # noqa: F401
+import services.cost_rollup_service  # noqa: F401
 from streamlit_option_menu import option_menu
 
+# === 页面路由表：(菜单名, 图标, 视图模块, 入口函数, 是否传入汇率) ===
+# 🚀 视图模块在首次进入该页面时才导入 (连带其 Service 与 pandas 等依赖)，冷启动只加载登录与侧边栏
+PAGES = [
+    ("财务流水录入", "currency-yen", "views.finance_view", "show_finance_page", True),
+    ("公司账面概览", "clipboard-data", "views.balance_view", "show_balance_page", True),
+    ("财务报表与分析", "pie-chart", "views.report_view", "show_report_page", True),
+    ("商品管理", "bag-heart", "views.product_view", "show_product_page", False),
+    ("商品成本核算", "calculator", "views.cost_view", "show_cost_page", True),
+    ("线上销售管理", "cart-check", "views.sales_order_view", "show_sales_order_page", True),
+    ("预售销售管理", "basket3", "views.presale_order_view", "show_presale_order_page", True),
+    ("线下销售管理", "shop", "views.offline_sales_view", "show_offline_sales_page", False),
+    ("销售额一览", "graph-up-arrow", "views.sales_view", "show_sales_page", True),
+    ("仓库库存管理", "arrow-left-right", "views.inventory_view", "show_inventory_page", False),
+    ("固定资产管理", "camera-reels", "views.asset_view", "show_asset_page", True),
+    ("其他资产管理", "box-seam", "views.consumable_view", "show_other_asset_page", True),
+    ("慢查询日志", "hourglass-split", "views.slow_query_view", "show_slow_query_page", False),
+]
+
+def load_page(title):
+    """按菜单名导入对应视图模块，返回 (入口函数, 是否传入汇率)"""
+    for name, _, module_name, func_name, needs_rate in PAGES:
+        if name == title:
+            return getattr(importlib.import_module(module_name), func_name), needs_rate
+    raise KeyError(title)
+
 # === 1. 页面配置 (必须放在第一行) ===
 st.set_page_config(page_title="Yurara综合管理系统", layout="wide")
 cookie_controller = CookieController()
@@ -48,14 +67,36 @@ def generate_secure_token(username, password):
 # === 登录认证 ===
 # ==========================================
 
+AUTH_COOKIES = ("yurara_auth_user", "yurara_auth_token")
+
+def _authenticate(user_input, pwd_input):
+    """校验 secrets 中的账号，通过时返回用户名"""
+    all_creds = st.secrets["credentials"]
+    for key, cred_config in all_creds.items():
+        if "username" in cred_config and "password" in cred_config:
+            if user_input == cred_config["username"] and pwd_input == cred_config["password"]:
+                return cred_config["username"]
+    return None
+
 def check_login():
+    # 0. 上一次运行点了「退出登录」：在本次 (不会被 rerun 打断的) 运行中删除 cookie，保证浏览器端一定执行
+    if st.session_state.pop("logout_pending", False):
+        saved = cookie_controller.getAll() or {}
+        for name in AUTH_COOKIES:
+            if name in saved:
+                cookie_controller.remove(name)
+
+    # 1. Cookie 握手：会话的第一次运行时 cookie 组件还没有回传浏览器 cookie (只有默认值)，
+    #    组件回传后 Streamlit 会自动重跑，这里直接结束本次运行等待回传，不再 sleep + rerun
+    first_run = "cookie_handshake" not in st.session_state
+    st.session_state.cookie_handshake = True
+    if first_run and not st.session_state.get("authenticated", False):
+        st.caption("⏳ 正在安全同步登录状态...")
+        # 浏览器拦截了组件脚本时不会自动重跑，留一个手动继续的入口
+        st.button("未自动跳转？点此继续", key="cookie_handshake_retry")
+        st.stop()
+
     all_cookies = cookie_controller.getAll()
-    if all_cookies is None and "login_attempted" not in st.session_state:
-        st.session_state.login_attempted = True
-        with st.spinner("⏳ 正在安全同步登录状态..."):
-            time.sleep(0.8) # 云端网络环境建议给 
-            st.rerun()
-            
     if all_cookies:
         saved_user = all_cookies.get("yurara_auth_user")
         # 建议同时校验 token 以防用户名伪造
@@ -70,54 +111,50 @@ def check_login():
     if st.session_state.get("authenticated", False):
         return True
 
-    # 3. 如果没登录，显示常规的登录界面
-    st.header("🔒 Yurara Studio 系统登录")
-    
-    with st.form("login_form"):
-        user_input = st.text_input("用户名")
-        pwd_input = st.text_input("密码", type="password")
-        submitted = st.form_submit_button("登录", type="primary")
+    # 3. 如果没登录，显示常规的登录界面 (放在占位容器里，登录成功后原地清空并继续渲染，无需 sleep + rerun)
+    login_box = st.empty()
+    logged_in_user = None
+    with login_box.container():
+        st.header("🔒 Yurara Studio 系统登录")
         
+        with st.form("login_form"):
+            user_input = st.text_input("用户名")
+            pwd_input = st.text_input("密码", type="password")
+            submitted = st.form_submit_button("登录", type="primary")
+            
         if submitted:
             try:
-                all_creds = st.secrets["credentials"]
-                found = False
-                
-                for key, cred_config in all_creds.items():
-                    if "username" in cred_config and "password" in cred_config:
-                        if user_input == cred_config["username"] and pwd_input == cred_config["password"]:
-                            # 验证通过
-                            st.session_state.authenticated = True
-                            st.session_state.current_user_name = cred_config["username"] 
-                            
-                            # ✨ 核心操作：登录成功后，把用户名写进浏览器的 Cookie！
-                            # Cookie 存活 7 天 (7 * 24 * 3600 秒)
-                            token = generate_secure_token(user_input, pwd_input)
-                            cookie_controller.set(
-                                    "yurara_auth_user", user_input, 
-                                    max_age=604800, path="/", 
-                                    secure=True, same_site="Lax"
-                                )
-                            cookie_controller.set(
-                                "yurara_auth_token", token, 
-                                max_age=604800, path="/", 
-                                secure=True, same_site="Lax"
-                            )
-                            st.success(f"欢迎回来，{user_input}！")
-                            time.sleep(0.5)
-                            st.rerun()
-                            found = True
-                            break
-                
-                if not found:
+                logged_in_user = _authenticate(user_input, pwd_input)
+                if not logged_in_user:
                     st.error("用户名或密码错误")
-            
             except KeyError:
                 st.error("Secrets 配置错误：找不到 [credentials] 节点")
             except Exception as e:
                 st.error(f"登录发生未知错误: {e}")
-                
-    return False
+
+    if not logged_in_user:
+        return False
+
+    # 验证通过
+    login_box.empty()
+    st.session_state.authenticated = True
+    st.session_state.current_user_name = logged_in_user
+
+    # ✨ 核心操作：登录成功后，把用户名写进浏览器的 Cookie！
+    # Cookie 存活 7 天 (7 * 24 * 3600 秒)；本次运行不 rerun，写 cookie 的组件一定会送达浏览器
+    token = generate_secure_token(user_input, pwd_input)
+    cookie_controller.set(
+            "yurara_auth_user", user_input, 
+            max_age=604800, path="/", 
+            secure=True, same_site="Lax"
+        )
+    cookie_controller.set(
+        "yurara_auth_token", token, 
+        max_age=604800, path="/", 
+        secure=True, same_site="Lax"
+    )
+    st.toast(f"欢迎回来，{user_input}！", icon="👋")
+    return True
 
 if not check_login():
     st.stop()
@@ -135,22 +172,24 @@ if "test_mode" not in st.session_state:
 def get_cached_engine(is_test: bool):
     """根据当前环境获取并缓存数据库 Engine，防止连接池耗尽"""
     if is_test:
-        # 测试环境 (本地 SQLite)
-        # check_same_thread=False 是 Streamlit 多线程访问 SQLite 所必需的
-        return create_engine("sqlite:///yurara_test_env.db", pool_pre_ping=True, connect_args={"check_same_thread": False})
+        # 测试环境 (本地 SQLite，工厂负责 check_same_thread / WAL 设置)
+        return get_engine("sqlite:///yurara_test_env.db")
     else:
-        # 真实环境 (Supabase / PostgreSQL)
+        # 真实环境 (Supabase / PostgreSQL)；与 database.py 同一 URL 时共用连接池
         try:
             db_url = os.getenv("DATABASE_URL")
             if not db_url:
                 db_url = st.secrets["database"]["DATABASE_URL"]
-
-            if db_url.startswith("postgres://"):
-                db_url = db_url.replace("postgres://", "postgresql+psycopg2://", 1)
-            elif db_url.startswith("postgresql://"):
-                db_url = db_url.replace("postgresql://", "postgresql+psycopg2://", 1)
-            
-            return create_engine(db_url, pool_pre_ping=True)
+            real_engine = get_engine(db_url)
+            # 只读副本 (可选)：报表与概览类查询读副本，写入仍走主库
+            read_url = os.getenv("YURARA_READ_DATABASE_URL")
+            if not read_url:
+                try:
+                    read_url = st.secrets["database"].get("READ_DATABASE_URL")
+                except Exception:
+                    read_url = None
+            register_read_replica(real_engine, read_url)
+            return real_engine
         except Exception as e:
             st.error(f"真实数据库连接初始化失败: {e}")
             return None
@@ -161,58 +200,29 @@ engine = get_cached_engine(st.session_state.test_mode)
 if not engine:
     st.stop()
 
-# 每次页面重新渲染时，绑定到当前的 engine
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-
-def get_db():
-    """用于主页面全局渲染的 DB Generator"""
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
 # 🚀 核心优化：动态会话生成器
 def get_dynamic_session():
     """
-    供 Fragment 局部刷新使用的动态会话。
+    供 Fragment 局部刷新与缓存加载函数使用的独立会话 (调用方负责 close)。
     调用缓存的 Engine 生成 Session，避免重复创建 Engine 导致内存泄漏！
     """
     is_test = st.session_state.get("test_mode", False)
-    dyn_engine = get_cached_engine(is_test)
-    return sessionmaker(autocommit=False, autoflush=False, bind=dyn_engine)()
+    return session_manager.new_session(get_cached_engine(is_test))
+
+def get_read_session():
+    """供缓存加载函数使用的只读会话 (调用方负责 close)：配置了只读副本时连接副本，否则与 get_dynamic_session 相同"""
+    is_test = st.session_state.get("test_mode", False)
+    return session_manager.new_read_session(get_cached_engine(is_test))
 
 # 🔥 将其挂载到全局 session_state，使得其他 View 文件可以直接调用，彻底杜绝 Python 循环导入(Circular Import)报错
 st.session_state.get_dynamic_session = get_dynamic_session
-
-# === 全局表映射，用于备份和测试环境克隆 ===
-TABLES_MAP = [
-    ("warehouses.csv", "warehouses", Warehouse), 
-    ("products.csv", "products", Product),
-    ("product_colors.csv", "product_colors", ProductColor),
-    ("product_parts.csv", "product_parts", ProductPart), 
-    ("product_prices.csv", "product_prices", ProductPrice),
-    ("finance_records.csv", "finance_records", FinanceRecord),
-    ("cost_items.csv", "cost_items", CostItem),
-    ("inventory_logs.csv", "inventory_logs", InventoryLog),
-    ("fixed_assets.csv", "fixed_assets_detail", FixedAsset),
-    ("fixed_asset_logs.csv", "fixed_asset_logs", FixedAssetLog),
-    ("consumables.csv", "consumable_items", ConsumableItem),
-    ("consumable_logs.csv", "consumable_logs", ConsumableLog),
-    ("company_balance.csv", "company_balance_items", CompanyBalanceItem),
-    ("sales_orders.csv", "sales_orders", SalesOrder),
-    ("sales_order_items.csv", "sales_order_items", SalesOrderItem),
-    ("order_refunds.csv", "order_refunds", OrderRefund),
-    ("offline_templates.csv", "offline_templates", OfflineTemplate),
-    ("offline_template_items.csv", "offline_template_items", OfflineTemplateItem),
-    # ("system_settings.csv", "system_settings", SystemSetting), #暂未修改该bug
-]
+st.session_state.get_read_session = get_read_session
 
 # 初始化表结构 (会自动建在当前绑定的引擎上)
 @st.cache_resource
 def init_database(_engine):
-    """只在应用启动时执行一次表结构同步"""
-    Base.metadata.create_all(bind=_engine)
+    """只在应用启动时执行一次表结构同步 (含新增列补齐与一次性回填)"""
+    upgrade_schema(_engine)
     return True
 
 init_database(engine)
@@ -239,287 +249,227 @@ def set_system_setting(db, key, new_value):
 # === 3. 侧边栏与业务路由 ===
 # ==========================================
 
-db = next(get_db())
-
-with st.sidebar:
-    # 隐藏的保活脚本 (Heartbeat)，防止长时间无操作掉线
-    components.html(
-        """
-        <script>
-        // 每 10 分钟 (600000毫秒) 偷偷向服务器发一次请求，防止代理服务器因超时切断连接
-        setInterval(() => {
-            fetch('/healthz').catch(() => {});
-        }, 600000);
-        </script>
-        """,
-        height=0,
-        width=0
-    )
-    current_user = st.session_state.get("current_user_name", "Unknown")
+def render_sidebar(db):
+    """侧边栏：导航、汇率、备份恢复、清空数据、环境切换；返回 (所选页面, 汇率)"""
+    with st.sidebar:
+        # 隐藏的保活脚本 (Heartbeat)，防止长时间无操作掉线
+        components.html(
+            """
+            <script>
+            // 每 10 分钟 (600000毫秒) 偷偷向服务器发一次请求，防止代理服务器因超时切断连接
+            setInterval(() => {
+                fetch('/healthz').catch(() => {});
+            }, 600000);
+            </script>
+            """,
+            height=0,
+            width=0
+        )
+        current_user = st.session_state.get("current_user_name", "Unknown")
     
-    # 顶部状态栏：醒目的测试环境提示
-    if st.session_state.test_mode:
-        st.error("🧪 **测试环境已开启**\n\n当前操作仅写入本地沙盒库，不会影响真实数据。")
-    else:
-        st.caption(f"当前账号: {current_user}")
+        # 顶部状态栏：醒目的测试环境提示
+        if st.session_state.test_mode:
+            st.error("🧪 **测试环境已开启**\n\n当前操作仅写入本地沙盒库，不会影响真实数据。")
+        else:
+            st.caption(f"当前账号: {current_user}")
         
-    if st.button("退出登录"):
-        st.session_state.authenticated = False
-        cookie_controller.remove("yurara_auth_user")
-        cookie_controller.remove("yurara_auth_token")
-
-        time.sleep(0.2)
-        st.rerun()
-
-    selected = option_menu(
-        menu_title="Yurara Studio",
-        menu_icon="dataset",
-        options=[
-            "财务流水录入",
-            "公司账面概览",
-            "财务报表与分析",
-            "商品管理",
-            "商品成本核算",
-            "线上销售管理",
-            "预售销售管理",
-            "线下销售管理",
-            "销售额一览",
-            "仓库库存管理",
-            "固定资产管理",
-            "其他资产管理"
-        ],
-        icons=[
-            "currency-yen",
-            "clipboard-data",
-            "pie-chart",
-            "bag-heart",
-            "calculator",
-            "cart-check",
-            "basket3",
-            "shop",
-            "graph-up-arrow",
-            "arrow-left-right",
-            "camera-reels",
-            "box-seam"
-        ],
-        default_index=0,
-        styles={
-            "container": {"padding": "5px", "background-color": "#262730"},
-            "icon": {"color": "#555", "font-size": "18px"}, 
-            "nav-link": {"font-size": "14px", "text-align": "left", "margin": "5px", "--hover-color": "#7284aa"},
-            "nav-link-selected": {"background-color": "#263c54", "color": "white", "font-weight": "normal"},
-        }
-    )
-
-    # === 全局汇率设置 ===
-    st.divider()
-    st.markdown("### 💱 全局汇率设置")
-    db_rate_str = get_system_setting(db, "exchange_rate", "4.8")
-    rate_input = st.number_input(
-        "汇率 (100 JPY 兑 CNY)", 
-        value=float(db_rate_str), 
-        step=0.1, 
-        format="%.2f",
-        key="global_rate_widget" 
-    )
-
-    if rate_input < 0.01:
-        rate_input = 0.01
-
-    if abs(rate_input - float(db_rate_str)) > 0.001:
-        set_system_setting(db, "exchange_rate", rate_input)
-        st.toast(f"汇率已更新: {rate_input}", icon="💾")
-        st.rerun()
-    exchange_rate = rate_input / 100.0
+        if st.button("退出登录"):
+            st.session_state.authenticated = False
+            # cookie 在下一次运行开头删除 (见 check_login)，不用 sleep 等组件送达
+            st.session_state.logout_pending = True
+            st.rerun()
 
-    # === 备份/恢复 ===
-    st.divider()
-    with st.popover("💾 数据备份与恢复", width="stretch"):
-        # 下载全量备份
-        zip_buffer = io.BytesIO()
-        try:
-            with zipfile.ZipFile(zip_buffer, "w") as zf:
-                for file_name, _, model_cls in TABLES_MAP:
-                    try:
-                        df_export = pd.read_sql(db.query(model_cls).statement, db.bind)
-                        csv_bytes = df_export.to_csv(index=False).encode('utf-8-sig')
-                        zf.writestr(file_name, csv_bytes)
-                    except Exception as e:
-                        pass
-            current_time = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
-            backup_filename = f"yurara-db-backup_{current_time}.zip"
-            st.download_button(
-                "⬇️ 下载全量备份 (ZIP)", 
-                data=zip_buffer.getvalue(), 
-                file_name=backup_filename,
-                mime="application/zip"
-            )
-        except Exception as e:
-            st.error(f"导出错误: {e}")
+        selected = option_menu(
+            menu_title="Yurara Studio",
+            menu_icon="dataset",
+            options=[p[0] for p in PAGES],
+            icons=[p[1] for p in PAGES],
+            default_index=0,
+            styles={
+                "container": {"padding": "5px", "background-color": "#262730"},
+                "icon": {"color": "#555", "font-size": "18px"}, 
+                "nav-link": {"font-size": "14px", "text-align": "left", "margin": "5px", "--hover-color": "#7284aa"},
+                "nav-link-selected": {"background-color": "#263c54", "color": "white", "font-weight": "normal"},
+            }
+        )
+
+        # === 全局汇率设置 ===
+        st.divider()
+        st.markdown("### 💱 全局汇率设置")
+        db_rate_str = get_system_setting(db, "exchange_rate", "4.8")
+        rate_input = st.number_input(
+            "汇率 (100 JPY 兑 CNY)", 
+            value=float(db_rate_str), 
+            step=0.1, 
+            format="%.2f",
+            key="global_rate_widget" 
+        )
+
+        if rate_input < 0.01:
+            rate_input = 0.01
+
+        if abs(rate_input - float(db_rate_str)) > 0.001:
+            set_system_setting(db, "exchange_rate", rate_input)
+            st.toast(f"汇率已更新: {rate_input}", icon="💾")
+            st.rerun()
+        exchange_rate = rate_input / 100.0
 
+        # === 备份/恢复 ===
         st.divider()
+        with st.popover("💾 数据备份与恢复", width="stretch"):
+            # 全量备份 / 恢复 / 重建都提交为后台任务，进度与结果见侧边栏「后台任务」面板，浏览器断开也不会中断
+            backup = tracked_job("backup_job")
+            if is_active(backup):
+                show_job_progress(backup)
+            elif st.button("📦 生成全量备份 (ZIP)", width="stretch"):
+                current_time = datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+                st.session_state.backup_job = submit_job(
+                    "backup", "导出全量备份", backup_job, engine, f"yurara-db-backup_{current_time}.zip"
+                )
+                st.rerun()
+            show_job_download(backup, f"⬇️ 下载 {backup.file_name}" if backup else "")
+
+            st.divider()
         
-        # 导入备份
-        uploaded_file = st.file_uploader("上传备份 ZIP", type="zip")
-        if uploaded_file and st.button("🔴 确认导入"):
-            try:
-                from sqlalchemy import text
-                
-                # 使用 engine.begin() 开启一个统一的事务连接
-                with engine.begin() as conn:
-                    # 临时关闭外键检查触发器 
-                    if "postgres" in str(engine.url):
-                        conn.execute(text("SET session_replication_role = 'replica';"))
-                    
-                    with zipfile.ZipFile(uploaded_file) as zf:
-                        for file_name, table_name, _ in TABLES_MAP:
-                            if file_name in zf.namelist():
-                                with zf.open(file_name) as f:
-                                    df_import = pd.read_csv(f, encoding='utf-8-sig')
-                                    if not df_import.empty:
-                                        df_import.to_sql(table_name, conn, if_exists='append', index=False)
-                                        st.toast(f"已导入 {table_name}")
-                    
-                    # 恢复 PostgreSQL 的外键检查，并重置自增 ID 序列
-                    if "postgres" in str(engine.url):
-                        conn.execute(text("SET session_replication_role = 'origin';"))
-                        for _, table_name, _ in TABLES_MAP:
-                            try:
-                                conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), coalesce(max(id),0) + 1, false) FROM {table_name};"))
-                            except Exception:
-                                pass 
-                        
-                st.success("恢复完成")
-                st.cache_data.clear()
+            # 导入备份 (同一时间只允许一个恢复任务)
+            restoring = job_runner.active("restore")
+            if restoring:
+                show_job_progress(restoring[0])
+            else:
+                uploaded_file = st.file_uploader("上传备份 ZIP", type="zip")
+                if uploaded_file and st.button("🔴 确认导入"):
+                    submit_job("restore", f"恢复备份: {uploaded_file.name}", restore_job, engine, uploaded_file.getvalue())
+                    st.rerun()
+
+            st.divider()
+
+            # 汇总表重建 (数据修复用)
+            rebuilding = job_runner.active("rebuild")
+            if st.button("🔁 重建销售汇总表", width="stretch", disabled=bool(rebuilding), help="从订单/售后/成本明细重新生成销售日汇总、POS 模板汇总与商品成本汇总"):
+                submit_job("rebuild", "重建销售汇总表", rebuild_job, engine)
                 st.rerun()
-            except Exception as e:
-                st.error(f"导入错误: {e}")
 
-    # === 清空所有数据 ===
-    with st.popover("🔴 清空当前环境数据", width="stretch"):
-        env_name = "测试环境" if st.session_state.test_mode else "真实环境"
-        st.error(f"⚠️ **警告**：此操作将删除【{env_name}】的所有业务数据！")
+        # === 清空所有数据 ===
+        with st.popover("🔴 清空当前环境数据", width="stretch"):
+            env_name = "测试环境" if st.session_state.test_mode else "真实环境"
+            st.error(f"⚠️ **警告**：此操作将删除【{env_name}】的所有业务数据！")
         
-        confirm_input = st.text_input("请输入确认口令", placeholder="输入 DELETE 以确认")
+            confirm_input = st.text_input("请输入确认口令", placeholder="输入 DELETE 以确认")
         
-        if st.button("💣 确认清空", type="primary", disabled=(confirm_input != "DELETE"), width="stretch"):
-            try:
-                # 按照依赖关系顺序删除 (子表先删，主表后删)
-                db.query(ProductPart).delete()   # ✨ 清空部件
-                db.query(ProductPrice).delete()  # ✨ 清空价格
-                db.query(ProductColor).delete()
+            if st.button("💣 确认清空", type="primary", disabled=(confirm_input != "DELETE"), width="stretch"):
+                try:
+                    # 按照依赖关系顺序删除 (子表先删，主表后删)
+                    db.query(ProductPart).delete()   # ✨ 清空部件
+                    db.query(ProductPrice).delete()  # ✨ 清空价格
+                    db.query(ProductColor).delete()
                 
-                db.query(CostItem).delete()
-                db.query(FixedAsset).delete()
-                db.query(ConsumableItem).delete()
-                db.query(SalesOrderItem).delete() 
-                db.query(OrderRefund).delete() 
-
-                db.query(InventoryLog).delete()
-                db.query(FixedAssetLog).delete()
-                db.query(ConsumableLog).delete()   
-                db.query(CompanyBalanceItem).delete()
-
-                db.query(Product).delete()
-                db.query(FinanceRecord).delete()
-                db.query(SalesOrder).delete() 
-                db.query(Warehouse).delete() 
-
-                db.query(OfflineTemplateItem).delete()
-                db.query(OfflineTemplate).delete()
+                    db.query(CostItem).delete()
+                    db.query(ProductCostRollup).delete()
+                    db.query(ProductCostSnapshot).delete()
+                    db.query(FixedAsset).delete()
+                    db.query(ConsumableItem).delete()
+                    db.query(SalesOrderItem).delete() 
+                    db.query(OrderRefund).delete() 
+
+                    db.query(InventoryLog).delete()
+                    db.query(InventoryLogArchive).delete()
+                    db.query(FixedAssetLog).delete()
+                    db.query(ConsumableLog).delete()   
+                    db.query(CompanyBalanceItem).delete()
+
+                    db.query(Product).delete()
+                    db.query(FinanceRecord).delete()
+                    db.query(SalesOrder).delete() 
+                    db.query(Warehouse).delete() 
+
+                    db.query(OfflineTemplateSalesSummary).delete()
+                    db.query(SalesDailyFact).delete()
+                    db.query(InventoryStockCheckpoint).delete()
+                    db.query(OfflineTemplateItem).delete()
+                    db.query(OfflineTemplate).delete()
                 
-                # 系统设置也可以选择性清空，如果不清空汇率会保留。如果想彻底重置加上下面这句：
-                #db.query(SystemSetting).delete()
+                    # 系统设置也可以选择性清空，如果不清空汇率会保留。如果想彻底重置加上下面这句：
+                    #db.query(SystemSetting).delete()
                 
-                db.commit()
-                st.session_state["toast_msg"] = ("数据已清空！表结构已保留。", "🧹")
+                    db.commit()
+                    st.session_state["toast_msg"] = ("数据已清空！表结构已保留。", "🧹")
                 
+                    sync_all_caches()
+                    for key in list(st.session_state.keys()):
+                        if key not in ['authenticated', 'current_user_name', 'global_rate_input', 'test_mode', 'get_dynamic_session', 'get_read_session']:
+                            del st.session_state[key]
+                    st.rerun()
+                except Exception as e:
+                    db.rollback()
+                    st.error(f"清空失败: {e}")
+
+        # ==========================================
+        # === 环境切换按钮 (放置在左下角) ===
+        # ==========================================
+        st.markdown("<br><br>", unsafe_allow_html=True) # 撑开一点间距，使其靠下
+        st.divider()
+    
+        # 沙盒复制在后台执行：完成后 (由「后台任务」面板触发整页刷新) 才切换到测试环境
+        clone = tracked_job("sandbox_clone_job")
+        if clone is not None and not is_active(clone):
+            st.session_state.pop("sandbox_clone_job")
+            if clone.status == "done":
+                st.session_state.test_mode = True
+                st.session_state.test_mode_toggle = True
                 st.cache_data.clear()
-                for key in list(st.session_state.keys()):
-                    if key not in ['authenticated', 'current_user_name', 'global_rate_input', 'test_mode', 'get_dynamic_session']:
-                        del st.session_state[key]
                 st.rerun()
-            except Exception as e:
-                db.rollback()
-                st.error(f"清空失败: {e}")
-
-    # ==========================================
-    # === 环境切换按钮 (放置在左下角) ===
-    # ==========================================
-    st.markdown("<br><br>", unsafe_allow_html=True) # 撑开一点间距，使其靠下
-    st.divider()
-    
-    test_mode_toggle = st.toggle(
-        "🧪 **开启测试环境**", 
-        value=st.session_state.test_mode, 
-        help="开启后，系统会复制当前的真实数据。你在测试环境的任何操作均不会影响线上数据。"
-    )
-
-    if test_mode_toggle != st.session_state.test_mode:
+            st.error(f"沙盒复制失败: {clone.message or clone.status}")
+            # 复位开关，不会再次触发复制
+            st.session_state.test_mode_toggle = False
+            clone = None
+        if clone is not None:
+            show_job_progress(clone)
+
+        # 开关状态只由 key 维护 (复制进行中禁用开关时组件不会被重建)
+        st.session_state.setdefault("test_mode_toggle", st.session_state.test_mode)
+        test_mode_toggle = st.toggle(
+            "🧪 **开启测试环境**", 
+            key="test_mode_toggle",
+            disabled=clone is not None,
+            help="开启后，系统会复制当前的真实数据。你在测试环境的任何操作均不会影响线上数据。"
+        )
+
+        if test_mode_toggle != st.session_state.test_mode and clone is None:
+
+            # 无论是进测试还是回线上，把临时交互状态统统清空，防 UI 错位
+            keys_to_keep = ['authenticated', 'current_user_name', 'global_rate_widget', 'test_mode', 'test_mode_toggle', 'get_dynamic_session', 'get_read_session', 'page_profiling', 'watched_jobs']
+            for key in list(st.session_state.keys()):
+                if key not in keys_to_keep:
+                    del st.session_state[key]
+
+            if test_mode_toggle:
+                # 切换到测试环境：提交数据复制任务 (采用统一缓存的引擎获取方式)
+                st.session_state.sandbox_clone_job = submit_job(
+                    "sandbox_clone", "复制真实数据到测试沙盒", sandbox_clone_job,
+                    get_cached_engine(False), get_cached_engine(True)
+                )
+                st.rerun()
+            else:
+                # 返回真实环境
+                st.session_state.test_mode = False
+                st.cache_data.clear()
+                st.rerun()
+    return selected, exchange_rate
 
-        # 无论是进测试还是回线上，把临时交互状态统统清空，防 UI 错位
-        keys_to_keep = ['authenticated', 'current_user_name', 'global_rate_widget', 'test_mode', 'get_dynamic_session']
-        for key in list(st.session_state.keys()):
-            if key not in keys_to_keep:
-                del st.session_state[key]
+# 每次完整运行使用一个请求级 Session，运行结束 (含 st.rerun / st.stop) 时关闭
+with session_manager.request_scope(engine) as db:
+    selected, exchange_rate = render_sidebar(db)
 
-        if test_mode_toggle:
-            # 切换到测试环境：执行数据复制
-            with st.spinner("正在从真实环境复制数据到沙盒，请稍候..."):
-                # 采用统一缓存的引擎获取方式
-                real_engine = get_cached_engine(False)
-                test_engine = get_cached_engine(True)
-                
-                # 1. 清空并重建测试环境的表结构
-                Base.metadata.drop_all(bind=test_engine)
-                Base.metadata.create_all(bind=test_engine)
-                
-                # 2. 从真实库拉取数据写入测试库
-                real_db = sessionmaker(bind=real_engine)()
-                try:
-                    for _, table_name, model_cls in TABLES_MAP:
-                        try:
-                            # 提取整表数据
-                            df_sync = pd.read_sql(real_db.query(model_cls).statement, real_db.bind)
-                            if not df_sync.empty:
-                                # 写入 SQLite 测试库 (利用 pandas 自动处理 ID 映射)
-                                df_sync.to_sql(table_name, test_engine, if_exists='append', index=False)
-                        except Exception as e:
-                            pass # 忽略某张空表的异常
-                finally:
-                    real_db.close()
-            
-            st.session_state.test_mode = True
-            st.cache_data.clear()
-            st.rerun()
+    # --- 路由分发 (开启页面性能分析时记录本次渲染，含首次进入页面时的模块导入) ---
+    with profile_page(selected):
+        show_page, needs_rate = load_page(selected)
+        if needs_rate:
+            show_page(db, exchange_rate)
         else:
-            # 返回真实环境
-            st.session_state.test_mode = False
-            st.cache_data.clear()
-            st.rerun()
+            show_page(db)
 
-# --- 路由分发 ---
-if selected == "商品管理":
-    show_product_page(db)
-elif selected == "商品成本核算":
-    show_cost_page(db, exchange_rate)
-elif selected == "仓库库存管理":
-    show_inventory_page(db)
-elif selected == "线上销售管理":
-    show_sales_order_page(db, exchange_rate)
-elif selected == "销售额一览":
-    show_sales_page(db, exchange_rate)
-elif selected == "财务流水录入":
-    show_finance_page(db, exchange_rate)
-elif selected == "公司账面概览":
-    show_balance_page(db, exchange_rate)
-elif selected == "固定资产管理":
-    show_asset_page(db, exchange_rate)
-elif selected == "其他资产管理":
-    show_other_asset_page(db, exchange_rate)
-elif selected == "财务报表与分析":
-    show_report_page(db, exchange_rate)
-elif selected == "线下销售管理":
-    show_offline_sales_page(db)
-elif selected == "预售销售管理":
-    show_presale_order_page(db, exchange_rate)
\ No newline at end of file
+    with st.sidebar:
+        render_job_panel()
+
+with st.sidebar:
+    render_profiling_panel()
\ No newline at end of file
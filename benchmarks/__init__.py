@@ -0,0 +1,13 @@
+# benchmarks/__init__.py
+"""
+合成数据生成与热点路径基准测试。
+
+    python -m benchmarks.synthetic_data --db /tmp/yurara_small.db --scale small
+    python -m benchmarks.run_benchmarks --scales xs,small --out bench.json
+    python -m benchmarks.run_benchmarks --compare old.json new.json
+"""
+import os
+
+# database.py 在导入时按 DATABASE_URL 创建全局引擎；基准测试为每个规模单独建库，
+# 这里只保证未配置连接串时导入 models 不会失败
+os.environ.setdefault("DATABASE_URL", "sqlite://")
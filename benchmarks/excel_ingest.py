@@ -0,0 +1,161 @@
+# benchmarks/excel_ingest.py
+"""
+Excel 批量导入基准：按合成库中的商品 / 仓库生成一份 N 行 (默认 5 万行) 的订单导入表，对比
+1. pd.read_excel 整表读取 (旧流程) 与 ExcelChunkReader 分块流式读取的耗时和内存峰值；
+2. 整表读取 + validate_and_parse_import_data 与分块读取 + OrderImportValidator 增量校验的完整流程。
+耗时取多轮中位数 (不开 tracemalloc)，内存峰值为单独一轮 tracemalloc 统计的 Python 分配峰值。
+
+    python -m benchmarks.excel_ingest --rows 50000 --repeat 3
+    python -m benchmarks.excel_ingest --rows 50000 --skip-validate --out excel_$(git rev-parse --short HEAD).json
+"""
+import argparse
+import io
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+import pandas as pd
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Product, ProductColor, Warehouse
+from services.excel_ingest import ExcelChunkReader, CHUNK_SIZE, ORDER_TEXT_COLUMNS, ORDER_NUMBER_COLUMNS
+from benchmarks.synthetic_data import SCALES, SyntheticDataGenerator
+from benchmarks.run_benchmarks import EXCHANGE_RATE, BENCH_END_DATE, _git
+
+COLUMNS = ["订单号", "商品名", "商品型号", "数量", "销售平台", "订单总额", "币种", "出货仓库"]
+
+
+def build_workbook(db, n_rows):
+    """
+    生成导入用 xlsx (bytes)。订单号为 15 位纯数字 (电商平台导出常见，Excel 中存为数值)，
+    每 10 行有一行多款式订单 (分号分隔)，商品 / 款式 / 仓库取自库中数据。
+    """
+    from openpyxl import Workbook
+    skus = db.query(Product.name, ProductColor.color_name).join(ProductColor, ProductColor.product_id == Product.id).all()
+    wh_names = [w for (w,) in db.query(Warehouse.name).all()]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("订单")
+    ws.append(COLUMNS)
+    for i in range(n_rows):
+        p_name, variant = skus[i % len(skus)]
+        wh = wh_names[i % len(wh_names)]
+        if i % 10 == 0:
+            same_product = [c for p, c in skus if p == p_name]
+            variants, qty, whs = ";".join(same_product[:2]), ";".join(["1"] * len(same_product[:2])), ";".join([wh] * len(same_product[:2]))
+        else:
+            variants, qty, whs = variant, 1 + i % 3, wh
+        ws.append([310000000000000 + i, p_name, variants, qty, "微店", 100.0 + i % 50, "CNY", whs])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+
+# ================= 用例 =================
+
+def read_full(data):
+    return len(pd.read_excel(io.BytesIO(data)))
+
+
+def read_stream(data):
+    reader = ExcelChunkReader(data, text_columns=ORDER_TEXT_COLUMNS, number_columns=ORDER_NUMBER_COLUMNS)
+    return sum(len(chunk) for chunk in reader)
+
+
+def validate_full(session_maker, data):
+    from services.sales_order_service import SalesOrderService
+    df = pd.read_excel(io.BytesIO(data))
+    with session_maker() as db:
+        parsed, errors = SalesOrderService(db).validate_and_parse_import_data(df, EXCHANGE_RATE)
+    return len(parsed or []), len(errors or [])
+
+
+def validate_stream(session_maker, data):
+    """与 order_import_parse_job 相同的流程"""
+    from services.sales_order_service import OrderImportValidator
+    reader = ExcelChunkReader(data, text_columns=ORDER_TEXT_COLUMNS, number_columns=ORDER_NUMBER_COLUMNS)
+    with session_maker() as db:
+        validator = OrderImportValidator(db, EXCHANGE_RATE)
+        for chunk in reader:
+            if validator.rows_seen == 0 and validator.check_columns(chunk.columns):
+                raise RuntimeError("导入表缺少必要列")
+            validator.feed(chunk, total=reader.total_rows)
+        parsed, errors = validator.finish()
+    return len(parsed or []), len(errors or [])
+
+
+def measure(fn, repeat):
+    """repeat 轮计时 + 一轮 tracemalloc 内存峰值"""
+    runs, outcome = [], None
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        outcome = fn()
+        runs.append(time.perf_counter() - t0)
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return {"median": statistics.median(runs), "min": min(runs), "runs": runs, "peak_mb": peak / 1024 / 1024, "outcome": outcome}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Excel 批量导入基准 (整表读取 vs 分块流式读取)")
+    parser.add_argument("--rows", type=int, default=50000, help="导入表行数")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--scale", default="xs", choices=list(SCALES), help="提供商品 / 仓库 / 库存的合成库规模")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-dir", help="合成库目录 (已存在的同规模同种子库直接复用)，默认临时目录")
+    parser.add_argument("--skip-validate", action="store_true", help="只对比读取，不跑完整校验")
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    args = parser.parse_args()
+
+    payload = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0], "pandas": pd.__version__,
+        "rows": args.rows, "chunk_size": CHUNK_SIZE, "repeat": args.repeat, "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db_dir or tmp
+        os.makedirs(db_dir, exist_ok=True)
+        path = os.path.join(db_dir, f"synthetic_{args.scale}_seed{args.seed}.db")
+        engine = create_engine(f"sqlite:///{path}")
+        if not os.path.exists(path):
+            SyntheticDataGenerator(engine, args.scale, args.seed, end_date=BENCH_END_DATE).generate()
+        session_maker = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+
+        t0 = time.perf_counter()
+        with session_maker() as db:
+            data = build_workbook(db, args.rows)
+        payload["file_mb"] = len(data) / 1024 / 1024
+        print(f"▶ {args.rows} 行导入表 ({payload['file_mb']:.1f} MB, 生成 {time.perf_counter() - t0:.1f} s)")
+
+        cases = [("read[pd.read_excel]", lambda: read_full(data)), ("read[ExcelChunkReader]", lambda: read_stream(data))]
+        if not args.skip_validate:
+            cases += [
+                ("validate[read_excel + 整表校验]", lambda: validate_full(session_maker, data)),
+                ("validate[分块读取 + 增量校验]", lambda: validate_stream(session_maker, data)),
+            ]
+        for name, fn in cases:
+            r = payload["results"][name] = measure(fn, args.repeat)
+            print(f"  {name:<32}{r['median']:>9.2f} s{r['peak_mb']:>10.1f} MB 峰值   结果 {r['outcome']}")
+        engine.dispose()
+
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
+        print(f"✅ 结果已写入 {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+# benchmarks/query_budgets.py
+"""
+写路径的查询预算检查：在 xs 规模合成库上执行 10 行订单的 发货 / 售后 / 线下结账 等操作，
+每项在 query_budget 下运行，SQL 数或同形状语句重复次数超出预算时以非零状态退出，
+N+1 回归在提交前就能发现。
+
+    python -m benchmarks.query_budgets            # 检查预算
+    python -m benchmarks.query_budgets --report   # 只打印各场景的 SQL 统计与疑似 N+1，不检查预算
+"""
+import argparse
+import os
+import sys
+import tempfile
+from datetime import date
+
+from sqlalchemy import create_engine, func
+from sqlalchemy.orm import sessionmaker
+
+from models import InventoryLog, Warehouse, CompanyBalanceItem
+from constants import Currency
+from services.query_profiler import query_budget, profile_queries, QueryBudgetExceeded
+from benchmarks.synthetic_data import SyntheticDataGenerator
+
+ORDER_LINES = 10
+BENCH_END_DATE = date(2025, 12, 31)
+
+# 场景名: (SQL 总数上限, 同形状 SELECT 重复上限)；10 行订单涉及 5 个商品，
+# 指标同步与待结算款按批处理，任何逐行 / 逐商品查询都会让重复数超过上限
+BUDGETS = {
+    "create_order": (15, 2),
+    "ship_order": (40, 2),
+    "complete_order": (12, 3),
+    "add_refund": (48, 2),
+    "checkout_offline_order": (20, 2),
+}
+
+
+def _stocked_lines(db, n):
+    """主仓库存量最多的 n 个款式 [(商品, 款式, 仓库ID)]"""
+    wh_id = db.query(Warehouse.id).order_by(Warehouse.id).first()[0]
+    rows = db.query(InventoryLog.product_name, InventoryLog.variant, func.sum(InventoryLog.change_amount).label("qty")).filter(
+        InventoryLog.warehouse_id == wh_id
+    ).group_by(InventoryLog.product_name, InventoryLog.variant).order_by(func.sum(InventoryLog.change_amount).desc()).limit(n).all()
+    return [(p, v, wh_id) for p, v, _ in rows]
+
+
+def run_scenarios(session_maker, check=True):
+    from services.sales_order_service import SalesOrderService
+    from services.offline_sales_service import OfflineSalesService
+    from services.metrics_sync_queue import metrics_sync_queue
+
+    results, failures = [], []
+
+    def measure(name, fn):
+        max_queries, max_repeats = BUDGETS[name]
+        try:
+            if check:
+                with query_budget(max_queries, max_repeats, label=name) as prof:
+                    fn()
+            else:
+                with profile_queries(name) as prof:
+                    fn()
+        except QueryBudgetExceeded as e:
+            prof = e.profile
+            failures.append(str(e))
+        results.append((name, prof, BUDGETS[name]))
+        return prof
+
+    db = session_maker()
+    try:
+        lines = _stocked_lines(db, ORDER_LINES)
+        svc = SalesOrderService(db)
+        items = [{"product_name": p, "variant": v, "quantity": 1, "unit_price": 100.0, "warehouse_id": wh} for p, v, wh in lines]
+
+        state = {}
+        measure("create_order", lambda: state.update(order=svc.create_order(
+            items, "微店", Currency.CNY, order_no="BUDGET-0001", target_account_name="流动资金-微店账户")[0]))
+        order_id = state["order"].id
+        measure("ship_order", lambda: svc.ship_order(order_id))
+        measure("complete_order", lambda: svc.complete_order(order_id))
+        returned = [{"product_name": p, "variant": v, "quantity": 1, "warehouse_id": wh} for p, v, wh in lines]
+        measure("add_refund", lambda: svc.add_refund(order_id, 300.0, "预算检查", is_returned=True, returned_quantity=len(returned), returned_items=returned))
+
+        pos = OfflineSalesService(db)
+        pos.create_template("预算检查展会", "BGT", Currency.JPY, lines[0][2], "日本线下",
+                            [{"product_name": p, "variant": v, "preset_price": 1000.0, "quantity": 2} for p, v, _ in lines])
+        tpl_id = pos.get_all_templates()[-1].id
+        acc_id = db.query(CompanyBalanceItem.id).filter(CompanyBalanceItem.name == "流动资金-日元临时账户").scalar()
+        cart = [{"product_name": p, "variant": v, "qty": 1, "unit_price": 1000.0} for p, v, _ in lines]
+        measure("checkout_offline_order", lambda: pos.checkout_offline_order(tpl_id, cart, "现金", 0.0, acc_id))
+        metrics_sync_queue.wait_until_idle()
+    finally:
+        db.close()
+    return results, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="写路径查询预算检查")
+    parser.add_argument("--report", action="store_true", help="只打印统计，不检查预算")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp, 'budget.db')}")
+        SyntheticDataGenerator(engine, "xs", args.seed, end_date=BENCH_END_DATE).generate()
+        results, failures = run_scenarios(sessionmaker(bind=engine, autocommit=False, autoflush=False), check=not args.report)
+        engine.dispose()
+
+    for name, prof, (max_queries, max_repeats) in results:
+        worst = max((n for _, n, _ in prof.repeated(1)), default=0)
+        print(f"{name:<26}{prof.count:>5} 条 / 预算 {max_queries:<5} 最多重复 {worst:>3} / 上限 {max_repeats:<4}{prof.db_time * 1000:>8.1f} ms")
+        if args.report:
+            print(prof.format_report(limit=5, threshold=3))
+    if failures:
+        print("\n❌ 超出查询预算:\n" + "\n\n".join(failures))
+        sys.exit(1)
+    if not args.report:
+        print("✅ 全部场景在查询预算内")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+# benchmarks/run_benchmarks.py
+"""
+热点路径基准测试：按多个数据规模生成 (或复用) 合成库，逐项计时并输出 JSON，
+不同提交的结果可用 --compare 对比。
+
+    python -m benchmarks.run_benchmarks --scales xs,small,medium --repeat 5 --out bench_$(git rev-parse --short HEAD).json
+    python -m benchmarks.run_benchmarks --compare bench_old.json bench_new.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, datetime
+
+import pandas as pd
+import sqlalchemy
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+from models import Product, ProductColor, ProductPart, Warehouse, CompanyBalanceItem, FinanceRecord
+from services.query_profiler import profile_queries
+from benchmarks.synthetic_data import SCALES, SyntheticDataGenerator
+
+EXCHANGE_RATE = 0.048
+# 固定数据截止日，同一种子在任何日期生成的库都相同，便于跨提交对比
+BENCH_END_DATE = date(2025, 12, 31)
+IMPORT_ROWS = {"xs": 100, "small": 300, "medium": 1000, "large": 2000}
+
+
+# ================= 场景准备 =================
+
+def _pick_sample_product(db):
+    """带部件的商品 (部件路径最重)，没有则取第一个商品"""
+    row = db.query(Product.id, Product.name).join(ProductColor, ProductColor.product_id == Product.id)\
+        .join(ProductPart, ProductPart.color_id == ProductColor.id).order_by(Product.id).first()
+    return row or db.query(Product.id, Product.name).order_by(Product.id).first()
+
+
+def _build_import_frame(db, n_rows):
+    """模拟批量导入的 Excel：订单号均为新单号，商品/款式/仓库取自库中数据"""
+    skus = db.query(Product.name, ProductColor.color_name).join(ProductColor, ProductColor.product_id == Product.id).all()
+    wh_names = [w for (w,) in db.query(Warehouse.name).all()]
+    rows = []
+    for i in range(n_rows):
+        p_name, variant = skus[i % len(skus)]
+        rows.append({
+            "订单号": f"IMP{i + 1:07d}", "商品名": p_name, "商品型号": variant, "数量": 1 + i % 3,
+            "销售平台": "微店", "订单总额": 100.0 + i % 50, "币种": "CNY", "出货仓库": wh_names[i % len(wh_names)],
+        })
+    return pd.DataFrame(rows)
+
+
+def build_cases(db, scale):
+    """返回 [(名称, fn(db))]；fn 在独立会话中执行，执行后回滚"""
+    from services.inventory_service import InventoryService
+    from services.sales_order_service import SalesOrderService
+    from services.sales_service import SalesService
+    from services.balance_service import BalanceService
+    from services.finance_service import FinanceService
+
+    sample_id, sample_name = _pick_sample_product(db)
+    import_df = _build_import_frame(db, IMPORT_ROWS.get(scale, 300))
+    last_page = max(1, (db.query(FinanceRecord).count() + 99) // 100)
+
+    def report_pipeline(s):
+        cash_accounts = s.query(CompanyBalanceItem).filter(
+            CompanyBalanceItem.category == "asset", CompanyBalanceItem.asset_type == "现金"
+        ).all()
+        df = FinanceService.get_report_frame(s, cash_accounts, EXCHANGE_RATE)
+        # 报表页的月度/年度汇总
+        df.groupby(["年月", "财务性质"])["折合CNY"].sum()
+        df.groupby(["年份", "分类"])["折合CNY"].sum()
+        return df
+
+    return [
+        ("get_warehouse_inventory_details", lambda s: InventoryService(s).get_warehouse_inventory_details()),
+        ("get_stock_overview_by_parts", lambda s: InventoryService(s).get_stock_overview_by_parts(sample_id, sample_name)),
+        ("sync_product_metrics", lambda s: InventoryService(s).sync_product_metrics(sample_id)),
+        ("validate_and_parse_import_data", lambda s: SalesOrderService(s).validate_and_parse_import_data(import_df.copy(), EXCHANGE_RATE)),
+        ("process_sales_data_v2", lambda s: SalesService.process_sales_data_v2(s)),
+        ("get_financial_summary", lambda s: BalanceService.get_financial_summary(s)),
+        ("get_finance_records_page[first]", lambda s: FinanceService.get_finance_records_page(s, 1, 100)),
+        ("get_finance_records_page[last]", lambda s: FinanceService.get_finance_records_page(s, last_page, 100)),
+        ("report_pipeline", report_pipeline),
+    ]
+
+
+# ================= 计时 =================
+
+def time_case(session_maker, fn, repeat, warmup=1):
+    """
+    每次运行使用新会话 (不复用身份映射)，运行后回滚，保证各次之间数据不变。
+    预热那一次同时统计 SQL 数与疑似 N+1 的语句形状，计时的各次不挂统计。
+    """
+    runs, prof = [], None
+    for i in range(warmup + repeat):
+        s = session_maker()
+        try:
+            if i == 0:
+                with profile_queries() as prof:
+                    fn(s)
+                continue
+            t0 = time.perf_counter()
+            fn(s)
+            elapsed = time.perf_counter() - t0
+        finally:
+            s.rollback()
+            s.close()
+        if i >= warmup:
+            runs.append(elapsed)
+    return {
+        "min": min(runs), "median": statistics.median(runs), "mean": statistics.fmean(runs), "runs": runs,
+        "queries": prof.count, "db_time": prof.db_time,
+        "n_plus_one": [[shape[:200], n] for shape, n, _ in prof.repeated()],
+    }
+
+
+def run_scale(scale, repeat, db_dir, seed, only=None):
+    path = os.path.join(db_dir, f"synthetic_{scale}_seed{seed}.db")
+    engine = create_engine(f"sqlite:///{path}")
+    result = {"db": path}
+    if os.path.exists(path):
+        result["generated"] = False
+    else:
+        t0 = time.perf_counter()
+        result["row_counts"] = SyntheticDataGenerator(engine, scale, seed, end_date=BENCH_END_DATE).generate()
+        result["generate_seconds"] = time.perf_counter() - t0
+        result["generated"] = True
+
+    session_maker = sessionmaker(bind=engine, autocommit=False, autoflush=False)
+    db = session_maker()
+    try:
+        cases = build_cases(db, scale)
+    finally:
+        db.close()
+
+    result["timings"] = {}
+    for name, fn in cases:
+        if only and name.split("[")[0] not in only: continue
+        result["timings"][name] = time_case(session_maker, fn, repeat)
+        t = result["timings"][name]
+        print(f"  {scale:<7}{name:<36}{t['median'] * 1000:>10.1f} ms{t['queries']:>7} SQL" + (f"  ⚠️ N+1 ×{len(t['n_plus_one'])}" if t["n_plus_one"] else ""))
+    engine.dispose()
+    return result
+
+
+def _git(*args):
+    try:
+        return subprocess.run(["git", *args], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ================= 对比 =================
+
+def compare(old_path, new_path):
+    with open(old_path, encoding="utf-8") as f: old = json.load(f)
+    with open(new_path, encoding="utf-8") as f: new = json.load(f)
+    print(f"基线 {old.get('commit') or '?'}  →  当前 {new.get('commit') or '?'} (中位数, ms)")
+    for scale, res in new["results"].items():
+        base = old["results"].get(scale, {}).get("timings", {})
+        for name, t in res["timings"].items():
+            cur = t["median"] * 1000
+            if name in base:
+                prev = base[name]["median"] * 1000
+                q = f"{base[name].get('queries', '?')}→{t.get('queries', '?')} SQL"
+                print(f"  {scale:<7}{name:<36}{prev:>10.1f}{cur:>10.1f}{cur / prev if prev else float('nan'):>8.2f}x  {q}")
+            else:
+                print(f"  {scale:<7}{name:<36}{'-':>10}{cur:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="热点路径基准测试")
+    parser.add_argument("--scales", default="xs,small", help=f"逗号分隔 (可选: {', '.join(SCALES)})")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--db-dir", help="合成库目录 (已存在的同规模同种子库直接复用)，默认临时目录")
+    parser.add_argument("--only", help="只运行指定用例 (逗号分隔)")
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="对比两份 JSON 结果")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    scales = [s.strip() for s in args.scales.split(",") if s.strip()]
+    unknown = [s for s in scales if s not in SCALES]
+    if unknown: parser.error(f"未知规模: {', '.join(unknown)}")
+    only = {s.strip() for s in args.only.split(",")} if args.only else None
+
+    payload = {
+        "commit": _git("rev-parse", "HEAD"),
+        "dirty": bool(_git("status", "--porcelain", "--untracked-files=no")),
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "python": sys.version.split()[0], "platform": platform.platform(),
+        "sqlalchemy": sqlalchemy.__version__, "pandas": pd.__version__,
+        "repeat": args.repeat, "seed": args.seed, "results": {},
+    }
+    with tempfile.TemporaryDirectory() as tmp:
+        db_dir = args.db_dir or tmp
+        os.makedirs(db_dir, exist_ok=True)
+        for scale in scales:
+            print(f"▶ {scale}")
+            payload["results"][scale] = run_scale(scale, args.repeat, db_dir, args.seed, only)
+
+    text = json.dumps(payload, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f: f.write(text)
+        print(f"✅ 结果已写入 {args.out}")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,163 @@
+# benchmarks/sales_golden.py
+"""
+V1 / V2 销售数据引擎的金样 (golden) 对照：在固定种子的 xs 合成库上追加一组边界数据
+(缺平台/币种回落订单、发货撤销按明细单价计价、无订单撤销、零金额订单退款、无订单退货等)，
+把 process_sales_data_v1 / process_sales_data_v2 的输出规整为 CSV 后取 sha256，
+与仓库中的 benchmarks/sales_golden.json 比对，行数 / 列类型 / 内容任何变化都以非零状态退出。
+
+金样取自批量预取改造前的逐行实现，改动两套引擎后运行本脚本即可确认输出未变：
+
+    python -m benchmarks.sales_golden                 # 比对金样
+    python -m benchmarks.sales_golden --dump /tmp/g   # 同时导出各用例 CSV，便于排查差异
+    python -m benchmarks.sales_golden --update        # 有意改变输出口径时重写金样
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+import tempfile
+from datetime import date
+
+import pandas as pd
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import InventoryLog, SalesOrder, SalesOrderItem, OrderRefund
+from constants import Currency, OrderStatus, StockLogReason
+from benchmarks.synthetic_data import SyntheticDataGenerator
+
+GOLDEN_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "sales_golden.json")
+SEED = 42
+BENCH_END_DATE = date(2025, 12, 31)
+EDGE_DATE = date(2025, 12, 30)
+
+
+def _add_edge_cases(engine):
+    """追加合成数据不会产生的边界行 (订单号 EDGE-*)，覆盖两套引擎的全部分支"""
+    log = dict(variant="款式1", change_amount=0, reason=StockLogReason.OUT_STOCK, date=EDGE_DATE, note="金样边界",
+               is_sold=False, sale_amount=0.0, currency=None, platform=None, is_other_out=False,
+               warehouse_id=1, part_name=None, order_id=None, cost_item_id=None, is_opening=False)
+    order = dict(order_type="线上", final_order_no=None, deposit_amount=0.0, final_amount=0.0, currency=Currency.JPY,
+                 platform="Booth", target_account_name="流动资金-booth账户", created_date=EDGE_DATE, shipped_date=EDGE_DATE,
+                 completed_date=None, notes="", discount_note="", template_id=None)
+    with engine.begin() as conn:
+        o1 = conn.execute(insert(SalesOrder).values(order_no="EDGE-1", status=OrderStatus.SHIPPED, total_amount=3000.0, **order)).inserted_primary_key[0]
+        o2 = conn.execute(insert(SalesOrder).values(order_no="EDGE-2", status=OrderStatus.AFTER_SALES, total_amount=0.0, **order)).inserted_primary_key[0]
+        o3 = conn.execute(insert(SalesOrder).values(order_no="EDGE-3", status=OrderStatus.PENDING, total_amount=500.0, **order)).inserted_primary_key[0]
+        p = "合成商品0001"
+        conn.execute(insert(SalesOrderItem), [
+            dict(order_id=o1, product_name=p, variant="款式1", quantity=2, unit_price=1000.0, subtotal=2000.0, warehouse_id=1),
+            dict(order_id=o1, product_name=p, variant="款式2", quantity=1, unit_price=1000.0, subtotal=1000.0, warehouse_id=1),
+            dict(order_id=o1, product_name=p, variant="款式1", quantity=1, unit_price=900.0, subtotal=900.0, warehouse_id=1),
+            dict(order_id=o2, product_name=p, variant="款式3", quantity=1, unit_price=0.0, subtotal=0.0, warehouse_id=1),
+            dict(order_id=o3, product_name=p, variant="款式3", quantity=1, unit_price=500.0, subtotal=500.0, warehouse_id=1),
+        ])
+        conn.execute(insert(OrderRefund), [
+            dict(order_id=o1, refund_amount=1234.5, refund_reason="金样退款", refund_date=EDGE_DATE, is_returned=False,
+                 returned_quantity=0, is_resend=False, resend_quantity=0, cost_item_id=None),
+            dict(order_id=o2, refund_amount=100.0, refund_reason="零金额订单退款", refund_date=EDGE_DATE, is_returned=False,
+                 returned_quantity=0, is_resend=False, resend_quantity=0, cost_item_id=None),
+        ])
+        conn.execute(insert(InventoryLog), [
+            # 售出流水缺平台/币种：回落到关联订单
+            {**log, "product_name": p, "change_amount": -2, "is_sold": True, "sale_amount": 2000.0, "order_id": o1, "platform": "", "currency": None},
+            # 售出流水缺平台且无订单：其他/未知，金额为 0
+            {**log, "product_name": p, "change_amount": -1, "is_sold": True, "sale_amount": None},
+            # 发货撤销带金额 / 无金额按订单明细首条单价 / 无匹配明细 / 无订单
+            {**log, "product_name": p, "change_amount": 2, "reason": StockLogReason.UNDO_SHIP, "sale_amount": 2000.0, "order_id": o1},
+            {**log, "product_name": p, "change_amount": 3, "reason": StockLogReason.UNDO_SHIP, "order_id": o1, "platform": "Booth", "currency": Currency.JPY},
+            {**log, "product_name": p, "variant": "款式3", "change_amount": 1, "reason": StockLogReason.UNDO_SHIP, "order_id": o1},
+            {**log, "product_name": p, "change_amount": 1, "reason": StockLogReason.UNDO_SHIP, "sale_amount": None},
+            # 退货入库：有订单取订单平台，无订单且平台为空时 未知 / CNY
+            {**log, "product_name": p, "change_amount": 1, "reason": StockLogReason.RETURN_IN, "is_sold": True, "order_id": o1},
+            {**log, "product_name": p, "change_amount": 2, "reason": StockLogReason.RETURN_IN, "is_sold": True, "platform": "", "currency": ""},
+        ])
+
+
+def build_database(path):
+    engine = create_engine(f"sqlite:///{path}")
+    SyntheticDataGenerator(engine, "xs", SEED, end_date=BENCH_END_DATE).generate()
+    _add_edge_cases(engine)
+    return engine
+
+
+def run_cases(db, sales_service):
+    """返回 {用例名: DataFrame}；sales_service 可传入其他实现做对照"""
+    logs = sales_service.get_raw_sales_logs_v1(db)
+    # 全部为整数 0 金额的子集：V1 在此情况下输出整型金额列
+    int_logs = [l for l in logs if not l.sale_amount and not l.order_id]
+    return {
+        "v2": sales_service.process_sales_data_v2(db),
+        "v1": sales_service.process_sales_data_v1(db, logs),
+        "v1[无金额无订单]": sales_service.process_sales_data_v1(db, int_logs),
+    }
+
+
+def _kind(dtype):
+    if pd.api.types.is_bool_dtype(dtype): return "bool"
+    if pd.api.types.is_integer_dtype(dtype): return "int"
+    if pd.api.types.is_float_dtype(dtype): return "float"
+    return "other"
+
+
+def _canonical_csv(df):
+    return df.to_csv(index=False, lineterminator="\n")
+
+
+def fingerprint(df):
+    """行数 + 列类型 (整数/浮点/布尔/其他，不依赖 pandas 版本的字符串类型) + 规整 CSV 的 sha256"""
+    return {
+        "rows": len(df),
+        "columns": {c: _kind(t) for c, t in df.dtypes.items()},
+        "sha256": hashlib.sha256(_canonical_csv(df).encode("utf-8")).hexdigest(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="V1/V2 销售数据引擎金样对照")
+    parser.add_argument("--update", action="store_true", help="用当前实现的输出重写金样")
+    parser.add_argument("--dump", help="把各用例的规整 CSV 写入该目录")
+    args = parser.parse_args()
+
+    from services.sales_service import SalesService
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = build_database(os.path.join(tmp, "golden.db"))
+        db = sessionmaker(bind=engine, autoflush=False)()
+        try:
+            frames = run_cases(db, SalesService)
+        finally:
+            db.close()
+            engine.dispose()
+
+    if args.dump:
+        os.makedirs(args.dump, exist_ok=True)
+        for name, df in frames.items():
+            with open(os.path.join(args.dump, f"{name}.csv"), "w", encoding="utf-8") as f: f.write(_canonical_csv(df))
+        print(f"📄 CSV 已写入 {args.dump}")
+
+    current = {name: fingerprint(df) for name, df in frames.items()}
+    if args.update:
+        with open(GOLDEN_PATH, "w", encoding="utf-8") as f:
+            f.write(json.dumps(current, ensure_ascii=False, indent=2) + "\n")
+        print(f"✅ 金样已写入 {GOLDEN_PATH}")
+        return
+
+    with open(GOLDEN_PATH, encoding="utf-8") as f:
+        golden = json.load(f)
+    failures = []
+    for name in sorted(set(golden) | set(current)):
+        exp, got = golden.get(name), current.get(name)
+        ok = exp == got
+        print(f"{'✅' if ok else '❌'} {name:<20}{(got or {}).get('rows', '-'):>6} 行")
+        if not ok:
+            failures.append(f"{name}\n  金样: {exp}\n  当前: {got}")
+    if failures:
+        print("\n❌ 输出与金样不一致:\n" + "\n".join(failures))
+        sys.exit(1)
+    print("✅ V1/V2 输出与金样一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+# benchmarks/startup.py
+"""
+冷启动基准：每一轮在全新的子进程中
+1. 依次导入 app.py 顶层 import 的模块，统计导入耗时；
+2. 用 Streamlit AppTest 以已登录状态运行 app.py，统计首屏 (第一次完整运行) 与再次运行的耗时，
+并列出首屏后已加载的重型依赖与视图模块，用来确认视图按需加载没有被顶层 import 破坏。
+
+    python -m benchmarks.startup --repeat 5
+    python -m benchmarks.startup --repeat 5 --out startup_$(git rev-parse --short HEAD).json
+"""
+import argparse
+import ast
+import importlib
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_PATH = os.path.join(PROJECT_ROOT, "app.py")
+HEAVY_MODULES = ["pandas", "numpy", "openpyxl", "pyarrow", "plotly", "altair"]
+
+
+def startup_modules():
+    """app.py 顶层 import 的模块 (按出现顺序)"""
+    with open(APP_PATH, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    modules = []
+    for node in tree.body:
+        if isinstance(node, ast.Import):
+            modules.extend(alias.name for alias in node.names)
+        elif isinstance(node, ast.ImportFrom) and node.module and node.level == 0:
+            modules.append(node.module)
+    return list(dict.fromkeys(modules))
+
+
+def _child(app_timeout):
+    """子进程：导入计时 + 首屏计时，结果以 JSON 输出到 stdout 最后一行"""
+    import_ms = {}
+    t_all = time.perf_counter()
+    for name in startup_modules():
+        t0 = time.perf_counter()
+        importlib.import_module(name)
+        import_ms[name] = (time.perf_counter() - t0) * 1000
+    imports_total = (time.perf_counter() - t_all) * 1000
+
+    from streamlit.testing.v1 import AppTest
+    at = AppTest.from_file(APP_PATH, default_timeout=app_timeout)
+    at.session_state["authenticated"] = True
+    at.session_state["current_user_name"] = "bench"
+    at.session_state["cookie_handshake"] = True
+
+    t0 = time.perf_counter()
+    at.run()
+    first_paint = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    at.run()
+    rerun = (time.perf_counter() - t0) * 1000
+
+    print(json.dumps({
+        "imports_ms": imports_total, "import_breakdown": import_ms,
+        "first_paint_ms": first_paint, "rerun_ms": rerun,
+        "exceptions": [str(e.value) for e in at.exception],
+        "heavy_loaded": [m for m in HEAVY_MODULES if m in sys.modules],
+        "views_loaded": sorted(m for m in sys.modules if m.startswith("views.")),
+    }, ensure_ascii=False))
+
+
+def run_once(db_url, metrics_url, app_timeout):
+    env = dict(os.environ, DATABASE_URL=db_url, YURARA_METRICS_DB_URL=metrics_url)
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", "--timeout", str(app_timeout)],
+        cwd=PROJECT_ROOT, env=env, capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="冷启动基准 (导入耗时 / 首屏耗时)")
+    parser.add_argument("--repeat", type=int, default=3, help="冷启动轮数 (每轮一个新进程)")
+    parser.add_argument("--scale", default="xs", help="合成库规模")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--out", help="JSON 结果输出路径")
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        _child(args.timeout)
+        return
+
+    from sqlalchemy import create_engine
+    from benchmarks.synthetic_data import SyntheticDataGenerator
+    from benchmarks.run_benchmarks import BENCH_END_DATE, _git
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "startup.db")
+        engine = create_engine(f"sqlite:///{db_path}")
+        SyntheticDataGenerator(engine, args.scale, 42, end_date=BENCH_END_DATE).generate()
+        engine.dispose()
+        runs = [run_once(f"sqlite:///{db_path}", f"sqlite:///{os.path.join(tmp, 'metrics.db')}", args.timeout) for _ in range(args.repeat)]
+
+    last = runs[-1]
+    summary = {
+        key: statistics.median(r[key] for r in runs) for key in ["imports_ms", "first_paint_ms", "rerun_ms"]
+    }
+    print(f"导入 {summary['imports_ms']:.0f} ms | 首屏 {summary['first_paint_ms']:.0f} ms | 再次运行 {summary['rerun_ms']:.0f} ms (中位数, {args.repeat} 轮)")
+    for name, ms in sorted(last["import_breakdown"].items(), key=lambda kv: -kv[1])[:8]:
+        print(f"  {name:<40}{ms:>8.1f} ms")
+    print(f"首屏后已加载: 重型依赖 {last['heavy_loaded'] or '无'}，视图 {last['views_loaded'] or '无'}")
+    if last["exceptions"]:
+        print(f"⚠️ 运行异常: {last['exceptions']}")
+
+    if args.out:
+        payload = {"commit": _git("rev-parse", "HEAD"), "scale": args.scale, "repeat": args.repeat, "median": summary, "runs": runs}
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(payload, f, ensure_ascii=False, indent=2)
+        print(f"✅ 结果已写入 {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# benchmarks/synthetic_data.py
+"""
+按 models.py 的结构生成合成业务数据 (SQLite)，规模可配置：
+商品 × 款式 × 部件、多年库存流水、数万订单 (含退款/退货)、财务流水与成本明细。
+原始表用批量 INSERT 直接写入，汇总表与派生账目再交给现有服务重建，
+生成后的库与真实使用中的库一致 (对账报告无差异)。
+"""
+import argparse
+import random
+import time
+from datetime import date, timedelta
+
+from sqlalchemy import create_engine, insert
+from sqlalchemy.orm import sessionmaker
+
+from models import (
+    Product, ProductColor, ProductPrice, ProductPart, CostItem, InventoryLog, FinanceRecord,
+    CompanyBalanceItem, SalesOrder, SalesOrderItem, OrderRefund, Warehouse
+)
+from constants import PRODUCT_COST_CATEGORIES, BalanceCategory, Currency, OrderStatus, StockLogReason, FinanceCategory
+from schema_manager import upgrade_schema
+
+# 规模预设：orders / finance_records 为总条数，其余为每个商品 (或每个款式) 的数量
+SCALES = {
+    "xs":     {"products": 5,   "colors": 3, "parts": 2, "years": 1, "orders": 500,   "refund_rate": 0.05, "finance_records": 300,   "cost_items": 10, "stock_events": 20},
+    "small":  {"products": 20,  "colors": 4, "parts": 2, "years": 2, "orders": 5000,  "refund_rate": 0.05, "finance_records": 3000,  "cost_items": 20, "stock_events": 40},
+    "medium": {"products": 60,  "colors": 5, "parts": 3, "years": 3, "orders": 20000, "refund_rate": 0.06, "finance_records": 10000, "cost_items": 30, "stock_events": 60},
+    "large":  {"products": 120, "colors": 6, "parts": 3, "years": 5, "orders": 50000, "refund_rate": 0.08, "finance_records": 25000, "cost_items": 40, "stock_events": 80},
+}
+
+WAREHOUSES = ["主仓库", "东京仓", "上海仓"]
+PART_NAMES = ["主体", "配件A", "配件B", "配件C", "包装盒"]
+CASH_ACCOUNTS = [
+    ("流动资金-支付宝账户", Currency.CNY), ("流动资金-微店账户", Currency.CNY),
+    ("流动资金-booth账户", Currency.JPY), ("流动资金-日元临时账户", Currency.JPY),
+]
+# (平台, 币种, 价格平台代号, 收款账户, 权重)
+ORDER_PLATFORMS = [
+    ("微店", Currency.CNY, "weidian", "流动资金-微店账户", 5),
+    ("Booth", Currency.JPY, "booth", "流动资金-booth账户", 3),
+    ("国内线下", Currency.CNY, "offline_cn", "流动资金-支付宝账户", 1),
+    ("日本线下", Currency.JPY, "offline_jp", "流动资金-日元临时账户", 1),
+]
+MISC_FINANCE = [("其他", -1, 6), ("其他现金收入", 1, 2), ("分红", -1, 1), ("投资", 1, 1)]
+CHUNK_SIZE = 5000
+
+
+def _bulk_insert(conn, model, rows):
+    # executemany 要求每行的列一致，未给出的列补 None
+    keys = {k for r in rows for k in r}
+    rows = [{k: r.get(k) for k in keys} for r in rows]
+    for i in range(0, len(rows), CHUNK_SIZE):
+        conn.execute(insert(model.__table__), rows[i:i + CHUNK_SIZE])
+
+
+class SyntheticDataGenerator:
+    """
+    生成一套完整的合成数据。所有主键在内存中预先分配，外键直接引用，
+    因此整库只需每张表若干次批量 INSERT。
+    """
+    def __init__(self, engine, scale="small", seed=42, end_date=None, **overrides):
+        if scale not in SCALES:
+            raise ValueError(f"未知规模: {scale} (可选: {', '.join(SCALES)})")
+        self.engine = engine
+        self.cfg = {**SCALES[scale], **overrides}
+        self.rng = random.Random(seed)
+        self.end_date = end_date or date.today() - timedelta(days=1)
+        self.start_date = self.end_date - timedelta(days=365 * self.cfg["years"])
+        self.rows = {}
+
+    def _rand_date(self, start=None, end=None):
+        start, end = start or self.start_date, end or self.end_date
+        return start + timedelta(days=self.rng.randint(0, max(0, (end - start).days)))
+
+    def _add(self, model, **values):
+        rows = self.rows.setdefault(model, [])
+        values.setdefault("id", len(rows) + 1)
+        rows.append(values)
+        return values
+
+    # ================= 基础数据 =================
+
+    def _build_master_data(self):
+        cfg, rng = self.cfg, self.rng
+        self.warehouse_ids = [self._add(Warehouse, name=n, remarks="合成数据")["id"] for n in WAREHOUSES]
+        self.accounts = {
+            name: self._add(CompanyBalanceItem, category=BalanceCategory.ASSET, name=name, amount=0.0, currency=curr, asset_type="现金")["id"]
+            for name, curr in CASH_ACCOUNTS
+        }
+
+        self.skus = []  # [(product_name, color_name, {price_code: price})]
+        self.products = []
+        for i in range(cfg["products"]):
+            name = f"合成商品{i + 1:04d}"
+            with_parts = cfg["parts"] > 1 and i % 2 == 0
+            colors = []
+            for j in range(cfg["colors"]):
+                colors.append({"name": f"款式{j + 1}", "planned": rng.randint(50, 300)})
+            prod = self._add(
+                Product, name=name, total_quantity=sum(c["planned"] for c in colors), marketable_quantity=0,
+                is_production_completed=rng.random() < 0.7, target_platform="微店"
+            )
+            self.products.append((prod, colors, with_parts))
+
+            for c in colors:
+                color = self._add(ProductColor, product_id=prod["id"], color_name=c["name"], quantity=c["planned"], produced_quantity=0)
+                base = rng.randint(30, 300)
+                prices = {"weidian": float(base), "offline_cn": float(base), "booth": float(base * 21), "offline_jp": float(base * 21)}
+                for code, price in prices.items():
+                    curr = Currency.JPY if code in ("booth", "offline_jp") else Currency.CNY
+                    self._add(ProductPrice, color_id=color["id"], platform=code, currency=curr, price=price)
+                c["parts"] = {}
+                if with_parts:
+                    for k, pt in enumerate(PART_NAMES[:cfg["parts"]]):
+                        req = 2 if k == cfg["parts"] - 1 and i % 4 == 0 else 1
+                        self._add(ProductPart, color_id=color["id"], part_name=pt, quantity=req)
+                        c["parts"][pt] = req
+                self.skus.append((name, c["name"], prices))
+
+    # ================= 库存流水 =================
+
+    def _log(self, product, variant, qty, reason, log_date, warehouse_id, **extra):
+        row = dict(
+            product_name=product, variant=variant, change_amount=qty, reason=reason, date=log_date, note=extra.pop("note", None),
+            is_sold=False, sale_amount=0.0, currency=None, platform=None, is_other_out=False,
+            warehouse_id=warehouse_id, part_name=None, order_id=None, cost_item_id=None, is_opening=False
+        )
+        row.update(extra)
+        return self._add(InventoryLog, **row)
+
+    def _build_stock_logs(self):
+        """生产批次入库 (验收 → 验收完成)、部件补货、调拨、消耗与其他出库"""
+        rng = self.rng
+        for prod, colors, _ in self.products:
+            p_name = prod["name"]
+            batch_date = self._rand_date(self.start_date, self.start_date + timedelta(days=60))
+            for c in colors:
+                # 生产量在计划量上下浮动，保证订单出库后库存大体为正
+                produced = c["planned"] + rng.randint(0, 40)
+                for wh_id, share in zip(self.warehouse_ids, (0.6, 0.25, 0.15)):
+                    qty = max(1, int(produced * share))
+                    self._log(p_name, c["name"], qty, StockLogReason.IN_INSPECT, batch_date, wh_id, note="生产批次验收")
+                    self._log(p_name, c["name"], qty, StockLogReason.INSPECT_COMPLETED, batch_date + timedelta(days=rng.randint(3, 20)), wh_id, note="验收完成")
+                c["produced"] = produced
+
+            for _ in range(self.cfg["stock_events"]):
+                c = rng.choice(colors)
+                d = self._rand_date()
+                roll = rng.random()
+                if roll < 0.35:
+                    src, dst = rng.sample(self.warehouse_ids, 2)
+                    qty = rng.randint(1, 10)
+                    self._log(p_name, c["name"], -qty, StockLogReason.TRANSFER, d, src, note="库存移动")
+                    self._log(p_name, c["name"], qty, StockLogReason.TRANSFER, d, dst, note="库存移动")
+                elif roll < 0.55 and c["parts"]:
+                    self._log(p_name, c["name"], rng.randint(1, 5), StockLogReason.OTHER_IN, d, rng.choice(self.warehouse_ids),
+                              part_name=rng.choice(list(c["parts"])), note="部件补货")
+                elif roll < 0.7:
+                    self._log(p_name, c["name"], rng.randint(1, 5), StockLogReason.OTHER_IN, d, rng.choice(self.warehouse_ids), note="其他入库")
+                elif roll < 0.85:
+                    self._log(p_name, c["name"], -rng.randint(1, 3), StockLogReason.OUT_STOCK, d, rng.choice(self.warehouse_ids),
+                              note="样品消耗", is_other_out=True)
+                else:
+                    self._log(p_name, c["name"], -rng.randint(1, 3), StockLogReason.OUT_STOCK, d, rng.choice(self.warehouse_ids),
+                              note="其他出库 (赠品)", is_other_out=True)
+
+    # ================= 订单 / 退款 =================
+
+    def _build_orders(self):
+        rng, cfg = self.rng, self.cfg
+        weights = [p[4] for p in ORDER_PLATFORMS]
+        recent = self.end_date - timedelta(days=14)
+        for i in range(cfg["orders"]):
+            platform, curr, price_code, acc_name, _ = rng.choices(ORDER_PLATFORMS, weights)[0]
+            created = self._rand_date()
+            if created > recent:
+                status = rng.choice([OrderStatus.PENDING, OrderStatus.SHIPPED, OrderStatus.COMPLETED])
+            else:
+                status = rng.choices([OrderStatus.COMPLETED, OrderStatus.AFTER_SALES, OrderStatus.SHIPPED], [90, 5, 5])[0]
+            shipped = created + timedelta(days=rng.randint(0, 4)) if status != OrderStatus.PENDING else None
+            completed = min(shipped + timedelta(days=rng.randint(3, 14)), self.end_date) if status == OrderStatus.COMPLETED else None
+
+            order_id = len(self.rows.get(SalesOrder, [])) + 1
+            items, total = [], 0.0
+            for sku_name, variant, prices in rng.sample(self.skus, min(len(self.skus), rng.choices([1, 2, 3], [70, 22, 8])[0])):
+                qty = rng.choices([1, 2, 3], [80, 15, 5])[0]
+                subtotal = prices[price_code] * qty
+                total += subtotal
+                wh_id = rng.choice(self.warehouse_ids)
+                items.append(self._add(SalesOrderItem, order_id=order_id, product_name=sku_name, variant=variant, quantity=qty,
+                                       unit_price=prices[price_code], subtotal=subtotal, warehouse_id=wh_id))
+                self._log(sku_name, variant, -qty, StockLogReason.OUT_STOCK, created, wh_id, note=f"销售订单发货: SYN{order_id:07d}",
+                          is_sold=True, sale_amount=subtotal, currency=curr, platform=platform, order_id=order_id)
+
+            self._add(SalesOrder, id=order_id, order_no=f"SYN{order_id:07d}", order_type="线上", final_order_no=None,
+                      deposit_amount=0.0, final_amount=0.0, status=status, total_amount=total, currency=curr, platform=platform,
+                      target_account_name=acc_name, created_date=created, shipped_date=shipped, completed_date=completed,
+                      notes="", discount_note="", template_id=None)
+
+            if completed:
+                fee = round(total * 0.006, 2) if platform == "微店" else 0.0
+                self._add(FinanceRecord, date=completed, amount=total - fee, currency=curr, category=FinanceCategory.SALES_INCOME,
+                          description=f"订单收款: SYN{order_id:07d} (平台:{platform}) [账户: {acc_name}]",
+                          account_id=self.accounts[acc_name], order_id=order_id)
+                if rng.random() < cfg["refund_rate"]:
+                    self._build_refund(order_id, items, total, curr, platform, acc_name, completed)
+
+    def _build_refund(self, order_id, items, total, curr, platform, acc_name, completed):
+        rng = self.rng
+        refund_date = min(completed + timedelta(days=rng.randint(1, 20)), self.end_date)
+        returned = rng.random() < 0.5
+        amount = round(total * (1.0 if returned else rng.uniform(0.1, 0.5)), 2)
+        returned_qty = 0
+        if returned:
+            for it in items:
+                returned_qty += it["quantity"]
+                self._log(it["product_name"], it["variant"], it["quantity"], StockLogReason.RETURN_IN, refund_date, it["warehouse_id"],
+                          note=f"订单退货: SYN{order_id:07d} - 合成退货", is_sold=True, currency=curr, platform=platform, order_id=order_id)
+        self._add(OrderRefund, order_id=order_id, refund_amount=amount, refund_reason="合成退款", refund_date=refund_date,
+                  is_returned=returned, returned_quantity=returned_qty, is_resend=False, resend_quantity=0, cost_item_id=None)
+        self._add(FinanceRecord, date=refund_date, amount=-amount, currency=curr, category=FinanceCategory.SALES_INCOME,
+                  description=f"退款: SYN{order_id:07d} - 合成退款 [账户: {acc_name}]", account_id=self.accounts[acc_name], order_id=order_id)
+
+    # ================= 成本 / 财务流水 =================
+
+    def _build_costs_and_finance(self):
+        rng, cfg = self.rng, self.cfg
+        cny_accounts = [n for n, c in CASH_ACCOUNTS if c == Currency.CNY]
+        for prod, _, _ in self.products:
+            for k in range(cfg["cost_items"]):
+                cat = rng.choice(PRODUCT_COST_CATEGORIES)
+                if k % 5 == 0:
+                    unit_price, qty = round(rng.uniform(1, 50), 2), rng.randint(10, 300)
+                    self._add(CostItem, product_id=prod["id"], item_name=f"{cat}-预算{k}", actual_cost=0.0, supplier="预算设定",
+                              category=cat, unit_price=unit_price, quantity=qty, remarks="", unit="个", currency=Currency.CNY)
+                    continue
+                amount = round(rng.uniform(50, 3000), 2)
+                acc_name = rng.choice(cny_accounts)
+                rec = self._add(FinanceRecord, date=self._rand_date(self.start_date, self.start_date + timedelta(days=120)), amount=-amount,
+                                currency=Currency.CNY, category="商品成本", description=f"{prod['name']}-{cat}-{k} [账户: {acc_name}]",
+                                account_id=self.accounts[acc_name])
+                self._add(CostItem, product_id=prod["id"], item_name=f"{cat}-{k}", actual_cost=amount, supplier=f"供应商{rng.randint(1, 30)}",
+                          category=cat, unit_price=amount, quantity=1, remarks="", unit="", currency=Currency.CNY,
+                          original_amount=amount, finance_record_id=rec["id"])
+
+        weights = [m[2] for m in MISC_FINANCE]
+        for _ in range(cfg["finance_records"]):
+            cat, sign, _ = rng.choices(MISC_FINANCE, weights)[0]
+            acc_name, curr = rng.choice(CASH_ACCOUNTS)
+            amount = round(rng.uniform(10, 2000) * (20 if curr == Currency.JPY else 1), 2)
+            self._add(FinanceRecord, date=self._rand_date(), amount=sign * amount, currency=curr, category=cat,
+                      description=f"合成{cat} [账户: {acc_name}]", account_id=self.accounts[acc_name])
+
+    # ================= 写入 =================
+
+    def generate(self):
+        """建表、写入原始数据并重建汇总表/派生账目，返回 {表名: 行数}"""
+        from services.sales_fact_service import SalesFactService
+        from services.cost_rollup_service import CostRollupService
+        from services.cost_history_service import CostHistoryService
+        from services.balance_rebuild_service import BalanceRebuildService
+
+        upgrade_schema(self.engine)
+        self._build_master_data()
+        self._build_stock_logs()
+        self._build_orders()
+        self._build_costs_and_finance()
+
+        insert_order = [
+            Warehouse, CompanyBalanceItem, Product, ProductColor, ProductPrice, ProductPart,
+            SalesOrder, SalesOrderItem, FinanceRecord, CostItem, OrderRefund, InventoryLog
+        ]
+        with self.engine.begin() as conn:
+            for model in insert_order:
+                _bulk_insert(conn, model, self.rows.get(model, []))
+
+        db = sessionmaker(bind=self.engine, autoflush=False)()
+        try:
+            SalesFactService(db).rebuild()
+            CostRollupService(db).rebuild()
+            BalanceRebuildService(db).apply()
+            CostHistoryService(db).capture_all()
+        finally:
+            db.close()
+        return {model.__tablename__: len(self.rows.get(model, [])) for model in insert_order}
+
+
+def generate_database(path, scale="small", seed=42, **overrides):
+    """在 path 新建 SQLite 库并写入合成数据，返回 (engine, {表名: 行数})"""
+    engine = create_engine(f"sqlite:///{path}")
+    counts = SyntheticDataGenerator(engine, scale, seed, **overrides).generate()
+    return engine, counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成业务数据 (SQLite)")
+    parser.add_argument("--db", required=True, help="输出的 SQLite 文件路径 (需不存在)")
+    parser.add_argument("--scale", default="small", choices=list(SCALES))
+    parser.add_argument("--seed", type=int, default=42)
+    for key in SCALES["xs"]:
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(SCALES["xs"][key]), dest=key, help=f"覆盖规模预设的 {key}")
+    args = parser.parse_args()
+
+    overrides = {k: v for k in SCALES["xs"] if (v := getattr(args, k)) is not None}
+    t0 = time.perf_counter()
+    _, counts = generate_database(args.db, args.scale, args.seed, **overrides)
+    for table, n in counts.items():
+        print(f"{table:<24}{n:>10,}")
+    print(f"✅ 已生成 {args.db} ({time.perf_counter() - t0:.1f}s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -6,7 +6,7 @@ import asyncio
 from dotenv import load_dotenv
 
 # 导入工具和视图
-from bot_src.utils import run_db_task, is_in_allowed_channel, ALLOWED_CHANNEL_IDS
+from bot_src.utils import run_db_task, is_in_allowed_channel, ALLOWED_CHANNEL_IDS, DBExecutorBusy, format_executor_status, send_interaction_error
 from bot_src.views import ControlView
 
 # 加载环境变量
@@ -49,6 +49,10 @@ async def on_tree_error(interaction: discord.Interaction, error: app_commands.Ap
         else:
             await interaction.followup.send(msg, ephemeral=True)
             
+    elif isinstance(getattr(error, "original", None), DBExecutorBusy):
+        # 数据库执行器背压：直接提示用户稍后重试 (按钮 / 下拉框回调见 bot_src/views.py 的 BaseView)
+        await send_interaction_error(interaction, error.original)
+
     else:
         # 其他代码报错
         err_msg = f"❌ 系统错误: {str(error)}"
@@ -78,6 +82,7 @@ async def menu(interaction: discord.Interaction):
             ),
             color=discord.Color.gold()
         )
+        embed.add_field(name="🩺 数据库执行器状态", value=format_executor_status(), inline=False)
         
         await interaction.followup.send(embed=embed, view=view)
 
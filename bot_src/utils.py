@@ -1,13 +1,17 @@
 # 文件路径: bot_src/utils.py
 import os
+import time
+import bisect
 import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import discord
 from discord import app_commands
 from dotenv import load_dotenv
 
 # 确保能从根目录导入 database
 # 注意：只要并在根目录运行 python bot.py，这里就能直接 import database
-from database import SessionLocal
+from database import SessionLocal, engine, get_async_read_session_maker
 
 # 加载环境变量
 load_dotenv()
@@ -42,13 +46,190 @@ def is_in_allowed_channel():
 # ==========================================
 # === 通用工具：异步数据库执行器 ===
 # ==========================================
-async def run_db_task(task_func, *args, **kwargs):
-    def wrapper():
-        db = SessionLocal()
+# 专用线程池：工作线程数与 SQLAlchemy 连接池对齐，避免默认执行器无上限地抢连接
+def _default_worker_count():
+    try:
+        return max(1, engine.pool.size())
+    except Exception:
+        return 5
+
+BOT_DB_WORKERS = int(os.getenv("BOT_DB_WORKERS", 0)) or _default_worker_count()
+BOT_DB_MAX_PENDING = int(os.getenv("BOT_DB_MAX_PENDING", 0)) or BOT_DB_WORKERS * 4
+
+# 延迟直方图分桶 (毫秒)，最后一桶为溢出桶
+LATENCY_BUCKETS_MS = [50, 100, 250, 500, 1000, 2500, 5000]
+
+class DBExecutorBusy(Exception):
+    """排队任务超过上限时抛出，由交互回调直接展示给用户 (背压提示)"""
+    pass
+
+async def send_interaction_error(interaction: discord.Interaction, error: Exception):
+    """
+    交互回调 (斜杠命令 / 按钮 / 下拉框 / 表单) 未捕获异常的统一回复：
+    执行器背压直接提示稍后重试，其他异常回复系统错误。仅自己可见。
+    """
+    if isinstance(error, DBExecutorBusy):
+        msg = str(error)
+    else:
+        msg = f"❌ 系统错误: {str(error)}"
+        print(f"交互回调异常: {error!r}")
+    try:
+        if not interaction.response.is_done():
+            await interaction.response.send_message(msg, ephemeral=True)
+        else:
+            await interaction.followup.send(msg, ephemeral=True)
+    except discord.HTTPException as e:
+        print(f"⚠️ 错误提示发送失败: {e}")
+
+class HandlerStats:
+    """单个处理器的耗时统计：直方图 + 次数/总耗时/最大值/失败数"""
+    def __init__(self):
+        self.buckets = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, elapsed_ms, failed=False):
+        idx = bisect.bisect_left(LATENCY_BUCKETS_MS, elapsed_ms)
+        self.buckets[idx] += 1
+        self.count += 1
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        if failed: self.errors += 1
+
+    def percentile(self, pct):
+        """按直方图桶上界估算分位数 (溢出桶返回观测到的最大值)"""
+        if not self.count: return 0.0
+        target = self.count * pct
+        running = 0
+        for idx, n in enumerate(self.buckets):
+            running += n
+            if running >= target:
+                return min(LATENCY_BUCKETS_MS[idx], self.max_ms) if idx < len(LATENCY_BUCKETS_MS) else self.max_ms
+        return self.max_ms
+
+class BotDBExecutor:
+    """
+    Bot 专用数据库执行器：
+    1. 固定大小的线程池，每个工作线程复用一个 Session (每次任务后 close 归还连接)
+    2. 在途任务超过 BOT_DB_MAX_PENDING 时立即拒绝，返回背压提示而不是无限排队
+    3. 按处理器名称记录排队等待与执行耗时
+    """
+    def __init__(self, workers, max_pending):
+        self.workers = workers
+        self.max_pending = max_pending
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="bot-db")
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._running = 0
+        self.rejected = 0
+        self.stats = {}
+        self.wait_stats = HandlerStats()
+
+    def _get_session(self):
+        db = getattr(self._local, "db", None)
+        if db is None:
+            db = SessionLocal()
+            self._local.db = db
+        return db
+
+    @staticmethod
+    def handler_name(task_func):
+        # ControlView.balance_button.<locals>.logic -> ControlView.balance_button
+        return task_func.__qualname__.replace(".<locals>", "").rsplit(".logic", 1)[0]
+
+    def _record(self, name, elapsed_ms, failed):
+        with self._lock:
+            self.stats.setdefault(name, HandlerStats()).observe(elapsed_ms, failed)
+
+    async def submit(self, task_func, *args, **kwargs):
+        with self._lock:
+            if self._in_flight >= self.max_pending:
+                self.rejected += 1
+                raise DBExecutorBusy(f"⏳ 系统繁忙：当前有 {self._in_flight} 个查询在排队，请稍后再试。")
+            self._in_flight += 1
+
+        name = self.handler_name(task_func)
+        submitted_at = time.perf_counter()
+
+        def wrapper():
+            started_at = time.perf_counter()
+            with self._lock:
+                self._running += 1
+                self.wait_stats.observe((started_at - submitted_at) * 1000)
+            db = self._get_session()
+            failed = False
+            try:
+                return task_func(db, *args, **kwargs)
+            except Exception:
+                failed = True
+                db.rollback()
+                raise
+            finally:
+                db.close()
+                with self._lock:
+                    self._running -= 1
+                self._record(name, (time.perf_counter() - started_at) * 1000, failed)
+
         try:
-            return task_func(db, *args, **kwargs)
-        except Exception as e:
-            raise e
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._pool, wrapper)
         finally:
-            db.close()
-    return await asyncio.to_thread(wrapper)
\ No newline at end of file
+            with self._lock:
+                self._in_flight -= 1
+
+    def snapshot(self):
+        """供 /menu 状态面板展示的运行快照"""
+        with self._lock:
+            handlers = sorted(
+                ((name, s.count, s.errors, s.percentile(0.5), s.percentile(0.95), s.max_ms) for name, s in self.stats.items()),
+                key=lambda x: x[4], reverse=True
+            )
+            return {
+                "workers": self.workers, "max_pending": self.max_pending,
+                "running": self._running, "queued": max(0, self._in_flight - self._running),
+                "rejected": self.rejected, "wait_p95": self.wait_stats.percentile(0.95),
+                "handlers": handlers,
+            }
+
+db_executor = BotDBExecutor(BOT_DB_WORKERS, BOT_DB_MAX_PENDING)
+
+async def run_db_task(task_func, *args, **kwargs):
+    return await db_executor.submit(task_func, *args, **kwargs)
+
+# ==========================================
+# === 通用工具：异步只读查询 (AsyncSession) ===
+# ==========================================
+async def run_db_read(task_func, *args, **kwargs):
+    """
+    只读查询直接在事件循环内 await，不占用执行器线程。
+    task_func 为 async 函数，第一个参数是 AsyncReadService；耗时同样计入执行器状态面板。
+    """
+    from services.async_read_service import AsyncReadService
+    name = BotDBExecutor.handler_name(task_func)
+    started_at = time.perf_counter()
+    failed = False
+    try:
+        # 副本健康检查 (同步，带缓存) 放到线程里，不阻塞事件循环
+        session_maker = await asyncio.to_thread(get_async_read_session_maker)
+        async with session_maker() as session:
+            return await task_func(AsyncReadService(session), *args, **kwargs)
+    except Exception:
+        failed = True
+        raise
+    finally:
+        db_executor._record(f"{name} (async)", (time.perf_counter() - started_at) * 1000, failed)
+
+def format_executor_status(top_n=3):
+    """把执行器快照格式化为 Embed 字段文本"""
+    snap = db_executor.snapshot()
+    lines = [
+        f"线程 {snap['running']}/{snap['workers']} 忙碌 | 排队 {snap['queued']}/{snap['max_pending']} | 拒绝 {snap['rejected']} 次",
+        f"排队等待 P95≤{snap['wait_p95']:.0f} ms",
+    ]
+    for name, count, errors, p50, p95, max_ms in snap["handlers"][:top_n]:
+        err_str = f", 失败 {errors}" if errors else ""
+        lines.append(f"`{name}` ×{count}{err_str} | P50≤{p50:.0f} / P95≤{p95:.0f} / Max {max_ms:.0f} ms")
+    return "\n".join(lines)
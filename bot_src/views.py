@@ -4,24 +4,32 @@ from datetime import date
 from typing import Optional
 
 # 导入工具
-from bot_src.utils import run_db_task
+from bot_src.utils import run_db_task, run_db_read, send_interaction_error
 
 # 导入业务逻辑
 from services.finance_service import FinanceService
-from services.inventory_service import InventoryService
-from services.balance_service import BalanceService
 from services.product_service import ProductService
-from services.cost_service import CostService
-from services.sales_service import SalesService
 from services.consumable_service import ConsumableService
 from constants import Currency, PRODUCT_COST_CATEGORIES
 
+# ==========================================
+# === 公共基类：回调未捕获的异常 (含执行器背压) 统一回复用户 ===
+# ==========================================
+# 斜杠命令的异常由 bot.tree.error 处理，按钮 / 下拉框 / 表单的回调异常只会进入各自 View / Modal 的 on_error
+class BaseView(ui.View):
+    async def on_error(self, interaction: discord.Interaction, error: Exception, item: ui.Item):
+        await send_interaction_error(interaction, error)
+
+class BaseModal(ui.Modal):
+    async def on_error(self, interaction: discord.Interaction, error: Exception):
+        await send_interaction_error(interaction, error)
+
 # ==========================================
 # === 第一部分：记账相关组件 (Modals & Selects) ===
 # ==========================================
 
 # --- 1. 普通支出 Modal ---
-class SimpleExpenseModal(ui.Modal, title="记一笔 - 普通支出"):
+class SimpleExpenseModal(BaseModal, title="记一笔 - 普通支出"):
     amount = ui.TextInput(label="金额", placeholder="例如: 100.50", required=True)
     currency = ui.TextInput(label="币种 (CNY/JPY)", default="CNY", min_length=3, max_length=3, required=True)
     category = ui.TextInput(label="分类", placeholder="如: 交通费, 餐饮, 运营杂费", required=True)
@@ -32,7 +40,7 @@ class SimpleExpenseModal(ui.Modal, title="记一笔 - 普通支出"):
         await _handle_expense_submit(interaction, self, "normal")
 
 # --- 2. 商品成本 Modal ---
-class CostExpenseModal(ui.Modal, title="记一笔 - 商品成本"):
+class CostExpenseModal(BaseModal, title="记一笔 - 商品成本"):
     def __init__(self, product_id, product_name, cost_category):
         super().__init__()
         self.product_id = product_id
@@ -74,13 +82,13 @@ class CostCategorySelect(ui.Select):
             CostExpenseModal(self.product_id, self.product_name, selected_cat)
         )
 
-class CostCategorySelectView(ui.View):
+class CostCategorySelectView(BaseView):
     def __init__(self, product_id, product_name):
         super().__init__()
         self.add_item(CostCategorySelect(product_id, product_name))
 
 # --- 3. 资产购入 Modal ---
-class AssetExpenseModal(ui.Modal, title="记一笔 - 资产购入"):
+class AssetExpenseModal(BaseModal, title="记一笔 - 资产购入"):
     def __init__(self, asset_type):
         super().__init__()
         self.asset_type = asset_type
@@ -191,7 +199,7 @@ class ExpenseTypeSelect(ui.Select):
             except Exception as e:
                 await interaction.followup.send(f"❌ 失败: {e}", ephemeral=True)
 
-class ExpenseTypeSelectView(ui.View):
+class ExpenseTypeSelectView(BaseView):
     def __init__(self):
         super().__init__()
         self.add_item(ExpenseTypeSelect())
@@ -214,7 +222,7 @@ class ProductSelectForCost(ui.Select):
             ephemeral=True
         )
 
-class ProductSelectForCostView(ui.View):
+class ProductSelectForCostView(BaseView):
     def __init__(self, products):
         super().__init__()
         self.add_item(ProductSelectForCost(products))
@@ -252,17 +260,17 @@ class StockSelect(ui.Select):
             return
 
         val = self.values[0]
-        _, pname = val.split("|") # 只需要名字来查库存
+        pid, pname = val.split("|", 1)
         
         await interaction.response.defer(ephemeral=True)
 
-        def logic(db):
-            service = InventoryService(db)
-            real, pre_in, _, _ = service.get_stock_overview(pname)
-            return pname, real, pre_in
+        async def logic(svc):
+            summary = (await svc.get_stock_summary([int(pid)])).get(int(pid))
+            if not summary: return pname, {}, {}
+            return pname, summary["real"], summary["pre"]
 
         try:
-            p_name, real_stock, pre_in = await run_db_task(logic)
+            p_name, real_stock, pre_in = await run_db_read(logic)
             
             # 构建显示结果
             embed = discord.Embed(title=f"📦 库存查询: {p_name}", color=discord.Color.green())
@@ -294,7 +302,7 @@ class StockSelect(ui.Select):
         except Exception as e:
             await interaction.followup.send(f"❌ 查询出错: {e}", ephemeral=True)
 
-class StockSelectView(ui.View):
+class StockSelectView(BaseView):
     def __init__(self, product_data_list):
         super().__init__()
         self.add_item(StockSelect(product_data_list))
@@ -304,7 +312,7 @@ class StockSelectView(ui.View):
 # === 第三部分：产品透视组件 (Dashboard) ===
 # ==========================================
 
-class ProductDashboardView(ui.View):
+class ProductDashboardView(BaseView):
     def __init__(self, product_id, product_name):
         super().__init__(timeout=600)
         self.product_id = product_id
@@ -343,12 +351,10 @@ class ProductDashboardView(ui.View):
 
     @ui.button(label="成本分析", style=discord.ButtonStyle.blurple, emoji="💰")
     async def cost_btn(self, interaction: discord.Interaction, button: ui.Button):
-        def logic(db):
-            service = CostService(db)
-            return service.get_cost_items(self.product_id), service.get_product_by_name(self.product_name)
+        async def logic(svc): return await svc.get_cost_listing(self.product_id)
         
         # 获取成本项和商品信息
-        items, prod = await run_db_task(logic)
+        items, prod = await run_db_read(logic)
         
         # 1. 计算分母 (可销售数量)
         denom = prod.marketable_quantity if (prod and prod.marketable_quantity) else (prod.total_quantity if prod else 0)
@@ -405,8 +411,9 @@ class ProductDashboardView(ui.View):
 
     @ui.button(label="库存状态", style=discord.ButtonStyle.blurple, emoji="📦")
     async def stock_btn(self, interaction: discord.Interaction, button: ui.Button):
-        def logic(db): return InventoryService(db).get_stock_overview(self.product_name)
-        real, pre, _, _ = await run_db_task(logic)
+        async def logic(svc): return (await svc.get_stock_summary([self.product_id])).get(self.product_id)
+        summary = await run_db_read(logic) or {"real": {}, "pre": {}}
+        real, pre = summary["real"], summary["pre"]
         embed = discord.Embed(title=f"📦 库存: {self.product_name}", color=discord.Color.green())
         embed.add_field(name="✅ 现货", value="\n".join([f"**{k}**: {int(v)}" for k,v in real.items() if v!=0]) or "无", inline=True)
         embed.add_field(name="🏭 生产中", value="\n".join([f"**{k}**: {int(v)}" for k,v in pre.items() if v>0]) or "无", inline=True)
@@ -414,19 +421,22 @@ class ProductDashboardView(ui.View):
 
     @ui.button(label="销售统计", style=discord.ButtonStyle.blurple, emoji="📈")
     async def sales_btn(self, interaction: discord.Interaction, button: ui.Button):
-        def logic(db):
-            s = SalesService()
-            return s.process_sales_data(db, s.get_raw_sales_logs(db))
-        df = await run_db_task(logic)
+        async def logic(svc): return await svc.get_product_sales_summary(self.product_name)
+        df = await run_db_read(logic)
         embed = discord.Embed(title=f"📈 销售: {self.product_name}", color=discord.Color.red())
         if df.empty: embed.description = "无数据"
         else:
-            p_df = df[df['product'] == self.product_name]
-            if p_df.empty: embed.description = "无数据"
-            else:
-                embed.description = f"**净销量**: {int(p_df['qty'].sum())}"
-                embed.add_field(name="CNY", value=f"¥ {p_df[p_df['currency']=='CNY']['amount'].sum():,.2f}", inline=True)
-                embed.add_field(name="JPY", value=f"¥ {p_df[p_df['currency']=='JPY']['amount'].sum():,.0f}", inline=True)
+            embed.description = f"**净销量**: {int(df['qty'].sum())} (售出 {int(df['sold_qty'].sum())} / 退货 {int(df['return_qty'].sum())})"
+            for curr, fmt in [("CNY", ",.2f"), ("JPY", ",.0f")]:
+                c_df = df[df['currency'] == curr]
+                embed.add_field(
+                    name=curr,
+                    value=f"¥ {c_df['amount'].sum():{fmt}}\n(销售 {c_df['gross'].sum():{fmt}} / 退款 {c_df['refund'].sum():{fmt}})",
+                    inline=True
+                )
+            platform_qty = df.groupby('platform')['qty'].sum().sort_values(ascending=False)
+            platform_str = "\n".join([f"**{pf}**: {int(q)}" for pf, q in platform_qty.items() if q != 0])
+            embed.add_field(name="平台净销量", value=platform_str or "无", inline=False)
         await self.update_display(interaction, embed)
 
 class ProductSelect(ui.Select):
@@ -453,7 +463,7 @@ class ProductSelect(ui.Select):
             ephemeral=True
         )
 
-class ProductSelectionView(ui.View):
+class ProductSelectionView(BaseView):
     def __init__(self, product_data_list):
         super().__init__()
         self.add_item(ProductSelect(product_data_list))
@@ -463,7 +473,7 @@ class ProductSelectionView(ui.View):
 # === 第四部分：主控制面板 (ControlView) ===
 # ==========================================
 
-class ControlView(ui.View):
+class ControlView(BaseView):
     def __init__(self):
         super().__init__(timeout=None)
 
@@ -474,9 +484,9 @@ class ControlView(ui.View):
     @ui.button(label="公司财务", style=discord.ButtonStyle.blurple, emoji="🏦", row=0)
     async def balance_button(self, interaction: discord.Interaction, button: ui.Button):
         await interaction.response.defer(ephemeral=True)
-        def logic(db): return BalanceService.get_financial_summary(db)
+        async def logic(svc): return await svc.get_balance_summary()
         try:
-            s = await run_db_task(logic)
+            s = await run_db_read(logic)
             e = discord.Embed(title="🏦 资产负债表 (概览)", color=discord.Color.purple(), timestamp=discord.utils.utcnow())
             e.add_field(name="💵 流动CNY", value=f"¥ {s['cash']['CNY']:,.2f}", inline=True)
             e.add_field(name="💵 流动JPY", value=f"¥ {s['cash']['JPY']:,.0f}", inline=True)
@@ -493,23 +503,11 @@ class ControlView(ui.View):
     async def stock_button(self, interaction: discord.Interaction, button: ui.Button):
         await interaction.response.defer(ephemeral=True)
         
-        # 优化逻辑：获取产品同时计算实时库存
-        def logic(db):
-            p_service = ProductService(db)
-            i_service = InventoryService(db)
-            # 获取前25个产品
-            products = p_service.get_all_products()[:25]
-            
-            # 计算每个产品的实时库存
-            data_list = []
-            for p in products:
-                real_map, _, _, _ = i_service.get_stock_overview(p.name)
-                current_qty = int(sum(real_map.values()))
-                data_list.append((p, current_qty))
-            return data_list
+        # 获取产品同时批量计算实时库存 (一次分组查询)
+        async def logic(svc): return await svc.get_products_with_stock()
         
         try:
-            product_data_list = await run_db_task(logic)
+            product_data_list = await run_db_read(logic)
             if not product_data_list:
                 await interaction.followup.send("⚠️ 暂无商品。", ephemeral=True)
                 return
@@ -524,21 +522,11 @@ class ControlView(ui.View):
     async def product_master_button(self, interaction: discord.Interaction, button: ui.Button):
         await interaction.response.defer(ephemeral=True)
         
-        # 同样优化：这里也预先计算库存，让下拉框显示准确数字
-        def logic(db):
-            p_service = ProductService(db)
-            i_service = InventoryService(db)
-            products = p_service.get_all_products()[:25]
-            
-            data_list = []
-            for p in products:
-                real_map, _, _, _ = i_service.get_stock_overview(p.name)
-                current_qty = int(sum(real_map.values()))
-                data_list.append((p, current_qty))
-            return data_list
+        # 同样预先批量计算库存，让下拉框显示准确数字
+        async def logic(svc): return await svc.get_products_with_stock()
 
         try:
-            product_data_list = await run_db_task(logic)
+            product_data_list = await run_db_read(logic)
             if not product_data_list:
                 await interaction.followup.send("⚠️ 暂无商品。", ephemeral=True)
                 return
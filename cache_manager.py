@@ -1,9 +1,13 @@
 # cache_manager.py
 import streamlit as st
+from engine_factory import pin_primary_reads
 
 def sync_all_caches():
     """
     万能同步函数：一键清空全系统所有带 @st.cache_data 的缓存。
     在任何 View 中，只要执行了增、删、改数据库的操作，在 st.rerun() 前调用此函数即可保证数据 100% 同步。
+    配置了只读副本时，随后 READ_MAX_LAG_S 秒内的读改走主库：清空缓存后的重新加载不会从尚未同步的副本
+    读到写入前的数据并缓存 5 分钟。
     """
-    st.cache_data.clear()
\ No newline at end of file
+    st.cache_data.clear()
+    pin_primary_reads()
\ No newline at end of file
@@ -1,7 +1,7 @@
 import streamlit as st
-from sqlalchemy import create_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from engine_factory import get_engine, get_async_engine, normalize_url, register_read_replica, read_engine, read_router
 
 # 1. 获取连接字符串
 # 注意：如果是本地运行 Bot，st.secrets 可能无法加载，
@@ -16,17 +16,73 @@ except:
     SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "")
 
 # 2. 修正协议头 (Supabase 兼容性处理)
-if SQLALCHEMY_DATABASE_URL.startswith("postgres://"):
-    SQLALCHEMY_DATABASE_URL = SQLALCHEMY_DATABASE_URL.replace("postgres://", "postgresql://", 1)
+SQLALCHEMY_DATABASE_URL = normalize_url(SQLALCHEMY_DATABASE_URL)
 
-# 3. 创建引擎
-# 建议加上 pool_pre_ping=True 以防止断连
-engine = create_engine(SQLALCHEMY_DATABASE_URL, pool_pre_ping=True)
+# 3. 创建引擎 (engine_factory：连接池参数、超时、慢查询日志统一配置，与 App 同 URL 时共用连接池)
+engine = get_engine(SQLALCHEMY_DATABASE_URL)
+# 只读副本 (YURARA_READ_DATABASE_URL，可选)：Bot 的查询按钮读副本
+register_read_replica(engine)
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
 Base = declarative_base()
 
+# 4. 异步引擎 (仅 Discord Bot 的只读查询使用，按需创建，Web 端不需要安装异步驱动)
+# postgresql:// -> postgresql+asyncpg://，sqlite:// -> sqlite+aiosqlite://
+_async_session_makers = {}  # 同步 URL -> async_sessionmaker (主库 / 只读副本各一个)
+
+def _to_async_url(url):
+    from sqlalchemy.engine import make_url
+    url = make_url(url)
+    if url.drivername.startswith("postgresql"):
+        # SQLAlchemy 侧的预编译语句缓存同样关闭 (见 _async_engine_kwargs)
+        url = url.set(drivername="postgresql+asyncpg").update_query_dict({"prepared_statement_cache_size": "0"})
+        # asyncpg 不认识 libpq 的 sslmode 参数
+        if "sslmode" in url.query:
+            query = dict(url.query)
+            query["ssl"] = query.pop("sslmode")
+            url = url.set(query=query)
+    elif url.drivername.startswith("sqlite"):
+        url = url.set(drivername="sqlite+aiosqlite")
+    return url
+
+def _async_engine_kwargs(async_url):
+    """驱动相关的附加参数 (连接池大小、超时与监控由 engine_factory.get_async_engine 统一配置)"""
+    kwargs = {"pool_pre_ping": True}
+    if async_url.drivername == "postgresql+asyncpg":
+        # Supabase pooler / pgbouncer 事务模式下同一连接的各个事务可能落在不同的服务端后端，
+        # 预编译语句只存在于准备它的后端：关闭 asyncpg 与 SQLAlchemy 两层语句缓存，
+        # 显式 prepare 的语句用唯一名称，避免 "prepared statement ... does not exist / already exists"
+        from uuid import uuid4
+        kwargs["connect_args"] = {
+            "statement_cache_size": 0,
+            "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+        }
+    return kwargs
+
+def _async_session_maker_for(sync_engine):
+    url = sync_engine.url.render_as_string(hide_password=False)
+    maker = _async_session_makers.get(url)
+    if maker is None:
+        from sqlalchemy.ext.asyncio import async_sessionmaker
+        async_url = _to_async_url(url)
+        async_engine = get_async_engine(async_url, **_async_engine_kwargs(async_url))
+        router = read_router(engine)
+        if router is not None and sync_engine is router.replica:
+            router.watch(async_engine.sync_engine)
+        maker = _async_session_makers[url] = async_sessionmaker(bind=async_engine, expire_on_commit=False, autoflush=False)
+    return maker
+
+def get_async_session_maker():
+    return _async_session_maker_for(engine)
+
+def get_async_read_session_maker():
+    """
+    只读查询的异步 Session 工厂：只读副本可用时连接副本，否则为主库。
+    副本健康检查是同步的 (结果缓存)，在事件循环中请用 asyncio.to_thread 调用。
+    """
+    return _async_session_maker_for(read_engine(engine))
+
 def get_db():
     db = SessionLocal()
     try:
@@ -0,0 +1,389 @@
+# engine_factory.py
+"""
+统一的 Engine 工厂：App (真实库 / 测试沙盒) 与 Bot 都从这里取 Engine，同一 URL 在进程内只建一个连接池。
+
+PostgreSQL (Supabase)：
+    YURARA_DB_POOL_SIZE=5              常驻连接数
+    YURARA_DB_MAX_OVERFLOW=5           高峰时额外允许的连接数 (总数受 Supabase pooler 上限约束)
+    YURARA_DB_POOL_TIMEOUT=30          取连接最长等待秒数
+    YURARA_DB_POOL_RECYCLE=1800        连接最长复用秒数 (早于 pooler / 防火墙的空闲断开)
+    YURARA_DB_STATEMENT_TIMEOUT_MS=30000           单条语句超时 (每个事务开头以事务级设置下发)，0 不限制
+    YURARA_DB_IDLE_TX_TIMEOUT_MS=60000             事务内空闲超时 (忘记提交的会话不会一直占着连接)，0 不限制
+    批量写入使用 psycopg2 的 execute_values / execute_batch (executemany_mode='values_plus_batch')。
+
+Bot 的异步 Engine (asyncpg / aiosqlite，get_async_engine)：与同步 Engine 相同的事务超时、SQLite pragma、
+慢查询日志与连接池统计，连接池单独计数 (与同步池一起占用 Supabase pooler 的连接上限)：
+    YURARA_ASYNC_DB_POOL_SIZE=2        异步连接池常驻连接数
+    YURARA_ASYNC_DB_MAX_OVERFLOW=2     异步连接池高峰时额外允许的连接数
+
+SQLite (测试沙盒 / 本地)：开启 WAL 与 busy_timeout，Streamlit 多线程读写不再互相阻塞报 database is locked。
+
+只读副本 (报表 / 概览 / Bot 查询按钮)：
+    YURARA_READ_DATABASE_URL=...       副本连接串 (App 也可在 secrets 的 [database] READ_DATABASE_URL 配置)
+    YURARA_READ_DB_POOL_SIZE=5         副本连接池常驻连接数 (与主库分开的连接池)
+    YURARA_READ_MAX_LAG_S=30           复制延迟超过该秒数时读回主库
+    YURARA_READ_CHECK_INTERVAL_S=10    副本健康检查 (连通性 + 延迟) 的缓存秒数
+本地验证：主库与副本各指向一个 SQLite 文件 (副本为主库的拷贝) 即可。
+"""
+import os
+import time
+import threading
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+
+from services.slow_query_log import attach_slow_query_log
+
+POOL_SIZE = int(os.getenv("YURARA_DB_POOL_SIZE", "5"))
+MAX_OVERFLOW = int(os.getenv("YURARA_DB_MAX_OVERFLOW", "5"))
+POOL_TIMEOUT = int(os.getenv("YURARA_DB_POOL_TIMEOUT", "30"))
+POOL_RECYCLE = int(os.getenv("YURARA_DB_POOL_RECYCLE", "1800"))
+STATEMENT_TIMEOUT_MS = int(os.getenv("YURARA_DB_STATEMENT_TIMEOUT_MS", "30000"))
+IDLE_TX_TIMEOUT_MS = int(os.getenv("YURARA_DB_IDLE_TX_TIMEOUT_MS", "60000"))
+ASYNC_POOL_SIZE = int(os.getenv("YURARA_ASYNC_DB_POOL_SIZE", "2"))
+ASYNC_MAX_OVERFLOW = int(os.getenv("YURARA_ASYNC_DB_MAX_OVERFLOW", "2"))
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("YURARA_SQLITE_BUSY_TIMEOUT_MS", "5000"))
+READ_DATABASE_URL = os.getenv("YURARA_READ_DATABASE_URL")
+READ_POOL_SIZE = int(os.getenv("YURARA_READ_DB_POOL_SIZE", str(POOL_SIZE)))
+READ_MAX_LAG_S = float(os.getenv("YURARA_READ_MAX_LAG_S", "30"))
+READ_CHECK_INTERVAL_S = float(os.getenv("YURARA_READ_CHECK_INTERVAL_S", "10"))
+
+
+def normalize_url(url):
+    """postgres:// 与 postgresql:// 统一为 postgresql+psycopg2:// (Supabase 连接串兼容)"""
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg2://", 1)
+    if url.startswith("postgresql://"):
+        return url.replace("postgresql://", "postgresql+psycopg2://", 1)
+    return url
+
+
+def pool_kwargs(url):
+    """连接池参数 (同步 / 异步 Engine 共用)；SQLite 使用 SQLAlchemy 默认的池"""
+    if make_url(url).get_backend_name() == "sqlite":
+        return {}
+    return {
+        "pool_size": POOL_SIZE, "max_overflow": MAX_OVERFLOW, "pool_timeout": POOL_TIMEOUT,
+        "pool_recycle": POOL_RECYCLE, "pool_pre_ping": True,
+        # LIFO：低峰时多余的连接保持空闲，由 pool_recycle / 服务端超时回收，不会被轮流续命
+        "pool_use_lifo": True,
+    }
+
+
+# ================= 连接建立时的会话设置 =================
+
+def _setup_sqlite(engine):
+    in_memory = engine.url.database in (None, "", ":memory:")
+
+    @event.listens_for(engine, "connect")
+    def _sqlite_pragmas(dbapi_conn, connection_record):
+        cursor = dbapi_conn.cursor()
+        try:
+            if not in_memory:
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("PRAGMA synchronous=NORMAL")
+            cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+            cursor.execute("PRAGMA temp_store=MEMORY")
+        finally:
+            cursor.close()
+
+
+def _setup_postgres(engine):
+    settings = []
+    if STATEMENT_TIMEOUT_MS > 0: settings.append(f"set_config('statement_timeout', '{STATEMENT_TIMEOUT_MS}', true)")
+    if IDLE_TX_TIMEOUT_MS > 0: settings.append(f"set_config('idle_in_transaction_session_timeout', '{IDLE_TX_TIMEOUT_MS}', true)")
+    if not settings: return
+    sql = f"SELECT {', '.join(settings)}"
+
+    @event.listens_for(engine, "begin")
+    def _pg_timeouts(conn):
+        # 每个事务开头设置事务级参数 (等同 SET LOCAL，一条语句设置全部)，不用连接建立时的会话级 SET：
+        # Supabase 事务模式 pooler 下同一连接的各个事务会落在不同的服务端后端，
+        # 会话级 SET 只留在执行它的那个后端上，既不能保证生效，又会影响共用该后端的其他客户端。
+        # AUTOCOMMIT 连接没有事务块，事务级设置无效，跳过
+        if conn.get_execution_options().get("isolation_level") == "AUTOCOMMIT": return
+        try:
+            conn.exec_driver_sql(sql)
+        except Exception as e:
+            print(f"⚠️ 数据库事务超时设置失败: {e}")
+            raise
+
+
+# ================= 连接池指标 =================
+
+class PoolStats:
+    """按 Engine 统计的取连接次数、当前占用峰值、新建与失效次数"""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.connects = 0
+        self.invalidations = 0
+
+    def attach(self, engine):
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_conn, record):
+            with self._lock: self.connects += 1
+
+        @event.listens_for(engine, "checkout")
+        def _on_checkout(dbapi_conn, record, proxy):
+            with self._lock:
+                self.checkouts += 1
+                self.checked_out += 1
+                self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+        @event.listens_for(engine, "checkin")
+        def _on_checkin(dbapi_conn, record):
+            with self._lock: self.checked_out = max(0, self.checked_out - 1)
+
+        @event.listens_for(engine, "invalidate")
+        def _on_invalidate(dbapi_conn, record, exception):
+            with self._lock: self.invalidations += 1
+
+
+_engines = {}   # 规范化后的 URL -> Engine (异步 Engine 记录其 sync_engine，供连接池面板统计)
+_async_engines = {}  # 异步驱动 URL -> AsyncEngine
+_stats = {}     # id(Engine) -> PoolStats
+_lock = threading.Lock()
+
+
+def get_engine(url, **overrides):
+    """
+    按 URL 取 (或创建) Engine，进程内同一 URL 共用一个连接池；
+    已挂载慢查询日志与连接池统计。overrides 会覆盖默认的 create_engine 参数 (只在首次创建时生效)。
+    """
+    url = normalize_url(url)
+    engine = _engines.get(url)
+    if engine is not None: return engine
+    with _lock:
+        engine = _engines.get(url)
+        if engine is not None: return engine
+
+        backend = make_url(url).get_backend_name()
+        kwargs = pool_kwargs(url)
+        if backend == "sqlite":
+            kwargs["connect_args"] = {"check_same_thread": False}
+        elif make_url(url).drivername == "postgresql+psycopg2":
+            kwargs["executemany_mode"] = "values_plus_batch"
+        kwargs.update(overrides)
+
+        engine = create_engine(url, **kwargs)
+        _instrument(engine)
+        _engines[url] = engine
+        return engine
+
+
+def get_async_engine(url, **overrides):
+    """
+    按异步驱动 URL (postgresql+asyncpg / sqlite+aiosqlite) 取 (或创建) AsyncEngine，进程内同一 URL 共用一个连接池。
+    底层 sync_engine 挂载与 get_engine 相同的会话设置、慢查询日志与连接池统计，并出现在 all_pool_status 中；
+    连接池大小单独配置 (ASYNC_POOL_SIZE / ASYNC_MAX_OVERFLOW)。
+    """
+    url = make_url(url).render_as_string(hide_password=False)
+    async_engine = _async_engines.get(url)
+    if async_engine is not None: return async_engine
+    with _lock:
+        async_engine = _async_engines.get(url)
+        if async_engine is not None: return async_engine
+
+        from sqlalchemy.ext.asyncio import create_async_engine
+        kwargs = pool_kwargs(url)
+        if kwargs:
+            kwargs.update(pool_size=ASYNC_POOL_SIZE, max_overflow=ASYNC_MAX_OVERFLOW)
+        kwargs.update(overrides)
+
+        async_engine = create_async_engine(url, **kwargs)
+        _instrument(async_engine.sync_engine)
+        _engines[url] = async_engine.sync_engine
+        _async_engines[url] = async_engine
+        return async_engine
+
+
+def _instrument(engine):
+    """会话设置 (SQLite pragma / PostgreSQL 事务超时)、连接池统计与慢查询日志；异步 Engine 传入其 sync_engine"""
+    backend = engine.dialect.name
+    if backend == "sqlite":
+        _setup_sqlite(engine)
+    elif backend == "postgresql":
+        _setup_postgres(engine)
+    stats = PoolStats()
+    stats.attach(engine)
+    _stats[id(engine)] = stats
+    attach_slow_query_log(engine)
+
+
+def pool_status(engine):
+    """
+    连接池现状与累计指标：
+    size 常驻连接数，checkedout 当前占用，checkedin 池中空闲，overflow 超出常驻的连接数 (QueuePool 为负数表示尚未建满)，
+    peak_checked_out 占用峰值，checkouts 累计取连接次数，connects 新建连接次数，invalidations 失效次数
+    """
+    pool = engine.pool
+    status = {"url": engine.url.render_as_string(hide_password=True), "pool": type(pool).__name__}
+    for name in ("size", "checkedout", "overflow", "checkedin"):
+        fn = getattr(pool, name, None)
+        if callable(fn):
+            try:
+                status[name] = fn()
+            except Exception:
+                pass
+    stats = _stats.get(id(engine))
+    if stats:
+        status.update(
+            checkouts=stats.checkouts, peak_checked_out=stats.peak_checked_out,
+            connects=stats.connects, invalidations=stats.invalidations,
+        )
+    return status
+
+
+def all_pool_status():
+    """本进程内由工厂创建的全部 Engine 的连接池状态"""
+    with _lock:
+        engines = list(_engines.values())
+    return [pool_status(e) for e in engines]
+
+
+# ================= 只读副本路由 =================
+
+# 副本复制延迟 (秒)：主库 / 已追平时为 0
+_PG_LAG_SQL = """
+SELECT CASE
+    WHEN NOT pg_is_in_recovery() THEN 0
+    WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END
+"""
+
+
+class ReadRouter:
+    """
+    主库 Engine 对应的只读副本：engine() 在副本健康且延迟不超过 READ_MAX_LAG_S 时返回副本，否则返回主库。
+    健康检查结果缓存 READ_CHECK_INTERVAL_S 秒；副本上出现断连错误时立即标记为不可用。
+    pin_primary() 之后的一段时间内 (默认 READ_MAX_LAG_S，副本最多可能落后的秒数) 读也走主库，
+    写入后清空缓存的那次重新加载不会从尚未同步的副本读到旧数据再缓存下来。
+    """
+    def __init__(self, primary, replica):
+        self.primary = primary
+        self.replica = replica
+        self._lock = threading.Lock()
+        self._checked_at = None
+        self.healthy = False
+        self.lag_s = None
+        self.last_error = None
+        self.routed = 0       # 路由到副本的次数
+        self.fallbacks = 0    # 读回主库的次数
+        self.pinned = 0       # 写入后固定读主库的次数
+        self._primary_until = 0.0
+        self.watch(replica)
+
+    def watch(self, engine):
+        """连接副本的 Engine (含 Bot 的异步 Engine 的 sync_engine) 出现断连错误时标记副本不可用"""
+        @event.listens_for(engine, "handle_error")
+        def _on_replica_error(exception_context):
+            if exception_context.is_disconnect:
+                self.mark_down(exception_context.original_exception)
+
+    def mark_down(self, error):
+        with self._lock:
+            self.healthy = False
+            self.last_error = str(error)[:300]
+            self._checked_at = time.monotonic()
+
+    def check(self):
+        """副本是否可用于读 (带缓存)"""
+        with self._lock:
+            if self._checked_at is not None and time.monotonic() - self._checked_at < READ_CHECK_INTERVAL_S:
+                return self.healthy
+            self._checked_at = time.monotonic()
+        try:
+            with self.replica.connect() as conn:
+                if self.replica.dialect.name == "postgresql":
+                    lag = float(conn.exec_driver_sql(_PG_LAG_SQL).scalar() or 0)
+                else:
+                    # SQLite 拷贝没有复制状态可查，只检查能打开且不是空库 (文件不存在时 SQLite 会新建空库)
+                    if conn.exec_driver_sql("SELECT count(*) FROM sqlite_master").scalar() == 0:
+                        raise RuntimeError("副本为空库")
+                    lag = 0.0
+        except Exception as e:
+            print(f"⚠️ 只读副本不可用，读回主库: {e}")
+            self.mark_down(e)
+            return False
+        with self._lock:
+            self.lag_s = lag
+            self.healthy = lag <= READ_MAX_LAG_S
+            self.last_error = None if self.healthy else f"复制延迟 {lag:.1f}s 超过 {READ_MAX_LAG_S:.0f}s"
+            return self.healthy
+
+    def pin_primary(self, seconds=None):
+        """接下来 seconds 秒 (默认 READ_MAX_LAG_S) 内的读都走主库"""
+        until = time.monotonic() + (READ_MAX_LAG_S if seconds is None else seconds)
+        with self._lock:
+            self._primary_until = max(self._primary_until, until)
+
+    def engine(self):
+        with self._lock:
+            if time.monotonic() < self._primary_until:
+                self.pinned += 1
+                return self.primary
+        use_replica = self.check()
+        with self._lock:
+            if use_replica: self.routed += 1
+            else: self.fallbacks += 1
+        return self.replica if use_replica else self.primary
+
+    def status(self):
+        return {
+            "primary": self.primary.url.render_as_string(hide_password=True),
+            "replica": self.replica.url.render_as_string(hide_password=True),
+            "healthy": self.healthy, "lag_s": self.lag_s, "routed": self.routed,
+            "fallbacks": self.fallbacks, "pinned": self.pinned, "last_error": self.last_error,
+            "pinned_for_s": max(0.0, self._primary_until - time.monotonic()),
+        }
+
+
+_routers = {}   # id(主库 Engine) -> ReadRouter
+
+
+def register_read_replica(primary, replica_url=None):
+    """
+    为主库 Engine 登记只读副本 (幂等)；replica_url 为空时取 YURARA_READ_DATABASE_URL，仍为空则不登记。
+    副本 Engine 同样由 get_engine 创建 (独立连接池，已挂载慢查询日志与连接池统计)。
+    """
+    replica_url = replica_url or READ_DATABASE_URL
+    if not replica_url: return None
+    with _lock:
+        router = _routers.get(id(primary))
+        if router is not None: return router
+    overrides = {} if make_url(normalize_url(replica_url)).get_backend_name() == "sqlite" else {"pool_size": READ_POOL_SIZE}
+    replica = get_engine(replica_url, **overrides)
+    if replica is primary: return None
+    with _lock:
+        return _routers.setdefault(id(primary), ReadRouter(primary, replica))
+
+
+def read_engine(primary):
+    """只读查询使用的 Engine：已登记且可用的副本，否则为主库本身"""
+    router = _routers.get(id(primary))
+    return router.engine() if router else primary
+
+
+def read_router(primary):
+    return _routers.get(id(primary))
+
+
+def pin_primary_reads(seconds=None):
+    """
+    写入之后调用 (cache_manager.sync_all_caches)：所有副本在 seconds 秒 (默认 READ_MAX_LAG_S) 内读回主库，
+    保证写入方刷新后能读到自己刚写入的数据 (read-your-writes)。
+    """
+    with _lock:
+        routers = list(_routers.values())
+    for r in routers:
+        r.pin_primary(seconds)
+
+
+def read_routing_status():
+    """全部已登记副本的路由状态 (性能面板使用)"""
+    with _lock:
+        routers = list(_routers.values())
+    return [r.status() for r in routers]
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Date, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Float, Date, DateTime, ForeignKey, Boolean, Index
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -85,6 +85,7 @@ class InventoryLog(Base):
     part_name = Column(String, nullable=True) # 如果为空，代表是"整套操作"
     order_id = Column(Integer, ForeignKey("sales_orders.id", ondelete="CASCADE"), nullable=True) # 绑定的销售订单
     cost_item_id = Column(Integer, ForeignKey("cost_items.id", ondelete="SET NULL"), nullable=True) # 绑定的成本项 (消耗出库用)
+    is_opening = Column(Boolean, default=False, nullable=True) # 归档后写入的期初结转行
     warehouse = relationship("Warehouse")
 
 
@@ -198,6 +199,9 @@ class SalesOrder(Base):
     notes = Column(String, default="") # 备注
     discount_note = Column(String, default="") # 优惠备注
 
+    # ✨ 线下订单所属的 POS 模板 (替代 order_no LIKE 'CODE-%' 的前缀匹配)
+    template_id = Column(Integer, ForeignKey("offline_templates.id", ondelete="SET NULL"), nullable=True, index=True)
+
     # 关联
     items = relationship("SalesOrderItem", back_populates="order", cascade="all, delete-orphan")
     refunds = relationship("OrderRefund", back_populates="order", cascade="all, delete-orphan")
@@ -268,4 +272,93 @@ class OfflineTemplateItem(Base):
     quantity = Column(Integer, default=0)           # 初始分配数量
     remaining_quantity = Column(Integer, default=0) # 当前可用分配数量
     
-    template = relationship("OfflineTemplate", back_populates="items")
\ No newline at end of file
+    template = relationship("OfflineTemplate", back_populates="items")
+
+class OfflineTemplateSalesSummary(Base):
+    """✨ POS 模板销售汇总：按 模板/日期/支付方式 增量维护，用于历史面板与日结对账"""
+    __tablename__ = "offline_template_sales_summary"
+    template_id = Column(Integer, ForeignKey("offline_templates.id", ondelete="CASCADE"), primary_key=True, index=True)
+    sale_date = Column(Date, primary_key=True)
+    payment_method = Column(String, primary_key=True) # 现金 / PayPay
+    currency = Column(String, default="CNY")
+    order_count = Column(Integer, default=0)    # 订单数
+    item_count = Column(Integer, default=0)     # 售出件数
+    gross_amount = Column(Float, default=0.0)   # 原价合计
+    fee_amount = Column(Float, default=0.0)     # 手续费合计
+    net_amount = Column(Float, default=0.0)     # 实收净额 (扣除手续费后)
+
+class SalesDailyFact(Base):
+    """✨ 销售日汇总事实表：日期 × 商品 × 款式 × 平台 × 币种，由各销售写路径增量维护"""
+    __tablename__ = "sales_daily_facts"
+    sale_date = Column(Date, primary_key=True)
+    product_name = Column(String, primary_key=True, index=True)
+    variant = Column(String, primary_key=True)
+    platform = Column(String, primary_key=True)
+    currency = Column(String, primary_key=True)
+    sold_qty = Column(Integer, default=0)         # 售出数量 (按下单日期)
+    return_qty = Column(Integer, default=0)       # 退货入库数量 (按退货日期)
+    gross_amount = Column(Float, default=0.0)     # 销售额
+    refund_amount = Column(Float, default=0.0)    # 退款额 (按退款日期分摊)
+
+class InventoryStockCheckpoint(Base):
+    """✨ 库存时点快照：某日收盘时 商品 × 款式 × 仓库 × 部件 的现货流水累计，历史库存查询从最近快照起累加"""
+    __tablename__ = "inventory_stock_checkpoints"
+    id = Column(Integer, primary_key=True, index=True)
+    checkpoint_date = Column(Date, index=True)
+    product_name = Column(String, index=True)
+    variant = Column(String)
+    warehouse_id = Column(Integer, nullable=True) # 不设外键：仓库删除后快照仍按原 ID 留存，由失效机制统一清理
+    part_name = Column(String, nullable=True)     # 部件名，整套流水为空 (查询时按部件配比折算成套数)
+    quantity = Column(Integer, default=0)
+
+class InventoryLogArchive(Base):
+    """✨ 库存流水归档：早于归档截止日的流水原样移入此表 (保留原 ID)，主表只留期初结转行"""
+    __tablename__ = "inventory_logs_archive"
+    id = Column(Integer, primary_key=True, index=True)
+    log_id = Column(Integer, index=True) # 原 inventory_logs.id (SQLite 可能复用已删除的 ID，因此不作主键)
+    product_name = Column(String, index=True)
+    variant = Column(String)
+    change_amount = Column(Integer)
+    reason = Column(String)
+    date = Column(Date, index=True)
+    note = Column(String, nullable=True)
+    is_sold = Column(Boolean, default=False)
+    sale_amount = Column(Float, default=0.0)
+    currency = Column(String, nullable=True)
+    platform = Column(String, nullable=True)
+    is_other_out = Column(Boolean, default=False)
+    warehouse_id = Column(Integer, nullable=True)
+    part_name = Column(String, nullable=True)
+    order_id = Column(Integer, nullable=True)
+    cost_item_id = Column(Integer, nullable=True)
+    is_opening = Column(Boolean, default=False, nullable=True)
+    archive_cutoff = Column(Date, index=True) # 所属归档批次的截止日 (不含)
+
+class ProductCostRollup(Base):
+    """✨ 商品成本汇总：商品 × 成本分类 × 币种 的预算/实付/原币金额与项目数，由成本项写入时按分类刷新"""
+    __tablename__ = "product_cost_rollups"
+    product_id = Column(Integer, ForeignKey("products.id", ondelete="CASCADE"), primary_key=True, index=True)
+    category = Column(String, primary_key=True)
+    currency = Column(String, primary_key=True, default="CNY")
+    budget_amount = Column(Float, default=0.0)    # 预算 (预算项 单价×数量 + 未对应预算项的实付)
+    actual_amount = Column(Float, default=0.0)    # 实付 (CNY，即 actual_cost 合计)
+    original_amount = Column(Float, default=0.0)  # 原币实付 (original_amount，缺失时按 actual_cost)
+    item_count = Column(Integer, default=0)       # 成本项数
+    budget_item_count = Column(Integer, default=0) # 其中预算项数
+
+class ProductCostSnapshot(Base):
+    """✨ 商品单价/库存估值历史：每次商品指标同步且数值有变化时追加一行，供历史单价与期间销售成本 (COGS) 查询"""
+    __tablename__ = "product_cost_snapshots"
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, index=True)   # 不设外键：商品删除后历史仍保留，销售成本按 product_name 关联
+    product_name = Column(String)
+    snapshot_at = Column(DateTime, default=datetime.now)
+    snapshot_date = Column(Date)
+    unit_cost = Column(Float, default=0.0)            # 单件成本 (CNY)
+    marketable_quantity = Column(Integer, default=0)  # 可销售数量 (单价分母)
+    stock_quantity = Column(Integer, default=0)       # 实际库存 (整套)
+    stock_value = Column(Float, default=0.0)          # 大货资产估值 = 实际库存 × 单价
+    wip_offset = Column(Float, default=0.0)           # 在制资产冲销
+    total_cost = Column(Float, default=0.0)           # 实付成本合计
+
+    __table_args__ = (Index("ix_cost_snapshots_name_date", "product_name", "snapshot_date"),)
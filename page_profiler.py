@@ -0,0 +1,269 @@
+# page_profiler.py
+"""
+页面渲染性能分析 (可选开启)：
+- profile_page 包裹路由中的 show_*_page 调用，记录 总耗时 / DB 耗时 / SQL 数 / 读取行数；
+- profiled_cache_data 替代各 View 里的 @st.cache_data，区分缓存命中与未命中并记录各加载函数的耗时；
+- 每次渲染的样本写入本地指标库 (services/metrics_store，不进入业务库与备份)，侧边栏面板展示本次渲染与历史对比。
+未开启时 profile_page 直接放行，加载函数只多一次 ContextVar 读取。
+"""
+import os
+import json
+import time
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+
+import streamlit as st
+
+from services.query_profiler import profile_queries
+from services.metrics_store import PageRenderSample, metrics_session
+from engine_factory import all_pool_status, read_routing_status
+from session_manager import session_manager
+
+SESSION_KEY = "page_profiling"  # 侧边栏开关
+LAST_SAMPLE_KEY = "last_page_profile"
+SHOW_TRENDS_KEY = "page_profiling_show_trends"
+# 样本只保留最近 PAGE_PROFILE_KEEP 条 (与慢查询日志、后台任务记录相同的轮转方式)
+PAGE_PROFILE_KEEP = int(os.getenv("YURARA_PAGE_PROFILE_KEEP", "20000"))
+
+
+def is_enabled():
+    return bool(st.session_state.get(SESSION_KEY, False)) or os.getenv("YURARA_PAGE_PROFILING") == "1"
+
+
+# ================= 采集 =================
+
+class _PageSample:
+    def __init__(self, page):
+        self.page = page
+        self.loaders = []  # [{"loader", "hit", "wall_ms", "db_ms", "queries", "rows"}]
+
+_current_page = ContextVar("current_page_sample", default=None)
+_current_loader = ContextVar("current_loader_record", default=None)
+
+
+def _count_rows(result):
+    """加载函数返回值的行数：DataFrame/列表直接计数，元组/字典累加其中的 DataFrame"""
+    import pandas as pd
+    if isinstance(result, pd.DataFrame): return len(result)
+    if isinstance(result, dict): result = list(result.values())
+    if isinstance(result, (list, tuple)):
+        frames = [r for r in result if isinstance(r, pd.DataFrame)]
+        return sum(len(f) for f in frames) if frames else len(result)
+    return 0
+
+
+def profiled_cache_data(**cache_kwargs):
+    """
+    与 @st.cache_data(**cache_kwargs) 等价；页面分析开启时额外记录本次调用是否命中缓存、
+    耗时、SQL 数与返回行数 (未命中时函数体才会执行，以此判断命中)。
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def body(*args, **kwargs):
+            rec = _current_loader.get()
+            if rec is not None: rec["hit"] = False
+            return fn(*args, **kwargs)
+
+        cached = st.cache_data(**cache_kwargs)(body)
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            sample = _current_page.get()
+            if sample is None:
+                return cached(*args, **kwargs)
+            rec = {"loader": fn.__name__, "hit": True}
+            token = _current_loader.set(rec)
+            t0 = time.perf_counter()
+            try:
+                with profile_queries(fn.__name__) as prof:
+                    result = cached(*args, **kwargs)
+            finally:
+                _current_loader.reset(token)
+            rec.update(
+                wall_ms=(time.perf_counter() - t0) * 1000, db_ms=prof.db_time * 1000, queries=prof.count,
+                rows=0 if rec["hit"] else _count_rows(result)
+            )
+            sample.loaders.append(rec)
+            return result
+
+        wrapper.clear = cached.clear
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def profile_page(page):
+    """包裹一次页面渲染；未开启分析时不做任何事"""
+    if not is_enabled():
+        yield None
+        return
+    sample = _PageSample(page)
+    token = _current_page.set(sample)
+    status = "ok"
+    t0 = time.perf_counter()
+    try:
+        with profile_queries(page) as prof:
+            yield sample
+    except BaseException as e:
+        # st.rerun / st.stop 以异常实现，照常记录后继续抛出
+        status = type(e).__name__
+        raise
+    finally:
+        _current_page.reset(token)
+        _record(sample, prof, (time.perf_counter() - t0) * 1000, status)
+
+
+def _record(sample, prof, wall_ms, status):
+    row = {
+        "recorded_at": datetime.now(), "page": sample.page,
+        "env": "测试" if st.session_state.get("test_mode") else "真实", "status": status,
+        "wall_ms": wall_ms, "db_ms": prof.db_time * 1000, "query_count": prof.count,
+        "cache_hits": sum(1 for r in sample.loaders if r["hit"]),
+        "cache_misses": sum(1 for r in sample.loaders if not r["hit"]),
+        "rows_fetched": prof.rows_fetched,
+        "loader_rows": sum(r["rows"] for r in sample.loaders),
+    }
+    detail = {"loaders": sample.loaders, "repeated": [[shape[:300], n] for shape, n, _ in prof.repeated()]}
+    st.session_state[LAST_SAMPLE_KEY] = {**row, **detail}
+    try:
+        db = metrics_session()
+        try:
+            rec = PageRenderSample(**row, detail=json.dumps(detail, ensure_ascii=False))
+            db.add(rec)
+            db.flush()
+            # 轮转：只保留最近 PAGE_PROFILE_KEEP 条
+            db.query(PageRenderSample).filter(PageRenderSample.id <= rec.id - PAGE_PROFILE_KEEP).delete(synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+    except Exception as e:
+        # 指标库写入失败不能影响页面
+        print(f"⚠️ 页面性能样本写入失败: {e}")
+
+
+# ================= 读取 =================
+
+def get_page_trends(days=30, recent_days=7):
+    """
+    各页面近 recent_days 天与更早 (至 days 天前) 的耗时对比：
+    [页面, 样本数, 近期中位(ms), 近期P95(ms), 此前中位(ms), 变化, 平均SQL, 缓存命中率]
+    """
+    import pandas as pd
+    cols = ["页面", "样本数", "近期中位(ms)", "近期P95(ms)", "此前中位(ms)", "变化", "平均SQL", "缓存命中率"]
+    since = datetime.now() - timedelta(days=days)
+    db = metrics_session()
+    try:
+        rows = db.query(
+            PageRenderSample.page, PageRenderSample.recorded_at, PageRenderSample.wall_ms, PageRenderSample.query_count,
+            PageRenderSample.cache_hits, PageRenderSample.cache_misses
+        ).filter(PageRenderSample.recorded_at >= since, PageRenderSample.status == "ok").all()
+    finally:
+        db.close()
+    if not rows: return pd.DataFrame(columns=cols)
+
+    df = pd.DataFrame(rows, columns=["page", "at", "wall", "queries", "hits", "misses"])
+    df["recent"] = df["at"] >= datetime.now() - timedelta(days=recent_days)
+    result = []
+    for page, g in df.groupby("page"):
+        recent, before = g[g["recent"]]["wall"], g[~g["recent"]]["wall"]
+        lookups = g["hits"].sum() + g["misses"].sum()
+        recent_med = recent.median() if not recent.empty else None
+        before_med = before.median() if not before.empty else None
+        result.append([
+            page, len(g), recent_med, recent.quantile(0.95) if not recent.empty else None, before_med,
+            recent_med / before_med if recent_med and before_med else None,
+            g["queries"].mean(), g["hits"].sum() / lookups if lookups else None,
+        ])
+    return pd.DataFrame(result, columns=cols).sort_values("近期中位(ms)", ascending=False, na_position="last").reset_index(drop=True)
+
+
+def clear_samples():
+    db = metrics_session()
+    try:
+        db.query(PageRenderSample).delete()
+        db.commit()
+    finally:
+        db.close()
+
+
+# ================= 侧边栏面板 =================
+
+def _render_trends():
+    trends = get_page_trends()
+    if trends.empty:
+        st.caption("暂无样本")
+        return
+    st.dataframe(
+        trends, hide_index=True, width="stretch",
+        column_config={
+            **{c: st.column_config.NumberColumn(format="%.0f") for c in ["近期中位(ms)", "近期P95(ms)", "此前中位(ms)"]},
+            "变化": st.column_config.NumberColumn(format="%.2fx"),
+            "平均SQL": st.column_config.NumberColumn(format="%.1f"),
+            "缓存命中率": st.column_config.NumberColumn(format="percent"),
+        }
+    )
+    if st.button("🗑️ 清空样本", use_container_width=True):
+        clear_samples()
+        st.session_state.pop(LAST_SAMPLE_KEY, None)
+        st.rerun()
+
+
+def render_profiling_panel():
+    """侧边栏折叠面板：开关、本次渲染明细、各页面近期与此前的耗时对比、连接池、Session 与只读副本路由状态"""
+    import pandas as pd
+    with st.expander("⏱️ 页面性能分析", expanded=False):
+        st.toggle("开启分析 (记录每次渲染)", key=SESSION_KEY, help="开关在下一次渲染生效；样本写入本地指标库，不进入业务数据")
+        last = st.session_state.get(LAST_SAMPLE_KEY)
+        if last:
+            st.caption(f"本次：{last['page']} ({last['status']})")
+            c1, c2, c3 = st.columns(3)
+            c1.metric("总耗时", f"{last['wall_ms']:.0f} ms")
+            c2.metric("DB", f"{last['db_ms']:.0f} ms")
+            c3.metric("SQL", last["query_count"])
+            c4, c5, c6 = st.columns(3)
+            c4.metric("缓存命中", last["cache_hits"])
+            c5.metric("未命中", last["cache_misses"])
+            c6.metric("读取行数", last["rows_fetched"] if last["rows_fetched"] is not None else last["loader_rows"])
+            if last["loaders"]:
+                st.dataframe(
+                    pd.DataFrame(last["loaders"]).rename(columns={
+                        "loader": "加载函数", "hit": "命中", "wall_ms": "耗时(ms)", "db_ms": "DB(ms)", "queries": "SQL", "rows": "行数"
+                    }),
+                    hide_index=True, width="stretch",
+                    column_config={c: st.column_config.NumberColumn(format="%.1f") for c in ["耗时(ms)", "DB(ms)"]}
+                )
+            for shape, n in last["repeated"]:
+                st.caption(f"⚠️ 疑似 N+1 ×{n}: {shape[:120]}")
+        elif is_enabled():
+            st.caption("切换页面后显示本次渲染的统计")
+
+        st.markdown("**各页面耗时 (近 7 天 vs 此前)**")
+        # 折叠的面板每次渲染同样会执行：历史对比只在开启分析或手动加载后查询
+        if is_enabled() or st.session_state.get(SHOW_TRENDS_KEY):
+            _render_trends()
+        elif st.button("📈 加载历史对比", use_container_width=True):
+            st.session_state[SHOW_TRENDS_KEY] = True
+            _render_trends()
+
+        st.markdown("**连接池 (本进程)**")
+        sessions = session_manager.stats()
+        st.caption(
+            f"Session：当前打开 {sessions['open']} · 峰值 {sessions['peak']} · 累计 {sessions['total']}"
+            + (f" · 最久已打开 {sessions['oldest_seconds']:.0f} 秒" if sessions["open"] else "")
+        )
+        pools = pd.DataFrame(all_pool_status())
+        if not pools.empty:
+            st.dataframe(
+                pools.rename(columns={
+                    "url": "数据库", "pool": "类型", "size": "常驻", "checkedout": "占用", "overflow": "溢出", "checkedin": "空闲",
+                    "peak_checked_out": "占用峰值", "checkouts": "取连接次数", "connects": "新建连接", "invalidations": "失效",
+                }),
+                hide_index=True, width="stretch"
+            )
+        for r in read_routing_status():
+            state = "✅ 读副本" if r["healthy"] else f"⚠️ 读回主库 ({r['last_error'] or '未检查'})"
+            lag = f" · 延迟 {r['lag_s']:.1f}s" if r["lag_s"] is not None else ""
+            pinned = f" · 写入后读主库剩余 {r['pinned_for_s']:.0f}s" if r["pinned_for_s"] > 0 else ""
+            st.caption(f"只读副本 {r['replica']}：{state}{lag}{pinned} · 路由到副本 {r['routed']} 次 · 回退主库 {r['fallbacks']} 次 · 写入后读主库 {r['pinned']} 次")
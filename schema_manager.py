@@ -0,0 +1,110 @@
+# schema_manager.py
+from sqlalchemy import inspect, text
+from sqlalchemy.orm import sessionmaker
+from database import Base
+import models  # 确保全部模型已注册到 Base.metadata
+
+# 待执行的一次性回填 (按执行顺序)，记录在 system_settings 中，成功提交后才移除，失败时下次启动重试
+PENDING_BACKFILLS_KEY = "schema_pending_backfills"
+BACKFILL_ORDER = ["checkpoint_reset", "template_link", "template_summary", "sales_facts", "cost_rollups", "cost_snapshots"]
+
+def upgrade_schema(engine):
+    """
+    轻量表结构升级：create_all 只会建新表，不会给已有表补列。
+    这里在建表后对比模型与数据库，补齐缺失的可空列及其索引，并对新增结构执行一次性数据回填。
+    需要的回填在建表 / 补列之前先登记为待办，回填失败时抛出异常，下次启动继续重试，
+    不会因为表已存在而跳过 (否则增量钩子会在空汇总表上继续累加，报表一直错误)。
+    返回本次新增的 (表名, 列名) 列表。
+    """
+    inspector = inspect(engine)
+    tables_before = set(inspector.get_table_names())
+
+    # 先登记由新建表触发的回填，再建表
+    models.SystemSetting.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        _add_pending_backfills(conn, _table_backfills(tables_before))
+
+    Base.metadata.create_all(bind=engine)
+
+    added_columns = []
+    with engine.begin() as conn:
+        for table in Base.metadata.tables.values():
+            if table.name not in tables_before: continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for col in table.columns:
+                if col.name in existing: continue
+                col_type = col.type.compile(dialect=engine.dialect)
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {col.name} {col_type}"))
+                added_columns.append((table.name, col.name))
+                for idx in table.indexes:
+                    if col.name in idx.columns:
+                        idx.create(bind=conn, checkfirst=True)
+        # 补列触发的回填与补列在同一事务中登记
+        _add_pending_backfills(conn, _column_backfills(added_columns))
+
+    _run_backfills(engine)
+    return added_columns
+
+def _table_backfills(tables_before):
+    tasks = set()
+    if "sales_orders" in tables_before:
+        if "offline_template_sales_summary" not in tables_before: tasks.add("template_summary")
+        if "sales_daily_facts" not in tables_before: tasks.add("sales_facts")
+    if "cost_items" in tables_before and "product_cost_rollups" not in tables_before: tasks.add("cost_rollups")
+    if "products" in tables_before and "product_cost_snapshots" not in tables_before: tasks.add("cost_snapshots")
+    return tasks
+
+def _column_backfills(added_columns):
+    tasks = set()
+    if ("sales_orders", "template_id") in added_columns: tasks.update({"template_link", "template_summary"})
+    # 旧版库存快照只记整套流水，与部件口径不衔接，补列后全部作废 (需要时在库存页重新生成)
+    if ("inventory_stock_checkpoints", "part_name") in added_columns: tasks.add("checkpoint_reset")
+    return tasks
+
+def _get_pending_backfills(conn):
+    value = conn.execute(text("SELECT value FROM system_settings WHERE key = :k"), {"k": PENDING_BACKFILLS_KEY}).scalar()
+    return {t for t in (value or "").split(",") if t}
+
+def _set_pending_backfills(conn, tasks):
+    conn.execute(text("DELETE FROM system_settings WHERE key = :k"), {"k": PENDING_BACKFILLS_KEY})
+    if tasks:
+        conn.execute(text("INSERT INTO system_settings (key, value, description) VALUES (:k, :v, :d)"), {
+            "k": PENDING_BACKFILLS_KEY, "v": ",".join(t for t in BACKFILL_ORDER if t in tasks), "d": "待执行的结构升级数据回填",
+        })
+
+def _add_pending_backfills(conn, tasks):
+    if not tasks: return
+    _set_pending_backfills(conn, _get_pending_backfills(conn) | tasks)
+
+def _run_backfills(engine):
+    """按顺序执行登记的回填 (每项都是可重复执行的全量重建)，每项成功后移出待办；失败时保留待办并抛出"""
+    with engine.connect() as conn:
+        pending = _get_pending_backfills(conn)
+    if not pending: return
+
+    from services.offline_sales_service import OfflineSalesService
+    from services.sales_fact_service import SalesFactService
+    from services.cost_rollup_service import CostRollupService
+    from services.cost_history_service import CostHistoryService
+    steps = {
+        "checkpoint_reset": lambda db: (db.execute(text("DELETE FROM inventory_stock_checkpoints")), db.commit()),
+        "template_link": lambda db: OfflineSalesService(db).backfill_template_links(),
+        "template_summary": lambda db: OfflineSalesService(db).rebuild_template_summaries(),
+        "sales_facts": lambda db: SalesFactService(db).rebuild(),
+        "cost_rollups": lambda db: CostRollupService(db).rebuild(),
+        "cost_snapshots": lambda db: CostHistoryService(db).capture_all(),
+    }
+    for task in BACKFILL_ORDER:
+        if task not in pending: continue
+        db = sessionmaker(bind=engine)()
+        try:
+            steps[task](db)
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ 汇总表数据回填失败 ({task})，下次启动将重试: {e}")
+            raise
+        finally:
+            db.close()
+        pending.discard(task)
+        with engine.begin() as conn:
+            _set_pending_backfills(conn, pending)
@@ -0,0 +1,45 @@
+# services/async_read_service.py
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from models import Product, CostItem
+from services.balance_service import BalanceService
+from services.inventory_service import InventoryService
+from services.sales_service import SalesService
+
+class AsyncReadService:
+    """
+    Discord Bot 专用的异步只读查询 (AsyncSession)。
+    直接在事件循环中 await 数据库 IO，不为每个请求占用线程；
+    写操作仍走同步 Service + 执行器。
+    复杂的同步计算 (资产负债表、库存汇总、销售汇总) 通过 run_sync 复用原有实现，保证与 Web 端结果一致。
+    """
+    def __init__(self, session: AsyncSession):
+        self.session = session
+
+    async def get_balance_summary(self):
+        """资产负债表概览，与 BalanceService.get_financial_summary 同源"""
+        return await self.session.run_sync(BalanceService.get_financial_summary)
+
+    async def get_stock_summary(self, product_ids):
+        """批量库存汇总，与 InventoryService.get_stock_summary 同源"""
+        return await self.session.run_sync(lambda db: InventoryService(db).get_stock_summary(product_ids))
+
+    async def get_products_with_stock(self, limit=25):
+        """最近的 limit 个商品及其现货总数 (Discord 下拉框上限 25)"""
+        products = (await self.session.scalars(
+            select(Product).order_by(Product.id.desc()).limit(limit)
+        )).all()
+        summary = await self.get_stock_summary([p.id for p in products])
+        return [(p, summary.get(p.id, {}).get("total_real", 0)) for p in products]
+
+    async def get_cost_listing(self, product_id):
+        """商品成本明细 + 商品本体 (用于计算单品成本的分母)"""
+        items = (await self.session.scalars(
+            select(CostItem).filter(CostItem.product_id == product_id)
+        )).all()
+        prod = await self.session.get(Product, product_id)
+        return items, prod
+
+    async def get_product_sales_summary(self, product_name, date_range=None):
+        """单品销售汇总，与 SalesService.get_product_sales_summary 同源 (SQL 聚合)"""
+        return await self.session.run_sync(lambda db: SalesService.get_product_sales_summary(db, product_name, date_range))
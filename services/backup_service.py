@@ -0,0 +1,178 @@
+# services/backup_service.py
+"""
+全量备份 / 恢复、测试沙盒克隆与派生汇总表重建。
+这些操作都要读写整库，由侧边栏提交为后台任务 (services/job_runner) 执行，*_job 函数是对应的任务入口。
+"""
+import io
+import zipfile
+from sqlalchemy import text
+from models import (
+    Product, ProductColor, InventoryLog,
+    FinanceRecord, CostItem,
+    FixedAsset, FixedAssetLog,
+    ConsumableItem, ConsumableLog,
+    CompanyBalanceItem, ProductPrice, ProductPart,
+    SalesOrder, SalesOrderItem, OrderRefund,
+    Warehouse, OfflineTemplate, OfflineTemplateItem, OfflineTemplateSalesSummary,
+    SalesDailyFact, InventoryStockCheckpoint, InventoryLogArchive, ProductCostRollup, ProductCostSnapshot
+)
+from database import Base
+from session_manager import session_manager
+
+# === 全局表映射，用于备份和测试环境克隆 ===
+TABLES_MAP = [
+    ("warehouses.csv", "warehouses", Warehouse),
+    ("products.csv", "products", Product),
+    ("product_colors.csv", "product_colors", ProductColor),
+    ("product_parts.csv", "product_parts", ProductPart),
+    ("product_prices.csv", "product_prices", ProductPrice),
+    ("finance_records.csv", "finance_records", FinanceRecord),
+    ("cost_items.csv", "cost_items", CostItem),
+    ("inventory_logs.csv", "inventory_logs", InventoryLog),
+    ("inventory_logs_archive.csv", "inventory_logs_archive", InventoryLogArchive),
+    ("fixed_assets.csv", "fixed_assets_detail", FixedAsset),
+    ("fixed_asset_logs.csv", "fixed_asset_logs", FixedAssetLog),
+    ("consumables.csv", "consumable_items", ConsumableItem),
+    ("consumable_logs.csv", "consumable_logs", ConsumableLog),
+    ("company_balance.csv", "company_balance_items", CompanyBalanceItem),
+    ("sales_orders.csv", "sales_orders", SalesOrder),
+    ("sales_order_items.csv", "sales_order_items", SalesOrderItem),
+    ("order_refunds.csv", "order_refunds", OrderRefund),
+    ("offline_templates.csv", "offline_templates", OfflineTemplate),
+    ("offline_template_items.csv", "offline_template_items", OfflineTemplateItem),
+    ("offline_template_sales_summary.csv", "offline_template_sales_summary", OfflineTemplateSalesSummary),
+    ("sales_daily_facts.csv", "sales_daily_facts", SalesDailyFact),
+    ("product_cost_rollups.csv", "product_cost_rollups", ProductCostRollup),
+    ("product_cost_snapshots.csv", "product_cost_snapshots", ProductCostSnapshot),
+    # ("system_settings.csv", "system_settings", SystemSetting), #暂未修改该bug
+]
+
+
+def _report(progress, done, total, message):
+    if progress: progress(done, total, message)
+
+
+class BackupService:
+    @staticmethod
+    def rebuild_derived_tables(db):
+        """重建由明细派生的汇总表，返回销售日汇总行数"""
+        from services.sales_fact_service import SalesFactService
+        from services.offline_sales_service import OfflineSalesService
+        from services.cost_rollup_service import CostRollupService
+        OfflineSalesService(db).rebuild_template_summaries()
+        CostRollupService(db).rebuild()
+        # 库存快照随时可由流水重新生成，恢复数据后直接作废
+        db.query(InventoryStockCheckpoint).delete()
+        return SalesFactService(db).rebuild()
+
+    @staticmethod
+    def export_zip(bind, progress=None):
+        """各表导出为 CSV 打包成 ZIP，返回 bytes"""
+        import pandas as pd
+        zip_buffer = io.BytesIO()
+        with session_manager.scope(bind) as backup_db:
+            with zipfile.ZipFile(zip_buffer, "w") as zf:
+                for i, (file_name, _, model_cls) in enumerate(TABLES_MAP):
+                    _report(progress, i, len(TABLES_MAP), f"导出 {file_name}")
+                    try:
+                        df_export = pd.read_sql(backup_db.query(model_cls).statement, backup_db.bind)
+                        csv_bytes = df_export.to_csv(index=False).encode('utf-8-sig')
+                        zf.writestr(file_name, csv_bytes)
+                    except Exception as e:
+                        print(f"⚠️ 备份导出 {file_name} 失败: {e}")
+        return zip_buffer.getvalue()
+
+    @staticmethod
+    def restore_zip(bind, zip_bytes, progress=None):
+        """把备份 ZIP 中的各表追加导入 bind 对应的库，并重建汇总表；返回导入的表名列表"""
+        import pandas as pd
+        imported = []
+        is_postgres = bind.dialect.name == "postgresql"
+        # 使用 engine.begin() 开启一个统一的事务连接
+        with bind.begin() as conn:
+            # 临时关闭外键检查触发器
+            if is_postgres:
+                conn.execute(text("SET session_replication_role = 'replica';"))
+
+            with zipfile.ZipFile(io.BytesIO(zip_bytes)) as zf:
+                for i, (file_name, table_name, _) in enumerate(TABLES_MAP):
+                    _report(progress, i, len(TABLES_MAP) + 1, f"导入 {table_name}")
+                    if file_name in zf.namelist():
+                        with zf.open(file_name) as f:
+                            df_import = pd.read_csv(f, encoding='utf-8-sig')
+                            if not df_import.empty:
+                                df_import.to_sql(table_name, conn, if_exists='append', index=False)
+                                imported.append(table_name)
+
+            # 恢复 PostgreSQL 的外键检查，并重置自增 ID 序列
+            if is_postgres:
+                conn.execute(text("SET session_replication_role = 'origin';"))
+                for _, table_name, model_cls in TABLES_MAP:
+                    if "id" not in model_cls.__table__.columns: continue # 复合主键的汇总表没有自增序列
+                    # 每张表单独一个保存点：个别表重置失败只回滚该保存点，不会让整个恢复事务进入 aborted 状态
+                    try:
+                        with conn.begin_nested():
+                            conn.execute(text(f"SELECT setval(pg_get_serial_sequence('{table_name}', 'id'), coalesce(max(id),0) + 1, false) FROM {table_name};"))
+                    except Exception as e:
+                        print(f"⚠️ 重置 {table_name} 自增序列失败: {e}")
+
+        # 旧版备份可能不含汇总表，导入后统一从明细重建
+        _report(progress, len(TABLES_MAP), len(TABLES_MAP) + 1, "重建汇总表")
+        with session_manager.scope(bind) as db:
+            BackupService.rebuild_derived_tables(db)
+            db.commit()
+        return imported
+
+    @staticmethod
+    def clone_to_sandbox(source_bind, target_bind, progress=None):
+        """清空并重建测试库表结构，再从真实库整表复制；返回复制的行数"""
+        import pandas as pd
+        # 1. 清空并重建测试环境的表结构
+        Base.metadata.drop_all(bind=target_bind)
+        Base.metadata.create_all(bind=target_bind)
+
+        # 2. 从真实库拉取数据写入测试库
+        rows = 0
+        with session_manager.scope(source_bind) as real_db:
+            for i, (_, table_name, model_cls) in enumerate(TABLES_MAP):
+                _report(progress, i, len(TABLES_MAP), f"复制 {table_name}")
+                try:
+                    # 提取整表数据
+                    df_sync = pd.read_sql(real_db.query(model_cls).statement, real_db.bind)
+                    if not df_sync.empty:
+                        # 写入 SQLite 测试库 (利用 pandas 自动处理 ID 映射)
+                        df_sync.to_sql(table_name, target_bind, if_exists='append', index=False)
+                        rows += len(df_sync)
+                except Exception as e:
+                    print(f"⚠️ 沙盒复制 {table_name} 失败: {e}")
+        return rows
+
+
+# ================= 后台任务入口 =================
+
+def backup_job(ctx, bind, file_name):
+    data = BackupService.export_zip(bind, progress=ctx.progress)
+    ctx.save_file(data, file_name)
+    return f"备份完成 ({len(data) / 1024 / 1024:.1f} MB)"
+
+
+def restore_job(ctx, bind, zip_bytes):
+    imported = BackupService.restore_zip(bind, zip_bytes, progress=ctx.progress)
+    return f"恢复完成，导入 {len(imported)} 张表"
+
+
+def sandbox_clone_job(ctx, source_bind, target_bind):
+    rows = BackupService.clone_to_sandbox(source_bind, target_bind, progress=ctx.progress)
+    return f"沙盒复制完成，共 {rows} 行"
+
+
+def rebuild_job(ctx, bind):
+    ctx.progress(0, 1, "重建销售汇总表")
+    with session_manager.scope(bind) as db:
+        try:
+            fact_rows = BackupService.rebuild_derived_tables(db)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    return f"销售汇总已重建 ({fact_rows} 行)"
@@ -0,0 +1,261 @@
+# services/balance_rebuild_service.py
+import re
+import pandas as pd
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from models import CompanyBalanceItem, FinanceRecord, Product, SalesOrder, SalesOrderItem
+from constants import AssetPrefix, BalanceCategory, Currency, OrderStatus
+from services.inventory_service import InventoryService
+from services.finance_service import FinanceService
+from services.metrics_sync_queue import metrics_sync_queue
+
+TOLERANCE = 0.01
+KIND_STOCK = "大货资产"
+KIND_WIP_OFFSET = "在制资产冲销"
+KIND_PENDING = "待结算"
+KIND_CASH = "现金账户"
+KIND_MARKETABLE = "可销售数量"
+ALL_KINDS = [KIND_STOCK, KIND_WIP_OFFSET, KIND_PENDING, KIND_CASH, KIND_MARKETABLE]
+
+REPORT_COLUMNS = ["类型", "项目", "币种", "账面值", "重算值", "差额", "处理"]
+
+_ACCOUNT_RE = re.compile(r'\[账户:\s*(.+?)\]')
+NON_CASH_ACCOUNT = "无(资产账面核销)"
+
+class BalanceRebuildService:
+    """
+    派生账目的全量重算与对账：
+    - 大货资产- / 在制资产冲销- / 可销售数量：按 sync_product_metrics 口径，由流水分组合计与成本汇总一次算出全部商品；
+    - 待结算-：已发货/售后中且尚未完成收款的订单，按明细金额占比把当前订单金额分摊到 商品 × 币种；
+    - 现金账户：账户绑定流水的金额合计，资金移动与资产抵消按流水描述中的金额计入转出/转入账户。
+    只读生成差异报告，apply 按所选类型把账面值修正为重算值 (现金账户只改金额，不增删账户)。
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ================= 1. 重算 =================
+
+    def _expected_product_items(self):
+        """{(类型, 商品名, 币种): {"amount", "product_id"}} 以及 {product_id: 可销售数量}"""
+        metrics = InventoryService(self.db).compute_all_product_metrics()
+        names = dict(self.db.query(Product.id, Product.name).all())
+        expected = {}
+        for p_id, m in metrics.items():
+            p_name = names[p_id]
+            if m["stock_value"] > TOLERANCE:
+                expected[(KIND_STOCK, p_name, Currency.CNY)] = {"amount": m["stock_value"], "product_id": p_id}
+            if abs(m["wip_offset"]) > TOLERANCE:
+                expected[(KIND_WIP_OFFSET, p_name, Currency.CNY)] = {"amount": m["wip_offset"], "product_id": p_id}
+        return expected, {p_id: m["marketable_quantity"] for p_id, m in metrics.items()}
+
+    def _expected_pending(self, legacy_names):
+        """
+        待结算款：发货时按订单金额计入、售后退款扣减、完成收款时整笔转出，
+        因此等于 已发货/售后中 且未完成 (completed_date 为空) 订单的当前 total_amount。
+        存在旧版按订单号命名的待结算项时，该订单整笔计入旧项。
+        """
+        rows = self.db.query(
+            SalesOrder.id, SalesOrder.order_no, SalesOrder.currency, SalesOrder.total_amount,
+            SalesOrderItem.product_name, SalesOrderItem.subtotal
+        ).join(SalesOrderItem, SalesOrderItem.order_id == SalesOrder.id).filter(
+            SalesOrder.status.in_([OrderStatus.SHIPPED, OrderStatus.AFTER_SALES]),
+            SalesOrder.shipped_date != None,
+            SalesOrder.completed_date == None
+        ).order_by(SalesOrder.id.asc(), SalesOrderItem.id.asc()).all()
+
+        orders = {}
+        for o_id, order_no, curr, total, p_name, subtotal in rows:
+            o = orders.setdefault(o_id, {"order_no": order_no, "currency": curr, "total": total or 0.0, "items": []})
+            o["items"].append((p_name, subtotal or 0.0))
+
+        expected = {}
+        def add(name, curr, amount):
+            e = expected.setdefault((KIND_PENDING, name, curr), {"amount": 0.0, "product_id": None})
+            e["amount"] += amount
+
+        for o in orders.values():
+            legacy_name = f"{AssetPrefix.PENDING_SETTLE}-{o['order_no']}"
+            if legacy_name in legacy_names:
+                add(legacy_name, o["currency"], o["total"])
+                continue
+            items_total = sum(sub for _, sub in o["items"])
+            if items_total > 0:
+                for p_name, sub in o["items"]:
+                    add(f"{AssetPrefix.PENDING_SETTLE}-{p_name}-{o['currency']}", o["currency"], o["total"] * sub / items_total)
+            else:
+                add(f"{AssetPrefix.PENDING_SETTLE}-{o['items'][0][0]}-{o['currency']}", o["currency"], o["total"])
+        return {k: v for k, v in expected.items() if v["amount"] > TOLERANCE}
+
+    def _expected_cash(self, cash_accounts, asset_ids_by_name):
+        """
+        {账户 ID: 金额}。普通流水：按 account_id (老数据按描述中的 [账户: 名称]) 计入流水金额，
+        无任何账户信息的老流水按删除流水时的回退口径计入该币种第一个现金账户；
+        非现金分类与 "无(资产账面核销)" 不计入。
+        资金移动/资产抵消的金额不体现在流水 amount 上，按描述中的金额分别计入转出/转入账户。
+        """
+        expected = {acc.id: 0.0 for acc in cash_accounts}
+        default_acc = {}
+        for acc in sorted(cash_accounts, key=lambda a: a.id):
+            if acc.name.startswith(AssetPrefix.CASH):
+                default_acc.setdefault(acc.currency, acc.id)
+
+        def credit(acc_id, amount):
+            if acc_id in expected: expected[acc_id] += amount
+
+        # 1. 绑定账户的普通流水：一次分组聚合
+        special = ["资金移动", "资产抵消"]
+        non_cash = list(FinanceService.NON_CASH_CATEGORIES)
+        for acc_id, total in self.db.query(FinanceRecord.account_id, func.sum(FinanceRecord.amount)).filter(
+            FinanceRecord.account_id != None,
+            FinanceRecord.category.notin_(special + non_cash)
+        ).group_by(FinanceRecord.account_id).all():
+            credit(acc_id, total or 0.0)
+
+        # 2. 未绑定账户的老流水 (金额非零)
+        for desc, curr, amount in self.db.query(FinanceRecord.description, FinanceRecord.currency, FinanceRecord.amount).filter(
+            FinanceRecord.account_id == None,
+            FinanceRecord.amount != 0,
+            FinanceRecord.category.notin_(special + non_cash)
+        ).all():
+            match = _ACCOUNT_RE.search(desc or "")
+            if match:
+                if match.group(1) != NON_CASH_ACCOUNT:
+                    credit(asset_ids_by_name.get(match.group(1)), amount)
+            else:
+                credit(default_acc.get(curr), amount)
+
+        # 3. 资金移动 / 资产抵消
+        for category, desc, acc_id, related_id in self.db.query(
+            FinanceRecord.category, FinanceRecord.description, FinanceRecord.account_id, FinanceRecord.related_item_id
+        ).filter(FinanceRecord.category.in_(special)).all():
+            desc = desc or ""
+            try:
+                if category == "资金移动":
+                    amount = float(desc.split("金额: ")[1].split(" |")[0].strip())
+                    if not (acc_id and related_id):
+                        part = desc.split("资金移动: [")[1]
+                        acc_id = asset_ids_by_name.get(part.split("] -> [")[0])
+                        related_id = asset_ids_by_name.get(part.split("] -> [")[1].split("] |")[0])
+                    credit(acc_id, -amount)
+                    credit(related_id, amount)
+                else:
+                    amount = float(desc.split("核销金额:")[1].split("|")[0].strip())
+                    credit(asset_ids_by_name.get(desc.split("[使用资产/账户: ")[1].split("]")[0]), -amount)
+            except (IndexError, ValueError):
+                continue
+        return expected
+
+    # ================= 2. 对账 =================
+
+    def _classify_stored(self, items, product_names):
+        """把现有账目按重算口径分组：{(类型, 名称, 币种): [items]}，现金账户单独按 ID 返回"""
+        stored, cash_accounts = {}, []
+        for i in items:
+            if i.category != BalanceCategory.ASSET or not i.name: continue
+            if i.asset_type == "现金":
+                cash_accounts.append(i)
+                continue
+            for kind, prefix in [(KIND_WIP_OFFSET, AssetPrefix.WIP_OFFSET), (KIND_STOCK, AssetPrefix.STOCK)]:
+                if i.name.startswith(prefix):
+                    p_name = product_names.get(i.product_id) or i.name[len(prefix):]
+                    stored.setdefault((kind, p_name, Currency.CNY), []).append(i)
+                    break
+            else:
+                if i.name.startswith(f"{AssetPrefix.PENDING_SETTLE}-"):
+                    stored.setdefault((KIND_PENDING, i.name, i.currency), []).append(i)
+        return stored, cash_accounts
+
+    def build_report(self):
+        """
+        重算全部派生账目并与账面对比，返回 (差异 DataFrame, 明细上下文)。
+        DataFrame 只包含差额超过 0.01 的行；上下文供 apply 直接使用，避免二次重算。
+        """
+        metrics_sync_queue.wait_until_idle()  # 后台指标同步完成后再读账面，避免把排队中的更新误报为差异
+        items = self.db.query(CompanyBalanceItem).all()
+        products = self.db.query(Product).all()
+        product_names = {p.id: p.name for p in products}
+        legacy_names = {i.name for i in items if i.name and i.name.startswith(f"{AssetPrefix.PENDING_SETTLE}-")}
+        stored, cash_accounts = self._classify_stored(items, product_names)
+
+        expected, marketable = self._expected_product_items()
+        expected.update(self._expected_pending(legacy_names))
+        asset_ids_by_name = {}
+        for i in sorted(items, key=lambda x: x.id, reverse=True):
+            if i.category == BalanceCategory.ASSET and i.name: asset_ids_by_name[i.name] = i.id
+        expected_cash = self._expected_cash(cash_accounts, asset_ids_by_name)
+
+        rows, fixes = [], []
+        for key in sorted(stored.keys() | expected.keys(), key=lambda k: (ALL_KINDS.index(k[0]), k[1], k[2])):
+            kind, name, curr = key
+            book = sum(i.amount or 0.0 for i in stored.get(key, []))
+            target = expected.get(key)
+            value = target["amount"] if target else 0.0
+            if abs(book - value) <= TOLERANCE and len(stored.get(key, [])) <= 1: continue
+            action = "新增" if not stored.get(key) else ("删除" if not target else ("合并重复项" if len(stored[key]) > 1 else "更新"))
+            rows.append([kind, name, curr, book, value, value - book, action])
+            fixes.append((key, target, stored.get(key, [])))
+
+        for acc in cash_accounts:
+            value = expected_cash.get(acc.id, 0.0)
+            if abs((acc.amount or 0.0) - value) <= TOLERANCE: continue
+            rows.append([KIND_CASH, acc.name, acc.currency, acc.amount or 0.0, value, value - (acc.amount or 0.0), "更新"])
+            fixes.append(((KIND_CASH, acc.name, acc.currency), {"amount": value}, [acc]))
+
+        for p in products:
+            qty = marketable.get(p.id, 0)
+            if (p.marketable_quantity or 0) == qty: continue
+            rows.append([KIND_MARKETABLE, p.name, "件", p.marketable_quantity or 0, qty, qty - (p.marketable_quantity or 0), "更新"])
+            fixes.append(((KIND_MARKETABLE, p.name, "件"), {"amount": qty}, [p]))
+
+        return pd.DataFrame(rows, columns=REPORT_COLUMNS), fixes
+
+    # ================= 3. 修正 =================
+
+    def _apply_item(self, key, target, items):
+        kind, name, curr = key
+        if kind == KIND_MARKETABLE:
+            items[0].marketable_quantity = int(target["amount"])
+            return
+        if kind == KIND_CASH:
+            items[0].amount = target["amount"]
+            return
+
+        if not target:
+            for i in items:
+                if not i.finance_record_id: self.db.delete(i)
+            return
+
+        product_id = target.get("product_id")
+        item_name = name if kind == KIND_PENDING else f"{AssetPrefix.STOCK if kind == KIND_STOCK else AssetPrefix.WIP_OFFSET}{name}"
+        if items:
+            main, *orphans = items
+            main.amount = target["amount"]
+            main.name = item_name
+            if product_id: main.product_id = product_id
+            for orphan in orphans:
+                self.db.delete(orphan)
+        else:
+            self.db.add(CompanyBalanceItem(
+                name=item_name, amount=target["amount"], category=BalanceCategory.ASSET,
+                currency=curr, asset_type="资产", product_id=product_id
+            ))
+
+    def apply(self, kinds=None, fixes=None):
+        """把所选类型 (默认全部) 的账面值修正为重算值，返回修正条数"""
+        kinds = set(kinds or ALL_KINDS)
+        if fixes is None:
+            _, fixes = self.build_report()
+        applied = 0
+        try:
+            for key, target, items in fixes:
+                if key[0] not in kinds: continue
+                self._apply_item(key, target, items)
+                applied += 1
+            self.db.commit()
+            if {KIND_STOCK, KIND_WIP_OFFSET, KIND_MARKETABLE} <= kinds:
+                # 商品派生账目已整体按重算值修正，后台同步的失败记录不再有意义
+                metrics_sync_queue.clear_failures()
+        except Exception:
+            self.db.rollback()
+            raise
+        return applied
@@ -1,6 +1,6 @@
 # services/balance_service.py
 from sqlalchemy import func
-from models import CompanyBalanceItem, FixedAsset, ConsumableItem, FinanceRecord, Product, CostItem
+from models import CompanyBalanceItem, FixedAsset, ConsumableItem, FinanceRecord, Product, ProductCostRollup
 from constants import AssetPrefix, BalanceCategory, Currency
 
 class BalanceService:
@@ -68,7 +68,7 @@ class BalanceService:
 
         # 5. 在制资产 (WIP) 计算
         # ✨ 修改查询：把 Product.id 连同 name 一起查出来，方便后续做 ID 关联
-        wip_query = db.query(Product.id, Product.name, func.sum(CostItem.actual_cost)).outerjoin(CostItem, Product.id == CostItem.product_id).group_by(Product.id, Product.name).all()
+        wip_query = db.query(Product.id, Product.name, func.sum(ProductCostRollup.actual_amount)).outerjoin(ProductCostRollup, Product.id == ProductCostRollup.product_id).group_by(Product.id, Product.name).all()
         
         offset_map = {}
         for off in offset_items:
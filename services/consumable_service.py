@@ -3,6 +3,7 @@ from sqlalchemy import desc
 from datetime import date
 from models import ConsumableItem, ConsumableLog, Product, CostItem, FinanceRecord, CompanyBalanceItem
 from constants import AssetPrefix, BalanceCategory, Currency, FinanceCategory
+import services.cost_rollup_service  # noqa: F401 注册成本汇总刷新钩子
 
 class ConsumableService:
     def __init__(self, db: Session):
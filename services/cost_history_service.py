@@ -0,0 +1,141 @@
+# services/cost_history_service.py
+from datetime import datetime
+from sqlalchemy import func, select, case
+from sqlalchemy.orm import Session
+from models import ProductCostSnapshot, SalesDailyFact
+from constants import Currency
+
+# 与上一条快照相比，变化小于该值视为未变化 (不重复追加)
+SNAPSHOT_TOLERANCE = 1e-6
+SNAPSHOT_FIELDS = ["unit_cost", "marketable_quantity", "stock_quantity", "stock_value", "wip_offset", "total_cost"]
+_LOOKUP = object()  # record 未传入 last 时自行查询最近一条快照
+
+class CostHistoryService:
+    """
+    商品单价/库存估值历史 (product_cost_snapshots)：
+    InventoryService.sync_product_metrics 每次重算后调用 record，数值与该商品最近一条快照相同则跳过，
+    因此表的行数只随成本/数量的实际变化增长。
+    期间销售成本 (COGS) = 每个日汇总事实行的净销量 × 当日生效单价 (当日及之前最近一条快照)，
+    由一次聚合查询直接在 sales_daily_facts 上完成。
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    # ================= 写入 =================
+
+    def get_latest_snapshots(self, product_ids):
+        """{product_id: 最近一条快照}，单次查询 (批量同步时预取，传给 record 的 last)"""
+        ranked = select(
+            ProductCostSnapshot.id,
+            func.row_number().over(
+                partition_by=ProductCostSnapshot.product_id,
+                order_by=(ProductCostSnapshot.snapshot_at.desc(), ProductCostSnapshot.id.desc())
+            ).label("rn")
+        ).where(ProductCostSnapshot.product_id.in_(product_ids)).subquery()
+        rows = self.db.query(ProductCostSnapshot).join(ranked, ranked.c.id == ProductCostSnapshot.id).filter(ranked.c.rn == 1).all()
+        return {snap.product_id: snap for snap in rows}
+
+    def record(self, prod, unit_cost, stock_quantity, stock_value, wip_offset, total_cost, snapshot_at=None, last=_LOOKUP):
+        """追加一条快照 (与最近一条相同则跳过)，返回新快照或 None；last 为预取的最近一条快照 (None 表示没有)"""
+        values = {
+            "unit_cost": unit_cost or 0.0, "marketable_quantity": prod.marketable_quantity or 0, "stock_quantity": stock_quantity or 0,
+            "stock_value": stock_value or 0.0, "wip_offset": wip_offset or 0.0, "total_cost": total_cost or 0.0,
+        }
+        if last is _LOOKUP:
+            last = self.db.query(ProductCostSnapshot).filter(
+                ProductCostSnapshot.product_id == prod.id
+            ).order_by(ProductCostSnapshot.snapshot_at.desc(), ProductCostSnapshot.id.desc()).first()
+        if last and last.product_name == prod.name and all(
+            abs((getattr(last, f) or 0) - values[f]) < SNAPSHOT_TOLERANCE for f in SNAPSHOT_FIELDS
+        ):
+            return None
+
+        snapshot_at = snapshot_at or datetime.now()
+        snap = ProductCostSnapshot(product_id=prod.id, product_name=prod.name, snapshot_at=snapshot_at, snapshot_date=snapshot_at.date(), **values)
+        self.db.add(snap)
+        return snap
+
+    def capture_all(self):
+        """按当前数据为全部商品补一条快照 (首次上线时回填)，不改动商品与资产数据，返回新增条数"""
+        from services.inventory_service import InventoryService
+        from models import Product
+        inv = InventoryService(self.db)
+        added = 0
+        for prod in self.db.query(Product).all():
+            m = inv.compute_product_metrics(prod)
+            if self.record(prod, m["unit_cost"], m["actual_stock"], m["stock_value"], m["wip_offset"], m["total_cost"]):
+                added += 1
+        self.db.commit()
+        return added
+
+    # ================= 读取 =================
+
+    def get_history(self, product_id):
+        """某商品的快照历史 DataFrame (时间升序)"""
+        import pandas as pd
+        cols = ["时间", "单价", "可销售数量", "实际库存", "库存估值", "在制冲销", "实付成本"]
+        rows = self.db.query(
+            ProductCostSnapshot.snapshot_at, ProductCostSnapshot.unit_cost, ProductCostSnapshot.marketable_quantity,
+            ProductCostSnapshot.stock_quantity, ProductCostSnapshot.stock_value, ProductCostSnapshot.wip_offset, ProductCostSnapshot.total_cost
+        ).filter(ProductCostSnapshot.product_id == product_id).order_by(ProductCostSnapshot.snapshot_at.asc(), ProductCostSnapshot.id.asc()).all()
+        return pd.DataFrame(rows, columns=cols)
+
+    def get_unit_cost_as_of(self, product_name, as_of):
+        """某日收盘时的单价 (当日及之前最近一条快照)，无快照返回 None"""
+        return self.db.query(ProductCostSnapshot.unit_cost).filter(
+            ProductCostSnapshot.product_name == product_name,
+            ProductCostSnapshot.snapshot_date <= as_of
+        ).order_by(ProductCostSnapshot.snapshot_date.desc(), ProductCostSnapshot.snapshot_at.desc(), ProductCostSnapshot.id.desc()).limit(1).scalar()
+
+    @staticmethod
+    def _effective_unit_cost():
+        """
+        事实行当日生效单价的关联子查询：当日及之前最近一条快照；
+        销售早于首条快照时取首条快照的单价 (此前没有更早的成本记录)。
+        """
+        S = ProductCostSnapshot
+        as_of = select(S.unit_cost).where(
+            S.product_name == SalesDailyFact.product_name, S.snapshot_date <= SalesDailyFact.sale_date
+        ).order_by(S.snapshot_date.desc(), S.snapshot_at.desc(), S.id.desc()).limit(1).scalar_subquery()
+        earliest = select(S.unit_cost).where(
+            S.product_name == SalesDailyFact.product_name
+        ).order_by(S.snapshot_date.asc(), S.snapshot_at.asc(), S.id.asc()).limit(1).scalar_subquery()
+        return func.coalesce(as_of, earliest)
+
+    def get_cogs_report(self, start=None, end=None, exchange_rate=0.048, granularity=None):
+        """
+        期间销售成本与毛利 (单次聚合查询)。
+        granularity: None 按商品汇总整个区间；"day"/"month" 再按 日/月 拆分。
+        返回列: [期间 (可选), 商品, 净销量, 销售额(CNY), 销售成本, 毛利, 毛利率]；
+        销售额为 销售额 - 退款 (JPY 按 exchange_rate 折合)，净销量为 售出 - 退货。
+        """
+        import pandas as pd
+        F = SalesDailyFact
+        net_qty = func.coalesce(F.sold_qty, 0) - func.coalesce(F.return_qty, 0)
+        net_amount = func.coalesce(F.gross_amount, 0.0) - func.coalesce(F.refund_amount, 0.0)
+        revenue = net_amount * case((F.currency == Currency.JPY, exchange_rate), else_=1.0)
+
+        group_cols = [F.product_name] + ([F.sale_date] if granularity else [])
+        query = self.db.query(
+            *group_cols,
+            func.sum(net_qty).label("qty"),
+            func.sum(revenue).label("revenue"),
+            func.sum(net_qty * func.coalesce(self._effective_unit_cost(), 0.0)).label("cogs"),
+        )
+        if start: query = query.filter(F.sale_date >= start)
+        if end: query = query.filter(F.sale_date <= end)
+        rows = query.group_by(*group_cols).all()
+
+        cols = (["期间"] if granularity else []) + ["商品", "净销量", "销售额(CNY)", "销售成本", "毛利", "毛利率"]
+        if not rows: return pd.DataFrame(columns=cols)
+
+        df = pd.DataFrame(rows, columns=["商品"] + (["期间"] if granularity else []) + ["净销量", "销售额(CNY)", "销售成本"])
+        if granularity:
+            dates = pd.to_datetime(df["期间"])
+            df["期间"] = dates.dt.strftime("%Y-%m") if granularity == "month" else dates.dt.strftime("%Y-%m-%d")
+            df = df.groupby(["期间", "商品"], as_index=False)[["净销量", "销售额(CNY)", "销售成本"]].sum()
+        df["净销量"] = df["净销量"].astype(int)
+        df["毛利"] = df["销售额(CNY)"] - df["销售成本"]
+        df["毛利率"] = (df["毛利"] / df["销售额(CNY)"].where(df["销售额(CNY)"] != 0)).fillna(0.0)
+        sort_cols = (["期间"] if granularity else []) + ["销售额(CNY)"]
+        return df.sort_values(sort_cols, ascending=[True] * (len(sort_cols) - 1) + [False], kind="stable").reset_index(drop=True)[cols]
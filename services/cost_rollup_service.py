@@ -0,0 +1,129 @@
+# services/cost_rollup_service.py
+from sqlalchemy import event, delete, insert, select, tuple_, func
+from sqlalchemy.orm import Session
+from models import CostItem, FinanceRecord, Product, ProductCostRollup
+
+BUDGET_SUPPLIER = "预算设定"  # 预算项以 supplier 标记 (与 CostService.add_budget_item 一致)
+
+class CostRollupService:
+    """
+    商品成本汇总表 (product_cost_rollups) 的维护与读取。
+    成本项的任何新增/修改/删除 (成本页、财务流水关联、耗材转成本、售后成本、消耗出库、删除商品)
+    都会在 flush 时标记受影响的 (商品, 分类)，flush 完成后只重算这些分类，
+    读取方 (商品指标同步、在制资产、资产负债表、成本页) 不再全量汇总成本明细。
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def _summarize(items):
+        """
+        items: [(category, currency, supplier, item_name, actual_cost, original_amount, unit_price, quantity)]，按成本项 id 排序
+        预算口径与成本页一致：同一分类内按项目名对应预算项 (同名预算项以最后一条为准)，计 单价×数量；
+        非预算项若该分类下没有同名预算项，则以实付计入预算。
+        返回 {(category, currency): {...}}
+        """
+        budget_map = {}
+        for cat, curr, supplier, name, _, _, unit_price, qty in items:
+            if supplier == BUDGET_SUPPLIER:
+                budget_map[(cat, name)] = (curr or "CNY", (unit_price or 0.0) * (qty or 0.0))
+        rows = {}
+        def row(cat, curr):
+            return rows.setdefault((cat, curr or "CNY"), {
+                "budget_amount": 0.0, "actual_amount": 0.0, "original_amount": 0.0, "item_count": 0, "budget_item_count": 0
+            })
+        for cat, curr, supplier, name, actual, original, unit_price, qty in items:
+            r = row(cat, curr)
+            actual = actual or 0.0
+            r["actual_amount"] += actual
+            r["original_amount"] += original if original is not None else actual
+            r["item_count"] += 1
+            if supplier == BUDGET_SUPPLIER:
+                r["budget_item_count"] += 1
+            elif (cat, name) not in budget_map:
+                r["budget_amount"] += actual
+        for (cat, _), (curr, amount) in budget_map.items():
+            row(cat, curr)["budget_amount"] += amount
+        return rows
+
+    @classmethod
+    def refresh_keys(cls, conn, keys):
+        """按 (product_id, category) 重算汇总行，conn 可以是 Connection 或 Session"""
+        keys = {k for k in keys if k[0] is not None}
+        if not keys: return
+        conn.execute(delete(ProductCostRollup).where(tuple_(ProductCostRollup.product_id, ProductCostRollup.category).in_(keys)))
+        items = conn.execute(select(
+            CostItem.product_id, CostItem.category, CostItem.currency, CostItem.supplier, CostItem.item_name,
+            CostItem.actual_cost, CostItem.original_amount, CostItem.unit_price, CostItem.quantity
+        ).where(tuple_(CostItem.product_id, CostItem.category).in_(keys)).order_by(CostItem.id)).all()
+
+        by_product = {}
+        for p_id, *rest in items:
+            by_product.setdefault(p_id, []).append(tuple(rest))
+        values = [
+            {"product_id": p_id, "category": cat, "currency": curr, **r}
+            for p_id, p_items in by_product.items()
+            for (cat, curr), r in cls._summarize(p_items).items()
+        ]
+        if values:
+            conn.execute(insert(ProductCostRollup), values)
+
+    def rebuild(self):
+        """全量重建 (首次上线或数据修复)，返回写入行数"""
+        self.db.query(ProductCostRollup).delete()
+        keys = {tuple(k) for k in self.db.query(CostItem.product_id, CostItem.category).distinct().all()}
+        self.refresh_keys(self.db, keys)
+        self.db.commit()
+        return self.db.query(ProductCostRollup).count()
+
+    # ================= 读取 =================
+
+    def get_rollups(self, product_id):
+        return self.db.query(ProductCostRollup).filter(ProductCostRollup.product_id == product_id).all()
+
+    def get_total_actual(self, product_id):
+        """商品实付成本合计 (CNY)"""
+        return sum(r.actual_amount or 0.0 for r in self.get_rollups(product_id))
+
+    def get_totals_by_product(self, product_ids=None):
+        """{product_id: 实付成本合计 (CNY)}，单次分组查询；product_ids 为空时返回全部商品"""
+        q = self.db.query(ProductCostRollup.product_id, func.sum(ProductCostRollup.actual_amount))
+        if product_ids is not None:
+            q = q.filter(ProductCostRollup.product_id.in_(product_ids))
+        return {p_id: total or 0.0 for p_id, total in q.group_by(ProductCostRollup.product_id).all()}
+
+
+# ================= 写路径钩子 =================
+_PENDING_KEY = "cost_rollup_keys"
+
+@event.listens_for(Session, "before_flush")
+def _collect_cost_rollup_keys(session, flush_context, instances):
+    keys = session.info.setdefault(_PENDING_KEY, set())
+    for obj in session.new:
+        if isinstance(obj, CostItem): keys.add((obj.product_id, obj.category))
+    changed_ids = []
+    for obj in session.dirty:
+        if isinstance(obj, CostItem) and session.is_modified(obj):
+            keys.add((obj.product_id, obj.category))
+            changed_ids.append(obj.id)
+    if changed_ids:
+        # 提交后属性已过期，修改前的旧值不一定在 history 里，直接取库中当前 (修改前) 的归属
+        with session.no_autoflush:
+            keys.update(tuple(k) for k in session.query(CostItem.product_id, CostItem.category).filter(CostItem.id.in_(changed_ids)))
+    deleted_finance_ids = []
+    for obj in session.deleted:
+        if isinstance(obj, CostItem): keys.add((obj.product_id, obj.category))
+        elif isinstance(obj, FinanceRecord): deleted_finance_ids.append(obj.id)
+        elif isinstance(obj, Product):
+            keys.update((obj.id, cat) for (cat,) in session.query(CostItem.category).filter(CostItem.product_id == obj.id).distinct())
+    if deleted_finance_ids:
+        # 删除流水时数据库外键会级联删除其成本项 (不经过 ORM)
+        keys.update(tuple(k) for k in session.query(CostItem.product_id, CostItem.category).filter(
+            CostItem.finance_record_id.in_(deleted_finance_ids)
+        ).distinct())
+
+@event.listens_for(Session, "after_flush")
+def _refresh_cost_rollups(session, flush_context):
+    keys = session.info.pop(_PENDING_KEY, None)
+    if keys:
+        CostRollupService.refresh_keys(session.connection(), keys)
@@ -3,6 +3,7 @@ from sqlalchemy.orm import Session, joinedload
 from sqlalchemy import func, or_
 from datetime import date
 from services.inventory_service import InventoryService
+from services.cost_history_service import CostHistoryService
 from models import Product, CostItem, FinanceRecord, CompanyBalanceItem, InventoryLog, ProductColor
 from constants import PRODUCT_COST_CATEGORIES, AssetPrefix, BalanceCategory, Currency
 
@@ -25,6 +26,10 @@ class CostService:
     def get_cost_items(self, product_id):
         return self.db.query(CostItem).filter(CostItem.product_id == product_id).all()
 
+    def get_unit_cost_history(self, product_id):
+        """单价/库存估值快照历史，取自 product_cost_snapshots"""
+        return CostHistoryService(self.db).get_history(product_id)
+
     def get_wip_offset(self, product_id):
         prod = self.db.query(Product).filter(Product.id == product_id).first()
         if not prod: return 0.0
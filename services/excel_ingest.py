@@ -0,0 +1,131 @@
+# services/excel_ingest.py
+"""
+Excel 流式读取：openpyxl 只读模式逐行读取工作表，每 chunk_size 行组成一个 DataFrame 交给调用方，
+整个工作簿不会一次性载入内存 (电商平台导出的大表也能在固定内存内校验)。
+
+列类型不再交给 pandas 推断：订单号 / SKU 等文本列统一转为字符串 (Excel 把纯数字单号存成浮点时
+还原为整数写法，不会出现 '123.0')，金额列转为 float，无法识别的值保留原样交给校验逻辑报错。
+"""
+import io
+import math
+import zipfile
+from datetime import datetime, date
+
+CHUNK_SIZE = 2000
+
+# 订单导入模板中按文本读取的列 (单号、商品 / 型号、分号分隔的数量与仓库等)
+ORDER_TEXT_COLUMNS = ("订单号", "关联定金单号", "商品名", "商品型号", "数量", "销售平台", "币种", "出货仓库", "优惠")
+ORDER_NUMBER_COLUMNS = ("订单总额",)
+
+
+def to_text(value):
+    """单元格值 -> 去掉首尾空白的字符串；空值为 ''，整数值的浮点数去掉 '.0'"""
+    if value is None: return ""
+    if isinstance(value, float):
+        if math.isnan(value): return ""
+        if value.is_integer(): return str(int(value))
+        return repr(value)
+    if isinstance(value, datetime) and value.time() == datetime.min.time():
+        return value.date().isoformat()
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return str(value).strip()
+
+
+def to_number(value):
+    """单元格值 -> float；空值为 None，无法解析时原样返回 (由校验逻辑给出行号提示)"""
+    if value is None: return None
+    if isinstance(value, bool): return value
+    if isinstance(value, (int, float)):
+        return None if isinstance(value, float) and math.isnan(value) else float(value)
+    text = str(value).strip().replace(",", "")
+    if not text: return None
+    try:
+        return float(text)
+    except ValueError:
+        return value
+
+
+class ExcelChunkReader:
+    """
+    按块读取第一张工作表：第一行为列名，之后每 chunk_size 行产出一个 DataFrame，
+    索引沿用 0 起的数据行号 (与 pd.read_excel 相同，Excel 行号 = 索引 + 2)。
+    text_columns / number_columns 中的列按 to_text / to_number 转换，其余列保留单元格原值。
+
+        reader = ExcelChunkReader(uploaded_bytes, text_columns=ORDER_TEXT_COLUMNS, number_columns=ORDER_NUMBER_COLUMNS)
+        for chunk in reader: ...
+    """
+
+    def __init__(self, source, chunk_size=CHUNK_SIZE, text_columns=(), number_columns=()):
+        self.source = io.BytesIO(source) if isinstance(source, (bytes, bytearray)) else source
+        self.chunk_size = chunk_size
+        self.text_columns = set(text_columns)
+        self.number_columns = set(number_columns)
+        self.columns = None
+        self.total_rows = None   # 工作表声明的数据行数 (估计值，用于进度)；旧版 .xls 为实际行数
+
+    def _is_xlsx(self):
+        pos = self.source.tell()
+        try:
+            return zipfile.is_zipfile(self.source)
+        finally:
+            self.source.seek(pos)
+
+    def _convert(self, columns, rows, start):
+        import pandas as pd
+        data = {}
+        for i, name in enumerate(columns):
+            values = [row[i] if i < len(row) else None for row in rows]
+            if name in self.text_columns:
+                values = [to_text(v) for v in values]
+            elif name in self.number_columns:
+                values = [to_number(v) for v in values]
+            data[name] = values
+        return pd.DataFrame(data, columns=columns, index=pd.RangeIndex(start, start + len(rows)))
+
+    def _iter_rows(self):
+        """(列名列表, 数据行迭代器)"""
+        if not self._is_xlsx():
+            # 旧版 .xls 不是 zip 包，openpyxl 无法读取，退回 pandas 一次性读取 (仍按文本读入指定列)
+            import pandas as pd
+            df = pd.read_excel(self.source, dtype=object)
+            self.total_rows = len(df)
+            return [str(c).strip() for c in df.columns], (tuple(None if pd.isna(v) else v for v in r) for r in df.itertuples(index=False))
+
+        from openpyxl import load_workbook
+        wb = load_workbook(self.source, read_only=True, data_only=True)
+        ws = wb.worksheets[0]
+        rows = ws.iter_rows(values_only=True)
+        header = next(rows, None) or ()
+        self.total_rows = max(ws.max_row - 1, 0) if ws.max_row else None
+
+        def data_rows():
+            # 只读模式下表尾格式化过的空行也会读到：空行先计数，后面还有数据时才补出 (保持行号与 Excel 一致)
+            blank = 0
+            try:
+                for row in rows:
+                    if not row or all(v is None or v == "" for v in row):
+                        blank += 1
+                        continue
+                    for _ in range(blank): yield ()
+                    blank = 0
+                    yield row
+            finally:
+                wb.close()
+        columns = [to_text(c) for c in header]
+        # 去掉表头右侧的空列
+        while columns and not columns[-1]: columns.pop()
+        return columns, data_rows()
+
+    def __iter__(self):
+        columns, rows = self._iter_rows()
+        self.columns = columns
+        batch, start = [], 0
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self.chunk_size:
+                yield self._convert(columns, batch, start)
+                start += len(batch)
+                batch = []
+        if batch or start == 0:
+            yield self._convert(columns, batch, start)
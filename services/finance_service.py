@@ -8,6 +8,7 @@ from models import (
     FixedAsset, ConsumableLog, CompanyBalanceItem
 )
 from constants import AssetPrefix, BalanceCategory, Currency, FinanceCategory
+import services.cost_rollup_service  # noqa: F401 注册成本汇总刷新钩子
 
 class FinanceService:
     """
@@ -101,6 +102,46 @@ class FinanceService:
                 })
         return pd.DataFrame(processed_data), total_count
 
+    # --- 财务报表分类标准 ---
+    REPORT_NATURE_MAP = {
+        **{c: "经营损益" for c in ["销售收入", "其他现金收入", "商品成本", "退款", "其他", "分红"]},
+        **{c: "资产变动" for c in ["固定资产购入", "其他资产购入", "现有资产增加", "新资产增加", "现有资产减少"]},
+        **{c: "负债变动" for c in ["借入资金", "新增挂账资产", "债务偿还", "资产抵消"]},
+        **{c: "资本变动" for c in ["投资", "撤资"]},
+        **{c: "内部流转" for c in ["资金移动", "货币兑换"]},
+    }
+    REPORT_NON_CASH_FLOW = {"资产抵消", "取消/冲销", "新增挂账资产"}
+
+    @staticmethod
+    def get_report_frame(db, cash_accounts, exchange_rate):
+        """
+        财务报表的数据底表：每条流水一行 (日期/金额/折合CNY/财务性质/归属账户/年月 等)。
+        未绑定账户的流水归到同币种的第一个现金账户。无流水时返回空 DataFrame。
+        """
+        default_acc_id = {}
+        for acc in sorted(cash_accounts, key=lambda x: x.id):
+            default_acc_id.setdefault(acc.currency, acc.id)
+
+        rows = db.query(
+            FinanceRecord.date, FinanceRecord.amount, FinanceRecord.currency, FinanceRecord.category, FinanceRecord.account_id
+        ).all()
+        if not rows: return pd.DataFrame()
+
+        df = pd.DataFrame(rows, columns=["日期", "金额", "币种", "分类", "account_id"])
+        df["日期"] = pd.to_datetime(df["日期"])
+        df["金额"] = df["金额"].astype(float)
+        is_cny, is_jpy = df["币种"] == Currency.CNY, df["币种"] == Currency.JPY
+        df["CNY变动"] = df["金额"].where(is_cny, 0.0)
+        df["JPY变动"] = df["金额"].where(is_jpy, 0.0)
+        df["折合CNY"] = df["金额"].where(~is_jpy, df["金额"] * exchange_rate)
+        df["财务性质"] = df["分类"].map(FinanceService.REPORT_NATURE_MAP).fillna("其他")
+        df["account_id"] = df["account_id"].fillna(df["币种"].map(default_acc_id))
+        df["计入现金流"] = ~df["分类"].isin(FinanceService.REPORT_NON_CASH_FLOW)
+        df["年份"] = df["日期"].dt.year
+        df["月份"] = df["日期"].dt.month
+        df["年月"] = df["日期"].dt.strftime("%Y-%m")
+        return df[["日期", "金额", "CNY变动", "JPY变动", "折合CNY", "币种", "分类", "财务性质", "account_id", "计入现金流", "年份", "月份", "年月"]]
+
     @staticmethod
     def get_current_balances(db):
         """获取当前账户总余额"""
@@ -854,7 +895,8 @@ class FinanceService:
                 # 记录要被删除的成本项对应的 product_id
                 cost = db.query(CostItem).filter(CostItem.finance_record_id == record_id).first()
                 if cost: product_id_to_sync = cost.product_id
-                db.query(CostItem).filter(CostItem.finance_record_id == record_id).delete()
+                for c in db.query(CostItem).filter(CostItem.finance_record_id == record_id).all():
+                    db.delete(c) # 逐条删除以触发成本汇总刷新
             
             db.query(FixedAsset).filter(FixedAsset.finance_record_id == record_id).delete()
             db.query(ConsumableItem).filter(ConsumableItem.finance_record_id == record_id).delete()
@@ -0,0 +1,147 @@
+# services/inventory_archive_service.py
+from datetime import date, timedelta
+from sqlalchemy.orm import Session
+from sqlalchemy import func, or_, case, insert, select, literal
+from models import InventoryLog, InventoryLogArchive, InventoryStockCheckpoint
+from constants import StockLogReason
+from services.inventory_service import InventoryService
+
+OPENING_NOTE = "📦 期初结转"
+CONSUME_MARK = "消耗"  # sync_product_metrics 以备注含 "消耗" 识别成本消耗出库，结转行需保留该标记
+
+# 归档时原样复制的列 (两表同名，主表 id 另存为 log_id)
+ARCHIVE_COLUMNS = [
+    "product_name", "variant", "change_amount", "reason", "date", "note", "is_sold", "sale_amount",
+    "currency", "platform", "is_other_out", "warehouse_id", "part_name", "order_id", "cost_item_id", "is_opening"
+]
+
+class InventoryArchiveService:
+    """
+    库存流水归档：把截止日之前、与订单/成本无关联的流水移入 inventory_logs_archive，
+    主表按 (商品, 款式, 部件, 仓库, 流水类别) 各写一条期初结转行，库存计算结果保持精确。
+    流水类别 = 变动类型 + 是否消耗出库 + 是否其他出库，覆盖所有库存统计口径的区分维度。
+    销售/售后/撤销相关流水 (订单关联、is_sold、发货撤销) 与绑定成本项的流水始终保留在主表，
+    以免影响销售统计和级联删除。
+    """
+    def __init__(self, db: Session):
+        self.db = db
+
+    @staticmethod
+    def _is_consume(model):
+        return case((model.note.like(f"%{CONSUME_MARK}%"), True), else_=False)
+
+    def _group_columns(self, model):
+        return [
+            model.product_name, model.variant, model.part_name, model.warehouse_id,
+            model.reason, self._is_consume(model).label("is_consume"), func.coalesce(model.is_other_out, False).label("is_other_out")
+        ]
+
+    def _eligible_filters(self, cutoff):
+        return [
+            InventoryLog.date < cutoff,
+            InventoryLog.order_id == None,
+            InventoryLog.cost_item_id == None,
+            or_(InventoryLog.is_sold == None, InventoryLog.is_sold == False),
+            InventoryLog.reason != StockLogReason.UNDO_SHIP,
+        ]
+
+    def _fingerprint(self, model, extra_filters=()):
+        """按流水类别汇总的变动数量 {类别键: 数量}，所有库存统计都是这些分组和的线性组合"""
+        cols = self._group_columns(model)
+        rows = self.db.query(*cols, func.sum(model.change_amount)).filter(*extra_filters).group_by(*cols).all()
+        return {tuple(r[:-1]): int(r[-1] or 0) for r in rows}
+
+    def stock_fingerprint(self):
+        """主表当前的库存指纹 (剔除合计为 0 的类别)"""
+        return {k: v for k, v in self._fingerprint(InventoryLog).items() if v != 0}
+
+    # ================= 归档 =================
+
+    def preview(self, cutoff):
+        """归档预览: (待归档流水条数, 将生成的期初结转行数)"""
+        filters = self._eligible_filters(cutoff)
+        n_logs = self.db.query(func.count(InventoryLog.id)).filter(*filters).scalar() or 0
+        n_groups = len([v for v in self._fingerprint(InventoryLog, filters).values() if v != 0])
+        return n_logs, n_groups
+
+    def archive_before(self, cutoff):
+        """
+        归档 cutoff (不含) 之前的流水，期初结转行记在 cutoff 前一日。
+        同一事务内对比归档前后的库存指纹，不一致则回滚并抛出 ValueError。
+        完成后在 cutoff 前一日生成库存快照，供历史库存查询衔接。
+        返回 {"archived": 归档条数, "opening_rows": 结转行数}
+        """
+        if cutoff > date.today():
+            raise ValueError("归档截止日不能晚于今天")
+        opening_date = cutoff - timedelta(days=1)
+        filters = self._eligible_filters(cutoff)
+
+        try:
+            before = self.stock_fingerprint()
+
+            # 1. 原样复制到归档表 (INSERT ... SELECT，不经过 Python)
+            archived = self.db.execute(
+                insert(InventoryLogArchive).from_select(
+                    ["log_id"] + ARCHIVE_COLUMNS + ["archive_cutoff"],
+                    select(InventoryLog.id, *[getattr(InventoryLog, c) for c in ARCHIVE_COLUMNS], literal(cutoff)).where(*filters)
+                )
+            ).rowcount
+
+            # 2. 按类别汇总生成期初结转行
+            groups = self._fingerprint(InventoryLog, filters)
+            self.db.query(InventoryLog).filter(*filters).delete()
+            opening_rows = 0
+            for (p_name, v_name, part, wh_id, reason, is_consume, is_other_out), qty in groups.items():
+                if qty == 0: continue
+                self.db.add(InventoryLog(
+                    product_name=p_name, variant=v_name, part_name=part, warehouse_id=wh_id, reason=reason,
+                    change_amount=qty, date=opening_date, is_other_out=bool(is_other_out), is_opening=True,
+                    note=f"{OPENING_NOTE} ({CONSUME_MARK}) | 截至 {opening_date}" if is_consume else f"{OPENING_NOTE} | 截至 {opening_date}"
+                ))
+                opening_rows += 1
+            self.db.flush()
+
+            # 3. 校验：库存指纹必须完全一致
+            after = self.stock_fingerprint()
+            if before != after:
+                diff = {k for k in before.keys() | after.keys() if before.get(k, 0) != after.get(k, 0)}
+                raise ValueError(f"归档校验失败，{len(diff)} 个类别的库存合计不一致，已回滚")
+
+            # 4. 旧快照与期初结转行口径不再衔接，全部重建为截止日前一日的快照
+            self.db.query(InventoryStockCheckpoint).delete(synchronize_session=False)
+            InventoryService(self.db).build_stock_checkpoint(opening_date)
+        except Exception:
+            self.db.rollback()
+            raise
+        return {"archived": archived, "opening_rows": opening_rows}
+
+    # ================= 校验与查阅 =================
+
+    def verify(self):
+        """
+        独立校验：主表原始流水 + 归档表原始流水 (均不含期初结转行) 的分类合计，
+        必须等于主表当前 (含期初结转行) 的分类合计。返回不一致的类别列表，空列表表示通过。
+        """
+        not_opening = lambda m: or_(m.is_opening == None, m.is_opening == False)
+        raw = self._fingerprint(InventoryLog, [not_opening(InventoryLog)])
+        for k, v in self._fingerprint(InventoryLogArchive, [not_opening(InventoryLogArchive)]).items():
+            raw[k] = raw.get(k, 0) + v
+        current = self._fingerprint(InventoryLog)
+        return sorted(
+            [(k, raw.get(k, 0), current.get(k, 0)) for k in raw.keys() | current.keys() if raw.get(k, 0) != current.get(k, 0)],
+            key=lambda x: tuple(str(i) for i in x[0])
+        )
+
+    def get_archive_stats(self):
+        """{"count": 归档条数, "cutoff": 最近截止日, "earliest": 最早流水日期}"""
+        count, cutoff, earliest = self.db.query(
+            func.count(InventoryLogArchive.id), func.max(InventoryLogArchive.archive_cutoff), func.min(InventoryLogArchive.date)
+        ).one()
+        return {"count": count or 0, "cutoff": cutoff, "earliest": earliest}
+
+    def get_archived_logs(self, product_name=None, limit=200):
+        """按需查阅归档流水 (最近在前)"""
+        query = self.db.query(InventoryLogArchive)
+        if product_name:
+            query = query.filter(InventoryLogArchive.product_name == product_name)
+        return query.order_by(InventoryLogArchive.date.desc(), InventoryLogArchive.id.desc()).limit(limit).all()
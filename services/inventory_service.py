@@ -1,9 +1,82 @@
 # services/inventory_service.py
-from sqlalchemy.orm import Session
-from sqlalchemy import func, or_
-from datetime import date
-from models import Product, InventoryLog, ProductColor, CompanyBalanceItem, CostItem, FinanceRecord, Warehouse
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy import func, or_, event, select, union_all, inspect as sa_inspect
+from datetime import date, datetime, timedelta
+from models import Product, InventoryLog, ProductColor, CompanyBalanceItem, CostItem, FinanceRecord, Warehouse, InventoryStockCheckpoint, InventoryLogArchive
 from constants import PRODUCT_COST_CATEGORIES, AssetPrefix, BalanceCategory, Currency, StockLogReason, FinanceCategory
+from services.cost_rollup_service import CostRollupService
+from services.cost_history_service import CostHistoryService
+from services.query_profiler import profiled
+
+# 计入仓库物理库存的流水类型 (与 get_warehouse_inventory_details、库存页现货 _variant_part_stats 口径一致)
+WAREHOUSE_STOCK_REASONS = [
+    StockLogReason.INSPECT_COMPLETED, StockLogReason.OTHER_IN, StockLogReason.OUT_STOCK,
+    StockLogReason.IN_STOCK, StockLogReason.RETURN_IN, StockLogReason.TRANSFER
+]
+
+def _as_date(value):
+    if isinstance(value, datetime): return value.date()
+    return value or date.today()
+
+def invalidate_stock_checkpoints(session, since):
+    """
+    作废 since 及之后日期的库存快照。before_flush 钩子只看得到经 ORM 单条写入的流水，
+    bulk_insert_mappings 等绕过 flush 的批量写入需要显式调用。
+    """
+    if since is None: return
+    session.query(InventoryStockCheckpoint).filter(
+        InventoryStockCheckpoint.checkpoint_date >= since
+    ).delete(synchronize_session=False)
+
+@event.listens_for(Session, "before_flush")
+def _invalidate_stock_checkpoints(session, flush_context, instances):
+    """
+    任何库存流水的新增/修改/删除只要落在已有快照日期之前 (含补录历史日期)，
+    就作废该日期及之后的全部快照，保证历史库存查询不会读到过期的期初数。
+    """
+    touched = []
+    for obj in session.new:
+        if isinstance(obj, InventoryLog): touched.append(_as_date(obj.date))
+    for obj in session.deleted:
+        if isinstance(obj, InventoryLog): touched.append(_as_date(obj.date))
+    for obj in session.dirty:
+        if isinstance(obj, InventoryLog) and session.is_modified(obj):
+            hist = sa_inspect(obj).attrs.date.history
+            touched.extend(_as_date(d) for d in [obj.date, *hist.deleted])
+    if not touched: return
+    invalidate_stock_checkpoints(session, min(touched))
+
+@event.listens_for(Session, "do_orm_execute")
+def _invalidate_stock_checkpoints_on_bulk(orm_execute_state):
+    """
+    query(InventoryLog).delete() / update() 这类 ORM 批量语句不经过 flush：
+    删除时从受影响流水的最早日期起作废快照；批量修改可能改动日期，直接作废全部快照。
+    """
+    if not (orm_execute_state.is_delete or orm_execute_state.is_update): return
+    mapper = orm_execute_state.bind_mapper
+    if mapper is None or mapper.class_ is not InventoryLog: return
+    session = orm_execute_state.session
+    if orm_execute_state.is_update:
+        invalidate_stock_checkpoints(session, date.min)
+        return
+    where = orm_execute_state.statement.whereclause
+    q = select(func.min(InventoryLog.date))
+    if where is not None: q = q.where(where)
+    invalidate_stock_checkpoints(session, session.execute(q).scalar())
+
+def _sets_from_parts(parts_req, part_sums):
+    """
+    部件维度的累计数量 {部件名 (整套流水为 None 或 ''): 数量} 折算成套数，
+    与 _variant_part_stats 的现货口径一致：整套流水按配比展开到各部件，不在配比中的部件忽略。
+    """
+    parts_req = parts_req or {"整套": 1}
+    pool = {p: 0 for p in parts_req}
+    for part, qty in part_sums.items():
+        if part and part in parts_req:
+            pool[part] += qty
+        elif not part:
+            for p, req in parts_req.items(): pool[p] += qty * req
+    return min(max(0, pool[p]) // req for p, req in parts_req.items())
 
 class InventoryService:
     def __init__(self, db: Session):
@@ -11,11 +84,39 @@ class InventoryService:
         self.COST_CATEGORIES = PRODUCT_COST_CATEGORIES
 
     # ================= 1. 核心底座：大货资产与单价动态同步 =================
-    def sync_product_metrics(self, product_id):
-        prod = self.db.query(Product).filter(Product.id == product_id).first()
-        if not prod: return
+    @staticmethod
+    def _derive_metrics(prod, stats, consumed_qty, total_cost):
+        # 动态计算预计可销售数量
+        if prod.is_production_completed:
+            base_qty = sum(s.get("produced", 0) for s in stats.values())
+        else:
+            base_qty = prod.total_quantity
+        marketable_qty = max(0, base_qty - consumed_qty)
+        
+        # 重新计算单价
+        unit_cost = total_cost / marketable_qty if marketable_qty > 0 else 0.0
         
-        # 1. 计算在成本中消耗的数量 (仅限成套消耗)
+        # 大货资产 (实库存 * 最新单价)
+        actual_stock = sum(s.get("actual", 0) for s in stats.values())
+
+        # 在制资产冲销 (WIP_OFFSET)
+        if prod.is_production_completed:
+            wip_offset_val = -total_cost
+        else:
+            produced_qty = sum(s.get("produced", 0) for s in stats.values())
+            wip_offset_val = -(produced_qty * unit_cost)
+
+        return {
+            "marketable_quantity": marketable_qty, "total_cost": total_cost, "unit_cost": unit_cost,
+            "actual_stock": actual_stock, "stock_value": actual_stock * unit_cost, "wip_offset": wip_offset_val,
+        }
+
+    def compute_product_metrics(self, prod):
+        """
+        按当前流水与成本计算商品指标 (不写库)：
+        {"marketable_quantity", "total_cost", "unit_cost", "actual_stock", "stock_value", "wip_offset"}
+        """
+        # 计算在成本中消耗的数量 (仅限成套消耗)
         consumed_qty = 0
         logs = self.db.query(InventoryLog).filter(
             InventoryLog.product_name == prod.name,
@@ -25,90 +126,121 @@ class InventoryService:
         for l in logs:
             if l.note and "消耗" in l.note:
                 consumed_qty += abs(l.change_amount)
-                
-        # 2. 动态计算预计可销售数量
+
         stats = self.get_stock_overview_by_parts(prod.id, prod.name)
-        if prod.is_production_completed:
-            base_qty = sum(s.get("produced", 0) for s in stats.values())
-        else:
-            base_qty = prod.total_quantity
-            
-        prod.marketable_quantity = max(0, base_qty - consumed_qty)
-        
-        # 3. 重新计算单价
-        total_cost = self.db.query(func.sum(CostItem.actual_cost)).filter(CostItem.product_id == prod.id).scalar() or 0.0
-        unit_cost = total_cost / prod.marketable_quantity if prod.marketable_quantity > 0 else 0.0
-        
-        # 4. 实时更新大货资产 (实库存 * 最新单价)
-        actual_stock = sum(s.get("actual", 0) for s in stats.values())
-        asset_name = f"{AssetPrefix.STOCK}{prod.name}"
-        asset_val = actual_stock * unit_cost
-        
-        # 获取所有可能的记录，准备自动清理重复的老数据
-        items = self.db.query(CompanyBalanceItem).filter(
+        total_cost = CostRollupService(self.db).get_total_actual(prod.id)
+        return self._derive_metrics(prod, stats, consumed_qty, total_cost)
+
+    def compute_all_product_metrics(self):
+        """
+        🚀 全部商品的指标 (与 compute_product_metrics 口径一致)，固定 5 次查询：
+        商品/款式/部件、流水分组合计、消耗出库合计、成本汇总合计。返回 {product_id: 指标}
+        """
+        return {prod.id: m for prod, m in self._compute_metrics_batch()}
+
+    def _compute_metrics_batch(self, product_ids=None, lock=False):
+        """
+        [(商品, 指标)]，product_ids 为空时计算全部商品，查询次数与商品数无关。
+        lock=True 时先按 id 顺序对商品行 SELECT ... FOR UPDATE，之后的流水/成本查询读到的是拿到锁之后的已提交数据。
+        """
+        q = self.db.query(Product).options(selectinload(Product.colors).selectinload(ProductColor.parts))
+        if product_ids is not None:
+            q = q.filter(Product.id.in_(product_ids))
+        if lock:
+            q = q.with_for_update(of=Product)
+        products = q.order_by(Product.id).all()
+        if not products: return []
+        names = [p.name for p in products]
+        sums = self._grouped_log_sums(names)
+        consumed_q = self.db.query(InventoryLog.product_name, func.sum(func.abs(InventoryLog.change_amount))).filter(
+            InventoryLog.reason == StockLogReason.OUT_STOCK,
+            InventoryLog.part_name == None,
+            InventoryLog.note.like("%消耗%")
+        )
+        if product_ids is not None:
+            consumed_q = consumed_q.filter(InventoryLog.product_name.in_(names))
+        consumed = dict(consumed_q.group_by(InventoryLog.product_name).all())
+        totals = CostRollupService(self.db).get_totals_by_product(None if product_ids is None else [p.id for p in products])
+
+        result = []
+        for prod in products:
+            p_sums = sums.get(prod.name, {})
+            stats = {
+                c.color_name: self._variant_part_stats(c.quantity, {pt.part_name: pt.quantity for pt in c.parts}, p_sums.get(c.color_name, {}))
+                for c in prod.colors
+            }
+            result.append((prod, self._derive_metrics(prod, stats, consumed.get(prod.name) or 0, totals.get(prod.id, 0.0))))
+        return result
+
+    def sync_product_metrics(self, product_id):
+        self.sync_products_metrics([product_id])
+
+    @profiled()
+    def sync_products_metrics(self, product_ids):
+        """
+        🚀 重算一批商品的可销售数量、大货资产与在制资产冲销。
+        商品/流水/成本/资产科目/快照均按批一次取回，多商品订单的发货、售后不再按商品逐个查询。
+        前台事务与后台同步队列 (metrics_sync_queue) 都走这里：先锁商品行再读流水、锁资产科目再改写，
+        同一商品的两次重算串行执行，后提交的一方基于先提交的数据计算，不会用旧值覆盖新值。
+        """
+        product_ids = {pid for pid in product_ids if pid}
+        if not product_ids: return
+        batch = self._compute_metrics_batch(product_ids, lock=True)
+        if not batch: return
+
+        # 两类资产科目 (大货资产- / 在制资产冲销-) 一次取回，再按与逐个查询相同的条件分给各商品
+        prefixes = (AssetPrefix.STOCK, AssetPrefix.WIP_OFFSET)
+        names = [f"{prefix}{prod.name}" for prod, _ in batch for prefix in prefixes]
+        balance_items = self.db.query(CompanyBalanceItem).filter(
             or_(
-                (CompanyBalanceItem.product_id == prod.id) & CompanyBalanceItem.name.like(f"{AssetPrefix.STOCK}%"),
-                CompanyBalanceItem.name == asset_name
+                CompanyBalanceItem.product_id.in_(product_ids) & or_(*[CompanyBalanceItem.name.like(f"{prefix}%") for prefix in prefixes]),
+                CompanyBalanceItem.name.in_(names)
             ),
             CompanyBalanceItem.category == BalanceCategory.ASSET
-        ).all()
-        
-        if asset_val > 0.01:
+        ).order_by(CompanyBalanceItem.id).with_for_update().all()
+        history = CostHistoryService(self.db)
+        last_snapshots = history.get_latest_snapshots(product_ids)
+
+        for prod, m in batch:
+            prod.marketable_quantity = m["marketable_quantity"]
+            # 大货资产只保留正值，在制资产冲销按绝对值判断是否归零
+            for prefix, value, keep in (
+                (AssetPrefix.STOCK, m["stock_value"], m["stock_value"] > 0.01),
+                (AssetPrefix.WIP_OFFSET, m["wip_offset"], abs(m["wip_offset"]) > 0.01),
+            ):
+                asset_name = f"{prefix}{prod.name}"
+                items = [
+                    i for i in balance_items
+                    if (i.product_id == prod.id and (i.name or "").startswith(prefix)) or i.name == asset_name
+                ]
+                self._apply_metric_asset(prod, asset_name, value, keep, items)
+
+            # ✨ 追加单价/估值快照 (数值未变化时跳过)，供历史单价与销售成本查询
+            history.record(prod, m["unit_cost"], m["actual_stock"], m["stock_value"], m["wip_offset"], m["total_cost"],
+                           last=last_snapshots.get(prod.id))
+
+        self.db.flush()
+
+    def _apply_metric_asset(self, prod, asset_name, value, keep, items):
+        """实时更新大货资产 / 在制资产冲销：保留第一条并清理重复的老数据，keep 为假时删除 (关联财务流水的除外)"""
+        if keep:
             if items:
                 main_item = items[0]
-                main_item.amount = asset_val
-                main_item.name = asset_name 
-                main_item.product_id = prod.id 
-                
+                main_item.amount = value
+                main_item.name = asset_name
+                main_item.product_id = prod.id
+
                 for orphan in items[1:]:
                     self.db.delete(orphan)
             else:
                 self.db.add(CompanyBalanceItem(
-                    name=asset_name, amount=asset_val, category=BalanceCategory.ASSET, 
+                    name=asset_name, amount=value, category=BalanceCategory.ASSET,
                     currency=Currency.CNY, asset_type="资产", product_id=prod.id
                 ))
         else:
             for item in items:
                 if not item.finance_record_id:
                     self.db.delete(item)
-                
-        # 5. 实时动态核算在制资产冲销 (WIP_OFFSET)
-        if prod.is_production_completed:
-            wip_offset_val = -total_cost
-        else:
-            produced_qty = sum(s.get("produced", 0) for s in stats.values())
-            wip_offset_val = -(produced_qty * unit_cost)
-            
-        offset_name = f"{AssetPrefix.WIP_OFFSET}{prod.name}"
-        
-        offset_items = self.db.query(CompanyBalanceItem).filter(
-            or_(
-                (CompanyBalanceItem.product_id == prod.id) & CompanyBalanceItem.name.like(f"{AssetPrefix.WIP_OFFSET}%"),
-                CompanyBalanceItem.name == offset_name
-            ),
-            CompanyBalanceItem.category == BalanceCategory.ASSET
-        ).all()
-        
-        if abs(wip_offset_val) > 0.01:
-            if offset_items:
-                main_offset = offset_items[0]
-                main_offset.amount = wip_offset_val
-                main_offset.name = offset_name 
-                main_offset.product_id = prod.id 
-                
-                for orphan in offset_items[1:]:
-                    self.db.delete(orphan)
-            else:
-                self.db.add(CompanyBalanceItem(
-                    name=offset_name, amount=wip_offset_val, category=BalanceCategory.ASSET, 
-                    currency=Currency.CNY, asset_type="资产", product_id=prod.id
-                ))
-        else:
-            for offset_item in offset_items:
-                if not offset_item.finance_record_id:
-                    self.db.delete(offset_item)
-                
-        self.db.flush()
 
     # ================= 2. 基础获取 =================
     def get_all_products(self):
@@ -145,6 +277,8 @@ class InventoryService:
         wh = self.db.query(Warehouse).filter(Warehouse.id == warehouse_id).first()
         if wh:
             self.db.delete(wh)
+            # 流水的 warehouse_id 会被数据库置空 (不经过 ORM)，按仓库拆分的快照全部作废
+            self.db.query(InventoryStockCheckpoint).delete(synchronize_session=False)
             self.db.commit()
 
     def get_warehouse_inventory_details(self):
@@ -165,7 +299,7 @@ class InventoryService:
             w_id = l.warehouse_id
             if w_id not in wh_dict: continue
 
-            if l.reason not in [StockLogReason.INSPECT_COMPLETED, StockLogReason.OTHER_IN, StockLogReason.OUT_STOCK, StockLogReason.IN_STOCK, StockLogReason.RETURN_IN, StockLogReason.TRANSFER]:
+            if l.reason not in WAREHOUSE_STOCK_REASONS:
                 continue
 
             delta = l.change_amount
@@ -187,173 +321,439 @@ class InventoryService:
         return wh_dict
 
     # ================= 4. 部件维度的整体库存计算 =================
+    @staticmethod
+    def _variant_part_stats(planned, parts_req, sums):
+        """
+        单个款式的部件库存统计。sums: {(部件名或 None, 变动类型): 变动合计}，
+        各统计量都是流水的线性累加，按分组合计计算与逐条累加结果一致。
+        """
+        if not parts_req:
+            parts_req = {"整套": 1}
+
+        part_actual = {p: 0 for p in parts_req}
+        part_inspecting = {p: 0 for p in parts_req}
+        part_produced = {p: 0 for p in parts_req}
+
+        for (part_name, reason), delta in sums.items():
+            l_parts = []
+            if part_name and part_name in parts_req:
+                l_parts = [(part_name, delta)]
+            elif not part_name: 
+                l_parts = [(p, delta * req) for p, req in parts_req.items()]
+
+            for p, d in l_parts:
+                if reason == StockLogReason.IN_INSPECT:
+                    part_inspecting[p] += d
+                elif reason == StockLogReason.INSPECT_COMPLETED:
+                    part_inspecting[p] -= d
+                    part_actual[p] += d
+                    part_produced[p] += d 
+                elif reason == StockLogReason.OUT_STOCK:
+                    part_actual[p] += d   
+                elif reason in [StockLogReason.OTHER_IN, StockLogReason.IN_STOCK, StockLogReason.RETURN_IN, StockLogReason.TRANSFER]:
+                    part_actual[p] += d
+                    if reason == StockLogReason.IN_STOCK:
+                        part_produced[p] += d
+
+        def calc_sets(pool):
+            if not parts_req: return 0
+            return min(max(0, pool[p]) // req for p, req in parts_req.items()) if pool else 0
+
+        actual_sets = calc_sets(part_actual)
+        inspecting_sets = calc_sets(part_inspecting)
+        produced_sets = calc_sets(part_produced)
+
+        excess = {}
+        for p, req in parts_req.items():
+            exc = part_actual[p] - (actual_sets * req)
+            if exc > 0:
+                excess[p] = exc
+
+        return {
+            "planned": planned,
+            "produced": produced_sets,
+            "inspecting": inspecting_sets,
+            "actual": actual_sets,
+            "excess": excess
+        }
+
+    def _grouped_log_sums(self, product_names):
+        """{商品名: {款式: {(部件名, 变动类型): 变动合计}}}，单次分组查询"""
+        rows = self.db.query(
+            InventoryLog.product_name, InventoryLog.variant, InventoryLog.part_name, InventoryLog.reason, func.sum(InventoryLog.change_amount)
+        ).filter(InventoryLog.product_name.in_(product_names)).group_by(
+            InventoryLog.product_name, InventoryLog.variant, InventoryLog.part_name, InventoryLog.reason
+        ).all()
+        sums = {}
+        for p_name, v_name, part_name, reason, total in rows:
+            sums.setdefault(p_name, {}).setdefault(v_name, {})[(part_name, reason)] = total or 0
+        return sums
+
     def get_stock_overview_by_parts(self, product_id, product_name):
-        product = self.db.query(Product).filter(Product.id == product_id).first()
-        logs = self.db.query(InventoryLog).filter(InventoryLog.product_name == product_name).all()
+        product = self.db.query(Product).options(
+            selectinload(Product.colors).selectinload(ProductColor.parts)
+        ).filter(Product.id == product_id).first()
+        sums = self._grouped_log_sums([product_name]).get(product_name, {})
 
         stats = {}
         for c in product.colors:
-            v_name = c.color_name
             parts_req = {p.part_name: p.quantity for p in c.parts}
-            if not parts_req:
-                parts_req = {"整套": 1}
-
-            part_actual = {p: 0 for p in parts_req}
-            part_inspecting = {p: 0 for p in parts_req}
-            part_produced = {p: 0 for p in parts_req}
-
-            v_logs = [l for l in logs if l.variant == v_name]
-            for l in v_logs:
-                delta = l.change_amount
-                l_parts = []
-                if l.part_name and l.part_name in parts_req:
-                    l_parts = [(l.part_name, delta)]
-                elif not l.part_name: 
-                    l_parts = [(p, delta * req) for p, req in parts_req.items()]
-
-                for p, d in l_parts:
-                    if l.reason == StockLogReason.IN_INSPECT:
-                        part_inspecting[p] += d
-                    elif l.reason == StockLogReason.INSPECT_COMPLETED:
-                        part_inspecting[p] -= d
-                        part_actual[p] += d
-                        part_produced[p] += d 
-                    elif l.reason == StockLogReason.OUT_STOCK:
-                        part_actual[p] += d   
-                    elif l.reason in [StockLogReason.OTHER_IN, StockLogReason.IN_STOCK, StockLogReason.RETURN_IN, StockLogReason.TRANSFER]:
-                        part_actual[p] += d
-                        if l.reason == StockLogReason.IN_STOCK:
-                            part_produced[p] += d
-
-            def calc_sets(pool):
-                if not parts_req: return 0
-                return min(max(0, pool[p]) // req for p, req in parts_req.items()) if pool else 0
-
-            actual_sets = calc_sets(part_actual)
-            inspecting_sets = calc_sets(part_inspecting)
-            produced_sets = calc_sets(part_produced)
-
-            excess = {}
-            for p, req in parts_req.items():
-                exc = part_actual[p] - (actual_sets * req)
-                if exc > 0:
-                    excess[p] = exc
-
-            stats[v_name] = {
-                "planned": c.quantity,
-                "produced": produced_sets,
-                "inspecting": inspecting_sets,
-                "actual": actual_sets,
-                "excess": excess
-            }
+            stats[c.color_name] = self._variant_part_stats(c.quantity, parts_req, sums.get(c.color_name, {}))
         return stats
 
+    # ================= 4.1 批量库存汇总 (Bot 搜库存 / 产品详情) =================
+    def get_stock_summary(self, product_ids):
+        """
+        多个商品的现货与预入库，口径与库存页 (get_stock_overview_by_parts) 相同：按部件统计后折算成套数。
+        {product_id: {"name", "real": {款式: 套数}, "pre": {款式: 套数}, "total_real", "total_pre"}}
+        预入库 = 仍在验收中的套数 (入库验收 - 验收完成入库)。固定 4 次查询 (商品/款式/部件 + 流水分组合计)。
+        """
+        products = self.db.query(Product).options(
+            selectinload(Product.colors).selectinload(ProductColor.parts)
+        ).filter(Product.id.in_(product_ids)).all()
+        summary = {p.id: {"name": p.name, "real": {}, "pre": {}, "total_real": 0, "total_pre": 0} for p in products}
+        if not summary: return summary
+        sums = self._grouped_log_sums([p.name for p in products])
+
+        for prod in products:
+            entry, p_sums = summary[prod.id], sums.get(prod.name, {})
+            for c in prod.colors:
+                stats = self._variant_part_stats(c.quantity, {pt.part_name: pt.quantity for pt in c.parts}, p_sums.get(c.color_name, {}))
+                entry["real"][c.color_name] = stats["actual"]
+                entry["pre"][c.color_name] = stats["inspecting"]
+                entry["total_real"] += stats["actual"]
+                entry["total_pre"] += stats["inspecting"]
+        return summary
+
+    # ================= 4.2 历史库存 (时点查询 / 走势) =================
+    def _archive_cutoff(self):
+        """最近一次流水归档的截止日 (不含)，未归档过时为 None"""
+        return self.db.query(func.max(InventoryLogArchive.archive_cutoff)).scalar()
+
+    def _stock_log_source(self, as_of):
+        """
+        查询 as_of 及之后的库存时，主表 (含期初结转行) 即可得到精确结果；
+        查询归档截止日之前的时点时，改为 主表 + 归档表 的原始流水 (排除期初结转行)。
+        返回 (流水列集合, 可用快照的最早日期)
+        """
+        cutoff = self._archive_cutoff()
+        if not cutoff:
+            return InventoryLog, None
+        if as_of >= cutoff:
+            # 早于截止日的快照与期初结转行会重复计数，只能使用截止日前一日及之后的快照
+            return InventoryLog, cutoff - timedelta(days=1)
+
+        cols = ["product_name", "variant", "warehouse_id", "part_name", "reason", "change_amount", "date"]
+        hot = select(*[getattr(InventoryLog, c) for c in cols]).where(or_(InventoryLog.is_opening == None, InventoryLog.is_opening == False))
+        archived = select(*[getattr(InventoryLogArchive, c) for c in cols]).where(
+            or_(InventoryLogArchive.is_opening == None, InventoryLogArchive.is_opening == False)
+        )
+        return union_all(hot, archived).subquery("stock_logs").c, None
+
+    def _latest_checkpoint_date(self, on_or_before, not_before=None):
+        q = self.db.query(func.max(InventoryStockCheckpoint.checkpoint_date)).filter(
+            InventoryStockCheckpoint.checkpoint_date <= on_or_before
+        )
+        if not_before: q = q.filter(InventoryStockCheckpoint.checkpoint_date >= not_before)
+        return q.scalar()
+
+    def _stock_log_filters(self, src, product_name=None, variant=None, warehouse_id=None):
+        filters = [src.reason.in_(WAREHOUSE_STOCK_REASONS)]
+        if product_name: filters.append(src.product_name == product_name)
+        if variant: filters.append(src.variant == variant)
+        if warehouse_id: filters.append(src.warehouse_id == warehouse_id)
+        return filters
+
+    def _checkpoint_filters(self, cp_date, product_name=None, variant=None, warehouse_id=None):
+        filters = [InventoryStockCheckpoint.checkpoint_date == cp_date]
+        if product_name: filters.append(InventoryStockCheckpoint.product_name == product_name)
+        if variant: filters.append(InventoryStockCheckpoint.variant == variant)
+        if warehouse_id: filters.append(InventoryStockCheckpoint.warehouse_id == warehouse_id)
+        return filters
+
+    def _parts_req_map(self, product_names=None):
+        """{商品名: {款式: {部件名: 配比}}} (没有部件的款式为空字典)"""
+        q = self.db.query(Product).options(selectinload(Product.colors).selectinload(ProductColor.parts))
+        if product_names is not None: q = q.filter(Product.name.in_(product_names))
+        return {p.name: {c.color_name: {pt.part_name: pt.quantity for pt in c.parts} for c in p.colors} for p in q.all()}
+
+    def _stock_part_sums(self, as_of, product_name=None):
+        """
+        as_of 当日收盘时 商品 × 款式 × 仓库 × 部件 的现货流水累计 (部件为 None 表示整套流水)。
+        从 as_of 之前最近的快照起，只累加其后的流水。返回 {(商品, 款式, 仓库, 部件): 数量}
+        """
+        src, cp_not_before = self._stock_log_source(as_of)
+        cp_date = self._latest_checkpoint_date(as_of, cp_not_before)
+        totals = {}
+
+        if cp_date:
+            for p_name, v_name, wh_id, part, qty in self.db.query(
+                InventoryStockCheckpoint.product_name, InventoryStockCheckpoint.variant,
+                InventoryStockCheckpoint.warehouse_id, InventoryStockCheckpoint.part_name, InventoryStockCheckpoint.quantity
+            ).filter(*self._checkpoint_filters(cp_date, product_name)).all():
+                totals[(p_name, v_name, wh_id, part)] = qty or 0
+
+        log_q = self.db.query(
+            src.product_name, src.variant, src.warehouse_id, src.part_name, func.sum(src.change_amount)
+        ).filter(*self._stock_log_filters(src, product_name), src.date <= as_of)
+        if cp_date: log_q = log_q.filter(src.date > cp_date)
+        for p_name, v_name, wh_id, part, qty in log_q.group_by(src.product_name, src.variant, src.warehouse_id, src.part_name).all():
+            key = (p_name, v_name, wh_id, part)
+            totals[key] = totals.get(key, 0) + int(qty or 0)
+        return totals
+
+    def get_stock_snapshot(self, as_of, product_name=None):
+        """
+        时点库存：as_of 当日收盘时各 商品 × 款式 × 仓库 的现货套数 (如年末盘点估值)。
+        口径与库存页一致：整套与部件流水都计入，按部件配比折算成套数 (按仓库分别折算)。
+        返回 DataFrame: product_name, variant, warehouse_id, quantity (已去掉 0 库存行)
+        """
+        import pandas as pd
+        cols = ["product_name", "variant", "warehouse_id", "quantity"]
+        by_variant = {}
+        for (p_name, v_name, wh_id, part), qty in self._stock_part_sums(as_of, product_name).items():
+            parts = by_variant.setdefault((p_name, v_name, wh_id), {})
+            parts[part] = parts.get(part, 0) + qty
+        req_map = self._parts_req_map(sorted({k[0] for k in by_variant}))
+
+        rows = []
+        for (p_name, v_name, wh_id), part_sums in by_variant.items():
+            qty = _sets_from_parts(req_map.get(p_name, {}).get(v_name), part_sums)
+            if qty != 0: rows.append((p_name, v_name, wh_id, qty))
+        return pd.DataFrame(rows, columns=cols).sort_values(cols[:2], kind="stable").reset_index(drop=True)
+
+    def build_stock_checkpoint(self, as_of):
+        """
+        生成 as_of 收盘时的库存快照 (覆盖同日旧快照)，之后的历史查询不再扫描该日及之前的流水。
+        快照保存部件维度的流水累计 (不折算成套数)，商品部件配比调整后历史查询仍然准确。
+        只允许对今天之前的日期建快照；早于快照日期的流水变动会自动作废快照。
+        返回写入行数
+        """
+        if as_of >= date.today():
+            raise ValueError("只能为今天之前的日期生成库存快照")
+        sums = self._stock_part_sums(as_of)
+        self.db.query(InventoryStockCheckpoint).filter(
+            InventoryStockCheckpoint.checkpoint_date == as_of
+        ).delete(synchronize_session=False)
+        rows = [
+            dict(checkpoint_date=as_of, product_name=p_name, variant=v_name, warehouse_id=wh_id, part_name=part, quantity=int(qty))
+            for (p_name, v_name, wh_id, part), qty in sums.items() if qty != 0
+        ]
+        self.db.bulk_insert_mappings(InventoryStockCheckpoint, rows)
+        self.db.commit()
+        return len(rows)
+
+    def get_stock_checkpoints(self):
+        """已有快照: [(日期, 行数)]，按日期倒序"""
+        return self.db.query(
+            InventoryStockCheckpoint.checkpoint_date, func.count(InventoryStockCheckpoint.id)
+        ).group_by(InventoryStockCheckpoint.checkpoint_date).order_by(InventoryStockCheckpoint.checkpoint_date.desc()).all()
+
+    def get_stock_history(self, product_id, variant=None, warehouse_id=None, start=None, end=None, granularity="day"):
+        """
+        商品 (可选款式/仓库) 在 [start, end] 区间内每日或每周收盘时的现货套数，口径与库存页一致
+        (整套与部件流水都计入，按部件配比折算成套数)。
+        按 款式 × 部件 逐日汇总流水后用 SUM() OVER (PARTITION BY 款式, 部件 ORDER BY date) 在数据库端求累计和，
+        期初数取自最近的快照；区间早于归档截止日时自动合并归档表。
+        granularity: "day" 逐日；"week" 每周最后一天 (区间末尾不足一周时取 end)
+        返回 DataFrame: date, stock
+        """
+        import pandas as pd
+        end = end or date.today()
+        start = start or (end - timedelta(days=90))
+        if start > end: start, end = end, start
+
+        prod = self.db.query(Product).options(
+            selectinload(Product.colors).selectinload(ProductColor.parts)
+        ).filter(Product.id == product_id).first()
+        if not prod: return pd.DataFrame(columns=["date", "stock"])
+        parts_req = {c.color_name: {pt.part_name: pt.quantity for pt in c.parts} for c in prod.colors}
+        variants = [variant] if variant else list(parts_req)
+        if not variants: return pd.DataFrame(columns=["date", "stock"])
+
+        # 1. 期初：start 前一日及之前最近的快照 {(款式, 部件): 数量}，整套流水的部件记为 ''
+        src, cp_not_before = self._stock_log_source(start - timedelta(days=1))
+        cp_date = self._latest_checkpoint_date(start - timedelta(days=1), cp_not_before)
+        opening = {}
+        if cp_date:
+            for v_name, part, qty in self.db.query(
+                InventoryStockCheckpoint.variant, InventoryStockCheckpoint.part_name, func.sum(InventoryStockCheckpoint.quantity)
+            ).filter(
+                *self._checkpoint_filters(cp_date, prod.name, variant, warehouse_id), InventoryStockCheckpoint.variant.in_(variants)
+            ).group_by(InventoryStockCheckpoint.variant, InventoryStockCheckpoint.part_name).all():
+                opening[(v_name, part or "")] = int(qty or 0)
+
+        # 2. 快照之后到 end 的逐日累计 (窗口函数，按 款式 × 部件 分别累计)
+        daily_delta = func.sum(src.change_amount)
+        cumulative = func.sum(daily_delta).over(partition_by=[src.variant, src.part_name], order_by=src.date)
+        q = self.db.query(src.date, src.variant, src.part_name, cumulative).filter(
+            *self._stock_log_filters(src, prod.name, variant, warehouse_id), src.variant.in_(variants), src.date <= end
+        )
+        if cp_date: q = q.filter(src.date > cp_date)
+        rows = q.group_by(src.date, src.variant, src.part_name).order_by(src.date).all()
+
+        # 3. 补齐无流水的日期：各 款式 × 部件 沿用前一个有流水日期的累计数
+        days = pd.date_range(start, end, freq="D")
+        if rows:
+            df = pd.DataFrame(rows, columns=["date", "variant", "part", "cum"])
+            df["date"] = pd.to_datetime(df["date"])
+            df["part"] = df["part"].fillna("")
+            levels = df.pivot(index="date", columns=["variant", "part"], values="cum")
+            levels = levels.reindex(levels.index.union(days)).sort_index().ffill().fillna(0).loc[days[0]:days[-1]]
+        else:
+            levels = pd.DataFrame(index=days)
+
+        def level(v_name, part):
+            base = levels[(v_name, part)] if (v_name, part) in levels.columns else pd.Series(0.0, index=days)
+            return base + opening.get((v_name, part), 0)
+
+        # 4. 逐日折算成套数：各部件 (整套流水按配比展开) 可凑成的最少套数，再对款式求和
+        stock = pd.Series(0, index=days, dtype="int64")
+        for v_name in variants:
+            req_map = parts_req.get(v_name) or {"整套": 1}
+            whole = level(v_name, "")
+            v_sets = None
+            for part, req in req_map.items():
+                sets = ((level(v_name, part) + whole * req).clip(lower=0) // req).astype("int64")
+                v_sets = sets if v_sets is None else v_sets.where(v_sets <= sets, sets)
+            stock += v_sets
+        series = stock
+
+        if granularity == "week":
+            series = series.groupby(series.index.to_period("W")).tail(1)
+
+        return pd.DataFrame({"date": series.index.date, "stock": series.to_numpy()})
+
     # ================= 5. 库存变动提交 =================
+    def _get_warehouse_part_stock(self, warehouse_id, product_name, colors):
+        """
+        单个仓库内某商品各款式的部件级物理库存 {款式: {部件: 数量}}，
+        口径与 get_warehouse_inventory_details 相同，但只做一次按 款式/部件 分组的 SQL 汇总。
+        """
+        req_map = {c.color_name: ({p.part_name: p.quantity for p in c.parts} if c.parts else {"整套": 1}) for c in colors}
+        rows = self.db.query(InventoryLog.variant, InventoryLog.part_name, func.sum(InventoryLog.change_amount)).filter(
+            InventoryLog.product_name == product_name,
+            InventoryLog.warehouse_id == warehouse_id,
+            InventoryLog.reason.in_(WAREHOUSE_STOCK_REASONS)
+        ).group_by(InventoryLog.variant, InventoryLog.part_name).all()
+
+        stock = {}
+        for v_name, part, qty in rows:
+            v_stock = stock.setdefault(v_name, {})
+            parts_delta = [(part, qty)] if part else [(pt, qty * req) for pt, req in req_map.get(v_name, {"整套": 1}).items()]
+            for pt, d in parts_delta:
+                v_stock[pt] = v_stock.get(pt, 0) + int(d or 0)
+        return stock
+
     def add_inventory_movement(self, product_id, product_name, variant, quantity, 
                                move_type, date_obj, remark, warehouse_id=None, to_warehouse_id=None, 
                                is_set=True, part_name=None,
                                out_type=None, cons_cat=None, cons_content=None):
-        
+        return self.add_inventory_movements(
+            product_id, product_name, [{"variant": variant, "quantity": quantity, "part_name": None if is_set else part_name}],
+            move_type, date_obj, remark, warehouse_id=warehouse_id, to_warehouse_id=to_warehouse_id,
+            out_type=out_type, cons_cat=cons_cat, cons_content=cons_content
+        )
+
+    def add_inventory_movements(self, product_id, product_name, lines, move_type, date_obj, remark,
+                                warehouse_id=None, to_warehouse_id=None, out_type=None, cons_cat=None, cons_content=None):
+        """
+        🚀 整单录入：一张入库单 / 出库单 / 调拨单包含多个款式或部件。
+        lines: [{"variant": 款式, "quantity": 数量, "part_name": 部件 (None 为整套)}]
+        出库与移库基于同一份仓库库存快照统一校验 (同一部件的多行需求合并计算)，
+        流水一次性写入，商品指标只同步一次。不提交事务，由调用方 commit。
+        """
+        lines = [l for l in lines if l.get("quantity")]
+        if not lines: raise ValueError("没有需要录入的数量")
+        if any(l["quantity"] < 0 for l in lines): raise ValueError("数量不能为负数")
+        if move_type == StockLogReason.TRANSFER and warehouse_id == to_warehouse_id:
+            raise ValueError("移出仓库和移入仓库不能相同！")
+
         target_prod_obj = self.db.query(Product).filter(Product.id == product_id).first()
-        
-        # ✨ 核心修复：执行出库和库存移动前的严格库存校验
+        wh_from_name = self.db.query(Warehouse.name).filter(Warehouse.id == warehouse_id).scalar() if warehouse_id else None
+        wh_from_name = wh_from_name or "未分配仓库"
+
+        # ✨ 核心修复：执行出库和库存移动前的严格库存校验 (整单共用一份快照)
         if move_type in [StockLogReason.OUT_STOCK, StockLogReason.TRANSFER]:
-            wh_details = self.get_warehouse_inventory_details()
-            
-            # 解析本次操作具体扣减了哪些底层部件
-            parts_to_check = {}
-            if is_set:
-                target_c = next((c for c in target_prod_obj.colors if c.color_name == variant), None) if target_prod_obj else None
-                if target_c and target_c.parts:
-                    for p in target_c.parts:
-                        parts_to_check[p.part_name] = quantity * p.quantity
+            prod_colors = target_prod_obj.colors if target_prod_obj else []
+            colors = {c.color_name: c for c in prod_colors}
+            required = {}
+            for l in lines:
+                target_c = colors.get(l["variant"])
+                if l.get("part_name"):
+                    parts_to_check = {l["part_name"]: l["quantity"]}
+                elif target_c and target_c.parts:
+                    parts_to_check = {p.part_name: l["quantity"] * p.quantity for p in target_c.parts}
                 else:
-                    parts_to_check["整套"] = quantity
-            else:
-                parts_to_check[part_name] = quantity
-                
-            # 获取目标仓库的物理库存快照
-            stock_in_wh = wh_details.get(warehouse_id, {}).get("stock", {}).get(product_name, {}).get(variant, {})
-            wh_name = wh_details.get(warehouse_id, {}).get("name", "未分配仓库")
-            
-            # 逐个部件进行校验
-            for pt, req_qty in parts_to_check.items():
-                avail_qty = stock_in_wh.get(pt, 0)
-                if avail_qty < req_qty:
-                    raise ValueError(f"库存不足！【{product_name}-{variant}】的部件【{pt}】在【{wh_name}】中仅剩 {avail_qty} 件，无法执行扣减 {req_qty} 件的操作。")
+                    parts_to_check = {"整套": l["quantity"]}
+                for pt, qty in parts_to_check.items():
+                    required[(l["variant"], pt)] = required.get((l["variant"], pt), 0) + qty
 
-        actual_change_amt = -quantity if move_type == StockLogReason.OUT_STOCK else quantity
+            stock_in_wh = self._get_warehouse_part_stock(warehouse_id, product_name, prod_colors)
+            for (v_name, pt), req_qty in required.items():
+                avail_qty = stock_in_wh.get(v_name, {}).get(pt, 0)
+                if avail_qty < req_qty:
+                    raise ValueError(f"库存不足！【{product_name}-{v_name}】的部件【{pt}】在【{wh_from_name}】中仅剩 {avail_qty} 件，无法执行扣减 {req_qty} 件的操作。")
 
+        new_logs = []
         if move_type == StockLogReason.TRANSFER:
-            if warehouse_id == to_warehouse_id:
-                raise ValueError("移出仓库和移入仓库不能相同！")
-            
             # 优化流水备注：清晰写明移入移出仓库的名字
-            wh_from_name = wh_details.get(warehouse_id, {}).get("name", "未分配仓库")
             wh_to_name = self.db.query(Warehouse).filter(Warehouse.id == to_warehouse_id).first().name if to_warehouse_id else "未分配仓库"
-            
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=-quantity,
-                reason=StockLogReason.TRANSFER, note=f"移出至【{wh_to_name}】 | {remark}", date=date_obj,
-                warehouse_id=warehouse_id, part_name=None if is_set else part_name
-            ))
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=quantity,
-                reason=StockLogReason.TRANSFER, note=f"从【{wh_from_name}】移入 | {remark}", date=date_obj,
-                warehouse_id=to_warehouse_id, part_name=None if is_set else part_name
-            ))
+            for l in lines:
+                new_logs.append(InventoryLog(
+                    product_name=product_name, variant=l["variant"], change_amount=-l["quantity"],
+                    reason=StockLogReason.TRANSFER, note=f"移出至【{wh_to_name}】 | {remark}", date=date_obj,
+                    warehouse_id=warehouse_id, part_name=l.get("part_name")
+                ))
+                new_logs.append(InventoryLog(
+                    product_name=product_name, variant=l["variant"], change_amount=l["quantity"],
+                    reason=StockLogReason.TRANSFER, note=f"从【{wh_from_name}】移入 | {remark}", date=date_obj,
+                    warehouse_id=to_warehouse_id, part_name=l.get("part_name")
+                ))
             msg = "库存移动成功（生成一进一出两笔记录）"
 
         elif move_type == StockLogReason.OUT_STOCK:
-            target_cost_id = None
-            if out_type == "消耗" and target_prod_obj and is_set:
-                new_cost = CostItem(
-                    product_id=product_id, item_name=cons_content, actual_cost=0, supplier="", category=cons_cat,      
-                    unit_price=0, quantity=0, unit="", remarks=f"款式:{variant} 数量:{quantity} | {remark}"
-                )
-                self.db.add(new_cost)
-                self.db.flush() 
-                target_cost_id = new_cost.id
-
             log_note = f"消耗: {cons_content} | {remark}" if out_type == "消耗" else f"出库: {remark}"
-            
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=actual_change_amt,
-                reason=StockLogReason.OUT_STOCK, note=log_note, is_other_out=True, date=date_obj,
-                warehouse_id=warehouse_id, part_name=None if is_set else part_name,
-                cost_item_id=target_cost_id 
-            ))
+            # 消耗出库按行各生成一条成本项，保证删除流水时能精准级联
+            cost_items = {}
+            if out_type == "消耗" and target_prod_obj:
+                for i, l in enumerate(lines):
+                    if l.get("part_name"): continue
+                    cost_items[i] = CostItem(
+                        product_id=product_id, item_name=cons_content, actual_cost=0, supplier="", category=cons_cat,      
+                        unit_price=0, quantity=0, unit="", remarks=f"款式:{l['variant']} 数量:{l['quantity']} | {remark}"
+                    )
+                self.db.add_all(cost_items.values())
+                self.db.flush()
+
+            for i, l in enumerate(lines):
+                new_logs.append(InventoryLog(
+                    product_name=product_name, variant=l["variant"], change_amount=-l["quantity"],
+                    reason=StockLogReason.OUT_STOCK, note=log_note, is_other_out=True, date=date_obj,
+                    warehouse_id=warehouse_id, part_name=l.get("part_name"),
+                    cost_item_id=cost_items[i].id if i in cost_items else None
+                ))
             msg = "出库成功"
 
-        elif move_type == StockLogReason.IN_INSPECT:
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=quantity,
-                reason=StockLogReason.IN_INSPECT, note=remark, date=date_obj,
-                warehouse_id=warehouse_id, part_name=None if is_set else part_name
-            ))
-            msg = "入库验收已录入"
-
-        elif move_type == StockLogReason.INSPECT_COMPLETED:
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=quantity,
-                reason=StockLogReason.INSPECT_COMPLETED, note=remark, date=date_obj,
-                warehouse_id=warehouse_id, part_name=None if is_set else part_name
-            ))
-            msg = "验收完成入库已录入"
-            
-        elif move_type == StockLogReason.OTHER_IN:
-            self.db.add(InventoryLog(
-                product_name=product_name, variant=variant, change_amount=quantity,
-                reason=StockLogReason.OTHER_IN, note=remark, date=date_obj,
-                warehouse_id=warehouse_id, part_name=None if is_set else part_name
-            ))
-            msg = "其他入库已录入"
+        elif move_type in [StockLogReason.IN_INSPECT, StockLogReason.INSPECT_COMPLETED, StockLogReason.OTHER_IN]:
+            for l in lines:
+                new_logs.append(InventoryLog(
+                    product_name=product_name, variant=l["variant"], change_amount=l["quantity"],
+                    reason=move_type, note=remark, date=date_obj,
+                    warehouse_id=warehouse_id, part_name=l.get("part_name")
+                ))
+            msg = {
+                StockLogReason.IN_INSPECT: "入库验收已录入",
+                StockLogReason.INSPECT_COMPLETED: "验收完成入库已录入",
+                StockLogReason.OTHER_IN: "其他入库已录入",
+            }[move_type]
         else:
             msg = "未知操作类型"
 
+        self.db.add_all(new_logs)
         self.db.flush()
         self.sync_product_metrics(product_id)
-        return msg
+        return msg if len(lines) == 1 else f"{msg} (共 {len(lines)} 行)"
 
     def commit(self):
         self.db.commit()
@@ -380,6 +780,9 @@ class InventoryService:
         log_to_del = self.db.query(InventoryLog).filter(InventoryLog.id == log_id).first()
         if not log_to_del: raise ValueError("记录不存在")
 
+        if log_to_del.is_opening:
+            raise ValueError("拒绝操作：此记录为流水归档生成的【期初结转】，代表截止日前的历史累计，不能单独删除。")
+
         if getattr(log_to_del, 'order_id', None):
             raise ValueError("拒绝操作：此库存变动由【销售订单】自动生成。为了保证数据一致性，请前往【线上销售管理】模块撤销发货或删除该订单。")
 
@@ -439,8 +842,7 @@ class InventoryService:
         from services.cost_service import CostService
         cost_service = CostService(self.db)
         current_offset = cost_service.get_wip_offset(product_id)
-        all_items = self.db.query(CostItem).filter(CostItem.product_id == product_id).all()
-        current_total_cost = sum([i.actual_cost for i in all_items])
+        current_total_cost = CostRollupService(self.db).get_total_actual(product_id)
         return current_total_cost + current_offset
 
     def clear_wip_for_product(self, product_id):
@@ -0,0 +1,205 @@
+# services/job_runner.py
+"""
+后台任务：Excel 导入、全量备份 / 恢复、测试沙盒克隆、汇总表重建等耗时操作不再在 Streamlit 脚本线程里
+转圈等待，而是提交到进程内的线程池执行，浏览器断开或切换页面都不会中断。
+任务状态、进度、结果摘要与异常堆栈写入本地运行库 (services/metrics_store.BackgroundJob)，
+侧边栏的「后台任务」面板 (views/job_view) 轮询显示。
+
+    YURARA_JOB_WORKERS=2          同时执行的任务数
+    YURARA_JOB_DIR=yurara_jobs    产出文件 (备份 ZIP 等) 存放目录
+    YURARA_JOB_KEEP=200           任务记录保留条数 (超出的连同产出文件一起删除)
+
+任务函数的第一个参数是 JobContext，用 ctx.progress(done, total, message) 汇报进度、
+ctx.save_file(data, file_name) 保存产出文件；返回值保留在进程内存中 (job_runner.result)，
+返回字符串时同时作为完成摘要落库。进程重启时未完成的任务标记为 interrupted。
+"""
+import os
+import time
+import threading
+import traceback
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+from services.metrics_store import BackgroundJob, metrics_session
+
+JOB_WORKERS = int(os.getenv("YURARA_JOB_WORKERS", "2"))
+JOB_DIR = os.getenv("YURARA_JOB_DIR", "yurara_jobs")
+JOB_KEEP = int(os.getenv("YURARA_JOB_KEEP", "200"))
+# 进度落库的最小间隔 (秒)，逐行汇报进度的任务不会把运行库写满
+PROGRESS_INTERVAL = 0.5
+
+ACTIVE_STATUSES = ("queued", "running")
+
+
+class JobContext:
+    """传给任务函数的上下文：汇报进度、保存产出文件"""
+    def __init__(self, runner, job_id):
+        self.runner = runner
+        self.job_id = job_id
+        self.summary = None
+        self._last_write = 0.0
+
+    def progress(self, done, total=None, message=None):
+        """done / total 为进度 (total 为空时 done 视为 0~1 的比例)；按 PROGRESS_INTERVAL 节流落库，最后一步总会写入"""
+        fraction = done / total if total else done
+        fraction = max(0.0, min(1.0, float(fraction or 0)))
+        now = time.monotonic()
+        if now - self._last_write < PROGRESS_INTERVAL and fraction < 1.0: return
+        self._last_write = now
+        values = {BackgroundJob.progress: fraction}
+        if message is not None: values[BackgroundJob.message] = message
+        self.runner._update(self.job_id, values)
+
+    def save_file(self, data, file_name):
+        """保存产出文件 (bytes)，完成后面板提供下载"""
+        os.makedirs(JOB_DIR, exist_ok=True)
+        path = os.path.join(JOB_DIR, f"job_{self.job_id}_{file_name}")
+        with open(path, "wb") as f:
+            f.write(data)
+        self.runner._update(self.job_id, {BackgroundJob.file_path: path, BackgroundJob.file_name: file_name})
+        return path
+
+
+class JobRunner:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._results = {}     # job_id -> 任务函数返回值 (仅本进程内)
+        self._recovered = False
+
+    # ---------- 提交与执行 ----------
+    def _ensure_ready(self):
+        with self._lock:
+            if not self._recovered:
+                self._recovered = True
+                self._mark_interrupted()
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=JOB_WORKERS, thread_name_prefix="yurara-job")
+
+    def _mark_interrupted(self):
+        """上次进程退出时尚未完成的任务不会再执行"""
+        db = metrics_session()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.status.in_(ACTIVE_STATUSES)).update(
+                {BackgroundJob.status: "interrupted", BackgroundJob.finished_at: datetime.now(),
+                 BackgroundJob.error: "进程重启，任务中断"},
+                synchronize_session=False
+            )
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ 后台任务状态恢复失败: {e}")
+        finally:
+            db.close()
+
+    def submit(self, kind, title, func, *args, env=None, created_by=None, **kwargs):
+        """登记任务并交给线程池执行，返回任务 id"""
+        self._ensure_ready()
+        db = metrics_session()
+        try:
+            job = BackgroundJob(kind=kind, title=title, status="queued", progress=0.0, env=env, created_by=created_by)
+            db.add(job)
+            db.commit()
+            job_id = job.id
+        finally:
+            db.close()
+        self._rotate()
+        self._executor.submit(self._run, job_id, func, args, kwargs)
+        return job_id
+
+    def _run(self, job_id, func, args, kwargs):
+        ctx = JobContext(self, job_id)
+        self._update(job_id, {BackgroundJob.status: "running", BackgroundJob.started_at: datetime.now()})
+        try:
+            result = func(ctx, *args, **kwargs)
+        except Exception as e:
+            print(f"⚠️ 后台任务 #{job_id} 失败: {e}")
+            self._update(job_id, {
+                BackgroundJob.status: "failed", BackgroundJob.finished_at: datetime.now(),
+                BackgroundJob.message: str(e)[:500], BackgroundJob.error: traceback.format_exc(),
+            })
+            return
+        with self._lock:
+            self._results[job_id] = result
+        summary = ctx.summary if ctx.summary is not None else (result if isinstance(result, str) else None)
+        self._update(job_id, {
+            BackgroundJob.status: "done", BackgroundJob.progress: 1.0,
+            BackgroundJob.finished_at: datetime.now(), BackgroundJob.result: summary,
+        })
+
+    def _update(self, job_id, values):
+        db = metrics_session()
+        try:
+            db.query(BackgroundJob).filter(BackgroundJob.id == job_id).update(values, synchronize_session=False)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ 后台任务 #{job_id} 状态写入失败: {e}")
+        finally:
+            db.close()
+
+    def _rotate(self):
+        """只保留最近 JOB_KEEP 条已结束的任务记录，并删除其产出文件"""
+        db = metrics_session()
+        try:
+            old = db.query(BackgroundJob).filter(~BackgroundJob.status.in_(ACTIVE_STATUSES)).order_by(
+                BackgroundJob.id.desc()
+            ).offset(JOB_KEEP).all()
+            for job in old:
+                if job.file_path and os.path.exists(job.file_path):
+                    os.remove(job.file_path)
+                with self._lock:
+                    self._results.pop(job.id, None)
+                db.delete(job)
+            db.commit()
+        except Exception as e:
+            db.rollback()
+            print(f"⚠️ 后台任务记录轮转失败: {e}")
+        finally:
+            db.close()
+
+    # ---------- 查询 ----------
+    def get(self, job_id):
+        self._ensure_ready()
+        db = metrics_session()
+        try:
+            return db.get(BackgroundJob, job_id)
+        finally:
+            db.close()
+
+    def result(self, job_id):
+        """任务函数的返回值；进程重启后为 None"""
+        with self._lock:
+            return self._results.get(job_id)
+
+    def recent(self, limit=10):
+        self._ensure_ready()
+        db = metrics_session()
+        try:
+            return db.query(BackgroundJob).order_by(BackgroundJob.id.desc()).limit(limit).all()
+        finally:
+            db.close()
+
+    def active(self, kind=None):
+        """排队中 / 执行中的任务 (可按类型筛选)"""
+        self._ensure_ready()
+        db = metrics_session()
+        try:
+            q = db.query(BackgroundJob).filter(BackgroundJob.status.in_(ACTIVE_STATUSES))
+            if kind: q = q.filter(BackgroundJob.kind == kind)
+            return q.order_by(BackgroundJob.id).all()
+        finally:
+            db.close()
+
+    def wait(self, job_id, timeout=None, poll=0.2):
+        """阻塞直到任务结束 (脚本 / 基准使用)，返回任务记录"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            job = self.get(job_id)
+            if job is None or job.status not in ACTIVE_STATUSES: return job
+            if deadline is not None and time.monotonic() > deadline: return job
+            time.sleep(poll)
+
+
+# 全局单例：同一进程内所有浏览器会话共享
+job_runner = JobRunner()
@@ -0,0 +1,87 @@
+# services/metrics_store.py
+"""
+本地运行库：页面渲染样本、慢查询日志等诊断数据，以及后台任务 (services/job_runner) 的状态。
+独立于业务库 (单独的元数据，不参与 upgrade_schema / 备份 / 测试环境克隆)，
+默认写入运行目录下的 SQLite 文件，可通过 YURARA_METRICS_DB_URL 指定。
+"""
+import os
+import threading
+from datetime import datetime
+from sqlalchemy import create_engine, Column, Integer, Float, String, DateTime, Text, Index
+from sqlalchemy.orm import declarative_base, sessionmaker
+
+METRICS_DB_URL = os.getenv("YURARA_METRICS_DB_URL", "sqlite:///yurara_metrics.db")
+
+MetricsBase = declarative_base()
+
+
+class PageRenderSample(MetricsBase):
+    __tablename__ = "page_render_samples"
+    id = Column(Integer, primary_key=True, index=True)
+    recorded_at = Column(DateTime, default=datetime.now)
+    page = Column(String)
+    env = Column(String)             # 真实 / 测试
+    status = Column(String)          # ok / 异常类名 (st.rerun 等控制流异常也会记录)
+    wall_ms = Column(Float)          # 页面函数总耗时
+    db_ms = Column(Float)            # 其中 SQL 执行耗时
+    query_count = Column(Integer)
+    cache_hits = Column(Integer)     # profiled_cache_data 命中次数
+    cache_misses = Column(Integer)
+    rows_fetched = Column(Integer, nullable=True)  # 驱动上报的 SELECT 行数 (SQLite 不上报)
+    loader_rows = Column(Integer)    # 未命中缓存的加载函数返回的行数
+    detail = Column(Text)            # JSON: 各加载函数明细与疑似 N+1 语句
+    __table_args__ = (Index("ix_page_render_samples_page_time", "page", "recorded_at"),)
+
+
+class SlowQueryLog(MetricsBase):
+    __tablename__ = "slow_query_log"
+    id = Column(Integer, primary_key=True, index=True)
+    recorded_at = Column(DateTime, default=datetime.now, index=True)
+    dialect = Column(String)         # postgresql / sqlite
+    database = Column(String)        # 库名 (测试环境为 SQLite 文件名)
+    duration_ms = Column(Float)
+    shape = Column(Text)             # 语句形状 (IN 列表折叠)，用于归并同类语句
+    statement = Column(Text)
+    parameters = Column(Text)
+    caller = Column(String)          # 发起查询的业务函数 文件:函数:行号
+    rowcount = Column(Integer, nullable=True)
+    plan = Column(Text, nullable=True)  # 同一形状按间隔抓取一次执行计划，其余记录为空
+
+
+class BackgroundJob(MetricsBase):
+    __tablename__ = "background_jobs"
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String, index=True)    # backup / restore / sandbox_clone / rebuild / order_import_parse ...
+    title = Column(String)
+    status = Column(String, index=True)  # queued / running / done / failed / interrupted
+    progress = Column(Float, default=0.0)  # 0 ~ 1
+    message = Column(String, nullable=True)   # 当前进度说明
+    result = Column(Text, nullable=True)      # 完成摘要
+    error = Column(Text, nullable=True)       # 失败时的异常与堆栈
+    file_path = Column(String, nullable=True) # 产出文件 (如备份 ZIP)
+    file_name = Column(String, nullable=True)
+    env = Column(String)             # 真实 / 测试
+    created_by = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.now, index=True)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_metrics_engine():
+    """指标库 Engine (进程内单例，首次使用时建表)"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                connect_args = {"check_same_thread": False} if METRICS_DB_URL.startswith("sqlite") else {}
+                engine = create_engine(METRICS_DB_URL, connect_args=connect_args)
+                MetricsBase.metadata.create_all(bind=engine)
+                _engine = engine
+    return _engine
+
+
+def metrics_session():
+    return sessionmaker(bind=get_metrics_engine(), autocommit=False, autoflush=False)()
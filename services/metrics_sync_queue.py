@@ -0,0 +1,97 @@
+# services/metrics_sync_queue.py
+import queue
+import threading
+from datetime import datetime
+from sqlalchemy.orm import sessionmaker
+
+MAX_ATTEMPTS = 2  # 锁等待超时 / 死锁等瞬时错误重试一次
+
+class ProductMetricsSyncQueue:
+    """
+    后台商品指标同步队列：把 sync_product_metrics 从前台事务中剥离，
+    由单个守护线程在独立 Session 中按商品合并执行，避免收银等高频写入路径被全量日志重放拖慢。
+    与前台 (发货、售后等) 的重算通过 sync_products_metrics 内的商品行 / 资产科目行锁串行化；
+    重试后仍失败的商品记入 failures()，直到该商品下一次同步成功，对账页据此提示。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = set()  # (engine_key, product_id)，同一商品排队中只保留一份
+        self._worker = None
+        self._session_makers = {}
+        self._failures = {}  # product_id -> (时间, 错误信息)
+
+    def _get_session_maker(self, bind):
+        key = id(bind)
+        if key not in self._session_makers:
+            self._session_makers[key] = sessionmaker(autocommit=False, autoflush=False, bind=bind)
+        return key, self._session_makers[key]
+
+    def _ensure_worker(self):
+        if self._worker is None or not self._worker.is_alive():
+            self._worker = threading.Thread(target=self._run, name="product-metrics-sync", daemon=True)
+            self._worker.start()
+
+    def enqueue(self, db, product_ids):
+        """在调用方 commit 之后登记需要重算的商品，绑定与调用方相同的 Engine"""
+        product_ids = {pid for pid in product_ids if pid}
+        if not product_ids: return
+
+        key, maker = self._get_session_maker(db.get_bind())
+        with self._lock:
+            for pid in product_ids:
+                if (key, pid) in self._pending: continue
+                self._pending.add((key, pid))
+                self._queue.put((key, maker, pid))
+            self._ensure_worker()
+
+    def _run(self):
+        from services.inventory_service import InventoryService
+        while True:
+            key, maker, pid = self._queue.get()
+            with self._lock:
+                self._pending.discard((key, pid))
+            try:
+                error = None
+                for _ in range(MAX_ATTEMPTS):
+                    db = maker()
+                    try:
+                        InventoryService(db).sync_products_metrics([pid])
+                        db.commit()
+                        error = None
+                        break
+                    except Exception as e:
+                        db.rollback()
+                        error = e
+                    finally:
+                        db.close()
+                with self._lock:
+                    if error is None:
+                        self._failures.pop(pid, None)
+                    else:
+                        self._failures[pid] = (datetime.now(), str(error))
+                if error is not None:
+                    print(f"⚠️ 后台商品指标同步失败 (product_id={pid}): {error}")
+            finally:
+                self._queue.task_done()
+
+    def wait_until_idle(self):
+        """阻塞直到队列中所有同步任务执行完毕 (用于备份、对账等需要强一致的场景)"""
+        self._queue.join()
+
+    def failures(self):
+        """{product_id: (时间, 错误信息)}：重试后仍失败、且之后未再同步成功的商品"""
+        with self._lock:
+            return dict(self._failures)
+
+    def clear_failures(self, product_ids=None):
+        """账目已由其他途径 (如对账修正) 重算后清除失败记录，product_ids 为空时全部清除"""
+        with self._lock:
+            if product_ids is None:
+                self._failures.clear()
+            else:
+                for pid in product_ids: self._failures.pop(pid, None)
+
+# 全局单例：App 与 Bot 进程内共享
+metrics_sync_queue = ProductMetricsSyncQueue()
@@ -1,12 +1,17 @@
 # services/offline_sales_service.py
-from sqlalchemy.orm import Session, joinedload
+import re
+from sqlalchemy.orm import Session, joinedload, selectinload
 from sqlalchemy import func, or_
+from sqlalchemy.exc import IntegrityError
 from datetime import datetime
 from models import (
-    OfflineTemplate, OfflineTemplateItem, SalesOrder, SalesOrderItem, 
+    OfflineTemplate, OfflineTemplateItem, OfflineTemplateSalesSummary, SalesOrder, SalesOrderItem, 
     InventoryLog, FinanceRecord, CompanyBalanceItem, Product, Warehouse
 )
 from constants import OrderStatus, FinanceCategory
+from services.sales_fact_service import SalesFactService
+from services.inventory_service import invalidate_stock_checkpoints
+from services.query_profiler import profiled
 
 class OfflineSalesService:
     def __init__(self, db: Session):
@@ -99,17 +104,140 @@ class OfflineSalesService:
     def delete_template(self, template_id):
         tpl = self.db.query(OfflineTemplate).filter(OfflineTemplate.id == template_id).first()
         if tpl:
+            self.db.query(OfflineTemplateSalesSummary).filter(OfflineTemplateSalesSummary.template_id == template_id).delete()
             self.db.delete(tpl)
             self.db.commit()
 
-    def get_orders_by_template(self, template_code):
-        return self.db.query(SalesOrder).options(joinedload(SalesOrder.items)).filter(
-            SalesOrder.order_no.like(f"{template_code}-%")
-        ).order_by(SalesOrder.id.desc()).all()
+    def get_orders_by_template(self, template_id, limit=200):
+        """按模板外键 (索引) 取最近的线下订单，明细用 selectinload 一次 IN 查询取回"""
+        query = self.db.query(SalesOrder).options(selectinload(SalesOrder.items)).filter(
+            SalesOrder.template_id == template_id
+        ).order_by(SalesOrder.id.desc())
+        if limit: query = query.limit(limit)
+        return query.all()
 
+    # ================= POS 模板销售汇总 =================
+
+    @staticmethod
+    def parse_pos_notes(notes):
+        """从 POS 订单备注中解析 (支付方式, 手续费)"""
+        notes = notes or ""
+        method_match = re.search(r"POS结账: (\S+)", notes)
+        fee_match = re.search(r"扣除手续费 ([\d\.]+)", notes)
+        method = method_match.group(1) if method_match else "未知"
+        fee = float(fee_match.group(1)) if fee_match else 0.0
+        return method, fee
+
+    def _ensure_summary_row(self, template_id, sale_date, payment_method, currency):
+        """
+        (模板, 日期, 支付方式) 汇总行不存在时插入一行全零记录。
+        同一模板当天的第一单可能被多台收银机同时结账，用 INSERT ... ON CONFLICT DO NOTHING 代替先查后插，
+        并发时后到的一方不会因主键冲突失败；其他数据库退回保存点 + 捕获 IntegrityError。
+        """
+        values = dict(
+            template_id=template_id, sale_date=sale_date, payment_method=payment_method, currency=currency,
+            order_count=0, item_count=0, gross_amount=0.0, fee_amount=0.0, net_amount=0.0
+        )
+        dialect = self.db.get_bind().dialect.name
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert
+            self.db.execute(insert(OfflineTemplateSalesSummary).values(**values).on_conflict_do_nothing(
+                index_elements=["template_id", "sale_date", "payment_method"]
+            ))
+            return
+        exists = self.db.query(OfflineTemplateSalesSummary.template_id).filter(
+            OfflineTemplateSalesSummary.template_id == template_id,
+            OfflineTemplateSalesSummary.sale_date == sale_date,
+            OfflineTemplateSalesSummary.payment_method == payment_method
+        ).first()
+        if exists: return
+        try:
+            with self.db.begin_nested():
+                self.db.add(OfflineTemplateSalesSummary(**values))
+        except IntegrityError:
+            pass # 并发结账已插入同一行
+
+    def _apply_summary_delta(self, template_id, sale_date, payment_method, currency, item_count, gross, fee, sign=1):
+        """增量更新 (模板, 日期, 支付方式) 汇总行：结账时 sign=1，删除订单时 sign=-1"""
+        if sign > 0:
+            self._ensure_summary_row(template_id, sale_date, payment_method, currency)
+        row = self.db.query(OfflineTemplateSalesSummary).filter(
+            OfflineTemplateSalesSummary.template_id == template_id,
+            OfflineTemplateSalesSummary.sale_date == sale_date,
+            OfflineTemplateSalesSummary.payment_method == payment_method
+        ).with_for_update().first()
+        if not row: return # 汇总中本就没有这笔 (例如回填前的旧数据)，无需扣回
+
+        row.order_count += sign
+        row.item_count += sign * item_count
+        row.gross_amount += sign * gross
+        row.fee_amount += sign * fee
+        row.net_amount += sign * (gross - fee)
+
+        if row.order_count <= 0:
+            self.db.delete(row)
+
+    def remove_order_from_summary(self, order):
+        """删除线下订单前调用：从所属模板汇总中扣回该订单"""
+        if order.order_type != "线下" or not order.template_id: return
+        method, fee = self.parse_pos_notes(order.notes)
+        item_count = sum(i.quantity or 0 for i in order.items)
+        self._apply_summary_delta(
+            order.template_id, order.created_date, method, order.currency,
+            item_count, order.total_amount or 0.0, fee, sign=-1
+        )
+
+    def get_template_summary(self, template_id):
+        """读取模板汇总行 (按日期倒序)，供历史面板与日结对账使用"""
+        return self.db.query(OfflineTemplateSalesSummary).filter(
+            OfflineTemplateSalesSummary.template_id == template_id
+        ).order_by(OfflineTemplateSalesSummary.sale_date.desc(), OfflineTemplateSalesSummary.payment_method).all()
+
+    def backfill_template_links(self):
+        """一次性回填：按订单号前缀把历史线下订单挂到模板上 (长代号优先，避免 A 与 A-B 互相吞并)"""
+        templates = sorted(self.db.query(OfflineTemplate).all(), key=lambda t: len(t.code or ""), reverse=True)
+        for tpl in templates:
+            if not tpl.code: continue
+            self.db.query(SalesOrder).filter(
+                SalesOrder.order_type == "线下",
+                SalesOrder.template_id == None,
+                SalesOrder.order_no.like(f"{tpl.code}-%")
+            ).update({SalesOrder.template_id: tpl.id}, synchronize_session=False)
+        self.db.commit()
+
+    def rebuild_template_summaries(self):
+        """从线下订单全量重建模板汇总表 (回填或数据修复时使用)"""
+        orders = self.db.query(SalesOrder).options(selectinload(SalesOrder.items)).filter(
+            SalesOrder.order_type == "线下",
+            SalesOrder.template_id != None
+        ).all()
+
+        buckets = {}
+        for o in orders:
+            method, fee = self.parse_pos_notes(o.notes)
+            key = (o.template_id, o.created_date, method)
+            b = buckets.setdefault(key, dict(currency=o.currency, order_count=0, item_count=0, gross_amount=0.0, fee_amount=0.0))
+            b["order_count"] += 1
+            b["item_count"] += sum(i.quantity or 0 for i in o.items)
+            b["gross_amount"] += o.total_amount or 0.0
+            b["fee_amount"] += fee
+
+        self.db.query(OfflineTemplateSalesSummary).delete()
+        self.db.bulk_insert_mappings(OfflineTemplateSalesSummary, [
+            dict(template_id=t_id, sale_date=s_date, payment_method=method, net_amount=b["gross_amount"] - b["fee_amount"], **b)
+            for (t_id, s_date, method), b in buckets.items()
+        ])
+        self.db.commit()
+
+    @profiled()
     def checkout_offline_order(self, template_id, cart_items, payment_method, fee_rate, account_id):
         """
         线下结账：扣减模板分配额 -> 校验并扣减真实仓库库存 -> 生成已完成订单
+        单次结账的 SQL 次数固定：一次锁定全部模板明细、一次分组库存校验、批量写入明细与流水，
+        商品大货资产的重算交给后台队列，保证展会现场的结账延迟。
         """
         if not cart_items: raise ValueError("购物车为空")
 
@@ -118,44 +246,51 @@ class OfflineSalesService:
 
         now = datetime.now()
         order_no = f"{tpl.code}-{now.strftime('%Y%m%d%H%M%S')}"
-        total_amount = 0.0
-        product_ids_to_sync = set()
+        cart_names = {item["product_name"] for item in cart_items}
 
-        # 1. 预校验：模板额度与物理库存
+        # 1. 一次性锁定本次购物车涉及的全部模板明细 (SELECT ... FOR UPDATE)
+        locked_items = self.db.query(OfflineTemplateItem).filter(
+            OfflineTemplateItem.template_id == template_id,
+            OfflineTemplateItem.product_name.in_(cart_names)
+        ).with_for_update().all()
+        tpl_item_map = {(i.product_name, i.variant): i for i in locked_items}
+
+        # 2. 一次分组查询取回所有款式在出货仓库的物理库存
+        valid_reasons = ["入库", "出库", "退货入库", "发货撤销", "验收完成入库", "其他入库", "库存移动"]
+        stock_query = self.db.query(
+            InventoryLog.product_name, InventoryLog.variant, func.sum(InventoryLog.change_amount)
+        ).filter(
+            InventoryLog.product_name.in_(cart_names),
+            InventoryLog.reason.in_(valid_reasons)
+        )
+        if tpl.warehouse_id:
+            stock_query = stock_query.filter(InventoryLog.warehouse_id == tpl.warehouse_id)
+        else:
+            stock_query = stock_query.filter(InventoryLog.warehouse_id == None)
+        stock_map = {(p_name, v_name): (total or 0) for p_name, v_name, total in stock_query.group_by(InventoryLog.product_name, InventoryLog.variant).all()}
+
+        # 3. 预校验：模板额度与物理库存 (同款多行合并计算)
+        required_qty = {}
         for item in cart_items:
-            # 校验模板内分配的额度
-            tpl_item = self.db.query(OfflineTemplateItem).filter(
-                OfflineTemplateItem.template_id == template_id,
-                OfflineTemplateItem.product_name == item["product_name"],
-                OfflineTemplateItem.variant == item["variant"]
-            ).with_for_update().first()
-            
-            if not tpl_item or tpl_item.remaining_quantity < item["qty"]:
-                raise ValueError(f"模板额度不足：{item['product_name']} 剩余 {tpl_item.remaining_quantity if tpl_item else 0}")
-
-            # 校验物理仓库库存
-            valid_reasons = ["入库", "出库", "退货入库", "发货撤销", "验收完成入库", "其他入库", "库存移动"]
-            stock_query = self.db.query(func.sum(InventoryLog.change_amount)).filter(
-                InventoryLog.product_name == item["product_name"],
-                InventoryLog.variant == item["variant"],
-                InventoryLog.reason.in_(valid_reasons)
-            )
-            if tpl.warehouse_id:
-                stock_query = stock_query.filter(InventoryLog.warehouse_id == tpl.warehouse_id)
-            else:
-                stock_query = stock_query.filter(InventoryLog.warehouse_id == None)
-                
-            if (stock_query.scalar() or 0) < item["qty"]:
-                raise ValueError(f"仓库实物不足：{item['product_name']} 在选定仓库中已售罄")
+            key = (item["product_name"], item["variant"])
+            required_qty[key] = required_qty.get(key, 0) + item["qty"]
 
-            total_amount += item["qty"] * item["unit_price"]
+        for key, qty in required_qty.items():
+            tpl_item = tpl_item_map.get(key)
+            if not tpl_item or tpl_item.remaining_quantity < qty:
+                raise ValueError(f"模板额度不足：{key[0]} 剩余 {tpl_item.remaining_quantity if tpl_item else 0}")
+            if stock_map.get(key, 0) < qty:
+                raise ValueError(f"仓库实物不足：{key[0]} 在选定仓库中已售罄")
 
-        # 2. 财务计算
+        total_amount = sum(item["qty"] * item["unit_price"] for item in cart_items)
+
+        # 4. 财务计算
         fee = total_amount * fee_rate if payment_method == "PayPay" else 0.0
         net_amount = total_amount - fee
         target_acc = self.db.query(CompanyBalanceItem).filter(CompanyBalanceItem.id == account_id).first()
+        if not target_acc: raise ValueError("收款账户不存在")
 
-        # 3. 创建订单
+        # 5. 创建订单
         order = SalesOrder(
             order_no=order_no, 
             status=OrderStatus.COMPLETED, 
@@ -169,39 +304,39 @@ class OfflineSalesService:
             created_date=now.date(), 
             shipped_date=now.date(), 
             completed_date=now.date(),
-            notes=f"POS结账: {payment_method}" + (f" (扣除手续费 {fee:.2f})" if fee > 0 else "")
+            notes=f"POS结账: {payment_method}" + (f" (扣除手续费 {fee:.2f})" if fee > 0 else ""),
+            template_id=tpl.id
         )
         self.db.add(order)
         self.db.flush()
 
-        # 4. 执行扣减
-        for item in cart_items:
-            # 扣减模板额度
-            tpl_item = self.db.query(OfflineTemplateItem).filter(
-                OfflineTemplateItem.template_id == template_id,
-                OfflineTemplateItem.product_name == item["product_name"],
-                OfflineTemplateItem.variant == item["variant"]
-            ).first()
-            tpl_item.remaining_quantity -= item["qty"]
+        # 6. 扣减模板额度 (已锁定的对象直接修改)，并批量写入订单明细与出库流水
+        for key, qty in required_qty.items():
+            tpl_item_map[key].remaining_quantity -= qty
 
+        order_item_rows = []
+        log_rows = []
+        for item in cart_items:
             subtotal = item["qty"] * item["unit_price"]
             # 记录订单明细（绑定出货仓库）
-            self.db.add(SalesOrderItem(
+            order_item_rows.append(dict(
                 order_id=order.id, product_name=item["product_name"], variant=item["variant"],
                 quantity=item["qty"], unit_price=item["unit_price"], subtotal=subtotal,
                 warehouse_id=tpl.warehouse_id
             ))
             # 记录物理出库
-            self.db.add(InventoryLog(
+            log_rows.append(dict(
                 product_name=item["product_name"], variant=item["variant"], change_amount=-item["qty"],
                 reason="出库", date=now.date(), note=f"线下订单: {order.order_no}",
                 is_sold=True, sale_amount=subtotal, currency=tpl.currency, platform=tpl.platform,
-                order_id=order.id, warehouse_id=tpl.warehouse_id
+                order_id=order.id, warehouse_id=tpl.warehouse_id,
+                is_other_out=False, part_name=None, cost_item_id=None
             ))
-            p = self.db.query(Product).filter(Product.name == item["product_name"]).first()
-            if p: product_ids_to_sync.add(p.id)
+        self.db.bulk_insert_mappings(SalesOrderItem, order_item_rows)
+        self.db.bulk_insert_mappings(InventoryLog, log_rows)
+        invalidate_stock_checkpoints(self.db, now.date()) # 批量写入不经过 flush 钩子，显式作废快照
 
-        # 5. 财务入账
+        # 7. 财务入账
         self.db.add(FinanceRecord(
             date=now.date(), amount=net_amount, currency=tpl.currency,
             category=FinanceCategory.SALES_INCOME, description=f"POS销售: {order.order_no} ({tpl.platform})",
@@ -209,10 +344,22 @@ class OfflineSalesService:
         ))
         target_acc.amount += net_amount
 
-        self.db.flush()
-        from services.inventory_service import InventoryService
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync: inv_service.sync_product_metrics(pid)
+        # 8. 增量更新销售事实表与模板销售汇总 (销售一览、历史面板与日结对账直接读取)
+        SalesFactService(self.db).apply_sale_lines(
+            now.date(), tpl.platform, tpl.currency,
+            [(item["product_name"], item["variant"], item["qty"], item["qty"] * item["unit_price"]) for item in cart_items]
+        )
+        self._apply_summary_delta(
+            tpl.id, now.date(), payment_method, tpl.currency,
+            sum(required_qty.values()), total_amount, fee
+        )
+
+        product_ids_to_sync = [pid for (pid,) in self.db.query(Product.id).filter(Product.name.in_(cart_names)).all()]
 
         self.db.commit()
-        return order.order_no, net_amount
\ No newline at end of file
+
+        # 9. 大货资产/可售数量重算延后到后台队列执行
+        from services.metrics_sync_queue import metrics_sync_queue
+        metrics_sync_queue.enqueue(self.db, product_ids_to_sync)
+
+        return order_no, net_amount
@@ -0,0 +1,201 @@
+# services/query_profiler.py
+import re
+import time
+import threading
+import functools
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+# 同一语句形状在一次调用内执行达到该次数即视为疑似 N+1
+N_PLUS_ONE_THRESHOLD = 5
+
+_IN_LIST = re.compile(r"\((?:\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*,)+\s*(?:\?|%\(\w+\)s|%s|:\w+)\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+def statement_shape(statement):
+    """语句形状：压缩空白，并把 IN (?, ?, ...) 折叠为 IN (...)，只有参数值不同的语句形状相同"""
+    return _IN_LIST.sub("(...)", _WHITESPACE.sub(" ", statement).strip())
+
+
+class QueryProfile:
+    """一次被观测的调用 (服务方法 / 页面 / 测试片段) 内执行的全部 SQL"""
+    def __init__(self, label=None):
+        self.label = label
+        self.statements = []  # [(形状, 耗时秒, 影响行数或 None)]
+        self.calls = []       # 嵌套的 profiled 调用 [QueryProfile]
+        self.wall_time = 0.0
+
+    @property
+    def count(self):
+        return len(self.statements)
+
+    @property
+    def db_time(self):
+        return sum(t for _, t, _ in self.statements)
+
+    @property
+    def rows_fetched(self):
+        """驱动上报的 SELECT 行数合计 (psycopg2 会上报，sqlite3 不上报时为 None)"""
+        counts = [rc for shape, _, rc in self.statements if rc is not None and shape.startswith("SELECT")]
+        return sum(counts) if counts else None
+
+    def shape_counts(self):
+        return Counter(shape for shape, _, _ in self.statements)
+
+    def repeated(self, threshold=N_PLUS_ONE_THRESHOLD, selects_only=True):
+        """
+        执行次数 >= threshold 的语句形状 [(形状, 次数, 总耗时)]，按次数降序。
+        默认只看 SELECT：ORM 逐行 INSERT/UPDATE 是 flush 的正常行为，不算 N+1。
+        """
+        times = {}
+        for shape, t, _ in self.statements:
+            times[shape] = times.get(shape, 0.0) + t
+        return [
+            (shape, n, times[shape]) for shape, n in self.shape_counts().most_common()
+            if n >= threshold and (not selects_only or shape.startswith("SELECT"))
+        ]
+
+    def summary(self):
+        return {
+            "label": self.label, "queries": self.count, "db_time": self.db_time, "wall_time": self.wall_time,
+            "distinct_shapes": len(self.shape_counts()), "repeated": [(s, n) for s, n, _ in self.repeated()],
+        }
+
+    @staticmethod
+    def call_breakdown(calls):
+        """profiled 调用按名称合并：[(名称, 调用次数, SQL 数, DB 秒, 总秒, 下一层调用)]，按 SQL 数降序"""
+        merged = {}
+        for call in calls:
+            m = merged.setdefault(call.label, [0, 0, 0.0, 0.0, []])
+            m[0] += 1
+            m[1] += call.count
+            m[2] += call.db_time
+            m[3] += call.wall_time
+            m[4].extend(call.calls)
+        return sorted(((label, *m) for label, m in merged.items()), key=lambda r: r[2], reverse=True)
+
+    def _format_calls(self, calls, limit, depth=1):
+        lines = []
+        for label, n_calls, queries, db_time, wall_time, children in self.call_breakdown(calls)[:limit]:
+            times = f" ×{n_calls}" if n_calls > 1 else ""
+            lines.append(f"{'  ' * depth}↳ {label}{times}: {queries} 条 SQL, DB {db_time * 1000:.1f} ms / 总 {wall_time * 1000:.1f} ms")
+            lines.extend(self._format_calls(children, limit, depth + 1))
+        return lines
+
+    def format_report(self, limit=5, threshold=N_PLUS_ONE_THRESHOLD):
+        lines = [f"{self.label or '查询统计'}: {self.count} 条 SQL, DB {self.db_time * 1000:.1f} ms / 总 {self.wall_time * 1000:.1f} ms"]
+        # 逐层列出 profiled 服务方法各自的 SQL 数，定位大头落在哪个调用里
+        lines.extend(self._format_calls(self.calls, limit))
+        for shape, n, t in self.repeated(threshold)[:limit]:
+            lines.append(f"  ⚠️ 疑似 N+1 ×{n} ({t * 1000:.1f} ms): {shape[:160]}")
+        return "\n".join(lines)
+
+
+# ================= SQLAlchemy 事件 =================
+# 只在 Engine 类上挂一次全局监听；没有活动的 profile 时回调只读取一次 ContextVar。
+# ContextVar 按线程隔离，后台同步队列线程中的 SQL 不会计入前台调用。
+_active = ContextVar("query_profiles", default=())
+_install_lock = threading.Lock()
+_installed = False
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if _active.get():
+        conn.info.setdefault("_query_profiler_start", []).append(time.perf_counter())
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    profiles = _active.get()
+    if not profiles: return
+    starts = conn.info.get("_query_profiler_start")
+    if not starts: return
+    elapsed = time.perf_counter() - starts.pop()
+    rowcount = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+    record = (statement_shape(statement), elapsed, rowcount)
+    for prof in profiles:
+        prof.statements.append(record)
+
+def _handle_error(exception_context):
+    starts = exception_context.connection.info.get("_query_profiler_start") if exception_context.connection is not None else None
+    if starts: starts.pop()
+
+def install():
+    """注册全局语句计时监听 (幂等)"""
+    global _installed
+    if _installed: return
+    with _install_lock:
+        if _installed: return
+        event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+        event.listen(Engine, "handle_error", _handle_error)
+        _installed = True
+
+
+# ================= 对外接口 =================
+
+@contextmanager
+def profile_queries(label=None, warn_repeats=None):
+    """
+    统计 with 块内 (当前线程) 执行的 SQL，可嵌套，外层同样计入内层的语句。
+    warn_repeats: 给出阈值时，结束后打印疑似 N+1 的语句形状。
+    """
+    install()
+    prof = QueryProfile(label)
+    parents = _active.get()
+    token = _active.set(parents + (prof,))
+    t0 = time.perf_counter()
+    try:
+        yield prof
+    finally:
+        prof.wall_time = time.perf_counter() - t0
+        _active.reset(token)
+        if parents:
+            parents[-1].calls.append(prof)
+        if warn_repeats and prof.repeated(warn_repeats):
+            print(prof.format_report(threshold=warn_repeats))
+
+
+def profiled(label=None):
+    """
+    服务方法装饰器：外层有活动的 profile 时，单独统计本次调用并挂到外层的 calls 下；
+    没有活动的 profile 时直接调用，不产生额外开销。
+    """
+    def decorator(fn):
+        name = label or fn.__qualname__
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not _active.get():
+                return fn(*args, **kwargs)
+            with profile_queries(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class QueryBudgetExceeded(AssertionError):
+    def __init__(self, profile, problems):
+        self.profile = profile
+        super().__init__("；".join(problems) + "\n" + profile.format_report(limit=10))
+
+
+@contextmanager
+def query_budget(max_queries=None, max_repeats=None, label=None):
+    """
+    查询预算断言 (测试 / 基准脚本使用)：
+        with query_budget(max_queries=40, max_repeats=3, label="ship_order 10 行"):
+            svc.ship_order(order_id)
+    超出 SQL 总数，或任一语句形状重复次数超过 max_repeats 时抛出 QueryBudgetExceeded。
+    with 块本身抛出异常时不做预算检查。
+    """
+    with profile_queries(label) as prof:
+        yield prof
+    problems = []
+    if max_queries is not None and prof.count > max_queries:
+        problems.append(f"SQL 数 {prof.count} 超出预算 {max_queries}")
+    if max_repeats is not None:
+        worst = prof.repeated(max_repeats + 1)
+        if worst:
+            problems.append(f"语句重复 {worst[0][1]} 次超出上限 {max_repeats}")
+    if problems:
+        raise QueryBudgetExceeded(prof, problems)
@@ -0,0 +1,93 @@
+# services/sales_analytics_service.py
+import numpy as np
+import pandas as pd
+
+# 榜单维度 -> (明细列名, 展示名)
+LEADERBOARD_DIMENSIONS = {
+    "product": "产品名",
+    "variant": "款式",
+    "platform": "平台",
+    "month": "月份",
+}
+
+CATEGORY_COLUMNS = ["product", "variant", "platform", "currency", "type"]
+
+class SalesAnalyticsService:
+    """
+    销售一览的榜单/透视计算 (纯 pandas，无数据库访问)：
+    维度列统一转为 category，所有榜单均为单次 groupby().sum() + unstack 完成，
+    不再按分组逐个 apply 布尔掩码；Top-N 使用 nlargest 做部分排序。
+    输入为 V1/V2 明细结构 (id, date, product, variant, platform, currency, qty, amount, type)。
+    """
+
+    @staticmethod
+    def prepare(df):
+        """维度列转 category 并补充月份列 (YYYY-MM)，只需在数据版本变化时做一次"""
+        if df.empty: return df
+        df = df.copy()
+        for col in CATEGORY_COLUMNS:
+            if col in df.columns:
+                df[col] = df[col].fillna("未知").astype("category")
+        df["month"] = pd.to_datetime(df["date"], errors="coerce").dt.strftime("%Y-%m").fillna("未知").astype("category")
+        return df
+
+    @staticmethod
+    def apply_filters(df, platforms=None, date_range=None):
+        """platforms: 平台列表 (空为不过滤)；date_range: (起始日期, 结束日期) 闭区间"""
+        if df.empty: return df
+        mask = np.ones(len(df), dtype=bool)
+        if platforms:
+            mask &= df["platform"].isin(platforms).to_numpy()
+        if date_range:
+            start, end = date_range
+            dates = pd.to_datetime(df["date"], errors="coerce")
+            if start: mask &= (dates >= pd.Timestamp(start)).to_numpy()
+            if end: mask &= (dates <= pd.Timestamp(end)).to_numpy()
+        return df[mask] if not mask.all() else df
+
+    @staticmethod
+    def leaderboard(df, dimension="product", exchange_rate=0.048, top_n=None):
+        """
+        按维度汇总 CNY/JPY 销售额、折合 CNY 总额与净销量。
+        返回列: [dimension, 折合CNY总额, CNY总额, JPY总额, 净销量]，按折合总额降序。
+        """
+        cols = [dimension, "折合CNY总额", "CNY总额", "JPY总额", "净销量"]
+        if df.empty: return pd.DataFrame(columns=cols)
+
+        amounts = df.groupby([dimension, "currency"], observed=True)["amount"].sum().unstack("currency", fill_value=0.0)
+        board = pd.DataFrame({
+            "CNY总额": amounts["CNY"] if "CNY" in amounts.columns else 0.0,
+            "JPY总额": amounts["JPY"] if "JPY" in amounts.columns else 0.0,
+        }, index=amounts.index)
+        board["折合CNY总额"] = board["CNY总额"] + board["JPY总额"] * exchange_rate
+        board["净销量"] = df.groupby(dimension, observed=True)["qty"].sum().reindex(board.index, fill_value=0)
+
+        if top_n:
+            board = board.nlargest(top_n, "折合CNY总额")
+        else:
+            board = board.sort_values("折合CNY总额", ascending=False, kind="stable")
+
+        board = board.reset_index()
+        board[dimension] = board[dimension].astype(str)
+        return board[cols]
+
+    @staticmethod
+    def pivot(df, index="variant", columns="platform", values="qty", margins=True):
+        """交叉透视 (默认 款式 × 平台 净销量)，带 总计 行列"""
+        if df.empty: return pd.DataFrame()
+        table = df.pivot_table(
+            values=values, index=index, columns=columns,
+            aggfunc="sum", fill_value=0, observed=True, margins=margins, margins_name="总计"
+        )
+        table.index = table.index.astype(str)
+        table.columns = table.columns.astype(str)
+        return table
+
+    @staticmethod
+    def composition(df, keys=("variant", "platform"), values="qty"):
+        """图表用的多维汇总，去掉净值为 0 的组合"""
+        if df.empty: return pd.DataFrame(columns=[*keys, values])
+        data = df.groupby(list(keys), observed=True)[values].sum().reset_index()
+        for k in keys:
+            data[k] = data[k].astype(str)
+        return data[data[values] != 0]
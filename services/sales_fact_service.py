@@ -0,0 +1,169 @@
+# services/sales_fact_service.py
+import pandas as pd
+from sqlalchemy import tuple_
+from sqlalchemy.orm import Session
+from models import SalesDailyFact, InventoryLog, OrderRefund
+from constants import Currency, OrderStatus, StockLogReason
+
+# 计入销售额与销量的订单状态 (与 SalesService V2 口径一致)
+SALE_COUNTED_STATUSES = [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]
+
+class SalesFactService:
+    """
+    销售日汇总事实表 (sales_daily_facts) 的增量维护：
+    粒度为 日期 × 商品 × 款式 × 平台 × 币种，记录售出数量/销售额/退款额/退货数量。
+    由发货、完成、售后、POS 结账、删除订单等写路径在同一事务内调用，
+    销售一览与榜单直接读取，行数只随 天数 × SKU 增长，不随订单数增长。
+    """
+    def __init__(self, db: Session):
+        self.db = db
+        self._rows = {}  # 本事务内已取出的行，避免 autoflush=False 时重复插入同一主键
+        self._absent = set()  # 已批量确认库中不存在的键 (_bump 时直接新建，不再逐个查询)
+
+    @staticmethod
+    def _key(sale_date, product_name, variant, platform, currency):
+        return (sale_date, product_name, variant or "", platform or "未知", currency or Currency.CNY)
+
+    def _prefetch(self, keys):
+        """一次查询取出多行明细对应的事实行，避免逐行查询"""
+        missing = {k for k in keys if k not in self._rows and k not in self._absent}
+        if len(missing) < 2: return
+        F = SalesDailyFact
+        for row in self.db.query(F).filter(tuple_(F.sale_date, F.product_name, F.variant, F.platform, F.currency).in_(missing)).all():
+            key = (row.sale_date, row.product_name, row.variant, row.platform, row.currency)
+            self._rows[key] = row
+            missing.discard(key)
+        self._absent |= missing
+
+    def _bump(self, key, sold_qty=0, return_qty=0, gross=0.0, refund=0.0):
+        row = self._rows.get(key)
+        if row is None:
+            sale_date, product_name, variant, platform, currency = key
+            row = None if key in self._absent else self.db.query(SalesDailyFact).filter(
+                SalesDailyFact.sale_date == sale_date,
+                SalesDailyFact.product_name == product_name,
+                SalesDailyFact.variant == variant,
+                SalesDailyFact.platform == platform,
+                SalesDailyFact.currency == currency
+            ).first()
+            if row is None:
+                row = SalesDailyFact(
+                    sale_date=sale_date, product_name=product_name, variant=variant, platform=platform, currency=currency,
+                    sold_qty=0, return_qty=0, gross_amount=0.0, refund_amount=0.0
+                )
+                self.db.add(row)
+            self._rows[key] = row
+
+        row.sold_qty += sold_qty
+        row.return_qty += return_qty
+        row.gross_amount += gross
+        row.refund_amount += refund
+
+    # ================= 写路径钩子 =================
+
+    def apply_sale_lines(self, sale_date, platform, currency, lines, sign=1):
+        """lines: [(商品, 款式, 数量, 小计)]"""
+        self._prefetch(self._key(sale_date, p, v, platform, currency) for p, v, _, _ in lines)
+        for product_name, variant, qty, subtotal in lines:
+            self._bump(self._key(sale_date, product_name, variant, platform, currency), sold_qty=sign * (qty or 0), gross=sign * (subtotal or 0.0))
+
+    def apply_order_sale(self, order, sign=1):
+        """订单进入 (sign=1) 或离开 (sign=-1) 计入销售的状态时调用，销售日期取下单日期"""
+        self.apply_sale_lines(
+            order.created_date, order.platform, order.currency,
+            [(i.product_name, i.variant, i.quantity, i.subtotal) for i in order.items], sign
+        )
+
+    def on_status_change(self, order, old_status):
+        """状态流转后调用：只有 计入/不计入 销售的边界发生变化时才增减事实行"""
+        was_counted = old_status in SALE_COUNTED_STATUSES
+        is_counted = order.status in SALE_COUNTED_STATUSES
+        if was_counted != is_counted:
+            self.apply_order_sale(order, 1 if is_counted else -1)
+
+    def apply_refund(self, order, refund_amount, refund_date, sign=1):
+        """退款按明细金额占比分摊到各款式，计入退款日期"""
+        items = list(order.items)
+        order_items_total = sum(i.subtotal or 0 for i in items)
+        if order_items_total <= 0 or not refund_amount: return
+        self._prefetch(self._key(refund_date, i.product_name, i.variant, order.platform, order.currency) for i in items if i.subtotal)
+        for item in items:
+            allocated = (item.subtotal or 0) / order_items_total * refund_amount
+            if allocated:
+                self._bump(self._key(refund_date, item.product_name, item.variant, order.platform, order.currency), refund=sign * allocated)
+
+    def apply_returns(self, order, return_date, returned_items, sign=1):
+        """returned_items: [{"product_name", "variant", "quantity"}]"""
+        self._prefetch(self._key(return_date, i["product_name"], i["variant"], order.platform, order.currency) for i in returned_items)
+        for item in returned_items:
+            self._bump(self._key(return_date, item["product_name"], item["variant"], order.platform, order.currency), return_qty=sign * abs(item["quantity"]))
+
+    def remove_order(self, order):
+        """删除订单前调用：扣回该订单的销售、全部退款与退货"""
+        if order.status in SALE_COUNTED_STATUSES:
+            self.apply_order_sale(order, -1)
+        for r in self.db.query(OrderRefund).filter(OrderRefund.order_id == order.id).all():
+            self.apply_refund(order, r.refund_amount, r.refund_date, -1)
+        return_logs = self.db.query(InventoryLog).filter(
+            InventoryLog.order_id == order.id,
+            InventoryLog.is_sold == True,
+            InventoryLog.reason == StockLogReason.RETURN_IN
+        ).all()
+        for log in return_logs:
+            self._bump(self._key(log.date, log.product_name, log.variant, order.platform, order.currency), return_qty=-abs(log.change_amount))
+
+    # ================= 全量重建 =================
+
+    def rebuild(self):
+        """从 V2 明细全量重建事实表 (首次上线或数据修复时使用)，返回写入行数"""
+        from services.sales_service import SalesService
+        df = SalesService.process_sales_data_v2(self.db)
+
+        self.db.query(SalesDailyFact).delete()
+        self._rows = {}
+        if df.empty:
+            self.db.commit()
+            return 0
+
+        df = df.assign(
+            variant=df["variant"].fillna(""), platform=df["platform"].fillna("未知"), currency=df["currency"].fillna(Currency.CNY),
+            sold_qty=df["qty"].where(df["type"] == "sale", 0),
+            return_qty=(-df["qty"]).where(df["type"] == "return", 0),
+            gross_amount=df["amount"].where(df["type"] == "sale", 0.0),
+            refund_amount=(-df["amount"]).where(df["type"] == "refund", 0.0),
+        )
+        agg = df.groupby(["date", "product", "variant", "platform", "currency"], as_index=False)[
+            ["sold_qty", "return_qty", "gross_amount", "refund_amount"]
+        ].sum()
+
+        self.db.bulk_insert_mappings(SalesDailyFact, [
+            dict(sale_date=r.date, product_name=r.product, variant=r.variant, platform=r.platform, currency=r.currency,
+                 sold_qty=int(r.sold_qty), return_qty=int(r.return_qty), gross_amount=float(r.gross_amount), refund_amount=float(r.refund_amount))
+            for r in agg.itertuples(index=False)
+        ])
+        self.db.commit()
+        return len(agg)
+
+    # ================= 读取 =================
+
+    def get_facts_df(self):
+        """
+        以 V2 明细相同的列结构返回事实表 (每个事实行最多拆成 售出/退款/退货 三条)，
+        可直接交给销售一览与 SalesService.get_product_leaderboard 使用。
+        """
+        cols = ["id", "date", "product", "variant", "platform", "currency", "qty", "amount", "type"]
+        facts = self.db.query(SalesDailyFact).order_by(SalesDailyFact.sale_date.asc()).all()
+        data_list = []
+        for f in facts:
+            base = {"date": f.sale_date, "product": f.product_name, "variant": f.variant, "platform": f.platform, "currency": f.currency}
+            if f.sold_qty or abs(f.gross_amount or 0) > 1e-6:
+                data_list.append({**base, "qty": f.sold_qty, "amount": f.gross_amount, "type": "sale"})
+            if abs(f.refund_amount or 0) > 1e-6:
+                data_list.append({**base, "qty": 0, "amount": -f.refund_amount, "type": "refund"})
+            if f.return_qty:
+                data_list.append({**base, "qty": -f.return_qty, "amount": 0.0, "type": "return"})
+
+        if not data_list: return pd.DataFrame(columns=cols)
+        df = pd.DataFrame(data_list)
+        df["id"] = range(1, len(df) + 1)  # 按日期升序编号，日志倒序展示即为最近在前
+        return df[cols]
@@ -11,6 +11,11 @@ import math
 import pandas as pd
 from constants import OrderStatus, FinanceCategory, AssetPrefix
 from services.inventory_service import InventoryService
+from services.offline_sales_service import OfflineSalesService
+from services.sales_fact_service import SalesFactService
+from session_manager import session_manager
+from services.query_profiler import profiled
+from services.excel_ingest import ExcelChunkReader, ORDER_TEXT_COLUMNS, ORDER_NUMBER_COLUMNS, to_text, to_number
 
 class SalesOrderService:
     def __init__(self, db: Session):
@@ -18,25 +23,33 @@ class SalesOrderService:
         self.inventory_service = InventoryService(db)
         
     def _update_asset_by_name(self, name, delta, category="asset", currency="CNY"):
-        item = self.db.query(CompanyBalanceItem).filter(
-            CompanyBalanceItem.name == name
-        ).with_for_update().first()
-
-        if item:
-            item.amount += delta
-            if item.amount < 0 and name.startswith(AssetPrefix.PENDING_SETTLE):
-                item.amount = 0
-                
-            if abs(item.amount) <= 0.01 and not item.finance_record_id:
-                self.db.delete(item)
-        else:
-            if delta < 0 and name.startswith(AssetPrefix.PENDING_SETTLE):
-                return
-                
-            a_type = "现金" if name.startswith(AssetPrefix.CASH) else "资产"
-            self.db.add(CompanyBalanceItem(
-                name=name, amount=delta, category=category, currency=currency, asset_type=a_type
-            ))
+        self._update_assets_by_name({name: delta}, category=category, currency=currency)
+
+    def _update_assets_by_name(self, deltas, category="asset", currency="CNY"):
+        """{资产名: 变动额} 一次加锁取回再逐项更新 (多商品订单的待结算款不再按商品逐个查询)"""
+        items = {}
+        for item in self.db.query(CompanyBalanceItem).filter(
+            CompanyBalanceItem.name.in_(list(deltas))
+        ).order_by(CompanyBalanceItem.id).with_for_update().all():
+            items.setdefault(item.name, item)
+
+        for name, delta in deltas.items():
+            item = items.get(name)
+            if item:
+                item.amount += delta
+                if item.amount < 0 and name.startswith(AssetPrefix.PENDING_SETTLE):
+                    item.amount = 0
+
+                if abs(item.amount) <= 0.01 and not item.finance_record_id:
+                    self.db.delete(item)
+            else:
+                if delta < 0 and name.startswith(AssetPrefix.PENDING_SETTLE):
+                    continue
+
+                a_type = "现金" if name.startswith(AssetPrefix.CASH) else "资产"
+                self.db.add(CompanyBalanceItem(
+                    name=name, amount=delta, category=category, currency=currency, asset_type=a_type
+                ))
 
     def _distribute_pending_asset(self, order, amount_delta):
         legacy_asset_name = f"{AssetPrefix.PENDING_SETTLE}-{order.order_no}"
@@ -52,11 +65,11 @@ class SalesOrderService:
             for item in order.items:
                 product_subtotals[item.product_name] = product_subtotals.get(item.product_name, 0.0) + item.subtotal
             
-            for p_name, subtotal in product_subtotals.items():
-                item_delta = amount_delta * (subtotal / total_initial)
-                # 在资产名称后缀加上订单的币种，实现账目币种隔离
-                pending_asset_name = f"{AssetPrefix.PENDING_SETTLE}-{p_name}-{order.currency}" 
-                self._update_asset_by_name(pending_asset_name, item_delta, category="asset", currency=order.currency)
+            # 在资产名称后缀加上订单的币种，实现账目币种隔离
+            self._update_assets_by_name({
+                f"{AssetPrefix.PENDING_SETTLE}-{p_name}-{order.currency}": amount_delta * (subtotal / total_initial)
+                for p_name, subtotal in product_subtotals.items()
+            }, category="asset", currency=order.currency)
         else:
             if order.items:
                 pending_asset_name = f"{AssetPrefix.PENDING_SETTLE}-{order.items[0].product_name}-{order.currency}"
@@ -260,6 +273,7 @@ class SalesOrderService:
 
     # ================= 3. 订单状态通用流转 =================
 
+    @profiled()
     def ship_order(self, order_id, ship_date=None):
         order = self.db.query(SalesOrder).filter(SalesOrder.id == order_id).first()
         if not order: raise ValueError("订单不存在")
@@ -269,19 +283,20 @@ class SalesOrderService:
         product_ids_to_sync = set()
         valid_reasons = ["入库", "出库", "退货入库", "发货撤销", "验收完成入库", "其他入库", "库存移动"]
 
-        for item in order.items:
-            stock_query = self.db.query(func.sum(InventoryLog.change_amount)).filter(
-                InventoryLog.product_name == item.product_name,
-                InventoryLog.variant == item.variant,
+        items = list(order.items)
+        item_names = {item.product_name for item in items}
+        # 一次分组查询取回全部明细在各仓库 (含未分配仓库) 的库存
+        stock_map = {
+            (p_name, v_name, wh_id): (total or 0) for p_name, v_name, wh_id, total in self.db.query(
+                InventoryLog.product_name, InventoryLog.variant, InventoryLog.warehouse_id, func.sum(InventoryLog.change_amount)
+            ).filter(
+                InventoryLog.product_name.in_(item_names),
                 InventoryLog.reason.in_(valid_reasons)
-            )
-            
-            if item.warehouse_id is not None:
-                stock_query = stock_query.filter(InventoryLog.warehouse_id == item.warehouse_id)
-            else:
-                stock_query = stock_query.filter(InventoryLog.warehouse_id == None)
+            ).group_by(InventoryLog.product_name, InventoryLog.variant, InventoryLog.warehouse_id).all()
+        }
 
-            current_stock = stock_query.scalar() or 0
+        for item in items:
+            current_stock = stock_map.get((item.product_name, item.variant, item.warehouse_id), 0)
 
             if current_stock < item.quantity:
                 wh_name_display = item.warehouse.name if item.warehouse_id else '未分配仓库'
@@ -293,18 +308,17 @@ class SalesOrderService:
                 is_sold=True, sale_amount=item.subtotal, currency=order.currency, platform=order.platform,
                 order_id=order.id, warehouse_id=item.warehouse_id
             ))
-            
-            product = self.db.query(Product).filter(Product.name == item.product_name).first()
-            if product: product_ids_to_sync.add(product.id)
+
+        product_ids_to_sync.update(pid for (pid,) in self.db.query(Product.id).filter(Product.name.in_(item_names)).all())
 
         self._distribute_pending_asset(order, order.total_amount)
+        old_status = order.status
         order.status = OrderStatus.SHIPPED
         order.shipped_date = ship_date
+        SalesFactService(self.db).on_status_change(order, old_status)
 
         self.db.flush()
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync:
-            inv_service.sync_product_metrics(pid)
+        InventoryService(self.db).sync_products_metrics(product_ids_to_sync)
 
         self.db.commit()
         return f"订单已发货，已生成待结算款"
@@ -341,13 +355,16 @@ class SalesOrderService:
             ))
             msg = f"订单 {order.order_no} 已完成，收入 {actual_income:.2f} {order.currency}"
 
+        old_status = order.status
         order.status = OrderStatus.COMPLETED
         order.completed_date = complete_date
+        SalesFactService(self.db).on_status_change(order, old_status)
         self.db.commit()
         return msg
 
     # ================= 4. 售后处理 (自动兼容) =================
     
+    @profiled()
     def add_refund(self, order_id, refund_amount, refund_reason, is_returned=False,
                    returned_quantity=0, returned_items=None, refund_date=None,
                    exchange_rate=1.0, is_resend=False, resend_quantity=0, resend_items=None):
@@ -368,6 +385,7 @@ class SalesOrderService:
         self.db.flush()
 
         product_ids_to_sync = set()
+        touched_names = set()  # 退货/补发涉及的商品，循环结束后一次查出 ID
 
         if is_returned and returned_items and order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
             for item in returned_items:
@@ -377,8 +395,7 @@ class SalesOrderService:
                     is_sold=True, sale_amount=0, currency=order.currency, platform=order.platform,
                     order_id=order.id, warehouse_id=item.get("warehouse_id")
                 ))
-                product = self.db.query(Product).filter(Product.name == item["product_name"]).first()
-                if product: product_ids_to_sync.add(product.id)
+                touched_names.add(item["product_name"])
                 
         if is_resend and resend_items and order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
             for item in resend_items:
@@ -391,8 +408,10 @@ class SalesOrderService:
                     order_id=order.id, warehouse_id=item.get("warehouse_id"),
                     part_name=item.get("part_name") 
                 ))
-                product = self.db.query(Product).filter(Product.name == item["product_name"]).first()
-                if product: product_ids_to_sync.add(product.id)
+                touched_names.add(item["product_name"])
+
+        if touched_names:
+            product_ids_to_sync.update(pid for (pid,) in self.db.query(Product.id).filter(Product.name.in_(touched_names)).all())
 
         first_item = self.db.query(SalesOrderItem).filter(SalesOrderItem.order_id == order_id).first()
         if first_item:
@@ -430,12 +449,17 @@ class SalesOrderService:
             if order.total_amount < 0: order.total_amount = 0
             self._distribute_pending_asset(order, -refund_amount)
 
+        # 销售事实表：退款按下单明细分摊、退货计入退货日期；待付尾款等状态转入售后时同时计入销售
+        facts = SalesFactService(self.db)
+        facts.apply_refund(order, refund_amount, refund_date)
+        if is_returned and returned_items and order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
+            facts.apply_returns(order, refund_date, returned_items)
+        old_status = order.status
         order.status = OrderStatus.AFTER_SALES
+        facts.on_status_change(order, old_status)
 
         self.db.flush()
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync:
-            inv_service.sync_product_metrics(pid)
+        InventoryService(self.db).sync_products_metrics(product_ids_to_sync)
 
         self.db.commit()
         return "售后记录已添加"
@@ -496,11 +520,14 @@ class SalesOrderService:
             for log in resend_logs:
                 log.note = f"售后补发: {order.order_no} - {refund_reason}"
 
+        SalesFactService(self.db).apply_refund(order, delta, refund.refund_date)
+
         refund.refund_amount = refund_amount
         refund.refund_reason = refund_reason
         
         self.db.flush()
-        InventoryService(self.db).sync_product_metrics(order.items[0].product_id if order.items else None)
+        if refund.cost_item_id and cost_item:
+            InventoryService(self.db).sync_product_metrics(cost_item.product_id)
         
         self.db.commit()
         return "售后记录已成功修改"
@@ -512,6 +539,8 @@ class SalesOrderService:
         order = refund.order
         amount_to_restore = refund.refund_amount
         product_ids_to_sync = set()
+        facts = SalesFactService(self.db)
+        facts.apply_refund(order, amount_to_restore, refund.refund_date, -1)
         
         if order.status == OrderStatus.COMPLETED:
             asset_name = order.target_account_name if order.target_account_name else f"{AssetPrefix.CASH}({order.currency})"
@@ -538,6 +567,7 @@ class SalesOrderService:
             ).all()
             
             for log in return_logs:
+                facts.apply_returns(order, log.date, [{"product_name": log.product_name, "variant": log.variant, "quantity": log.change_amount}], -1)
                 p = self.db.query(Product).filter(Product.name == log.product_name).first()
                 if p: product_ids_to_sync.add(p.id)
                 self.db.delete(log)
@@ -558,9 +588,7 @@ class SalesOrderService:
         self.db.delete(refund)
         self.db.flush()
 
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync:
-            inv_service.sync_product_metrics(pid)
+        InventoryService(self.db).sync_products_metrics(product_ids_to_sync)
 
         self.db.commit()
         return "售后记录已删除，相关的资金、成本及实物库存均已回滚"
@@ -572,6 +600,7 @@ class SalesOrderService:
         if not order: raise ValueError("订单不存在")
 
         product_ids_to_sync = set()
+        SalesFactService(self.db).remove_order(order)
 
         if order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
             logs = self.db.query(InventoryLog).filter(
@@ -603,13 +632,14 @@ class SalesOrderService:
                 
         if order.status in [OrderStatus.SHIPPED, OrderStatus.AFTER_SALES]:
             self._distribute_pending_asset(order, -order.total_amount)
+
+        # 线下订单同步扣回 POS 模板销售汇总
+        OfflineSalesService(self.db).remove_order_from_summary(order)
                 
         self.db.delete(order)
         self.db.flush()
         
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync:
-            inv_service.sync_product_metrics(pid)
+        InventoryService(self.db).sync_products_metrics(product_ids_to_sync)
 
         self.db.commit()
         return f"订单 {order.order_no} 已删除，相关资金流水与资产已回滚！"
@@ -639,6 +669,13 @@ class SalesOrderService:
 
         product_ids_to_sync = set()
 
+        # 销售事实表：按解绑前的明细金额扣回销售与全部退款 (退货流水保留，不做调整)
+        facts = SalesFactService(self.db)
+        if order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
+            facts.apply_order_sale(order, -1)
+        for refund in self.db.query(OrderRefund).filter(OrderRefund.order_id == order.id).all():
+            facts.apply_refund(order, refund.refund_amount, refund.refund_date, -1)
+
         if order.status in [OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES]:
             logs = self.db.query(InventoryLog).filter(
                 InventoryLog.order_id == order.id,
@@ -688,306 +725,407 @@ class SalesOrderService:
 
         self.db.flush()
 
-        inv_service = InventoryService(self.db)
-        for pid in product_ids_to_sync:
-            inv_service.sync_product_metrics(pid)
+        InventoryService(self.db).sync_products_metrics(product_ids_to_sync)
 
         self.db.commit()
         return f"尾款已成功剥离解绑！订单 {order.order_no} 已恢复至【待付尾款】状态，库存与资金已安全回滚。"
 
     # ================= 6. 批量导入预售扩展 =================
-    def validate_and_parse_import_data(self, df, exchange_rate, presale_mode=None):
+    def validate_and_parse_import_data(self, df, exchange_rate, presale_mode=None, progress=None):
+        """
+        一次性校验整张表 (DataFrame)，返回 (parsed_orders, errors)；progress(done, total, message) 可选。
+        大文件请用 OrderImportValidator 配合 services/excel_ingest.ExcelChunkReader 分块校验。
+        """
+        validator = OrderImportValidator(self.db, exchange_rate, presale_mode=presale_mode)
+        column_error = validator.check_columns(df.columns)
+        if column_error: return None, column_error
+        validator.feed(df, progress=progress, total=len(df))
+        return validator.finish()
+
+    def batch_create_orders(self, parsed_orders, presale_mode=None, progress=None):
+        created_count = 0
+        for pos, data in enumerate(parsed_orders):
+            if progress: progress(pos, len(parsed_orders), f"写入第 {pos + 1}/{len(parsed_orders)} 单")
+            if presale_mode == "定金":
+                order, err = self.create_presale_deposit_order(
+                    items_data=data["items"], platform=data["platform"], currency=data["currency"], 
+                    notes="批量导入定金单", order_no=data["order_no"], target_account_name=data["target_account"],
+                    discount_note=data.get("discount_note", "")
+                )
+                if not err: created_count += 1
+            elif presale_mode == "尾款":
+                try:
+                    self.bind_presale_final_order(data["matched_deposit_id"], data["order_no"], data["net_price"], new_notes="批量绑定尾款")
+                    created_count += 1
+                except: pass
+            else:
+                order, err = self.create_order(
+                    items_data=data["items"], platform=data["platform"], currency=data["currency"], 
+                    notes="Excel批量导入", order_no=data["order_no"], target_account_name=data["target_account"]
+                )
+                if not err: created_count += 1
+        return created_count
+
+    def commit(self):
+        self.db.commit()
+
+
+def _safe_str(val):
+    return "" if val is None or pd.isna(val) else str(val).strip()
+
+
+class OrderImportValidator:
+    """
+    Excel 批量导入的增量校验器：商品 / 仓库字典只加载一次，之后按块 feed(DataFrame) 逐行校验，
+    内存只保留当前块与解析结果，电商平台导出的大表也不会整表载入。
+
+        validator = OrderImportValidator(db, exchange_rate, presale_mode)
+        error = validator.check_columns(columns)
+        for chunk in ExcelChunkReader(...): validator.feed(chunk)
+        parsed_orders, errors = validator.finish()
+
+    chunk 的索引为 0 起的数据行号 (Excel 行号 = 索引 + 2)。订单号重复跨块检测，已存在的单号按块批量查询，
+    各仓库现有库存按 (商品, 型号, 仓库) 缓存，表格内已占用的数量在整个文件范围内累计。
+    """
+    VALID_REASONS = ["入库", "出库", "退货入库", "发货撤销", "验收完成入库", "其他入库", "库存移动"]
+
+    def __init__(self, db: Session, exchange_rate, presale_mode=None):
+        self.db = db
+        self.exchange_rate = exchange_rate
+        self.presale_mode = presale_mode
+
+        self.valid_products = {}
+        for p in self.db.query(Product).all():
+            self.valid_products[p.name] = [c.color_name for c in p.colors]
+        self.warehouse_map = {w.name: w.id for w in self.db.query(Warehouse).all()}
+
+        self.errors = []
+        self.parsed_orders = []
+        self.consumed_stock = {}
+        self.seen_order_nos = set()
+        self.duplicate_order_nos = []
+        self.rows_seen = 0
+        self._stock_cache = {}
+        self._existing_nos = set()
+
+    def check_columns(self, columns):
+        """列名校验，缺列时返回错误 (字符串或列表，与旧接口一致)，否则返回 None"""
+        columns = list(columns)
         required_cols = ['订单号', '商品名', '商品型号', '数量', '销售平台', '订单总额', '币种', '出货仓库']
-        
-        if presale_mode == "尾款":
-            if '关联定金单号' not in df.columns:
-                return None, "尾款绑定模式下，Excel 必须包含【关联定金单号】列"
+
+        if self.presale_mode == "尾款":
+            if '关联定金单号' not in columns:
+                return "尾款绑定模式下，Excel 必须包含【关联定金单号】列"
             required_cols.append('关联定金单号')
-        elif presale_mode == "定金":
-            if '优惠' not in df.columns:
-                return None, "批量导入定金单时，Excel 必须包含【优惠】列"
+        elif self.presale_mode == "定金":
+            if '优惠' not in columns:
+                return "批量导入定金单时，Excel 必须包含【优惠】列"
             required_cols.append('优惠')
 
-        missing_cols = [c for c in required_cols if c not in df.columns]
-        if missing_cols: return None, [f"缺少必要列: {', '.join(missing_cols)}"]
+        missing_cols = [c for c in required_cols if c not in columns]
+        if missing_cols: return [f"缺少必要列: {', '.join(missing_cols)}"]
+        return None
+
+    def _normalize(self, df):
+        # 单号 / SKU 按文本处理 (纯数字单号被存成浮点时还原为整数写法)，金额转为数值
+        df = df.copy()
+        for col in ORDER_TEXT_COLUMNS:
+            if col in df.columns: df[col] = [to_text(v) for v in df[col]]
+        for col in ORDER_NUMBER_COLUMNS:
+            if col in df.columns: df[col] = pd.Series([to_number(v) for v in df[col]], index=df.index, dtype=object)
+        return df
+
+    def _prefetch_existing(self, order_nos):
+        """本块中已在系统存在的单号 (主单号或尾款单号)，每块两次 IN 查询代替逐行查询"""
+        order_nos = list({n for n in order_nos if n})
+        self._existing_nos = set()
+        if not order_nos: return
+        for column in (SalesOrder.order_no, SalesOrder.final_order_no):
+            rows = self.db.query(column).filter(column.in_(order_nos)).all()
+            self._existing_nos.update(r[0] for r in rows)
+
+    def _current_stock(self, p_name, v_name, wh_id):
+        key = (p_name, v_name, wh_id)
+        if key not in self._stock_cache:
+            stock_query = self.db.query(func.sum(InventoryLog.change_amount)).filter(
+                InventoryLog.product_name == p_name,
+                InventoryLog.variant == v_name,
+                InventoryLog.reason.in_(self.VALID_REASONS)
+            )
+            if wh_id is not None:
+                stock_query = stock_query.filter(InventoryLog.warehouse_id == wh_id)
+            else:
+                stock_query = stock_query.filter(InventoryLog.warehouse_id == None)
+            self._stock_cache[key] = stock_query.scalar() or 0
+        return self._stock_cache[key]
+
+    def feed(self, df, progress=None, total=None):
+        """校验一块数据；progress(done, total, message) 可选，total 为整个文件的行数 (估计值亦可)"""
+        df = self._normalize(df)
+        self._prefetch_existing(df['订单号'])
+        for index, row in zip(df.index, df.to_dict("records")):
+            if progress:
+                shown_total = max(total or 0, self.rows_seen + 1)
+                progress(self.rows_seen, shown_total, f"校验第 {self.rows_seen + 1}/{shown_total} 行")
+            self.rows_seen += 1
+            self._parse_row(index, row)
+
+    def finish(self):
+        """返回 (parsed_orders, errors)；表格内订单号重复时整体退回 (None, 提示)"""
+        if self.duplicate_order_nos:
+            duplicate_orders = list(dict.fromkeys(self.duplicate_order_nos))
+            return None, f"Excel 表格中存在重复的订单号，请合并！重复项: {', '.join(duplicate_orders)}"
+        return self.parsed_orders, self.errors
 
-        df['订单号'] = df['订单号'].astype(str).str.replace(r'\.0$', '', regex=True).str.strip()
-        if presale_mode == "尾款":
-            df['关联定金单号'] = df['关联定金单号'].astype(str).str.replace(r'\.0$', '', regex=True).str.strip()
+    def _parse_row(self, index, row):
+        order_no = row['订单号']
+        if not order_no or order_no == 'nan':
+            return
 
-        if df['订单号'].duplicated().any():
-            duplicate_orders = df[df['订单号'].duplicated()]['订单号'].unique().tolist()
-            return None, f"Excel 表格中存在重复的订单号，请合并！重复项: {', '.join(duplicate_orders)}"
+        if order_no in self.seen_order_nos:
+            self.duplicate_order_nos.append(order_no)
+            return
+        self.seen_order_nos.add(order_no)
 
-        valid_products = {}
-        for p in self.db.query(Product).all():
-            valid_products[p.name] = [c.color_name for c in p.colors]
-            
-        warehouses = self.db.query(Warehouse).all()
-        warehouse_map = {w.name: w.id for w in warehouses}
+        existing = order_no in self._existing_nos
 
-        errors = []
-        parsed_orders = []
-        consumed_stock_in_excel = {}
+        if self.presale_mode == "尾款":
+            if existing:
+                self.errors.append(f"第 {index+2} 行: 该尾款订单号 {order_no} 已在系统存在，不可重复绑定")
+                return
+        else:
+            if existing:
+                self.errors.append(f"第 {index+2} 行 - 主订单号已存在: {order_no}")
+                return
 
-        valid_reasons = ["入库", "出库", "退货入库", "发货撤销", "验收完成入库", "其他入库", "库存移动"]
+        discount_val = _safe_str(row.get('优惠', '')) if self.presale_mode == "定金" else ""
 
-        def safe_str(val):
-            return "" if pd.isna(val) else str(val).strip()
+        matched_deposit_id = None
+        if self.presale_mode == "尾款":
+            ref_deposit_no = _safe_str(row['关联定金单号'])
+            if not ref_deposit_no:
+                self.errors.append(f"第 {index+2} 行: 关联定金单号不能为空")
+                return
 
-        for index, row in df.iterrows():
-            order_no = row['订单号']
-            if not order_no or order_no == 'nan': 
-                continue 
-            
-            existing = self.db.query(SalesOrder).filter(
-                or_(SalesOrder.order_no == order_no, SalesOrder.final_order_no == order_no)
+            deposit_order = self.db.query(SalesOrder).filter(
+                SalesOrder.order_no == ref_deposit_no,
+                SalesOrder.order_type == "预售"
             ).first()
-            
-            if presale_mode == "尾款":
-                if existing:
-                    errors.append(f"第 {index+2} 行: 该尾款订单号 {order_no} 已在系统存在，不可重复绑定")
-                    continue
-            else:
-                if existing:
-                    errors.append(f"第 {index+2} 行 - 主订单号已存在: {order_no}")
-                    continue
-            
-            discount_val = safe_str(row.get('优惠', '')) if presale_mode == "定金" else ""
-            
-            matched_deposit_id = None
-            if presale_mode == "尾款":
-                ref_deposit_no = safe_str(row['关联定金单号'])
-                if not ref_deposit_no:
-                    errors.append(f"第 {index+2} 行: 关联定金单号不能为空")
-                    continue
-                    
-                deposit_order = self.db.query(SalesOrder).filter(
-                    SalesOrder.order_no == ref_deposit_no,
-                    SalesOrder.order_type == "预售"
-                ).first()
-                
-                if not deposit_order:
-                    errors.append(f"第 {index+2} 行: 未找到单号为 {ref_deposit_no} 的预售定金订单")
-                    continue
-                if deposit_order.status != OrderStatus.PRESALE_PENDING_FINAL:
-                    errors.append(f"第 {index+2} 行: 定金单 {ref_deposit_no} 状态为【{deposit_order.status}】，不是【待付尾款】，无法绑定")
-                    continue
-                
-                matched_deposit_id = deposit_order.id
-                
-                try: 
-                    gross_price = float(row['订单总额'])
-                except (ValueError, TypeError):
-                    errors.append(f"订单号 {order_no}: 总金额无效")
-                    continue
-                    
-                platform = safe_str(row['销售平台'])
-                currency = safe_str(row['币种'])
-                platform_lower = platform.lower()
-                fee = 0.0
-                shipping_and_other = 0.0
-                
-                if "booth" in platform_lower:
-                    preset_item_total = 0.0
-                    for item in deposit_order.items:
-                        target_p = self.db.query(Product).filter(Product.name == item.product_name).first()
-                        if target_p:
-                            target_c = next((c for c in target_p.colors if c.color_name == item.variant), None)
-                            if target_c:
-                                target_price = next((pr.price for pr in target_c.prices if pr.platform and pr.platform.lower() == "booth"), 0.0)
-                                preset_item_total += target_price * item.quantity
-                    if preset_item_total > 0:
-                        shipping_and_other = max(0.0, gross_price - preset_item_total)
-                    base_fixed_fee = 45 if currency == "JPY" else 2.16
-                    fee = math.ceil(gross_price * 0.056) + base_fixed_fee
-                    
-                elif "微店" in platform_lower:
-                    fee = gross_price * 0.006
-                    
-                net_price = gross_price - fee - shipping_and_other
-                
-                if net_price <= 0:
-                    errors.append(f"订单号 {order_no}: 扣除手续费后的净金额({net_price:.2f}) 小于等于 0")
-                    continue
-                
-                if "微店" in platform_lower: target_acc = "流动资金-微店账户"
-                elif "booth" in platform_lower: target_acc = "流动资金-booth账户"
-                elif currency == "JPY": target_acc = "流动资金-日元临时账户"
-                else: target_acc = "流动资金-支付宝账户"
-                
-                fake_items = [{"product_name": i.product_name, "variant": i.variant, "quantity": i.quantity, "warehouse_id": i.warehouse_id} for i in deposit_order.items]
-
-                parsed_orders.append({
-                    "order_no": order_no, "platform": platform, "currency": currency,
-                    "gross_price": gross_price, "fee": fee, "net_price": net_price,
-                    "total_qty": sum(i.quantity for i in deposit_order.items), "items": fake_items,
-                    "target_account": target_acc,
-                    "matched_deposit_id": matched_deposit_id,
-                    "discount_note": discount_val 
-                })
-                continue 
-            
-            platform = safe_str(row['销售平台'])
-            currency = safe_str(row['币种'])
-            p_name = safe_str(row['商品名'])
-            
-            try: 
-                gross_price = float(row['订单总额'])
-            except (ValueError, TypeError):
-                errors.append(f"订单号 {order_no}: 总金额无效")
-                continue
 
-            var_str = safe_str(row['商品型号']).replace('；', ';')
-            qty_str = safe_str(row['数量']).replace('；', ';')
-            wh_name_str = safe_str(row.get('出货仓库', '')).replace('；', ';')
-            
-            if not wh_name_str: 
-                wh_name_str = "未分配"
+            if not deposit_order:
+                self.errors.append(f"第 {index+2} 行: 未找到单号为 {ref_deposit_no} 的预售定金订单")
+                return
+            if deposit_order.status != OrderStatus.PRESALE_PENDING_FINAL:
+                self.errors.append(f"第 {index+2} 行: 定金单 {ref_deposit_no} 状态为【{deposit_order.status}】，不是【待付尾款】，无法绑定")
+                return
 
-            variants = [v.strip() for v in var_str.split(';') if v.strip()]
-            qtys_str = [q.strip() for q in qty_str.split(';') if q.strip()]
-            wh_names = [w.strip() for w in wh_name_str.split(';') if w.strip()]
+            matched_deposit_id = deposit_order.id
 
-            if len(variants) != len(qtys_str):
-                errors.append(f"订单号 {order_no}: 商品型号数量 ({len(variants)}) 与 数量个数 ({len(qtys_str)}) 不一致！")
-                continue
-            
-            if len(variants) == 0:
-                errors.append(f"订单号 {order_no}: 未读取到商品型号")
-                continue
-                
-            if len(wh_names) == 1 and len(variants) > 1:
-                wh_names = wh_names * len(variants)
-            elif len(wh_names) != len(variants):
-                errors.append(f"订单号 {order_no}: 填写的出货仓库数量 ({len(wh_names)}) 与 型号数量 ({len(variants)}) 不一致！")
-                continue
-
-            items_data = []
-            total_qty = 0
-            has_item_error = False
-            
-            for v_name, q_str, wh_name in zip(variants, qtys_str, wh_names):
-                try:
-                    qty = int(float(q_str))
-                    if qty <= 0:
-                        errors.append(f"订单号 {order_no}: 数量必须大于0 ({q_str})")
-                        has_item_error = True; break
-                except ValueError:
-                    errors.append(f"订单号 {order_no}: 数量格式无效 ({q_str})")
-                    has_item_error = True; break
-                    
-                wh_id = warehouse_map.get(wh_name)
-                if wh_name != "未分配" and wh_id is None:
-                    errors.append(f"订单号 {order_no}: 找不到名为 '{wh_name}' 的仓库！")
-                    has_item_error = True; break
-                    
-                if p_name not in valid_products:
-                    errors.append(f"订单号 {order_no}: 数据库中不存在商品 '{p_name}'")
-                    has_item_error = True; break
-                elif v_name not in valid_products[p_name]:
-                    errors.append(f"订单号 {order_no}: 商品 '{p_name}' 不存在型号 '{v_name}'")
-                    has_item_error = True; break
-                else:
-                    if presale_mode != "定金":
-                        stock_key = f"{p_name}_{v_name}_{wh_id}"
-                        current_consumed = consumed_stock_in_excel.get(stock_key, 0)
-                        
-                        stock_query = self.db.query(func.sum(InventoryLog.change_amount)).filter(
-                            InventoryLog.product_name == p_name,
-                            InventoryLog.variant == v_name,
-                            InventoryLog.reason.in_(valid_reasons)
-                        )
-                        if wh_id is not None:
-                            stock_query = stock_query.filter(InventoryLog.warehouse_id == wh_id)
-                        else:
-                            stock_query = stock_query.filter(InventoryLog.warehouse_id == None)
-                            
-                        current_stock = stock_query.scalar() or 0
-                        
-                        if current_stock < current_consumed + qty:
-                            errors.append(f"订单号 {order_no}: '{p_name}-{v_name}' 在【{wh_name}】库存不足 (当前可用:{current_stock}, 表格内已占用:{current_consumed + qty})")
-                            has_item_error = True; break
-                        
-                        consumed_stock_in_excel[stock_key] = current_consumed + qty
-                        
-                    items_data.append({"product_name": p_name, "variant": v_name, "quantity": qty, "warehouse_id": wh_id})
-                    total_qty += qty
-                    
-            if has_item_error: continue
+            try: 
+                gross_price = float(row['订单总额'])
+            except (ValueError, TypeError):
+                self.errors.append(f"订单号 {order_no}: 总金额无效")
+                return
 
+            platform = _safe_str(row['销售平台'])
+            currency = _safe_str(row['币种'])
             platform_lower = platform.lower()
             fee = 0.0
             shipping_and_other = 0.0
-            
+
             if "booth" in platform_lower:
                 preset_item_total = 0.0
-                for item in items_data:
-                    target_p = self.db.query(Product).filter(Product.name == item["product_name"]).first()
+                for item in deposit_order.items:
+                    target_p = self.db.query(Product).filter(Product.name == item.product_name).first()
                     if target_p:
-                        target_c = next((c for c in target_p.colors if c.color_name == item["variant"]), None)
+                        target_c = next((c for c in target_p.colors if c.color_name == item.variant), None)
                         if target_c:
                             target_price = next((pr.price for pr in target_c.prices if pr.platform and pr.platform.lower() == "booth"), 0.0)
-                            preset_item_total += target_price * item["quantity"]
-                
+                            preset_item_total += target_price * item.quantity
                 if preset_item_total > 0:
                     shipping_and_other = max(0.0, gross_price - preset_item_total)
-                
                 base_fixed_fee = 45 if currency == "JPY" else 2.16
                 fee = math.ceil(gross_price * 0.056) + base_fixed_fee
-                
+
             elif "微店" in platform_lower:
                 fee = gross_price * 0.006
-                
+
             net_price = gross_price - fee - shipping_and_other
-            
+
             if net_price <= 0:
-                errors.append(f"订单号 {order_no}: 扣除手续费后的净金额({net_price:.2f}) 小于等于 0")
-                continue
-                
-            final_unit_price = net_price / total_qty
-            for item in items_data:
-                item["unit_price"] = final_unit_price
-                item["subtotal"] = item["quantity"] * final_unit_price
-                
+                self.errors.append(f"订单号 {order_no}: 扣除手续费后的净金额({net_price:.2f}) 小于等于 0")
+                return
+
             if "微店" in platform_lower: target_acc = "流动资金-微店账户"
             elif "booth" in platform_lower: target_acc = "流动资金-booth账户"
             elif currency == "JPY": target_acc = "流动资金-日元临时账户"
             else: target_acc = "流动资金-支付宝账户"
 
-            parsed_orders.append({
+            fake_items = [{"product_name": i.product_name, "variant": i.variant, "quantity": i.quantity, "warehouse_id": i.warehouse_id} for i in deposit_order.items]
+
+            self.parsed_orders.append({
                 "order_no": order_no, "platform": platform, "currency": currency,
                 "gross_price": gross_price, "fee": fee, "net_price": net_price,
-                "total_qty": total_qty, "items": items_data,
+                "total_qty": sum(i.quantity for i in deposit_order.items), "items": fake_items,
                 "target_account": target_acc,
                 "matched_deposit_id": matched_deposit_id,
-                "discount_note": discount_val
+                "discount_note": discount_val 
             })
+            return 
 
-        return parsed_orders, errors
+        platform = _safe_str(row['销售平台'])
+        currency = _safe_str(row['币种'])
+        p_name = _safe_str(row['商品名'])
 
-    def batch_create_orders(self, parsed_orders, presale_mode=None):
-        created_count = 0
-        for data in parsed_orders:
-            if presale_mode == "定金":
-                order, err = self.create_presale_deposit_order(
-                    items_data=data["items"], platform=data["platform"], currency=data["currency"], 
-                    notes="批量导入定金单", order_no=data["order_no"], target_account_name=data["target_account"],
-                    discount_note=data.get("discount_note", "")
-                )
-                if not err: created_count += 1
-            elif presale_mode == "尾款":
-                try:
-                    self.bind_presale_final_order(data["matched_deposit_id"], data["order_no"], data["net_price"], new_notes="批量绑定尾款")
-                    created_count += 1
-                except: pass
+        try: 
+            gross_price = float(row['订单总额'])
+        except (ValueError, TypeError):
+            self.errors.append(f"订单号 {order_no}: 总金额无效")
+            return
+
+        var_str = _safe_str(row['商品型号']).replace('；', ';')
+        qty_str = _safe_str(row['数量']).replace('；', ';')
+        wh_name_str = _safe_str(row.get('出货仓库', '')).replace('；', ';')
+
+        if not wh_name_str: 
+            wh_name_str = "未分配"
+
+        variants = [v.strip() for v in var_str.split(';') if v.strip()]
+        qtys_str = [q.strip() for q in qty_str.split(';') if q.strip()]
+        wh_names = [w.strip() for w in wh_name_str.split(';') if w.strip()]
+
+        if len(variants) != len(qtys_str):
+            self.errors.append(f"订单号 {order_no}: 商品型号数量 ({len(variants)}) 与 数量个数 ({len(qtys_str)}) 不一致！")
+            return
+
+        if len(variants) == 0:
+            self.errors.append(f"订单号 {order_no}: 未读取到商品型号")
+            return
+
+        if len(wh_names) == 1 and len(variants) > 1:
+            wh_names = wh_names * len(variants)
+        elif len(wh_names) != len(variants):
+            self.errors.append(f"订单号 {order_no}: 填写的出货仓库数量 ({len(wh_names)}) 与 型号数量 ({len(variants)}) 不一致！")
+            return
+
+        items_data = []
+        total_qty = 0
+        has_item_error = False
+
+        for v_name, q_str, wh_name in zip(variants, qtys_str, wh_names):
+            try:
+                qty = int(float(q_str))
+                if qty <= 0:
+                    self.errors.append(f"订单号 {order_no}: 数量必须大于0 ({q_str})")
+                    has_item_error = True; break
+            except ValueError:
+                self.errors.append(f"订单号 {order_no}: 数量格式无效 ({q_str})")
+                has_item_error = True; break
+
+            wh_id = self.warehouse_map.get(wh_name)
+            if wh_name != "未分配" and wh_id is None:
+                self.errors.append(f"订单号 {order_no}: 找不到名为 '{wh_name}' 的仓库！")
+                has_item_error = True; break
+
+            if p_name not in self.valid_products:
+                self.errors.append(f"订单号 {order_no}: 数据库中不存在商品 '{p_name}'")
+                has_item_error = True; break
+            elif v_name not in self.valid_products[p_name]:
+                self.errors.append(f"订单号 {order_no}: 商品 '{p_name}' 不存在型号 '{v_name}'")
+                has_item_error = True; break
             else:
-                order, err = self.create_order(
-                    items_data=data["items"], platform=data["platform"], currency=data["currency"], 
-                    notes="Excel批量导入", order_no=data["order_no"], target_account_name=data["target_account"]
-                )
-                if not err: created_count += 1
-        return created_count
+                if self.presale_mode != "定金":
+                    stock_key = f"{p_name}_{v_name}_{wh_id}"
+                    current_consumed = self.consumed_stock.get(stock_key, 0)
 
-    def commit(self):
-        self.db.commit()
\ No newline at end of file
+                    current_stock = self._current_stock(p_name, v_name, wh_id)
+
+                    if current_stock < current_consumed + qty:
+                        self.errors.append(f"订单号 {order_no}: '{p_name}-{v_name}' 在【{wh_name}】库存不足 (当前可用:{current_stock}, 表格内已占用:{current_consumed + qty})")
+                        has_item_error = True; break
+
+                    self.consumed_stock[stock_key] = current_consumed + qty
+
+                items_data.append({"product_name": p_name, "variant": v_name, "quantity": qty, "warehouse_id": wh_id})
+                total_qty += qty
+
+        if has_item_error: return
+
+        platform_lower = platform.lower()
+        fee = 0.0
+        shipping_and_other = 0.0
+
+        if "booth" in platform_lower:
+            preset_item_total = 0.0
+            for item in items_data:
+                target_p = self.db.query(Product).filter(Product.name == item["product_name"]).first()
+                if target_p:
+                    target_c = next((c for c in target_p.colors if c.color_name == item["variant"]), None)
+                    if target_c:
+                        target_price = next((pr.price for pr in target_c.prices if pr.platform and pr.platform.lower() == "booth"), 0.0)
+                        preset_item_total += target_price * item["quantity"]
+
+            if preset_item_total > 0:
+                shipping_and_other = max(0.0, gross_price - preset_item_total)
+
+            base_fixed_fee = 45 if currency == "JPY" else 2.16
+            fee = math.ceil(gross_price * 0.056) + base_fixed_fee
+
+        elif "微店" in platform_lower:
+            fee = gross_price * 0.006
+
+        net_price = gross_price - fee - shipping_and_other
+
+        if net_price <= 0:
+            self.errors.append(f"订单号 {order_no}: 扣除手续费后的净金额({net_price:.2f}) 小于等于 0")
+            return
+
+        final_unit_price = net_price / total_qty
+        for item in items_data:
+            item["unit_price"] = final_unit_price
+            item["subtotal"] = item["quantity"] * final_unit_price
+
+        if "微店" in platform_lower: target_acc = "流动资金-微店账户"
+        elif "booth" in platform_lower: target_acc = "流动资金-booth账户"
+        elif currency == "JPY": target_acc = "流动资金-日元临时账户"
+        else: target_acc = "流动资金-支付宝账户"
+
+        self.parsed_orders.append({
+            "order_no": order_no, "platform": platform, "currency": currency,
+            "gross_price": gross_price, "fee": fee, "net_price": net_price,
+            "total_qty": total_qty, "items": items_data,
+            "target_account": target_acc,
+            "matched_deposit_id": matched_deposit_id,
+            "discount_note": discount_val
+        })
+
+
+# ================= 后台任务入口 (Excel 批量导入) =================
+
+def order_import_parse_job(ctx, bind, file_bytes, exchange_rate, presale_mode=None):
+    """分块读取并校验上传的 Excel (openpyxl 只读模式，单号 / SKU 列按文本读取)，返回 (parsed_orders, errors)"""
+    ctx.progress(0, 1, "读取 Excel")
+    reader = ExcelChunkReader(file_bytes, text_columns=ORDER_TEXT_COLUMNS, number_columns=ORDER_NUMBER_COLUMNS)
+    with session_manager.scope(bind) as db:
+        validator = OrderImportValidator(db, exchange_rate, presale_mode=presale_mode)
+        parsed, errors = None, None
+        for chunk in reader:
+            if validator.rows_seen == 0:
+                errors = validator.check_columns(chunk.columns)
+                if errors: break
+            validator.feed(chunk, progress=ctx.progress, total=reader.total_rows)
+        if not errors:
+            parsed, errors = validator.finish()
+    # 列缺失等整体性错误返回的是单条字符串
+    if isinstance(errors, str): errors = [errors]
+    parsed, errors = parsed or [], errors or []
+    ctx.summary = f"校验失败 ({len(errors)} 项问题)" if errors else f"校验通过，{len(parsed)} 个单据"
+    return parsed, errors
+
+
+def order_import_create_job(ctx, bind, parsed_orders, presale_mode=None):
+    """按校验结果逐单创建 / 绑定订单，返回成功数量"""
+    with session_manager.scope(bind) as db:
+        count = SalesOrderService(db).batch_create_orders(parsed_orders, presale_mode=presale_mode, progress=ctx.progress)
+    ctx.summary = f"成功处理 {count} / {len(parsed_orders)} 个单据"
+    return count
\ No newline at end of file
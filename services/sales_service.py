@@ -1,8 +1,19 @@
 # services/sales_service.py
 import pandas as pd
-from sqlalchemy import or_
+from sqlalchemy import or_, func
 from models import InventoryLog, SalesOrder, OrderRefund, SalesOrderItem
-from constants import Currency, StockLogReason
+from constants import Currency, StockLogReason, OrderStatus
+from services.query_profiler import profiled
+
+V2_COLUMNS = ["id", "date", "product", "variant", "platform", "currency", "qty", "amount", "type"]
+
+def _is_falsy(series):
+    """与 Python 真值判断一致：None/NaN/空字符串 视为假"""
+    return series.isna() | (series == "")
+
+def _fill_falsy(series, default):
+    """等价于逐行的 `value or default`"""
+    return series.where(~_is_falsy(series), default)
 
 class SalesService:
     """
@@ -10,57 +21,78 @@ class SalesService:
     """
 
     # ==================== V2.0 终极极简架构 (A方案/新版) ====================
+    # 🚀 输入数据固定 3 次 JOIN 查询取回，输出由 pandas 向量化拼装 (结果与逐行版本完全一致)
     @staticmethod
+    @profiled()
     def process_sales_data_v2(db):
         if not db: return pd.DataFrame()
-        data_list = []
+        parts = []
 
         # 1. 销售额与销量 (订单表)
-        orders = db.query(SalesOrder).filter(
+        sale_rows = db.query(
+            SalesOrderItem.id, SalesOrder.created_date, SalesOrderItem.product_name, SalesOrderItem.variant,
+            SalesOrder.platform, SalesOrder.currency, SalesOrderItem.quantity, SalesOrderItem.subtotal
+        ).join(SalesOrder, SalesOrderItem.order_id == SalesOrder.id).filter(
             SalesOrder.status.in_(["已发货", "订单完成", "售后中"])
-        ).all()
-
-        for o in orders:
-            for item in o.items:
-                data_list.append({
-                    "id": f"O_{item.id}", "date": o.created_date, "product": item.product_name,
-                    "variant": item.variant, "platform": o.platform, "currency": o.currency,
-                    "qty": item.quantity, "amount": item.subtotal, "type": "sale"
-                })
-
-        # 2. 售后退款金额 (只精准扣钱，不碰数量)
-        refunds = db.query(OrderRefund).all()
-        for r in refunds:
-            o = r.order
-            if not o: continue
-            order_items_total = sum(i.subtotal for i in o.items)
-            for item in o.items:
-                allocated_refund = (item.subtotal / order_items_total * r.refund_amount) if order_items_total > 0 else 0
-                if allocated_refund > 0:
-                    data_list.append({
-                        "id": f"R_{r.id}_{item.id}", "date": r.refund_date, "product": item.product_name,
-                        "variant": item.variant, "platform": o.platform, "currency": o.currency,
-                        "qty": 0, "amount": -allocated_refund, "type": "refund"
-                    })
-
-        # 3. 退货实物数量 (只精准扣数量，不碰钱)
-        return_logs = db.query(InventoryLog).filter(
+        ).order_by(SalesOrder.id, SalesOrderItem.id).all()
+
+        if sale_rows:
+            df_sale = pd.DataFrame(sale_rows, columns=["item_id", "date", "product", "variant", "platform", "currency", "qty", "amount"])
+            df_sale["id"] = "O_" + df_sale["item_id"].astype(str)
+            df_sale["type"] = "sale"
+            parts.append(df_sale[V2_COLUMNS])
+
+        # 2. 售后退款金额 (只精准扣钱，不碰数量)：退款 × 订单明细一次 JOIN，按明细金额占比分摊
+        refund_rows = db.query(
+            OrderRefund.id, OrderRefund.refund_date, OrderRefund.refund_amount,
+            SalesOrderItem.id, SalesOrderItem.order_id, SalesOrderItem.product_name, SalesOrderItem.variant, SalesOrderItem.subtotal,
+            SalesOrder.platform, SalesOrder.currency
+        ).select_from(OrderRefund)\
+         .join(SalesOrder, OrderRefund.order_id == SalesOrder.id)\
+         .join(SalesOrderItem, SalesOrderItem.order_id == SalesOrder.id)\
+         .order_by(OrderRefund.id, SalesOrderItem.id).all()
+
+        if refund_rows:
+            df_ref = pd.DataFrame(refund_rows, columns=[
+                "refund_id", "date", "refund_amount", "item_id", "order_id", "product", "variant", "subtotal", "platform", "currency"
+            ])
+            # 订单明细总额按明细顺序逐项累加 (与逐行版本的 sum() 浮点结果一致)
+            order_items = df_ref.drop_duplicates("item_id")
+            order_totals = {}
+            for order_id, subtotal in zip(order_items["order_id"], order_items["subtotal"]):
+                order_totals[order_id] = order_totals.get(order_id, 0) + subtotal
+
+            total = df_ref["order_id"].map(order_totals)
+            allocated = (df_ref["subtotal"] / total * df_ref["refund_amount"]).where(total > 0, 0)
+            df_ref = df_ref[allocated > 0].assign(amount=-allocated[allocated > 0], qty=0, type="refund")
+            if not df_ref.empty:
+                df_ref["id"] = "R_" + df_ref["refund_id"].astype(str) + "_" + df_ref["item_id"].astype(str)
+                parts.append(df_ref[V2_COLUMNS])
+
+        # 3. 退货实物数量 (只精准扣数量，不碰钱)：关联订单 LEFT JOIN 一次取回
+        return_rows = db.query(
+            InventoryLog.id, InventoryLog.date, InventoryLog.product_name, InventoryLog.variant, InventoryLog.change_amount,
+            InventoryLog.platform, InventoryLog.currency, SalesOrder.id, SalesOrder.platform, SalesOrder.currency
+        ).outerjoin(SalesOrder, InventoryLog.order_id == SalesOrder.id).filter(
             InventoryLog.is_sold == True,
             InventoryLog.reason == "退货入库"
-        ).all()
-
-        for log in return_logs:
-            o = db.query(SalesOrder).filter(SalesOrder.id == log.order_id).first() if log.order_id else None
-            platform = o.platform if o else (log.platform or "未知")
-            currency = o.currency if o else (log.currency or "CNY")
+        ).order_by(InventoryLog.id).all()
 
-            data_list.append({
-                "id": f"Ret_{log.id}", "date": log.date, "product": log.product_name,
-                "variant": log.variant, "platform": platform, "currency": currency,
-                "qty": -abs(log.change_amount), "amount": 0.0, "type": "return"
-            })
+        if return_rows:
+            df_ret = pd.DataFrame(return_rows, columns=[
+                "log_id", "date", "product", "variant", "change", "log_platform", "log_currency", "o_id", "o_platform", "o_currency"
+            ])
+            has_order = df_ret["o_id"].notna()
+            df_ret["platform"] = df_ret["o_platform"].where(has_order, _fill_falsy(df_ret["log_platform"], "未知"))
+            df_ret["currency"] = df_ret["o_currency"].where(has_order, _fill_falsy(df_ret["log_currency"], "CNY"))
+            df_ret["qty"] = -df_ret["change"].abs()
+            df_ret["amount"] = 0.0
+            df_ret["type"] = "return"
+            df_ret["id"] = "Ret_" + df_ret["log_id"].astype(str)
+            parts.append(df_ret[V2_COLUMNS])
 
-        return pd.DataFrame(data_list)
+        if not parts: return pd.DataFrame()
+        return pd.concat(parts, ignore_index=True)
 
     # ==================== V1.0 物理库存版 (更新前旧版) ====================
     @staticmethod
@@ -74,66 +106,154 @@ class SalesService:
 
     @staticmethod
     def process_sales_data_v1(db, all_logs):
+        """
+        🚀 订单平台/币种与撤销明细单价各一次批量查询预取，分类与金额计算全部向量化
+        (结果与逐行查询版本完全一致)
+        """
         if not all_logs: return pd.DataFrame()
-        raw_data_list = []
-        
-        for log in all_logs:
-            item = {
-                "id": log.id, "date": log.date, "product": log.product_name,
-                "variant": log.variant, "platform": log.platform, 
-                "currency": log.currency, "qty": 0, "amount": 0.0, "type": "unknown"
-            }
-            
-            if (not item["platform"] or not item["currency"]) and getattr(log, 'order_id', None):
-                order = db.query(SalesOrder).filter(SalesOrder.id == log.order_id).first()
-                if order:
-                    item["platform"] = item["platform"] or order.platform
-                    item["currency"] = item["currency"] or order.currency
-                    
-            item["platform"] = item["platform"] or "其他/未知"
-            item["currency"] = item["currency"] or Currency.CNY
-
-            if log.is_sold and log.change_amount < 0:
-                item["qty"] = -log.change_amount 
-                item["amount"] = log.sale_amount or 0
-                item["type"] = "sale"
-            elif log.is_sold and log.change_amount > 0:
-                item["qty"] = -log.change_amount 
-                item["amount"] = log.sale_amount or 0 
-                item["type"] = "return"
-            elif log.reason == "发货撤销":
-                deduct_qty = log.change_amount
-                item["qty"] = -deduct_qty 
-                item["type"] = "undo"
-                if log.sale_amount and log.sale_amount != 0:
-                    item["amount"] = -abs(log.sale_amount)
-                else:
-                    if getattr(log, 'order_id', None):
-                        order_item = db.query(SalesOrderItem).filter(
-                            SalesOrderItem.order_id == log.order_id,
-                            SalesOrderItem.product_name == log.product_name,
-                            SalesOrderItem.variant == log.variant
-                        ).first()
-                        if order_item:
-                            item["amount"] = -(order_item.unit_price * deduct_qty)
-                    else:
-                        item["amount"] = 0
-
-            raw_data_list.append(item)
-            
-        return pd.DataFrame(raw_data_list)
+        df = pd.DataFrame([{
+            "id": log.id, "date": log.date, "product": log.product_name, "variant": log.variant,
+            "platform": log.platform, "currency": log.currency, "order_id": getattr(log, 'order_id', None),
+            "change": log.change_amount, "sale_amount": log.sale_amount, "is_sold": bool(log.is_sold), "reason": log.reason
+        } for log in all_logs])
+
+        has_order_id = df["order_id"].notna() & (df["order_id"] != 0)
+        sale_amt_truthy = df["sale_amount"].notna() & (df["sale_amount"] != 0)
+
+        # 1. 平台/币种缺失时回落到关联订单 (一次查询)
+        need_order = has_order_id & (_is_falsy(df["platform"]) | _is_falsy(df["currency"]))
+        order_ids = {int(x) for x in df.loc[need_order, "order_id"]}
+        order_map = {}
+        if order_ids:
+            order_map = {o_id: (pf, cur) for o_id, pf, cur in db.query(
+                SalesOrder.id, SalesOrder.platform, SalesOrder.currency
+            ).filter(SalesOrder.id.in_(order_ids)).all()}
+        o_info = df["order_id"].where(need_order).map(lambda x: order_map.get(int(x)) if pd.notna(x) else None)
+        o_platform = o_info.map(lambda t: t[0] if t else None)
+        o_currency = o_info.map(lambda t: t[1] if t else None)
+
+        platform = df["platform"].where(~_is_falsy(df["platform"]), o_platform)
+        currency = df["currency"].where(~_is_falsy(df["currency"]), o_currency)
+
+        # 2. 分类 (顺序与逐行版本的 if/elif 一致)
+        is_sale = df["is_sold"] & (df["change"] < 0)
+        is_return = df["is_sold"] & (df["change"] > 0) & ~is_sale
+        is_undo = (df["reason"] == "发货撤销") & ~is_sale & ~is_return
+        is_known = is_sale | is_return | is_undo
+
+        # 3. 撤销且无金额的流水：按 (订单, 商品, 款式) 取第一条明细单价 (一次查询)
+        need_item = is_undo & ~sale_amt_truthy & has_order_id
+        item_price = pd.Series(float("nan"), index=df.index)
+        if need_item.any():
+            item_ids = {int(x) for x in df.loc[need_item, "order_id"]}
+            price_map = {}
+            for o_id, p_name, v_name, unit_price in db.query(
+                SalesOrderItem.order_id, SalesOrderItem.product_name, SalesOrderItem.variant, SalesOrderItem.unit_price
+            ).filter(SalesOrderItem.order_id.in_(item_ids)).order_by(SalesOrderItem.id).all():
+                price_map.setdefault((o_id, p_name, v_name), unit_price)
+            keys = df.loc[need_item, ["order_id", "product", "variant"]]
+            item_price.loc[need_item] = [price_map.get((int(o), p, v), float("nan")) for o, p, v in keys.itertuples(index=False)]
+
+        qty = (-df["change"]).where(is_known, 0)
+
+        sale_amt = df["sale_amount"].where(sale_amt_truthy, 0)
+        undo_amt = (-df["sale_amount"].abs()).where(
+            sale_amt_truthy,
+            (-(item_price * df["change"])).where(item_price.notna(), 0.0).where(has_order_id, 0)
+        )
+        amount = sale_amt.where(is_sale | is_return, undo_amt.where(is_undo, 0.0))
+
+        # 逐行版本中 "sale_amount or 0" / 无订单撤销 产生的是整数 0：全部为整数 0 时保持整型列
+        int_zero = ((is_sale | is_return) & ~sale_amt_truthy) | (is_undo & ~sale_amt_truthy & ~has_order_id)
+        amount = amount.astype("int64") if int_zero.all() else amount.astype("float64")
+
+        out = pd.DataFrame({
+            "id": df["id"], "date": df["date"], "product": df["product"], "variant": df["variant"],
+            "platform": _fill_falsy(platform, "其他/未知"), "currency": _fill_falsy(currency, Currency.CNY),
+            "qty": qty, "amount": amount,
+            "type": pd.Series("unknown", index=df.index).mask(is_sale, "sale").mask(is_return, "return").mask(is_undo, "undo")
+        })
+        return out
+
+    # ==================== 单品销售汇总 (SQL 聚合) ====================
+    @staticmethod
+    def get_product_sales_summary(db, product_name, date_range=None):
+        """
+        单品销售汇总，口径同 V2：订单销量/销售额 - 按金额占比分摊的退款 - 退货入库数量。
+        全部在数据库端分组聚合，不再拉取全量销售明细。
+        date_range: (起始日期, 结束日期) 闭区间，分别作用于 下单日期 / 退款日期 / 退货日期
+        返回 DataFrame: variant, platform, currency, sold_qty, return_qty, qty, gross, refund, amount
+        """
+        cols = ["variant", "platform", "currency", "sold_qty", "return_qty", "qty", "gross", "refund", "amount"]
+        start, end = date_range if date_range else (None, None)
+        rows = {}
+
+        def bucket(variant, platform, currency):
+            key = (variant, platform or "未知", currency or Currency.CNY)
+            if key not in rows:
+                rows[key] = {"sold_qty": 0, "return_qty": 0, "gross": 0.0, "refund": 0.0}
+            return rows[key]
+
+        # 1. 销量与销售额 (已发货/完成/售后)
+        sale_q = db.query(
+            SalesOrderItem.variant, SalesOrder.platform, SalesOrder.currency,
+            func.sum(SalesOrderItem.quantity), func.sum(SalesOrderItem.subtotal)
+        ).join(SalesOrder, SalesOrderItem.order_id == SalesOrder.id).filter(
+            SalesOrderItem.product_name == product_name,
+            SalesOrder.status.in_([OrderStatus.SHIPPED, OrderStatus.COMPLETED, OrderStatus.AFTER_SALES])
+        )
+        if start: sale_q = sale_q.filter(SalesOrder.created_date >= start)
+        if end: sale_q = sale_q.filter(SalesOrder.created_date <= end)
+        for variant, platform, currency, qty, amount in sale_q.group_by(SalesOrderItem.variant, SalesOrder.platform, SalesOrder.currency).all():
+            b = bucket(variant, platform, currency)
+            b["sold_qty"] += int(qty or 0)
+            b["gross"] += amount or 0.0
+
+        # 2. 退款：每笔退款按明细金额占订单明细总额的比例分摊到本商品各款式
+        order_total = db.query(
+            SalesOrderItem.order_id, func.sum(SalesOrderItem.subtotal).label("total")
+        ).group_by(SalesOrderItem.order_id).subquery()
+        refund_q = db.query(
+            SalesOrderItem.variant, SalesOrder.platform, SalesOrder.currency,
+            func.sum(SalesOrderItem.subtotal * OrderRefund.refund_amount / order_total.c.total)
+        ).select_from(OrderRefund)\
+         .join(SalesOrder, OrderRefund.order_id == SalesOrder.id)\
+         .join(SalesOrderItem, SalesOrderItem.order_id == SalesOrder.id)\
+         .join(order_total, order_total.c.order_id == SalesOrder.id)\
+         .filter(SalesOrderItem.product_name == product_name, order_total.c.total > 0)
+        if start: refund_q = refund_q.filter(OrderRefund.refund_date >= start)
+        if end: refund_q = refund_q.filter(OrderRefund.refund_date <= end)
+        for variant, platform, currency, refund in refund_q.group_by(SalesOrderItem.variant, SalesOrder.platform, SalesOrder.currency).all():
+            bucket(variant, platform, currency)["refund"] += refund or 0.0
+
+        # 3. 退货实物数量 (平台/币种优先取关联订单)
+        platform_col = func.coalesce(SalesOrder.platform, InventoryLog.platform)
+        currency_col = func.coalesce(SalesOrder.currency, InventoryLog.currency)
+        return_q = db.query(
+            InventoryLog.variant, platform_col, currency_col, func.sum(func.abs(InventoryLog.change_amount))
+        ).outerjoin(SalesOrder, InventoryLog.order_id == SalesOrder.id).filter(
+            InventoryLog.product_name == product_name,
+            InventoryLog.is_sold == True,
+            InventoryLog.reason == StockLogReason.RETURN_IN
+        )
+        if start: return_q = return_q.filter(InventoryLog.date >= start)
+        if end: return_q = return_q.filter(InventoryLog.date <= end)
+        for variant, platform, currency, qty in return_q.group_by(InventoryLog.variant, platform_col, currency_col).all():
+            bucket(variant, platform, currency)["return_qty"] += int(qty or 0)
+
+        if not rows: return pd.DataFrame(columns=cols)
+        df = pd.DataFrame([
+            {"variant": v, "platform": p, "currency": c, **b} for (v, p, c), b in rows.items()
+        ])
+        df["qty"] = df["sold_qty"] - df["return_qty"]
+        df["amount"] = df["gross"] - df["refund"]
+        return df[cols]
 
     # ==================== 共享榜单方法 ====================
     @staticmethod
     def get_product_leaderboard(df, exchange_rate=0.048):
+        """产品榜单 (向量化实现见 SalesAnalyticsService.leaderboard)"""
+        from services.sales_analytics_service import SalesAnalyticsService
         if df.empty: return pd.DataFrame()
-        df_prod_summary = df.groupby('product').apply(
-            lambda x: pd.Series({
-                'CNY总额': x[x['currency'] == 'CNY']['amount'].sum(),
-                'JPY总额': x[x['currency'] == 'JPY']['amount'].sum()
-            }),
-            include_groups=False  
-        ).reset_index()
-        df_prod_summary['折合CNY总额'] = df_prod_summary['CNY总额'] + (df_prod_summary['JPY总额'] * exchange_rate)
-        df_prod_summary = df_prod_summary.sort_values(by='折合CNY总额', ascending=False)
-        return df_prod_summary[['product', '折合CNY总额', 'CNY总额', 'JPY总额']]
\ No newline at end of file
+        board = SalesAnalyticsService.leaderboard(df, "product", exchange_rate)
+        return board[['product', '折合CNY总额', 'CNY总额', 'JPY总额']]
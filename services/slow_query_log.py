@@ -0,0 +1,269 @@
+# services/slow_query_log.py
+"""
+慢查询日志：挂在业务库 Engine 上，执行耗时超过阈值的语句连同参数、发起查询的业务函数
+以及执行计划 (PostgreSQL: EXPLAIN，SQLite: EXPLAIN QUERY PLAN) 写入本地指标库 (services/metrics_store)，
+只保留最近 SLOW_QUERY_KEEP 条。请求路径上只做不执行语句的 EXPLAIN；
+开启 YURARA_SLOW_QUERY_ANALYZE 后，PostgreSQL 的慢 SELECT 由后台写入线程另取连接在只读事务中
+EXPLAIN (ANALYZE, BUFFERS)，实际耗时与缓冲区命中替换请求路径上的估算计划。
+
+    YURARA_SLOW_QUERY_MS=200          慢查询阈值 (毫秒)，0 关闭
+    YURARA_SLOW_QUERY_KEEP=2000       保留条数
+    YURARA_SLOW_QUERY_ANALYZE=0       1 = 后台线程补抓 EXPLAIN ANALYZE (会把慢查询在主库上再执行一遍)
+    YURARA_SLOW_QUERY_ANALYZE_MS=5000 后台 EXPLAIN ANALYZE 的语句超时 (毫秒)
+"""
+import os
+import sys
+import time
+import queue
+import threading
+from datetime import datetime
+
+from sqlalchemy import event, func
+
+from services.query_profiler import statement_shape
+from services.metrics_store import SlowQueryLog, metrics_session
+
+SLOW_QUERY_MS = float(os.getenv("YURARA_SLOW_QUERY_MS", "200"))
+SLOW_QUERY_KEEP = int(os.getenv("YURARA_SLOW_QUERY_KEEP", "2000"))
+SLOW_QUERY_ANALYZE = os.getenv("YURARA_SLOW_QUERY_ANALYZE", "0") == "1"
+SLOW_QUERY_ANALYZE_MS = int(os.getenv("YURARA_SLOW_QUERY_ANALYZE_MS", "5000"))
+# 同一语句形状的执行计划最多每 PLAN_INTERVAL 秒抓取一次 (EXPLAIN ANALYZE 会把慢查询再执行一遍)
+PLAN_INTERVAL = 600
+MAX_TEXT = 4000
+
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+_THIS_FILE = os.path.abspath(__file__)
+
+
+def _find_caller():
+    """调用栈中最内层的项目代码帧 (跳过 SQLAlchemy / 第三方库与本模块)：'services/x.py:函数:行号'"""
+    frame = sys._getframe(2)
+    while frame is not None:
+        path = os.path.abspath(frame.f_code.co_filename)
+        if path.startswith(_PROJECT_ROOT) and path != _THIS_FILE and "site-packages" not in path:
+            return f"{os.path.relpath(path, _PROJECT_ROOT)}:{frame.f_code.co_name}:{frame.f_lineno}"
+        frame = frame.f_back
+    return None
+
+
+def _format_sqlite_plan(rows):
+    """EXPLAIN QUERY PLAN 的 (id, parent, notused, detail) 行按父子关系缩进"""
+    depth = {0: -1}
+    lines = []
+    for node_id, parent, _, detail in rows:
+        depth[node_id] = depth.get(parent, -1) + 1
+        lines.append("  " * depth[node_id] + detail)
+    return "\n".join(lines)
+
+
+def _explain(dialect, cursor, statement, parameters):
+    """
+    在原 DBAPI 连接上另开游标抓取执行计划 (不经过 SQLAlchemy，不会再次触发事件)。
+    只做不执行语句的 EXPLAIN，不占用请求时间；PostgreSQL 包在 SAVEPOINT 中，
+    EXPLAIN 失败不会让调用方的事务进入 aborted 状态。
+    """
+    raw = cursor.connection.cursor()
+    try:
+        if dialect == "sqlite":
+            raw.execute("EXPLAIN QUERY PLAN " + statement, parameters)
+            return _format_sqlite_plan(raw.fetchall())
+        if dialect == "postgresql":
+            raw.execute("SAVEPOINT yurara_slow_query_explain")
+            try:
+                raw.execute("EXPLAIN " + statement, parameters)
+                plan = "\n".join(r[0] for r in raw.fetchall())
+                raw.execute("RELEASE SAVEPOINT yurara_slow_query_explain")
+                return plan
+            except Exception:
+                raw.execute("ROLLBACK TO SAVEPOINT yurara_slow_query_explain")
+                raise
+        return None
+    finally:
+        raw.close()
+
+
+def _explain_analyze(engine, statement, parameters):
+    """
+    后台线程中另取一条连接 (raw_connection，不触发慢查询事件) 执行 EXPLAIN (ANALYZE, BUFFERS)：
+    只读事务 + 语句超时，结束后回滚，不影响业务连接与数据。
+    """
+    raw_conn = engine.raw_connection()
+    try:
+        cur = raw_conn.cursor()
+        try:
+            cur.execute("SET TRANSACTION READ ONLY")
+            cur.execute(f"SET LOCAL statement_timeout = {SLOW_QUERY_ANALYZE_MS}")
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + statement, parameters)
+            return "\n".join(r[0] for r in cur.fetchall())
+        finally:
+            cur.close()
+            raw_conn.rollback()
+    finally:
+        raw_conn.close()
+
+
+class SlowQueryLogger:
+    """
+    按 Engine 挂载的慢查询记录器。计时在事件回调中完成，
+    写入指标库交给单个守护线程 (与 metrics_sync_queue 相同的做法)，不占用前台请求时间。
+    """
+
+    def __init__(self):
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._worker = None
+        self._engines = set()        # 已挂载的 Engine id
+        self._plan_captured = {}     # 语句形状 -> 上次抓取执行计划的时间
+
+    def attach(self, engine, threshold_ms=None):
+        """为 Engine 挂载慢查询记录 (幂等)；阈值 <= 0 时不挂载"""
+        threshold = (SLOW_QUERY_MS if threshold_ms is None else threshold_ms) / 1000
+        if threshold <= 0: return engine
+        with self._lock:
+            if id(engine) in self._engines: return engine
+            self._engines.add(id(engine))
+
+        dialect = engine.dialect.name
+        database = os.path.basename(engine.url.database or "") or None
+
+        def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            conn.info.setdefault("_slow_query_start", []).append(time.perf_counter())
+
+        def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+            starts = conn.info.get("_slow_query_start")
+            if not starts: return
+            elapsed = time.perf_counter() - starts.pop()
+            if elapsed < threshold: return
+            self._record(engine, dialect, database, cursor, statement, parameters, executemany, elapsed)
+
+        def handle_error(exception_context):
+            conn = exception_context.connection
+            starts = conn.info.get("_slow_query_start") if conn is not None else None
+            if starts: starts.pop()
+
+        event.listen(engine, "before_cursor_execute", before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", after_cursor_execute)
+        event.listen(engine, "handle_error", handle_error)
+        return engine
+
+    def _record(self, engine, dialect, database, cursor, statement, parameters, executemany, elapsed):
+        shape = statement_shape(statement)
+        rowcount = cursor.rowcount if cursor.rowcount is not None and cursor.rowcount >= 0 else None
+        plan, analyze = None, None
+        now = time.monotonic()
+        if not executemany and now - self._plan_captured.get(shape, -PLAN_INTERVAL) >= PLAN_INTERVAL:
+            self._plan_captured[shape] = now
+            try:
+                plan = _explain(dialect, cursor, statement, parameters)
+            except Exception as e:
+                plan = f"⚠️ 执行计划获取失败: {e}"
+            # 写语句 ANALYZE 会真实执行一遍，只对 SELECT 补抓
+            if SLOW_QUERY_ANALYZE and dialect == "postgresql" and statement.lstrip().upper().startswith("SELECT"):
+                analyze = (engine, statement, parameters)
+        self._queue.put({
+            "recorded_at": datetime.now(), "dialect": dialect, "database": database,
+            "duration_ms": elapsed * 1000, "shape": shape, "statement": statement[:MAX_TEXT],
+            "parameters": repr(parameters)[:MAX_TEXT], "caller": _find_caller(), "rowcount": rowcount, "plan": plan,
+            "_analyze": analyze,
+        })
+        with self._lock:
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(target=self._run, name="slow-query-log", daemon=True)
+                self._worker.start()
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            for entry in batch:
+                analyze = entry.pop("_analyze", None)
+                if analyze is None: continue
+                try:
+                    entry["plan"] = _explain_analyze(*analyze)
+                except Exception as e:
+                    entry["plan"] = f"{entry['plan'] or ''}\n⚠️ EXPLAIN ANALYZE 失败: {e}".strip()
+            db = metrics_session()
+            try:
+                db.bulk_insert_mappings(SlowQueryLog, batch)
+                # 轮转：只保留最近 SLOW_QUERY_KEEP 条
+                max_id = db.query(func.max(SlowQueryLog.id)).scalar() or 0
+                db.query(SlowQueryLog).filter(SlowQueryLog.id <= max_id - SLOW_QUERY_KEEP).delete(synchronize_session=False)
+                db.commit()
+            except Exception as e:
+                db.rollback()
+                print(f"⚠️ 慢查询日志写入失败: {e}")
+            finally:
+                db.close()
+                for _ in batch:
+                    self._queue.task_done()
+
+    def wait_until_idle(self):
+        """阻塞直到待写入的慢查询全部落库 (查看页面 / 脚本使用)"""
+        self._queue.join()
+
+
+# 全局单例：App 与 Bot 进程内共享
+slow_query_logger = SlowQueryLogger()
+
+def attach_slow_query_log(engine, threshold_ms=None):
+    return slow_query_logger.attach(engine, threshold_ms)
+
+
+# ================= 查看 =================
+
+class SlowQueryLogService:
+    @staticmethod
+    def get_summary():
+        """
+        按语句形状归并：[形状, 次数, 总耗时(ms), 平均(ms), 最大(ms), 主要来源, 全表扫描, 最近一次]，按总耗时降序。
+        「全表扫描」取自最近抓到的执行计划 (SQLite: SCAN 表，PostgreSQL: Seq Scan)。
+        """
+        import pandas as pd
+        cols = ["形状", "次数", "总耗时(ms)", "平均(ms)", "最大(ms)", "主要来源", "全表扫描", "最近一次"]
+        db = metrics_session()
+        try:
+            rows = db.query(
+                SlowQueryLog.shape, SlowQueryLog.duration_ms, SlowQueryLog.caller, SlowQueryLog.plan, SlowQueryLog.recorded_at
+            ).all()
+        finally:
+            db.close()
+        if not rows: return pd.DataFrame(columns=cols)
+
+        df = pd.DataFrame(rows, columns=["shape", "ms", "caller", "plan", "at"])
+        result = []
+        for shape, g in df.groupby("shape", sort=False):
+            plans = g.dropna(subset=["plan"]).sort_values("at")["plan"]
+            plan = plans.iloc[-1] if not plans.empty else ""
+            callers = g["caller"].dropna()
+            result.append([
+                shape, len(g), g["ms"].sum(), g["ms"].mean(), g["ms"].max(),
+                callers.mode().iloc[0] if not callers.empty else None,
+                ("Seq Scan" in plan) or any(line.strip().startswith("SCAN ") for line in plan.splitlines()),
+                g["at"].max(),
+            ])
+        return pd.DataFrame(result, columns=cols).sort_values("总耗时(ms)", ascending=False).reset_index(drop=True)
+
+    @staticmethod
+    def get_entries(shape=None, limit=200):
+        """最近的慢查询记录 (可按语句形状筛选)"""
+        db = metrics_session()
+        try:
+            q = db.query(SlowQueryLog)
+            if shape: q = q.filter(SlowQueryLog.shape == shape)
+            return q.order_by(SlowQueryLog.id.desc()).limit(limit).all()
+        finally:
+            db.close()
+
+    @staticmethod
+    def clear():
+        slow_query_logger.wait_until_idle()
+        db = metrics_session()
+        try:
+            db.query(SlowQueryLog).delete()
+            db.commit()
+        finally:
+            db.close()
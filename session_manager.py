@@ -0,0 +1,188 @@
+# session_manager.py
+"""
+请求级 Session 生命周期：
+- 每次完整的脚本运行由 app.py 在 request_scope 中打开一个 Session，运行结束 (含 st.rerun / st.stop) 时关闭；
+- 局部刷新 (fragment) 单独重跑时，整页的 Session 已经关闭，fragment 里继续使用会隐式重新占用连接，
+  用 fragment 装饰器包裹后每次局部重跑结束都会释放传入的 Session；
+- 所有经由本模块创建的 Session 都会登记，open_sessions() 给出当前未关闭的数量，用于确认连接占用有界；
+- 只读 Session (new_read_session / read_scope / read_session) 绑定主库登记的只读副本 (engine_factory.register_read_replica)，
+  副本不可用或延迟过大时自动读回主库；只读 Session 上 flush 写入会直接报错，写操作始终走主库。
+"""
+import time
+import threading
+import functools
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+import streamlit as st
+from sqlalchemy import event
+from sqlalchemy.orm import Session, sessionmaker
+
+from engine_factory import read_engine
+
+
+class TrackedSession(Session):
+    """登记打开 / 关闭状态的 Session；close() 之后再次使用会重新开启事务，同样计为打开"""
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        session_manager._mark_open(self)
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            session_manager._mark_closed(self)
+
+
+@event.listens_for(TrackedSession, "after_begin")
+def _reopened(session, transaction, connection):
+    session_manager._mark_open(session)
+
+
+@event.listens_for(TrackedSession, "before_flush")
+def _reject_read_only_writes(session, flush_context, instances):
+    if session.info.get("read_only") and (session.new or session.dirty or session.deleted):
+        raise RuntimeError("只读 Session (可能连接只读副本) 不能写入，请使用主库 Session")
+
+
+class SessionManager:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open = weakref.WeakSet()   # 尚未关闭的 Session (被回收的自动移除)
+        self._makers = {}                # id(Engine) -> sessionmaker
+        self._request = ContextVar("request_session", default=None)
+        self._request_read = ContextVar("request_read_sessions", default=None)  # 主库 Engine id -> 只读 Session
+        self.opened_total = 0
+        self.peak_open = 0
+
+    # ---------- 登记 ----------
+    def _mark_open(self, session):
+        with self._lock:
+            if session in self._open: return
+            session.opened_at = time.monotonic()
+            self._open.add(session)
+            self.opened_total += 1
+            self.peak_open = max(self.peak_open, len(self._open))
+
+    def _mark_closed(self, session):
+        with self._lock:
+            self._open.discard(session)
+
+    # ---------- 创建 ----------
+    def new_session(self, engine):
+        """绑定 engine 的新 Session (调用方负责 close，或使用 scope)"""
+        key = id(engine)
+        maker = self._makers.get(key)
+        if maker is None:
+            with self._lock:
+                maker = self._makers.setdefault(key, sessionmaker(bind=engine, class_=TrackedSession, autocommit=False, autoflush=False))
+        return maker()
+
+    def new_read_session(self, engine):
+        """只读查询用的新 Session：绑定 engine 的只读副本 (不可用时为 engine 本身)，调用方负责 close"""
+        bind = read_engine(engine)
+        key = ("read", id(bind))
+        maker = self._makers.get(key)
+        if maker is None:
+            with self._lock:
+                maker = self._makers.setdefault(key, sessionmaker(
+                    bind=bind, class_=TrackedSession, autocommit=False, autoflush=False, info={"read_only": True}
+                ))
+        return maker()
+
+    @contextmanager
+    def read_scope(self, engine):
+        session = self.new_read_session(engine)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @contextmanager
+    def scope(self, engine):
+        """with 块内有效的 Session，退出时关闭"""
+        session = self.new_session(engine)
+        try:
+            yield session
+        finally:
+            session.close()
+
+    @contextmanager
+    def request_scope(self, engine):
+        """一次完整脚本运行的 Session；运行期间 current() 返回它"""
+        with self.scope(engine) as session:
+            token = self._request.set(session)
+            read_token = self._request_read.set({})
+            try:
+                yield session
+            finally:
+                for read_session in self._request_read.get().values():
+                    read_session.close()
+                self._request_read.reset(read_token)
+                self._request.reset(token)
+
+    def current(self):
+        return self._request.get()
+
+    def read_session(self, db):
+        """
+        与 db 同库的只读 Session，本次脚本运行内复用，随 request_scope 一起关闭 (页面中的报表 / 概览查询使用)。
+        不在 request_scope 中 (局部单独重跑) 时直接返回 db。
+        """
+        sessions = self._request_read.get()
+        if sessions is None: return db
+        bind = db.get_bind()
+        if id(bind) not in sessions:
+            sessions[id(bind)] = self.new_read_session(bind)
+        return sessions[id(bind)]
+
+    # ---------- fragment ----------
+    def release_after_fragment(self, func):
+        """
+        fragment 函数包装：整页运行中调用时 Session 归整页所有，不做处理；
+        局部单独重跑时 (没有活动的 request_scope)，结束后关闭参数中的 Session
+        (包括 Service 实例上的 .db)，避免整页已关闭的 Session 被局部重跑重新占用连接后一直不释放。
+        """
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if self._request.get() is not None:
+                return func(*args, **kwargs)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                for arg in [*args, *kwargs.values()]:
+                    session = arg if isinstance(arg, Session) else getattr(arg, "db", None)
+                    if isinstance(session, Session):
+                        session.close()
+        return wrapper
+
+    # ---------- 指标 ----------
+    def open_sessions(self):
+        with self._lock:
+            return len(self._open)
+
+    def stats(self):
+        """open 当前未关闭，peak 峰值，total 累计打开次数，oldest_seconds 最久未关闭的 Session 已打开秒数"""
+        with self._lock:
+            sessions = list(self._open)
+        now = time.monotonic()
+        return {
+            "open": len(sessions), "peak": self.peak_open, "total": self.opened_total,
+            "oldest_seconds": max((now - s.opened_at for s in sessions), default=0.0),
+        }
+
+
+# 全局单例：同一进程内所有浏览器会话共享
+session_manager = SessionManager()
+
+
+def fragment(func):
+    """
+    局部刷新装饰器 (兼容旧版 experimental_fragment)，并在局部单独重跑结束时释放传入的 Session。
+    """
+    wrapped = session_manager.release_after_fragment(func)
+    if hasattr(st, "fragment"):
+        return st.fragment(wrapped)
+    if hasattr(st, "experimental_fragment"):
+        return st.experimental_fragment(wrapped)
+    return wrapped
@@ -2,6 +2,10 @@
 import streamlit as st
 import pandas as pd
 from services.balance_service import BalanceService
+from session_manager import session_manager
+from services.balance_rebuild_service import BalanceRebuildService, ALL_KINDS
+from services.metrics_sync_queue import metrics_sync_queue
+from cache_manager import sync_all_caches
 
 def show_balance_page(db, exchange_rate):
     st.header("📊 公司账面概览 (资产负债表)")
@@ -23,9 +27,48 @@ def show_balance_page(db, exchange_rate):
                 except Exception as e:
                     st.error(str(e))
                     
+    # === 派生账目对账 ===
+    sync_failures = metrics_sync_queue.failures()
+    if sync_failures:
+        st.warning(
+            f"⚠️ 有 {len(sync_failures)} 个商品的后台指标同步失败 (大货资产 / 在制资产冲销 / 可销售数量可能未更新)，"
+            "生成差异报告并修正即可恢复：\n" + "\n".join(f"- 商品 #{pid} ({at:%m-%d %H:%M}): {err}" for pid, (at, err) in sync_failures.items())
+        )
+
+    with st.expander("🧮 账面对账 (派生账目重算)", expanded=False):
+        st.caption("从库存流水、成本、订单与财务流水重新计算 大货资产 / 在制资产冲销 / 待结算 / 现金账户 / 可销售数量，与当前账面对比。")
+        c_r1, c_r2 = st.columns([1, 3], vertical_alignment="bottom")
+        if c_r1.button("🔍 生成差异报告", use_container_width=True):
+            report, _ = BalanceRebuildService(db).build_report()
+            st.session_state.balance_rebuild_report = report
+
+        report = st.session_state.get("balance_rebuild_report")
+        if report is not None:
+            if report.empty:
+                st.success("✅ 账面与重算结果一致")
+            else:
+                st.dataframe(
+                    report, width="stretch", hide_index=True,
+                    column_config={c: st.column_config.NumberColumn(format="%.2f") for c in ["账面值", "重算值", "差额"]}
+                )
+                kinds = c_r2.multiselect(
+                    "修正类型", ALL_KINDS, default=[k for k in ALL_KINDS if k in set(report["类型"])],
+                    help="现金账户的差异也可能来自手工调账，请确认后再勾选"
+                )
+                if st.button("🛠️ 按重算值修正所选类型", type="primary", disabled=not kinds):
+                    try:
+                        applied = BalanceRebuildService(db).apply(kinds)
+                        st.session_state.pop("balance_rebuild_report", None)
+                        st.toast(f"已修正 {applied} 项", icon="🛠️")
+                        sync_all_caches()
+                        st.rerun()
+                    except Exception as e:
+                        st.error(f"修正失败: {e}")
+
     st.divider()
 
-    summary = BalanceService.get_financial_summary(db)
+    # 只读汇总走只读副本 (未配置或不可用时即主库)
+    summary = BalanceService.get_financial_summary(session_manager.read_session(db))
     cash = summary["cash"]
     cash_items = summary["cash_items"]
     fixed = summary["fixed"]
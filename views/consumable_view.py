@@ -7,10 +7,7 @@ from cache_manager import sync_all_caches
 from constants import PRODUCT_COST_CATEGORIES
 
 # 兼容性处理：适配不同版本的 Streamlit
-if hasattr(st, "fragment"):
-    fragment_decorator = st.fragment
-else:
-    fragment_decorator = st.experimental_fragment
+from session_manager import fragment as fragment_decorator  # 局部重跑结束时释放传入的 Session
 
 # ================= 🚀 核心性能优化：将表单区封装为局部渲染组件 =================
 @fragment_decorator
@@ -339,4 +339,19 @@ def show_cost_page(db, exchange_rate):
                 "height: 38px; margin-bottom: 16px;'>"
                 "✅ 已完成生产结单</div>", 
                 unsafe_allow_html=True
-            )
\ No newline at end of file
+            )
+
+    # ================= 6. 单价历史 =================
+    with st.expander("📈 单价 / 库存估值历史", expanded=False):
+        df_hist = service.get_unit_cost_history(prod.id)
+        if df_hist.empty:
+            st.caption("暂无快照。商品成本、数量或库存变动并同步后会自动记录。")
+        else:
+            st.line_chart(df_hist, x="时间", y="单价", height=220)
+            st.dataframe(
+                df_hist.iloc[::-1], width="stretch", hide_index=True,
+                column_config={
+                    "时间": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm"),
+                    **{c: st.column_config.NumberColumn(format="¥ %.2f") for c in ["单价", "库存估值", "在制冲销", "实付成本"]},
+                }
+            )
@@ -6,27 +6,20 @@ from datetime import date
 from services.finance_service import FinanceService
 from cache_manager import sync_all_caches
 from constants import PRODUCT_COST_CATEGORIES
+from page_profiler import profiled_cache_data
 
 # ================= 🚀 性能优化 1：局部刷新装饰器兼容 =================
-def fragment_if_available(func):
-    """
-    兼容性封装：将 UI 拆分为局部组件。
-    当组件内的输入框改变时，只刷新组件本身，绝不重新渲染外部的大表格！
-    """
-    if hasattr(st, "fragment"):
-        return st.fragment()(func)
-    elif hasattr(st, "experimental_fragment"):
-        return st.experimental_fragment()(func)
-    return func
+# 兼容性封装：将 UI 拆分为局部组件。当组件内的输入框改变时，只刷新组件本身，绝不重新渲染外部的大表格！
+from session_manager import fragment as fragment_if_available
 
 # ================= 🚀 性能优化 2：数据与表格渲染缓存 =================
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_finance_data(test_mode_flag, page, cache_version):
     """
     增加了 cache_version 参数。
     只要发生增删改，cache_version 会变化，Streamlit 就会自动重新执行此函数。
     """
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         # 调用新的真分页方法 (已内置窗口函数计算行余额)
         df_display, total_count = FinanceService.get_finance_records_page(db_cache, page=page, page_size=100)
@@ -1,14 +1,12 @@
 import streamlit as st
 import pandas as pd
-from datetime import date
+from datetime import date, timedelta
 from services.inventory_service import InventoryService
+from services.inventory_archive_service import InventoryArchiveService
 from cache_manager import sync_all_caches
 from constants import PRODUCT_COST_CATEGORIES, StockLogReason
 
-if hasattr(st, "fragment"):
-    fragment_decorator = st.fragment
-else:
-    fragment_decorator = st.experimental_fragment
+from session_manager import fragment as fragment_decorator  # 局部重跑结束时释放传入的 Session
 
 # ================= 新增：独立的局部刷新变动录入面板 =================
 @fragment_decorator
@@ -97,6 +95,189 @@ def render_inventory_movement_panel(db, service, selected_product_id, p_name, co
                     service.db.rollback()
                     st.error(f"操作失败: {e}")
 
+    render_bulk_movement_form(service, selected_product_id, p_name, colors, wh_options)
+
+def render_bulk_movement_form(service, selected_product_id, p_name, colors, wh_options):
+    """整单录入：一张表格录入多个款式/部件，整单校验、一次写入"""
+    with st.expander("📋 整单批量录入 (多款式入库 / 出库 / 调拨单)", expanded=False):
+        if not selected_product_id or not colors:
+            st.caption("请先选择带款式的产品")
+            return
+
+        c_date, c_type = st.columns(2)
+        b_date = c_date.date_input("日期", value=date.today(), key="bulk_date")
+        b_type = c_type.selectbox("变动类型", [
+            StockLogReason.IN_INSPECT, StockLogReason.INSPECT_COMPLETED,
+            StockLogReason.OTHER_IN, StockLogReason.OUT_STOCK, StockLogReason.TRANSFER
+        ], key="bulk_type")
+
+        b_to_wh_id = None
+        if b_type == StockLogReason.TRANSFER:
+            c_from, c_to = st.columns(2)
+            wh_options_from = {"未分配仓库 (旧数据)": None}
+            wh_options_from.update(wh_options)
+            b_wh_id = wh_options_from[c_from.selectbox("移出仓库", list(wh_options_from.keys()), key="bulk_wh_from")]
+            b_to_wh_id = wh_options[c_to.selectbox("移入仓库", list(wh_options.keys()), index=1 if len(wh_options) > 1 else 0, key="bulk_wh_to")]
+        else:
+            b_wh_id = wh_options[st.selectbox("目标操作仓库", list(wh_options.keys()), key="bulk_wh")]
+
+        part_options = ["整套"] + sorted({p.part_name for c in colors for p in c.parts})
+        df_lines = pd.DataFrame([{"款式": c.color_name, "部件": "整套", "数量": 0} for c in colors])
+        edited = st.data_editor(
+            df_lines, key=f"bulk_lines_{selected_product_id}", num_rows="dynamic", width="stretch", hide_index=True,
+            column_config={
+                "款式": st.column_config.SelectboxColumn(options=[c.color_name for c in colors], required=True),
+                "部件": st.column_config.SelectboxColumn(options=part_options, required=True, help="整套 = 该款式所有部件同比例增减"),
+                "数量": st.column_config.NumberColumn(min_value=0, step=1, required=True),
+            }
+        )
+
+        b_remark = st.text_input("备注", placeholder="选填备注 (整单共用)", key="bulk_remark")
+        b_out_type, b_cons_cat, b_cons_content = "其他", "其他成本", ""
+        if b_type == StockLogReason.OUT_STOCK:
+            b_out_type = st.radio("出库类型", ["消耗", "其他"], horizontal=True, key="bulk_out_type")
+            if b_out_type == "消耗":
+                c_cons1, c_cons2 = st.columns([1, 2])
+                b_cons_cat = c_cons1.selectbox("计入成本分类", service.COST_CATEGORIES, key="bulk_cons_cat")
+                b_cons_content = c_cons2.text_input("消耗内容 (必填)", placeholder="如：宣发样衣", key="bulk_cons_content")
+
+        lines = [
+            {"variant": r["款式"], "part_name": None if r["部件"] in (None, "整套") else r["部件"], "quantity": int(r["数量"] or 0)}
+            for r in edited.to_dict("records") if r.get("款式") and (r.get("数量") or 0) > 0
+        ]
+        st.caption(f"共 {len(lines)} 行，合计 {sum(l['quantity'] for l in lines)} 件")
+
+        if st.button("🚀 整单提交", type="primary", use_container_width=True, key="bulk_submit", disabled=not lines):
+            if b_type == StockLogReason.OUT_STOCK and b_out_type == "消耗" and not b_cons_content.strip():
+                st.error("❌ 请填写【消耗内容】。")
+            else:
+                try:
+                    msg = service.add_inventory_movements(
+                        selected_product_id, p_name, lines, b_type, b_date, b_remark,
+                        warehouse_id=b_wh_id, to_warehouse_id=b_to_wh_id,
+                        out_type=b_out_type, cons_cat=b_cons_cat, cons_content=b_cons_content
+                    )
+                    service.commit()
+                    st.toast(msg, icon="✅")
+                    st.rerun()
+                except Exception as e:
+                    service.db.rollback()
+                    st.error(f"操作失败: {e}")
+
+def render_stock_history_panel(service, product_id, colors, wh_options):
+    """库存走势：数据库端窗口累计，按日/周展示现货套数 (部件按配比折算，与库存总览一致)"""
+    with st.expander("📈 库存走势 (历史任意日期)", expanded=False):
+        h1, h2, h3, h4 = st.columns([1, 1, 1.6, 1])
+        v_sel = h1.selectbox("款式", ["全部款式"] + [c.color_name for c in colors], key=f"hist_var_{product_id}")
+        wh_sel = h2.selectbox("仓库", ["全部仓库"] + list(wh_options.keys()), key=f"hist_wh_{product_id}")
+        today = date.today()
+        d_range = h3.date_input("日期区间", value=(today - timedelta(days=90), today), key=f"hist_range_{product_id}")
+        gran = h4.radio("粒度", ["按日", "按周"], horizontal=True, key=f"hist_gran_{product_id}")
+
+        if not isinstance(d_range, (tuple, list)) or len(d_range) != 2:
+            st.caption("请选择完整的起止日期")
+            return
+
+        df_hist = service.get_stock_history(
+            product_id,
+            variant=None if v_sel == "全部款式" else v_sel,
+            warehouse_id=wh_options.get(wh_sel),
+            start=d_range[0], end=d_range[1],
+            granularity="week" if gran == "按周" else "day"
+        )
+        if df_hist.empty:
+            st.caption("暂无数据")
+        else:
+            st.line_chart(df_hist, x="date", y="stock", height=260)
+            st.caption(f"期末现货: **{int(df_hist['stock'].iloc[-1])}** 套 (部件流水按配比折算成套数)")
+
+def render_stock_snapshot_panel(service, wh_options):
+    """时点库存查询 (年末盘点/估值) 与库存快照管理"""
+    st.markdown("#### 📅 时点库存查询")
+    wh_names = {v: k for k, v in wh_options.items()}
+    c1, c2, c3 = st.columns([1, 1, 2], vertical_alignment="bottom")
+    as_of = c1.date_input("查询日期 (当日收盘)", value=date(date.today().year - 1, 12, 31), key="snapshot_as_of")
+
+    # 时点库存要累加快照之后的全部流水，只在点击查询时计算，结果按日期保存在会话里
+    snap = st.session_state.get("stock_snapshot_result")
+    if c2.button("🔍 查询", key="snapshot_query", width="stretch"):
+        snap = (as_of, service.get_stock_snapshot(as_of))
+        st.session_state["stock_snapshot_result"] = snap
+    if not snap or snap[0] != as_of:
+        st.caption("选择日期后点击「查询」")
+    elif snap[1].empty:
+        st.caption("该日期无现货")
+    else:
+        df_snap = snap[1].copy()
+        df_snap["warehouse"] = df_snap["warehouse_id"].map(lambda w: wh_names.get(w, "未分配仓库"))
+        st.dataframe(
+            df_snap.rename(columns={"product_name": "商品", "variant": "款式", "warehouse": "仓库", "quantity": "现货 (套)"})[["商品", "款式", "仓库", "现货 (套)"]],
+            width="stretch", hide_index=True
+        )
+
+    with c3.popover("📌 库存快照管理", width="stretch"):
+        st.caption("为历史日期保存快照后，走势与时点查询从快照起累加，不再扫描更早的流水；补录或修改更早日期的流水会自动作废快照。")
+        if st.button(f"保存 {as_of} 的库存快照", disabled=as_of >= date.today(), key="build_snapshot"):
+            try:
+                n = service.build_stock_checkpoint(as_of)
+                st.toast(f"快照已保存 ({n} 行)", icon="📌")
+            except Exception as e:
+                service.db.rollback()
+                st.error(f"保存失败: {e}")
+        checkpoints = service.get_stock_checkpoints()
+        if checkpoints:
+            st.dataframe(pd.DataFrame(checkpoints, columns=["快照日期", "行数"]), width="stretch", hide_index=True)
+
+def render_log_archive_panel(db, product_names):
+    """流水归档：截止日前的流水移入归档表，主表写期初结转行"""
+    archive_svc = InventoryArchiveService(db)
+    stats = archive_svc.get_archive_stats()
+    with st.expander(f"🗄️ 流水归档 (已归档 {stats['count']} 条{'，截至 ' + str(stats['cutoff']) if stats['cutoff'] else ''})", expanded=False):
+        st.caption("截止日之前的流水移入归档表，主表按 商品/款式/部件/仓库/类型 写入期初结转行，库存数量保持不变。订单、售后、消耗成本相关的流水不会归档。")
+        a1, a2 = st.columns([1, 2], vertical_alignment="bottom")
+        cutoff = a1.date_input("归档截止日 (不含)", value=date(date.today().year, 1, 1), max_value=date.today(), key="archive_cutoff")
+        # 预览要全表计数 + 分组，只在点击后计算，结果按截止日缓存在会话里
+        preview = st.session_state.get("archive_preview")
+        if preview and preview[0] != cutoff:
+            preview = None
+        if a2.button("🔎 预览", key="archive_preview_btn"):
+            preview = (cutoff, *archive_svc.preview(cutoff))
+            st.session_state["archive_preview"] = preview
+        if preview:
+            n_logs, n_groups = preview[1], preview[2]
+            st.info(f"将归档 **{n_logs}** 条流水，生成 **{n_groups}** 条期初结转")
+        else:
+            n_logs = 0
+            st.caption("选择截止日后点击「预览」查看将归档的流水数")
+
+        b1, b2 = st.columns(2)
+        if b1.button("🗄️ 执行归档", type="primary", disabled=n_logs == 0, width="stretch"):
+            try:
+                res = archive_svc.archive_before(cutoff)
+                st.session_state.pop("archive_preview", None)
+                st.toast(f"已归档 {res['archived']} 条，写入 {res['opening_rows']} 条期初结转", icon="🗄️")
+                sync_all_caches()
+                st.rerun()
+            except Exception as e:
+                st.error(f"归档失败: {e}")
+        if b2.button("🔍 校验归档一致性", width="stretch"):
+            mismatches = archive_svc.verify()
+            if not mismatches:
+                st.success("✅ 校验通过：主表 + 归档表的原始流水与当前库存完全一致")
+            else:
+                st.error(f"❌ {len(mismatches)} 个类别不一致")
+                st.dataframe(pd.DataFrame([
+                    {"类别": " / ".join(str(i) for i in k), "原始流水合计": raw, "主表合计": cur} for k, raw, cur in mismatches
+                ]), width="stretch", hide_index=True)
+
+        if stats["count"]:
+            p_sel = st.selectbox("查阅归档流水", ["全部产品"] + product_names, key="archive_browse_prod")
+            logs = archive_svc.get_archived_logs(None if p_sel == "全部产品" else p_sel)
+            st.dataframe(pd.DataFrame([{
+                "原ID": l.log_id, "日期": l.date, "产品": l.product_name, "款式": l.variant,
+                "部件/模式": l.part_name or "[成套]", "数量": l.change_amount, "类型": l.reason, "详情": l.note or ""
+            } for l in logs]), width="stretch", hide_index=True)
+
 def show_inventory_page(db):
     st.header("📦 库存管理系统")
     
@@ -181,6 +362,8 @@ def show_inventory_page(db):
                         st.dataframe(pd.DataFrame(excess_parts_data), width="stretch", hide_index=True)
             else:
                 st.info("该产品暂无款式信息")
+
+            render_stock_history_panel(service, selected_product_id, colors, wh_options)
                 
         st.divider()
 
@@ -248,6 +431,10 @@ def show_inventory_page(db):
                     except Exception as e:
                         st.error(str(e))
         
+        st.divider()
+        render_stock_snapshot_panel(service, {w.name: w.id for w in service.get_all_warehouses()})
+        render_log_archive_panel(db, [p.name for p in service.get_all_products()])
+
         st.divider()
         st.markdown("#### 📦 各仓库明细")
         
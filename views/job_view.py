@@ -0,0 +1,106 @@
+# views/job_view.py
+import os
+import streamlit as st
+from services.job_runner import job_runner, ACTIVE_STATUSES
+from session_manager import session_manager
+from cache_manager import sync_all_caches
+
+# 面板轮询间隔 (秒)，只在本会话有未完成任务时轮询
+POLL_SECONDS = 2
+
+STATUS_LABELS = {
+    "queued": "⏳ 排队中", "running": "🔄 执行中", "done": "✅ 已完成",
+    "failed": "❌ 失败", "interrupted": "⚠️ 已中断",
+}
+
+
+def submit_job(kind, title, func, *args, **kwargs):
+    """提交后台任务并登记到本会话的关注列表，任务结束时面板会触发一次整页刷新"""
+    job_id = job_runner.submit(
+        kind, title, func, *args,
+        env="测试" if st.session_state.get("test_mode") else "真实",
+        created_by=st.session_state.get("current_user_name"),
+        **kwargs
+    )
+    st.session_state.setdefault("watched_jobs", []).append(job_id)
+    return job_id
+
+
+def tracked_job(state_key):
+    """
+    取出 session_state[state_key] 记录的任务；任务已不存在 (记录被轮转) 时清除该键并返回 None。
+    调用方根据 job.status 决定显示进度、结果或错误。
+    """
+    job_id = st.session_state.get(state_key)
+    if job_id is None: return None
+    job = job_runner.get(job_id)
+    if job is None:
+        st.session_state.pop(state_key, None)
+    return job
+
+
+def show_job_progress(job):
+    """页面内显示排队 / 执行中任务的进度条"""
+    st.progress(job.progress or 0.0, text=f"{STATUS_LABELS[job.status]} · {job.title} · {job.message or ''} (可离开本页，完成后自动刷新)")
+
+
+def is_active(job):
+    return job is not None and job.status in ACTIVE_STATUSES
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def show_job_download(job, label, key=None):
+    """任务产出文件的下载按钮 (点击时才读文件)；任务未完成或文件已被轮转删除时不显示"""
+    if job is None or job.status != "done" or not job.file_path or not os.path.exists(job.file_path): return
+    st.download_button(
+        label, data=lambda path=job.file_path: _read_file(path),
+        file_name=job.file_name, key=key, width="stretch"
+    )
+
+
+def _render_job(job):
+    with st.container(border=True):
+        st.markdown(f"**{job.title}**  \n{STATUS_LABELS.get(job.status, job.status)} · #{job.id} · {job.env or ''} · {job.created_at:%m-%d %H:%M}")
+        if job.status in ACTIVE_STATUSES:
+            st.progress(job.progress or 0.0, text=job.message or "")
+        elif job.status == "done":
+            if job.result: st.caption(job.result)
+            show_job_download(job, "⬇️ 下载", key=f"job_download_{job.id}")
+        else:
+            st.caption(job.message or "")
+            if job.error:
+                with st.expander("错误详情"):
+                    st.code(job.error, language="text")
+
+
+def _job_panel():
+    watched = st.session_state.get("watched_jobs", [])
+    finished = [job_id for job_id in watched if not is_active(job_runner.get(job_id))]
+    if finished:
+        st.session_state.watched_jobs = [i for i in watched if i not in finished]
+        sync_all_caches()
+        # 本会话提交的任务在局部轮询中结束：整页刷新，让页面读取结果并清空缓存
+        # (整页运行时页面已先于面板渲染，不需要再刷新)
+        if session_manager.current() is None:
+            st.rerun()
+
+    jobs = job_runner.recent(limit=8)
+    active = sum(1 for j in jobs if j.status in ACTIVE_STATUSES)
+    with st.expander(f"🧵 后台任务{f' ({active} 进行中)' if active else ''}", expanded=bool(active)):
+        if not jobs:
+            st.caption("暂无任务")
+        for job in jobs:
+            _render_job(job)
+
+
+def render_job_panel():
+    """侧边栏「后台任务」面板：本会话有未完成的任务时每 POLL_SECONDS 秒局部刷新一次"""
+    polling = bool(st.session_state.get("watched_jobs"))
+    if hasattr(st, "fragment"):
+        st.fragment(run_every=POLL_SECONDS if polling else None)(_job_panel)()
+    else:
+        _job_panel()
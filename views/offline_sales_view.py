@@ -12,10 +12,7 @@ from constants import PLATFORM_CODES
 from cache_manager import sync_all_caches
 import streamlit.components.v1 as components
 
-if hasattr(st, "fragment"):
-    fragment_decorator = st.fragment
-else:
-    fragment_decorator = st.experimental_fragment
+from session_manager import fragment as fragment_decorator  # 局部重跑结束时释放传入的 Session
 
 def get_warehouse_stock_map(db, warehouse_id):
     """辅助函数：获取特定仓库下所有商品的现货库存字典"""
@@ -34,6 +31,32 @@ def get_warehouse_stock_map(db, warehouse_id):
     res = query.group_by(InventoryLog.product_name, InventoryLog.variant).all()
     return {f"{r.product_name}_{r.variant}": (r.total or 0) for r in res}
 
+def render_template_summary(svc, template):
+    """模板销售汇总与日结对账：直接读取增量维护的汇总表，不再扫描全部订单明细"""
+    rows = svc.get_template_summary(template.id)
+    if not rows: return
+
+    df = pd.DataFrame([{
+        "日期": str(r.sale_date), "支付方式": r.payment_method, "订单数": r.order_count, "件数": r.item_count,
+        "原价合计": r.gross_amount, "手续费": r.fee_amount, "实收净额": r.net_amount
+    } for r in rows])
+
+    m1, m2, m3, m4 = st.columns(4)
+    m1.metric("累计订单", f"{int(df['订单数'].sum())} 单")
+    m2.metric("累计件数", f"{int(df['件数'].sum())} 件")
+    m3.metric(f"原价合计 ({template.currency})", f"{df['原价合计'].sum():,.2f}")
+    m4.metric(f"实收净额 ({template.currency})", f"{df['实收净额'].sum():,.2f}")
+
+    with st.expander("🧮 日结对账 (按日期 / 支付方式)", expanded=False):
+        st.dataframe(
+            df, width="stretch", hide_index=True,
+            column_config={
+                "原价合计": st.column_config.NumberColumn(format="%.2f"),
+                "手续费": st.column_config.NumberColumn(format="%.2f"),
+                "实收净额": st.column_config.NumberColumn(format="%.2f")
+            }
+        )
+
 @fragment_decorator
 def render_pos_machine(db, template, all_cash_assets, image_lookup):
     """POS收银机：恢复购物车缩略图与非全屏底部历史记录，保持边框对齐与全屏优化"""
@@ -152,15 +175,13 @@ def render_pos_machine(db, template, all_cash_assets, image_lookup):
             st.session_state.show_history_only = False
             st.rerun()
             
-        orders = svc.get_orders_by_template(template.code)
+        render_template_summary(svc, template)
+        orders = svc.get_orders_by_template(template.id)
         if orders:
             order_data = []
             for o in orders:
                 items_str = ", ".join([f"{i.product_name}-{i.variant} ×{i.quantity}" for i in o.items])
-                import re
-                fee = 0.0
-                match = re.search(r"扣除手续费 ([\d\.]+)", o.notes or "")
-                if match: fee = float(match.group(1))
+                _, fee = svc.parse_pos_notes(o.notes)
                 order_data.append({
                     "订单号": o.order_no, "日期": str(o.created_date), 
                     "明细": items_str, "原价": o.total_amount, "实收": o.total_amount - fee, "备注": o.notes
@@ -317,17 +338,13 @@ def render_pos_machine(db, template, all_cash_assets, image_lookup):
     if not st.session_state.pos_fullscreen:
         st.divider()
         st.subheader(f"📜 [{template.name}] 历史交易")
-        orders = svc.get_orders_by_template(template.code)
+        render_template_summary(svc, template)
+        orders = svc.get_orders_by_template(template.id)
         if orders:
             order_data = []
             for o in orders:
                 items_str = ", ".join([f"{i.product_name}-{i.variant} ×{i.quantity}" for i in o.items])
-                
-                import re
-                fee = 0.0
-                match = re.search(r"扣除手续费 ([\d\.]+)", o.notes or "")
-                if match:
-                    fee = float(match.group(1))
+                _, fee = svc.parse_pos_notes(o.notes)
                 net_income = o.total_amount - fee
                 
                 order_data.append({
@@ -3,23 +3,26 @@ import streamlit as st
 import pandas as pd
 import math
 from datetime import date
-from services.sales_order_service import SalesOrderService
+from services.sales_order_service import SalesOrderService, order_import_parse_job, order_import_create_job
+from services.job_runner import job_runner
+from views.job_view import submit_job, tracked_job, show_job_progress, is_active
 from cache_manager import sync_all_caches
 from models import Product, CompanyBalanceItem, Warehouse
 from constants import OrderStatus, PLATFORM_CODES
+from page_profiler import profiled_cache_data
 
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_presale_order_stats(product_filter, test_mode_flag, cache_version):
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         service = SalesOrderService(db_cache)
         return service.get_order_statistics(product_name=product_filter, order_type="预售")
     finally:
         db_cache.close()
 
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_presale_orders_df(status_filter, product_filter, test_mode_flag, cache_version):
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         service = SalesOrderService(db_cache)
         orders = service.get_all_orders(status=status_filter, product_name=product_filter, order_type="预售", limit=None)
@@ -215,23 +218,48 @@ def show_presale_order_page(db, exchange_rate):
             
         up_file = st.file_uploader(f"上传Excel", type=["xlsx", "xls"], key=f"pre_ex_up_{st.session_state.pre_uploader_key}")
         
-        if up_file:
-            try:
-                df_imp = pd.read_excel(up_file)
-                parsed, errors = service.validate_and_parse_import_data(df_imp, exchange_rate, presale_mode=pm_mode)
+        # 校验与批量处理都在后台任务中执行
+        create_job = tracked_job("presale_import_create_job")
+        if create_job is not None and not is_active(create_job):
+            st.session_state.pop("presale_import_create_job")
+            st.session_state.pop("presale_import_parse", None)
+            if create_job.status == "done":
+                st.toast(f"{create_job.result}！", icon="✅")
+                sync_all_caches()
+                st.session_state.pre_uploader_key += 1
+                st.rerun()
+            st.error(f"处理失败: {create_job.message or create_job.status}")
+        elif is_active(create_job):
+            show_job_progress(create_job)
+        elif up_file:
+            parse_key = f"{up_file.file_id}:{pm_mode}:{exchange_rate}"
+            parse_state = st.session_state.get("presale_import_parse")
+            if not parse_state or parse_state["file"] != parse_key:
+                job_id = submit_job(
+                    "order_import_parse", f"校验预售{pm_mode} Excel: {up_file.name}", order_import_parse_job,
+                    db.get_bind(), up_file.getvalue(), exchange_rate, presale_mode=pm_mode
+                )
+                parse_state = st.session_state.presale_import_parse = {"file": parse_key, "job": job_id}
+            parse_job = job_runner.get(parse_state["job"])
+            parse_result = job_runner.result(parse_state["job"])
+
+            if is_active(parse_job):
+                show_job_progress(parse_job)
+            elif parse_job is None or parse_job.status != "done" or parse_result is None:
+                st.error(f"处理失败: {parse_job.message if parse_job else '任务记录已过期，请重新上传'}")
+            else:
+                parsed, errors = parse_result
                 if errors:
                     st.error("数据校验失败："); 
                     for err in errors: st.write(f"- {err}")
                 elif parsed:
                     st.success(f"校验通过，可导入/处理 {len(parsed)} 个单据。")
                     if st.button(f"🚀 开始批量{'创建' if pm_mode=='定金' else '绑定'}", type="primary"):
-                        with st.spinner("处理中..."):
-                            c = service.batch_create_orders(parsed, presale_mode=pm_mode)
-                            st.toast(f"成功处理 {c} 个单据！", icon="✅")
-                            sync_all_caches()
-                            st.session_state.pre_uploader_key += 1
-                            st.rerun()
-            except Exception as e: st.error(f"处理失败: {e}")
+                        st.session_state.presale_import_create_job = submit_job(
+                            "order_import_create", f"批量{'创建定金单' if pm_mode=='定金' else '绑定尾款'} ({len(parsed)} 单)",
+                            order_import_create_job, db.get_bind(), parsed, presale_mode=pm_mode
+                        )
+                        st.rerun()
 
     st.divider()
 
@@ -8,10 +8,7 @@ from services.product_service import ProductService
 from constants import PLATFORM_CODES
 
 # ================= 🚀 性能优化：局部刷新兼容 =================
-if hasattr(st, "fragment"):
-    fragment_decorator = st.fragment
-else:
-    fragment_decorator = st.experimental_fragment
+from session_manager import fragment as fragment_decorator  # 局部重跑结束时释放传入的 Session
 
 # --- 辅助函数：从“颜色/规格”对象的价格列表中提取特定平台价格 ---
 def get_price(color_obj, platform_key):
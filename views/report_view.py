@@ -3,7 +3,9 @@ import streamlit as st
 import pandas as pd
 from datetime import datetime
 from services.balance_service import BalanceService
-from models import FinanceRecord, CompanyBalanceItem
+from session_manager import session_manager
+from services.finance_service import FinanceService
+from models import CompanyBalanceItem
 
 def show_report_page(db, exchange_rate):
     st.header("📊 财务分析与资本报表")
@@ -14,71 +16,11 @@ def show_report_page(db, exchange_rate):
         CompanyBalanceItem.asset_type == '现金'
     ).all()
     
-    default_acc_id = {}
-    for curr in ['CNY', 'JPY']:
-        first_acc = next((a for a in sorted(cash_accounts, key=lambda x: x.id) if a.currency == curr), None)
-        if first_acc:
-            default_acc_id[curr] = first_acc.id
-
-    # 2. 读取所有财务流水
-    records = db.query(FinanceRecord).all()
-    if not records:
+    # 2. 读取所有财务流水 (整理为报表底表)
+    df = FinanceService.get_report_frame(db, cash_accounts, exchange_rate)
+    if df.empty:
         st.info("暂无财务流水数据，无法生成报表。")
         return
-
-    # --- 财务分类标准 ---
-    PL_INCOME = ["销售收入", "其他现金收入"]
-    PL_EXPENSE = ["商品成本", "退款", "其他", "分红"]
-    ASSET_ADD = ["固定资产购入", "其他资产购入", "现有资产增加", "新资产增加"]
-    ASSET_SUB = ["现有资产减少"]
-    LIAB_ADD = ["借入资金", "新增挂账资产"]
-    LIAB_SUB = ["债务偿还", "资产抵消"]
-    EQUITY_ADD = ["投资"]
-    EQUITY_SUB = ["撤资"]
-    INTERNAL = ["资金移动", "货币兑换"]
-
-    data = []
-    for r in records:
-        final_acc_id = r.account_id
-        if not final_acc_id and r.currency in default_acc_id:
-            final_acc_id = default_acc_id[r.currency]
-
-        if r.category in PL_INCOME + PL_EXPENSE:
-            nature = "经营损益"
-        elif r.category in ASSET_ADD + ASSET_SUB:
-            nature = "资产变动"
-        elif r.category in LIAB_ADD + LIAB_SUB:
-            nature = "负债变动"
-        elif r.category in EQUITY_ADD + EQUITY_SUB:
-            nature = "资本变动"
-        elif r.category in INTERNAL:
-            nature = "内部流转"
-        else:
-            nature = "其他"
-
-        is_cash_flow = r.category not in ["资产抵消", "取消/冲销", "新增挂账资产"]
-        cny_amount = r.amount * exchange_rate if r.currency == 'JPY' else r.amount
-        cny_original = r.amount if r.currency == 'CNY' else 0.0
-        jpy_original = r.amount if r.currency == 'JPY' else 0.0
-
-        dt = pd.to_datetime(r.date)
-        data.append({
-            "日期": dt,
-            "金额": r.amount,
-            "CNY变动": cny_original,
-            "JPY变动": jpy_original,
-            "折合CNY": cny_amount,
-            "币种": r.currency,
-            "分类": r.category,
-            "财务性质": nature,
-            "account_id": final_acc_id,
-            "计入现金流": is_cash_flow,
-            "年份": dt.year,
-            "月份": dt.month,
-            "年月": dt.strftime("%Y-%m")
-        })
-        
-    df = pd.DataFrame(data)
     
     # ================= 报表渲染核心函数 =================
     def render_report_dashboard(df_current, period_label, period_key):
@@ -161,7 +103,8 @@ def show_report_page(db, exchange_rate):
         st.markdown("#### 📦 4. 当前商品存货资产盘点 (实时家底)")
         st.caption("注：存货由于每天发货入库在实时变动，此处展示的是系统**当前的实时总资产**。上方“营业总成本”中支付给工厂的钱，最终化为了这里的实物家底。")
         
-        summary = BalanceService.get_financial_summary(db)
+        # 只读汇总走只读副本 (未配置或不可用时即主库)
+        summary = BalanceService.get_financial_summary(session_manager.read_session(db))
         
         # 1. 提取在制资产 (WIP) - 直接使用引擎算好的准确数值
         wip_cny = summary["wip"]["total_cny"]
@@ -3,25 +3,28 @@ import streamlit as st
 import pandas as pd
 import math
 from datetime import date
-from services.sales_order_service import SalesOrderService
+from services.sales_order_service import SalesOrderService, order_import_parse_job, order_import_create_job
+from services.job_runner import job_runner
+from views.job_view import submit_job, tracked_job, show_job_progress, is_active
 from cache_manager import sync_all_caches
 from models import Product, CompanyBalanceItem, Warehouse
 from constants import OrderStatus, PLATFORM_CODES
+from page_profiler import profiled_cache_data
 
 # ------------------ 🚀 性能优化：独立数据层缓存 ------------------
 
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_order_stats(product_filter, test_mode_flag, cache_version):
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         service = SalesOrderService(db_cache)
         return service.get_order_statistics(product_name=product_filter)
     finally:
         db_cache.close()
 
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_orders_df(status_filter, product_filter, test_mode_flag, cache_version):
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         service = SalesOrderService(db_cache)
         orders = service.get_all_orders(status=status_filter, product_name=product_filter, limit=1000)
@@ -277,19 +280,47 @@ def show_sales_order_page(db, exchange_rate):
             key=f"order_excel_uploader_{st.session_state.uploader_key}"
         )
         
-        if uploaded_file is not None:
-            try:
-                df_import = pd.read_excel(uploaded_file)
-                parsed_orders, errors = service.validate_and_parse_import_data(df_import, exchange_rate)
-                
+        # 校验与导入都在后台任务中执行 (大文件不再阻塞页面，浏览器断开也不会中断)
+        create_job = tracked_job("order_import_create_job")
+        if create_job is not None and not is_active(create_job):
+            st.session_state.pop("order_import_create_job")
+            st.session_state.pop("order_import_parse", None)
+            if create_job.status == "done":
+                st.toast(f"导入完成！{create_job.result}", icon="✅")
+                sync_all_caches()
+                st.session_state.uploader_key += 1
+                st.rerun()
+            st.error(f"导入订单失败: {create_job.message or create_job.status}")
+        elif is_active(create_job):
+            show_job_progress(create_job)
+        elif uploaded_file is not None:
+            # 同一文件只提交一次校验任务
+            parse_key = f"{uploaded_file.file_id}:{exchange_rate}"
+            parse_state = st.session_state.get("order_import_parse")
+            if not parse_state or parse_state["file"] != parse_key:
+                job_id = submit_job(
+                    "order_import_parse", f"校验订单 Excel: {uploaded_file.name}", order_import_parse_job,
+                    db.get_bind(), uploaded_file.getvalue(), exchange_rate
+                )
+                parse_state = st.session_state.order_import_parse = {"file": parse_key, "job": job_id}
+            parse_job = job_runner.get(parse_state["job"])
+            parse_result = job_runner.result(parse_state["job"])
+
+            if is_active(parse_job):
+                show_job_progress(parse_job)
+            elif parse_job is None or parse_job.status != "done" or parse_result is None:
+                st.error(f"读取或处理 Excel 文件失败: {parse_job.message if parse_job else '任务记录已过期，请重新上传'}")
+                st.caption("提示：请确保安装了 openpyxl 库。")
+            else:
+                parsed_orders, errors = parse_result
                 if errors:
                     st.error("❌ 数据校验失败，请修复 Excel 中的以下问题后重新上传：")
                     for err in errors: st.write(f"- {err}")
                 elif parsed_orders:
                     st.success(f"✅ 数据校验通过！共识别出 {len(parsed_orders)} 个有效订单。预览如下：")
                     preview_data = []
+                    wh_id_to_name = {w.id: w.name for w in all_warehouses}
                     for po in parsed_orders:
-                        wh_id_to_name = {w.id: w.name for w in all_warehouses}
                         items_str = ", ".join([f"{i['product_name']}-{i['variant']} ×{i['quantity']} (仓: {wh_id_to_name.get(i['warehouse_id'], '未分配')})" for i in po["items"]])
                         preview_data.append({
                             "订单号": po["order_no"], "平台": po["platform"], "收款目标账户": po["target_account"], 
@@ -300,15 +331,11 @@ def show_sales_order_page(db, exchange_rate):
                     st.dataframe(pd.DataFrame(preview_data), width="stretch", column_config={"原总价": st.column_config.NumberColumn(format="%.2f"), "预估手续费": st.column_config.NumberColumn(format="%.2f"), "实际净入账": st.column_config.NumberColumn(format="%.2f")})
                     
                     if st.button("🚀 确认无误，开始导入订单", type="primary"):
-                        with st.spinner("正在逐个生成订单并入账..."):
-                            count = service.batch_create_orders(parsed_orders)
-                            st.toast(f"导入完成！成功生成 {count} 个订单。", icon="✅")
-                            sync_all_caches() 
-                            st.session_state.uploader_key += 1
-                            st.rerun()
-            except Exception as e:
-                st.error(f"读取或处理 Excel 文件失败: {e}")
-                st.caption("提示：请确保安装了 openpyxl 库。")
+                        st.session_state.order_import_create_job = submit_job(
+                            "order_import_create", f"导入 {len(parsed_orders)} 个订单", order_import_create_job,
+                            db.get_bind(), parsed_orders
+                        )
+                        st.rerun()
 
     st.divider()
 
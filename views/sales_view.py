@@ -3,18 +3,16 @@ import streamlit as st
 import pandas as pd
 import math
 from services.sales_service import SalesService
-
-def fragment_if_available(func):
-    if hasattr(st, "fragment"):
-        return st.fragment()(func)
-    elif hasattr(st, "experimental_fragment"):
-        return st.experimental_fragment()(func)
-    return func
+from services.sales_fact_service import SalesFactService
+from services.sales_analytics_service import SalesAnalyticsService, LEADERBOARD_DIMENSIONS
+from services.cost_history_service import CostHistoryService
+from page_profiler import profiled_cache_data
+from session_manager import fragment as fragment_if_available
 
 # --- 分别缓存 V1 和 V2 数据 ---
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_sales_df_v1(test_mode_flag, cache_version): # ✨ 加入版本参数
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
         raw_logs = SalesService.get_raw_sales_logs_v1(db_cache)
         df = SalesService.process_sales_data_v1(db_cache, raw_logs)
@@ -22,15 +20,59 @@ def get_cached_sales_df_v1(test_mode_flag, cache_version): # ✨ 加入版本参
     finally:
         db_cache.close()
 
-@st.cache_data(ttl=300, show_spinner=False)
+@profiled_cache_data(ttl=300, show_spinner=False)
 def get_cached_sales_df_v2(test_mode_flag, cache_version): # ✨ 加入版本参数
-    db_cache = st.session_state.get_dynamic_session()
+    db_cache = st.session_state.get_read_session()
     try:
-        df = SalesService.process_sales_data_v2(db_cache)
+        # 🚀 直接读取按日预聚合的销售事实表，不再逐单重放订单/退款/退货
+        df = SalesFactService(db_cache).get_facts_df()
         return df
     finally:
         db_cache.close()
 
+@profiled_cache_data(ttl=300, show_spinner=False)
+def get_cached_product_sales_summary(test_mode_flag, cache_version, product_name):
+    """单品销售汇总 (SQL 聚合，只扫描该商品的数据)"""
+    db_cache = st.session_state.get_read_session()
+    try:
+        return SalesService.get_product_sales_summary(db_cache, product_name)
+    finally:
+        db_cache.close()
+
+@profiled_cache_data(ttl=300, show_spinner=False)
+def get_cached_prepared_sales_df(source, test_mode_flag, cache_version):
+    """明细维度列转 category，每个数据版本只做一次"""
+    loader = get_cached_sales_df_v2 if source == "v2" else get_cached_sales_df_v1
+    return SalesAnalyticsService.prepare(loader(test_mode_flag, cache_version))
+
+@profiled_cache_data(ttl=300, show_spinner=False)
+def get_cached_sales_analytics(source, test_mode_flag, cache_version, exchange_rate, dimension, top_n, platforms):
+    """
+    🚀 榜单按 (数据版本, 汇率, 筛选条件) 记忆化：只传入标量/元组参数，
+    不对整张明细表做哈希，切换筛选项时命中缓存直接返回
+    """
+    df = SalesAnalyticsService.apply_filters(
+        get_cached_prepared_sales_df(source, test_mode_flag, cache_version), platforms=list(platforms)
+    )
+    totals_by_currency = df.groupby("currency", observed=True)["amount"].sum() if not df.empty else pd.Series(dtype=float)
+    product_board = SalesAnalyticsService.leaderboard(df, "product", exchange_rate)
+    return {
+        "total_cny": float(totals_by_currency.get("CNY", 0.0)),
+        "total_jpy": float(totals_by_currency.get("JPY", 0.0)),
+        "total_qty": int(df["qty"].sum()) if not df.empty else 0,
+        "products": product_board["product"].tolist(),
+        "board": product_board.head(top_n) if dimension == "product" else SalesAnalyticsService.leaderboard(df, dimension, exchange_rate, top_n),
+    }
+
+@profiled_cache_data(ttl=300, show_spinner=False)
+def get_cached_cogs_report(test_mode_flag, cache_version, exchange_rate, start, end, granularity):
+    """期间销售成本与毛利 (销售日汇总 × 单价历史，单次聚合查询)"""
+    db_cache = st.session_state.get_read_session()
+    try:
+        return CostHistoryService(db_cache).get_cogs_report(start, end, exchange_rate, granularity)
+    finally:
+        db_cache.close()
+
 # --- 封装好的变动日志局部组件 (支持多版本前缀) ---
 @fragment_if_available
 def render_sales_logs_fragment(df_p, selected_product, version_prefix):
@@ -89,38 +131,45 @@ def render_sales_logs_fragment(df_p, selected_product, version_prefix):
                         st.rerun()
 
 # --- 封装好的单页大屏渲染器 ---
-def render_sales_dashboard(df, exchange_rate, version_prefix):
+def render_sales_dashboard(source, test_mode, cache_version, exchange_rate, product_summary_loader=None):
+    df = get_cached_prepared_sales_df(source, test_mode, cache_version)
     if df.empty:
         st.info("暂无销售数据。")
         return
 
-    total_cny = df[df['currency'] == 'CNY']['amount'].sum()
-    total_jpy = df[df['currency'] == 'JPY']['amount'].sum()
-    total_qty = df['qty'].sum()
-    grand_total_cny = total_cny + (total_jpy * exchange_rate)
+    f1, f2, f3 = st.columns([1, 1, 2])
+    dimension = f1.selectbox(
+        "榜单维度", list(LEADERBOARD_DIMENSIONS.keys()), format_func=LEADERBOARD_DIMENSIONS.get, key=f"board_dim_{source}"
+    )
+    top_n = f2.number_input("显示前 N 名", min_value=5, max_value=500, value=50, step=5, key=f"board_top_{source}")
+    platforms = f3.multiselect("平台筛选", sorted(str(p) for p in df["platform"].cat.categories), key=f"board_plat_{source}")
+
+    stats = get_cached_sales_analytics(source, test_mode, cache_version, exchange_rate, dimension, int(top_n), tuple(platforms))
+    grand_total_cny = stats["total_cny"] + (stats["total_jpy"] * exchange_rate)
 
     with st.container(border=True):
         c1, c2, c3, c4 = st.columns(4)
-        c1.metric("纯 CNY 销售额", f"¥ {total_cny:,.2f}")
-        c2.metric("纯 JPY 销售额", f"¥ {total_jpy:,.0f}")
+        c1.metric("纯 CNY 销售额", f"¥ {stats['total_cny']:,.2f}")
+        c2.metric("纯 JPY 销售额", f"¥ {stats['total_jpy']:,.0f}")
         c3.metric("折合总销售额 (CNY)", f"¥ {grand_total_cny:,.2f}", help=f"当前汇率: {exchange_rate*100}")
-        c4.metric("累计净销量", f"{int(total_qty)} 件")
+        c4.metric("累计净销量", f"{stats['total_qty']} 件")
     
     st.divider()
     col_nav, col_detail = st.columns([1, 2])
 
     with col_nav:
-        st.subheader("📋 产品榜单")
-        df_prod_summary = SalesService.get_product_leaderboard(df, exchange_rate)
-        if not df_prod_summary.empty:
-            df_display = df_prod_summary.rename(columns={'product': '产品名'})
+        st.subheader(f"📋 {LEADERBOARD_DIMENSIONS[dimension]}榜单")
+        df_board = stats["board"]
+        if not df_board.empty:
+            df_display = df_board.rename(columns={dimension: LEADERBOARD_DIMENSIONS[dimension]})
             st.dataframe(
                 df_display, width="stretch", hide_index=True,
                 column_config={
-                    "产品名": st.column_config.TextColumn(),
+                    LEADERBOARD_DIMENSIONS[dimension]: st.column_config.TextColumn(),
                     "折合CNY总额": st.column_config.NumberColumn(format="¥ %.2f"),
                     "CNY总额": st.column_config.NumberColumn(format="¥ %.2f"),
-                    "JPY总额": st.column_config.NumberColumn(format="¥ %.0f")
+                    "JPY总额": st.column_config.NumberColumn(format="¥ %.0f"),
+                    "净销量": st.column_config.NumberColumn(format="%d")
                 },
                 height=500
             )
@@ -128,32 +177,41 @@ def render_sales_dashboard(df, exchange_rate, version_prefix):
             st.caption("暂无榜单数据")
 
     with col_detail:
-        product_list = df_prod_summary['product'].tolist() if not df_prod_summary.empty else []
+        product_list = stats["products"]
         default_idx = 0 if product_list else None
-        selected_product = st.selectbox("🔍 选择要深入分析的产品", product_list, index=default_idx, key=f"sel_prod_{version_prefix}")
+        selected_product = st.selectbox("🔍 选择要深入分析的产品", product_list, index=default_idx, key=f"sel_prod_{source}")
 
         if selected_product:
             st.markdown(f"### 📦 {selected_product} 销售详情")
-            df_p = df[df['product'] == selected_product].copy()
+            df_p = SalesAnalyticsService.apply_filters(df[df['product'] == selected_product], platforms=platforms)
+            # V2 的单品指标与透视直接取 SQL 聚合结果 (variant/platform/currency/qty/amount 列与明细一致)
+            df_stat = product_summary_loader(selected_product) if product_summary_loader else df_p
+            if product_summary_loader:
+                df_stat = SalesAnalyticsService.apply_filters(df_stat, platforms=platforms)
             
-            p_cny = df_p[df_p['currency']=='CNY']['amount'].sum()
-            p_jpy = df_p[df_p['currency']=='JPY']['amount'].sum()
+            p_cny = df_stat[df_stat['currency']=='CNY']['amount'].sum()
+            p_jpy = df_stat[df_stat['currency']=='JPY']['amount'].sum()
             p_cny_equiv = p_cny + (p_jpy * exchange_rate)
-            p_qty = df_p['qty'].sum()
-            active_platforms = df_p[df_p['qty'] != 0]['platform'].nunique()
+            p_qty = df_stat['qty'].sum()
+            active_platforms = df_stat[df_stat['qty'] != 0]['platform'].nunique()
             
             k1, k2, k3 = st.columns(3)
             k1.info(f"净销量: **{int(p_qty)}** 件")
             k2.success(f"折合CNY: **¥{p_cny_equiv:,.2f}**") 
             k3.warning(f"活跃平台: **{active_platforms}** 个")
 
+            if 'gross' in df_stat.columns and not df_stat.empty:
+                df_curr = df_stat.groupby('currency')[['gross', 'refund', 'amount']].sum().reset_index()
+                st.dataframe(
+                    df_curr.rename(columns={'currency': '币种', 'gross': '销售额', 'refund': '退款', 'amount': '净销售额'}),
+                    width="stretch", hide_index=True,
+                    column_config={c: st.column_config.NumberColumn(format="%.2f") for c in ['销售额', '退款', '净销售额']}
+                )
+
             st.divider()
             st.markdown("#### 🧩 款式-平台 交叉透视 (净销量)")
-            if not df_p.empty:
-                pivot_table = pd.pivot_table(
-                    df_p, values='qty', index='variant', columns='platform', 
-                    aggfunc='sum', fill_value=0, margins=True, margins_name='总计'
-                )
+            if not df_stat.empty:
+                pivot_table = SalesAnalyticsService.pivot(df_stat, index='variant', columns='platform', values='qty')
                 st.dataframe(
                     pivot_table, width="stretch",
                     column_config={col: st.column_config.NumberColumn(format="%d") for col in pivot_table.columns}
@@ -162,15 +220,49 @@ def render_sales_dashboard(df, exchange_rate, version_prefix):
                 st.write("暂无数据")
 
             st.markdown("#### 📊 销量构成可视化")
-            chart_data = df_p.groupby(['variant', 'platform'])['qty'].sum().reset_index()
-            chart_data = chart_data[chart_data['qty'] != 0]
+            chart_data = SalesAnalyticsService.composition(df_stat, keys=('variant', 'platform'), values='qty')
             
             if not chart_data.empty:
                 st.bar_chart(chart_data, x="variant", y="qty", color="platform", stack=True, height=300)
             else:
                 st.caption("没有有效的净销量数据可供绘图。")
 
-            render_sales_logs_fragment(df_p, selected_product, version_prefix)
+            render_sales_logs_fragment(df_p, selected_product, source)
+
+@fragment_if_available
+def render_cogs_panel(test_mode, cache_version, exchange_rate):
+    """✨ 销售成本 (COGS) 与毛利：净销量按销售当日生效的单价快照计成本"""
+    with st.expander("💹 销售成本与毛利 (COGS)", expanded=False):
+        c1, c2 = st.columns([2, 1])
+        date_range = c1.date_input("统计区间", value=(), key="cogs_range", help="留空为全部日期")
+        granularity = c2.selectbox(
+            "拆分方式", [None, "month", "day"], key="cogs_granularity",
+            format_func=lambda g: {None: "按商品汇总", "month": "按月", "day": "按日"}[g]
+        )
+        start = date_range[0] if len(date_range) > 0 else None
+        end = date_range[1] if len(date_range) > 1 else start
+
+        df_cogs = get_cached_cogs_report(test_mode, cache_version, exchange_rate, start, end, granularity)
+        if df_cogs.empty:
+            st.caption("区间内暂无销售数据。")
+            return
+
+        revenue, cogs = df_cogs["销售额(CNY)"].sum(), df_cogs["销售成本"].sum()
+        k1, k2, k3 = st.columns(3)
+        k1.metric("销售额 (CNY)", f"¥ {revenue:,.2f}")
+        k2.metric("销售成本", f"¥ {cogs:,.2f}")
+        k3.metric("毛利", f"¥ {revenue - cogs:,.2f}", delta=f"{(revenue - cogs) / revenue:.1%}" if revenue else None)
+        st.dataframe(
+            df_cogs, width="stretch", hide_index=True,
+            column_config={
+                "净销量": st.column_config.NumberColumn(format="%d"),
+                "销售额(CNY)": st.column_config.NumberColumn(format="¥ %.2f"),
+                "销售成本": st.column_config.NumberColumn(format="¥ %.2f"),
+                "毛利": st.column_config.NumberColumn(format="¥ %.2f"),
+                "毛利率": st.column_config.NumberColumn(format="percent"),
+            }
+        )
+        st.caption("💡 单价取销售当日及之前最近一次商品指标同步的快照；早于首个快照的销售按首个快照单价计。")
 
 # --- 主页面入口 ---
 def show_sales_page(db, exchange_rate):
@@ -185,11 +277,13 @@ def show_sales_page(db, exchange_rate):
     with tab_v2:
         st.info("💡 **系统版本 V2.0**：数据源完全解耦，仅从「销售订单」和「售后管理」抓取。彻底消除冗余翻倍、负数异常、并能完美兼容“仅退款”操作。(**推荐使用**)")
         with st.spinner("正在加载 V2.0 销售大数据..."):
-            df_v2 = get_cached_sales_df_v2(test_mode, cache_version) # ✨ 传入版本
-        render_sales_dashboard(df_v2, exchange_rate, "v2")
+            render_sales_dashboard(
+                "v2", test_mode, cache_version, exchange_rate, # ✨ 传入版本
+                product_summary_loader=lambda name: get_cached_product_sales_summary(test_mode, cache_version, name)
+            )
+        render_cogs_panel(test_mode, cache_version, exchange_rate)
         
     with tab_v1:
         st.warning("⚠️ **系统版本 V1.0**：数据通过抓取底层「物理库存日志」强行反推。包含早期无订单记录的历史老数据，但受限于旧逻辑存在少量数据翻倍、负数等异常。(仅供历史对账参考)")
         with st.spinner("正在加载 V1.0 销售大数据..."):
-            df_v1 = get_cached_sales_df_v1(test_mode, cache_version) # ✨ 传入版本
-        render_sales_dashboard(df_v1, exchange_rate, "v1")
\ No newline at end of file
+            render_sales_dashboard("v1", test_mode, cache_version, exchange_rate) # ✨ 传入版本
\ No newline at end of file
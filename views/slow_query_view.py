@@ -0,0 +1,59 @@
+# views/slow_query_view.py
+import streamlit as st
+from services.slow_query_log import SlowQueryLogService, slow_query_logger, SLOW_QUERY_MS, SLOW_QUERY_KEEP, SLOW_QUERY_ANALYZE
+
+def show_slow_query_page(db):
+    st.header("🐢 慢查询日志")
+    st.caption(
+        f"耗时超过 {SLOW_QUERY_MS:.0f} ms 的语句 (YURARA_SLOW_QUERY_MS) 连同参数、来源函数与执行计划记录在本地指标库，"
+        f"保留最近 {SLOW_QUERY_KEEP} 条。同一语句形状的执行计划每 10 分钟抓取一次 (请求中只做 EXPLAIN，不再执行语句)"
+        + ("，PostgreSQL 的 SELECT 由后台线程补抓 EXPLAIN ANALYZE。" if SLOW_QUERY_ANALYZE else "。")
+    )
+
+    # 后台线程写入，打开页面时先等待落库
+    slow_query_logger.wait_until_idle()
+    summary = SlowQueryLogService.get_summary()
+    if summary.empty:
+        st.info("暂无慢查询记录")
+        return
+
+    c1, c2, c3 = st.columns(3)
+    c1.metric("语句形状", len(summary))
+    c2.metric("慢查询次数", int(summary["次数"].sum()))
+    c3.metric("含全表扫描", int(summary["全表扫描"].sum()))
+
+    st.markdown("#### 按总耗时排序")
+    st.dataframe(
+        summary, width="stretch", hide_index=True,
+        column_config={
+            "形状": st.column_config.TextColumn(width="large"),
+            **{c: st.column_config.NumberColumn(format="%.1f") for c in ["总耗时(ms)", "平均(ms)", "最大(ms)"]},
+            "全表扫描": st.column_config.CheckboxColumn(help="最近一次执行计划中出现 SCAN 表 (SQLite) 或 Seq Scan (PostgreSQL)"),
+            "最近一次": st.column_config.DatetimeColumn(format="YYYY-MM-DD HH:mm:ss"),
+        }
+    )
+
+    st.markdown("#### 明细")
+    shapes = summary["形状"].tolist()
+    shape = st.selectbox(
+        "语句形状", shapes, format_func=lambda s: f"{s[:100]}{'…' if len(s) > 100 else ''}", key="slow_query_shape"
+    )
+    entries = SlowQueryLogService.get_entries(shape, limit=50)
+    plan_entry = next((e for e in entries if e.plan), None)
+    if plan_entry:
+        st.markdown(f"**执行计划** ({plan_entry.recorded_at:%Y-%m-%d %H:%M:%S}，{plan_entry.duration_ms:.1f} ms)")
+        st.code(plan_entry.plan, language="text")
+    st.code(entries[0].statement if entries else shape, language="sql")
+    st.dataframe(
+        [{
+            "时间": e.recorded_at, "耗时(ms)": round(e.duration_ms, 1), "来源": e.caller,
+            "参数": e.parameters, "行数": e.rowcount, "库": f"{e.dialect}:{e.database or ''}",
+        } for e in entries],
+        width="stretch", hide_index=True
+    )
+
+    st.divider()
+    if st.button("🗑️ 清空慢查询日志"):
+        SlowQueryLogService.clear()
+        st.toast("已清空", icon="🗑️")
+        st.rerun()